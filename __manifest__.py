@@ -9,7 +9,7 @@
     'author': 'Inencon SAS / Colombia',
     'license': 'LGPL-3',
     'category': 'Human Resources/Payroll',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'website': "https://www.inenconsas.com",
     'images': ['static/images/main_screenshot.png'],
     'support': 'info@inenconsas.com',
@@ -36,6 +36,7 @@
         'data/hr_payslip_input_type_data.xml',
         'data/hr_arl_risk_level_data.xml',
         'data/hr_work_entry_type_data.xml',
+        'data/ir_cron_data.xml',
         'security/ir.model.access.csv',  
 
         # Vistas
@@ -46,6 +47,7 @@
         'views/earn_line_views.xml',
         'views/deduction_line_views.xml',
         'views/hr_payslip_views.xml',
+        'views/hr_payslip_api_buttons_views.xml',
         'views/hr_payslip_edi_views.xml',
         'views/edi_gen_views.xml',
         'views/hr_employee_views.xml',
@@ -56,10 +58,12 @@
         'views/hr_payslip_account_move_report.xml',
         'views/payroll_electronic_templates.xml',
         'views/hr_payslip_report_views.xml',
+        'views/payroll_month_end_run_views.xml',
         
 
         # Wizards
         'wizard/edi_gen_wizard_views.xml',
+        'wizard/payroll_test_set_runner_views.xml',
 
         # Reportes
         'report/hr_payslip_edi_report.xml',
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Mueve los XML/PDF DIAN y payloads existentes a artefactos comprimidos."""
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['l10n_co_nomina.edi.artifact']._migrate_legacy_edi_files(limit=None)
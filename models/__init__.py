@@ -9,11 +9,13 @@ from . import identification_type
 from . import organization_type
 from . import regime_type
 from . import res_city
+from . import l10n_co_nomina_edi_artifact
 
 # 2. Conector y Mixins (Bases para otros modelos)
 # El modelo 'l10n_co_hr_payroll.edi' debe cargarse ANTES que 'hr_payslip'
 from . import payroll_api_connector
 from . import edi
+from . import ir_sequence
 from . import l10n_co_dian_patch
 
 # 3. Modelos que Heredan de Odoo (Dependen de los modelos base)
@@ -40,6 +42,8 @@ from . import deduction_line
 # 6. Modelos Principales (Dependen de casi todo lo anterior)
 from . import hr_payslip
 from . import hr_payslip_edi
+from . import payroll_month_end_run
 
 # 7. Asistentes (Wizards)
 from . import edi_gen
+from . import payroll_test_set_runner
@@ -23,6 +23,7 @@
 from types import SimpleNamespace
 from collections import OrderedDict, defaultdict
 from hashlib import sha384
+import base64
 import json
 import logging
 import calendar
@@ -33,6 +34,13 @@ from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 from odoo.tools import float_round
 
+from .l10n_co_nomina_edi_artifact import LEGACY_FILE_FIELDS, compact_payload
+from .payroll_document import build_payroll_document
+from .payroll_edi_proxy import PayrollEdiProxy
+from .payroll_xml_builder import build_payroll_xml, qweb_values
+from .payroll_xsd import validate_payroll_xml
+from .payroll_zip import PayrollZipPackager
+
 _logger = logging.getLogger(__name__)
 
 
@@ -82,15 +90,60 @@ class Edi(models.AbstractModel):
         string="Enlace Descarga PDF DIAN", copy=False, readonly=True)
 
     # --- Campos de Adjuntos (Usando ir.attachment) ---
-    edi_xml_attachment_id = fields.Many2one(
-        'ir.attachment', string='Adjunto XML Firmado', copy=False, readonly=True)
+    # El XML firmado se guarda solo en ``edi_xml_artifact_id``
     edi_response_attachment_id = fields.Many2one(
         'ir.attachment', string='Adjunto Respuesta DIAN', copy=False, readonly=True)
 
+    # --- Artefactos comprimidos y deduplicados (XML/PDF DIAN y payload) ---
+    edi_xml_artifact_id = fields.Many2one(
+        'l10n_co_nomina.edi.artifact', string='Artefacto XML DIAN', copy=False, readonly=True,
+        index='btree_not_null', ondelete='restrict')
+    edi_pdf_artifact_id = fields.Many2one(
+        'l10n_co_nomina.edi.artifact', string='Artefacto PDF DIAN', copy=False, readonly=True,
+        index='btree_not_null', ondelete='restrict')
+    edi_payload_artifact_id = fields.Many2one(
+        'l10n_co_nomina.edi.artifact', string='Artefacto Payload', copy=False, readonly=True,
+        index='btree_not_null', ondelete='restrict')
+
     # --- Campo para Payload (para depuración) ---
     edi_payload = fields.Text(string="Payload Enviado (Debug)", copy=False, readonly=True,
+                              compute='_compute_edi_payload', inverse='_inverse_edi_payload',
                               help="Contenido JSON/Dict que se intentó enviar (para depuración).")
 
+    # --- Artefactos EDI ---
+
+    @api.depends('edi_xml_artifact_id', 'edi_pdf_artifact_id')
+    def _compute_edi_artifact_files(self):
+        """XML/PDF DIAN descomprimidos desde su artefacto, solo cuando se leen."""
+        for rec in self:
+            for field_name, (artifact_field, __) in LEGACY_FILE_FIELDS.items():
+                if field_name not in rec._fields:
+                    continue
+                artifact = rec[artifact_field]
+                rec[field_name] = base64.b64encode(artifact._get_content()) if artifact else False
+
+    def _inverse_edi_artifact_files(self):
+        Artifact = self.env['l10n_co_nomina.edi.artifact']
+        for field_name, (artifact_field, mimetype) in LEGACY_FILE_FIELDS.items():
+            if field_name not in self._fields:
+                continue
+            contents = [base64.b64decode(rec[field_name]) if rec[field_name] else None for rec in self]
+            for rec, artifact in zip(self, Artifact._store_many(contents, mimetype)):
+                rec[artifact_field] = artifact
+
+    @api.depends('edi_payload_artifact_id')
+    def _compute_edi_payload(self):
+        for rec in self:
+            artifact = rec.edi_payload_artifact_id
+            rec.edi_payload = artifact._get_content().decode('utf-8') if artifact else False
+
+    def _inverse_edi_payload(self):
+        Artifact = self.env['l10n_co_nomina.edi.artifact']
+        contents = [compact_payload(rec.edi_payload).encode('utf-8') if rec.edi_payload else None
+                    for rec in self]
+        for rec, artifact in zip(self, Artifact._store_many(contents, 'application/json')):
+            rec.edi_payload_artifact_id = artifact
+
     # --- Métodos Helper ---
 
     def _format_date_hours(self, date_obj, hours_float):
@@ -173,59 +226,281 @@ class Edi(models.AbstractModel):
 
     def _validate_dian_generic(self, consolidated_data=None):
         """
-        Orquesta el proceso de validación usando el flujo estándar de Odoo EDI,
-        creando un registro temporal en account.move.
+        Orquesta el proceso de validación usando el flujo estándar de Odoo EDI
+        a través de un proxy en memoria (sin crear ni borrar account.move).
+        Los XML de cada compañía se firman en lote con la llave cacheada por
+        worker (``_l10n_co_payroll_sign_xml_batch``) antes de enviarlos.
+        """
+        for company, records in self.grouped('company_id').items():
+            rendered = []
+            for rec in records:
+                _logger.info(
+                    f"Iniciando _validate_dian_generic (flujo estándar) para {rec.display_name}...")
+                try:
+                    # 1. Preparar y renderizar el XML
+                    xml_data = rec._prepare_xml_data(consolidated_data)
+                    xml_content_bytes = rec._render_payroll_xml(xml_data)
+                    rec._check_payroll_xml_schema(xml_content_bytes)
+                except Exception as e:
+                    _logger.exception(
+                        "Fallo durante el flujo estándar de envío a la DIAN: %s", e)
+                    raise UserError(_("Fallo durante el envío a la DIAN: %s") % e)
+                rendered.append((rec, xml_data.get('cune'), xml_content_bytes))
+
+            # 2. Firmar todo el lote de la compañía con una sola carga de la llave
+            signed = self._sign_payroll_xml_batch(company, [xml for __, __, xml in rendered])
+
+            for (rec, cune, __), signed_xml in zip(rendered, signed):
+                try:
+                    # l10n_co_dian guarda su propio adjunto del XML firmado; aquí
+                    # basta un contenedor en memoria.
+                    attachment = SimpleNamespace(name=f"{cune}.xml", raw=signed_xml)
+
+                    # 3. Obtener el Diario y construir el proxy del documento
+                    payroll_journal = rec.company_id.edi_payroll_journal_id
+                    if not payroll_journal:
+                        raise UserError(
+                            _("No se ha configurado un 'Diario para Nómina Electrónica' en la compañía."))
+
+                    proxy = rec._get_payroll_edi_proxy(payroll_journal)
+
+                    # 4. Enviar y procesar la respuesta vía l10n_co_dian
+                    edi_result = proxy._post(attachment)
+
+                    if edi_result.get('error'):
+                        raise UserError(edi_result['error'])
+
+                    # 5. Actualizar nuestro registro con la respuesta
+                    rec.edi_is_valid = edi_result.get('success', False)
+                    rec.message_post(
+                        body=f"Resultado de la DIAN: {edi_result.get('message', 'Sin mensaje.')}")
+
+                except Exception as e:
+                    _logger.exception(
+                        "Fallo durante el flujo estándar de envío a la DIAN: %s", e)
+                    raise UserError(_("Fallo durante el envío a la DIAN: %s") % e)
+
+    def _sign_payroll_xml_batch(self, company, xml_documents):
         """
+        Firma los XML de ``company`` en lote; un fallo (certificado ausente,
+        contraseña incorrecta o firma inválida) se informa con el certificado
+        de la compañía.
+        """
+        try:
+            return company._l10n_co_payroll_sign_xml_batch(xml_documents)
+        except Exception as e:
+            _logger.exception("Fallo al firmar los XML de nómina de %s: %s", company.name, e)
+            raise UserError(_(
+                "No se pudo firmar el XML de nómina con el certificado %(certificate)s "
+                "de la compañía %(company)s: %(error)s",
+                certificate=company.certificate_filename or _("(sin nombre)"),
+                company=company.name, error=e))
+
+    # --- Envío por lotes en sobres ZIP ---
+
+    def _prepare_signed_payroll_documents(self):
+        """
+        Prepara, renderiza, aplica el autochequeo XSD (si está activo) y firma el XML de cada registro.
+        Todos los registros deben ser de la misma compañía: la llave se carga
+        una sola vez. Devuelve ``[(nombre_xml, bytes_firmados, registro)]``.
+        """
+        company = self.mapped('company_id')
+        if len(company) != 1:
+            raise UserError(_("El envío por lotes requiere documentos de una sola compañía."))
+        rendered = []
+        consolidated_by_id = self._get_consolidated_payroll_data_batch()
         for rec in self:
-            _logger.info(
-                f"Iniciando _validate_dian_generic (flujo estándar) para {rec.display_name}...")
-            temp_move = self.env['account.move']
+            consolidated_data = consolidated_by_id.get(rec.id)
+            if consolidated_data is None and hasattr(rec, '_get_consolidated_payroll_data'):
+                consolidated_data = rec._get_consolidated_payroll_data()
+            xml_data = rec._prepare_xml_data(consolidated_data)
+            xml_content_bytes = rec._render_payroll_xml(xml_data)
+            rec._check_payroll_xml_schema(xml_content_bytes)
+            rendered.append((xml_data.get('cune'), xml_content_bytes, rec))
+        signed = self._sign_payroll_xml_batch(company, [xml for __, xml, __ in rendered])
+        documents = []
+        for (cune, __, rec), signed_xml in zip(rendered, signed):
+            filename = '%s.xml' % cune
+            # El CUNE y el nombre del XML permiten ubicar cada documento en GetStatusZip
+            rec.write({'edi_uuid': cune, 'edi_xml_name': filename})
+            documents.append((filename, signed_xml, rec))
+        return documents
+
+    def _send_payroll_zip_batch(self, test_set_id=None):
+        """
+        Empaqueta los documentos firmados en sobres ZIP (en memoria) y los
+        envía de forma asíncrona: al set de pruebas si hay ``test_set_id``,
+        si no con SendBillAsync. El ZipKey de cada sobre se enlaza a todos
+        sus documentos con una sola escritura.
+
+        Un sobre fallido no interrumpe el lote: el error queda en sus
+        documentos y los ZipKeys de los sobres ya enviados se conservan.
+        Devuelve ``({zip_key: registros}, registros_fallidos)``.
+        """
+        if not self:
+            return {}, self
+        company = self.mapped('company_id')
+        documents = self._prepare_signed_payroll_documents()
+        packager = PayrollZipPackager(company.partner_id.vat or company.vat)
+        service, service_kwargs = company.with_context(
+            is_l10n_co_payroll=True)._get_l10n_co_dian_service('payroll')
+        soap_headers = service_kwargs.get('soapheaders')
+
+        results = {}
+        failed = self.browse()
+        for envelope in packager.package(documents):
+            records = self.browse([rec.id for rec in envelope.refs])
+            content_b64 = base64.b64encode(envelope.content).decode('ascii')
+            _logger.info("Enviando sobre %s con %s documentos de nómina a la DIAN.",
+                         envelope.name, len(records))
             try:
-                # 1. Preparar y renderizar el XML
-                xml_data = rec._prepare_xml_data(consolidated_data)
-                xml_content = self.env['ir.qweb']._render(
-                    rec._get_xml_template_ref(), xml_data)
-                xml_content_bytes = xml_content.encode(
-                    'utf-8') if isinstance(xml_content, str) else xml_content
-
-                attachment = self.env['ir.attachment'].create({
-                    'name': f"{xml_data.get('cune')}.xml",
-                    'datas': base64.b64encode(xml_content_bytes),
-                    'mimetype': 'application/xml'
-                })
-
-                # 2. Obtener el Diario y crear un registro proxy en account.move
-                payroll_journal = rec.company_id.edi_payroll_journal_id
-                if not payroll_journal:
-                    raise UserError(
-                        _("No se ha configurado un 'Diario para Nómina Electrónica' en la compañía."))
+                if test_set_id:
+                    response = service.SendTestSetAsync(
+                        fileName=envelope.name, contentFile=content_b64,
+                        testSetId=test_set_id, _soapheaders=soap_headers)
+                else:
+                    response = service.SendBillAsync(
+                        fileName=envelope.name, contentFile=content_b64,
+                        _soapheaders=soap_headers)
+            except Exception as e:
+                _logger.exception("Fallo enviando el sobre %s a la DIAN.", envelope.name)
+                records._mark_payroll_zip_failed(
+                    envelope.name, _("Fallo enviando el sobre %s a la DIAN: %s") % (envelope.name, e))
+                failed |= records
+                continue
+
+            zip_key = getattr(response, 'ZipKey', None)
+            if not zip_key:
+                records._mark_payroll_zip_failed(
+                    envelope.name, _("La DIAN no devolvió ZipKey para el sobre %s: %s")
+                    % (envelope.name, getattr(response, 'ErrorMessageList', response)))
+                failed |= records
+                continue
+            records.write({
+                'edi_zip_key': zip_key,
+                'edi_zip_name': envelope.name,
+                'edi_sync': False,
+            })
+            results[zip_key] = records
+        return results, failed
+
+    def _mark_payroll_zip_failed(self, envelope_name, message):
+        _logger.warning(message)
+        self.write({
+            'edi_zip_name': envelope_name,
+            'edi_status_message': message,
+        })
 
-                temp_move = self.env['account.move'].create({
-                    'journal_id': payroll_journal.id,
-                    'move_type': 'entry',
-                    'is_payroll_document_proxy': True,  # Nuestra bandera
-                })
+    def action_send_payroll_zip_batch(self):
+        """
+        Envía los documentos seleccionados pendientes en sobres ZIP, un lote
+        por compañía (al set de pruebas de la DIAN si la compañía está en
+        habilitación).
+        """
+        pending = self.filtered(
+            lambda r: r.state in ('done', 'paid') and not r.edi_is_valid and not r.edi_zip_key)
+        if not pending:
+            raise UserError(_("No hay documentos hechos pendientes de envío entre los seleccionados."))
+        sent_count = 0
+        failed = self.browse()
+        for company, records in pending.grouped('company_id').items():
+            test_set_id = None
+            if not company.edi_payroll_is_not_test:
+                test_set_id = company.l10n_co_payroll_test_set_id
+                if not test_set_id:
+                    raise UserError(_(
+                        "La compañía %s está en habilitación pero no tiene 'ID del Set de Pruebas DIAN'.")
+                        % company.name)
+            sent, company_failed = records._send_payroll_zip_batch(test_set_id=test_set_id)
+            sent_count += sum(len(sent_records) for sent_records in sent.values())
+            failed |= company_failed
+        message = _("%s documento(s) enviados en sobres ZIP.") % sent_count
+        if failed:
+            message += " " + _("%s documento(s) fallaron: %s") % (
+                len(failed), ", ".join(failed.mapped('display_name')))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Envío DIAN en sobres ZIP"),
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            },
+        }
 
-                # 3. Llamar al método _post del framework EDI de Odoo
-                # Este método se encarga de firmar, enviar y procesar la respuesta.
-                edi_result = temp_move._post(attachment)
+    def action_get_payroll_zip_status(self):
+        """Consulta GetStatusZip para los sobres de los documentos seleccionados."""
+        with_zip = self.filtered('edi_zip_key')
+        if not with_zip:
+            raise UserError(_("Ninguno de los documentos seleccionados tiene ZipKey de la DIAN."))
+        with_zip._get_payroll_zip_status()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Estado de sobres ZIP"),
+                'message': _("%s de %s documento(s) validados por la DIAN.") % (
+                    len(with_zip.filtered('edi_is_valid')), len(with_zip)),
+                'type': 'info',
+                'sticky': False,
+            },
+        }
 
-                if edi_result.get('error'):
-                    raise UserError(edi_result['error'])
+    def _get_payroll_zip_status(self):
+        """
+        Consulta GetStatusZip una sola vez por ZipKey y actualiza cada
+        documento del sobre según su CUNE.
+        """
+        by_zip_key = defaultdict(lambda: self.browse())
+        for rec in self.filtered('edi_zip_key'):
+            by_zip_key[rec.edi_zip_key] |= rec
+        for zip_key, records in by_zip_key.items():
+            company = records.mapped('company_id')[:1]
+            service, service_kwargs = company.with_context(
+                is_l10n_co_payroll=True)._get_l10n_co_dian_service('payroll')
+            responses = service.GetStatusZip(
+                trackId=zip_key, _soapheaders=service_kwargs.get('soapheaders'))
+            if not isinstance(responses, list):
+                responses = [responses]
+            by_key = {}
+            for resp in responses:
+                by_key[getattr(resp, 'XmlDocumentKey', None)] = resp
+                by_key[getattr(resp, 'XmlFileName', None)] = resp
+            for rec in records:
+                response = by_key.get(rec.edi_uuid) or by_key.get(rec.edi_xml_name)
+                if response is None and len(records) == 1 and responses:
+                    response = responses[0]
+                if response is None:
+                    continue
+                errors = getattr(response, 'ErrorMessage', None) or []
+                if not isinstance(errors, list):
+                    errors = [errors]
+                rec.write({
+                    'edi_is_valid': bool(getattr(response, 'IsValid', False)),
+                    'edi_status_code': str(getattr(response, 'StatusCode', '')),
+                    'edi_status_message': getattr(response, 'StatusDescription', ''),
+                    'edi_errors_messages': '\n'.join(str(error) for error in errors) or False,
+                })
 
-                # 4. Actualizar nuestro registro con la respuesta
-                self.edi_is_valid = edi_result.get('success', False)
-                self.message_post(
-                    body=f"Resultado de la DIAN: {edi_result.get('message', 'Sin mensaje.')}")
+    def _get_consolidated_payroll_data_batch(self):
+        """
+        Datos consolidados por registro (``{id: datos}``) calculados en lote.
+        Solo los modelos consolidados los proveen; por defecto no hay ninguno.
+        """
+        return {}
 
-            except Exception as e:
-                _logger.exception(
-                    "Fallo durante el flujo estándar de envío a la DIAN: %s", e)
-                raise UserError(_("Fallo durante el envío a la DIAN: %s") % e)
-            finally:
-                # 5. Asegurarnos de borrar siempre el registro temporal
-                if temp_move:
-                    temp_move.unlink()
+    def _get_payroll_edi_proxy(self, journal):
+        """Proxy en memoria que reciben los hooks de l10n_co_dian_patch en lugar de un account.move."""
+        self.ensure_one()
+        return PayrollEdiProxy(
+            env=self.env,
+            company_id=self.company_id,
+            journal_id=journal,
+            name=getattr(self, 'number', False) or self.display_name,
+            date=getattr(self, 'date', False) or fields.Date.context_today(self),
+            source=self,
+        )
 
     def _process_raw_dian_response(self, response, cune, signed_xml_bytes):
         """
@@ -257,14 +532,9 @@ class Edi(models.AbstractModel):
                 for error in errors:
                     error_messages.append(str(error))
 
-        # Crear adjuntos
-        xml_attachment = self.env['ir.attachment'].create({
-            'name': f"{cune}.xml",
-            'type': 'binary',
-            'datas': base64.b64encode(signed_xml_bytes),
-            'res_model': self._name,
-            'res_id': self.id,
-        })
+        # XML firmado como artefacto comprimido (deduplicado por contenido)
+        xml_artifact = self.env['l10n_co_nomina.edi.artifact']._store(
+            signed_xml_bytes, 'application/xml')
 
         vals_to_write = {
             'edi_is_valid': is_valid,
@@ -272,7 +542,7 @@ class Edi(models.AbstractModel):
             'edi_status_code': str(status_code),
             'edi_status_message': status_message,
             'edi_errors_messages': '\n'.join(error_messages) if error_messages else False,
-            'edi_xml_attachment_id': xml_attachment.id,
+            'edi_xml_artifact_id': xml_artifact.id,
             'edi_issue_date': fields.Date.today(),
         }
         self.write(vals_to_write)
@@ -308,6 +578,8 @@ class Edi(models.AbstractModel):
         ]) if isinstance(errors, list) else str(errors)
 
         xml_attachment = dian_document.attachment_id
+        xml_artifact = self.env['l10n_co_nomina.edi.artifact']._store(
+            xml_attachment.raw, 'application/xml') if xml_attachment.raw else False
         response_attachment = dian_document.response_attachment_id
         issue_date = fields.Date.to_date(
             response_data.get('issue_date')) or getattr(self, 'date', date.today())
@@ -318,7 +590,7 @@ class Edi(models.AbstractModel):
             'edi_status_code': status_code,  # Usar estado DIAN o el estado del documento Odoo
             'edi_status_message': status_message,
             'edi_errors_messages': error_messages,
-            'edi_xml_attachment_id': xml_attachment.id if xml_attachment else False,
+            'edi_xml_artifact_id': xml_artifact.id if xml_artifact else False,
             'edi_response_attachment_id': response_attachment.id if response_attachment else False,
             'edi_zip_key': dian_document.zip_key or False,
             'edi_payload': original_payload,  # Guardar payload para depuración
@@ -433,90 +705,16 @@ class Edi(models.AbstractModel):
             if payslip_obj.note:
                 source_data['notes'] = [{'text': payslip_obj.note}]
 
-            # --- Agregar Devengos y Deducciones NUMÉRICOS a source_data (agregados por categoría) ---
-            aggregated_values = defaultdict(
-                lambda: {'total': 0.0, 'quantity': 0.0, 'rates': [], 'details': []})
-
-            # Procesar line_ids (Calculados por reglas)
-            for line in payslip_obj.line_ids:
-                rule = line.salary_rule_id
-                if not rule:
-                    continue
-
-                concept_type = getattr(rule, 'type_concept', None)
-                is_detailed = getattr(rule, 'edi_is_detailed', False)
-
-                if concept_type == 'earn':
-                    earn_category = getattr(rule, 'earn_category', None)
-                    if not earn_category:
-                        continue
-                    # Si es la categoría 'basic', la manejamos aparte para los días y salario base
-                    if earn_category == 'basic':
-                        _logger.debug(
-                            f"Línea Salario Básico ({rule.name}/{rule.code}) encontrada: Cantidad={line.quantity}, Total={line.total}")
-                        source_data['earn']['basic']['worked_days'] = line.quantity
-                        source_data['earn']['basic']['worker_salary'] = line.total
-                    else:
-                        key = ('earn_calc', earn_category)
-                        aggregated_values[key]['total'] += line.total
-                        aggregated_values[key]['quantity'] += getattr(
-                            line, 'edi_quantity', line.quantity)
-                        rate = getattr(line, 'edi_rate', line.rate)
-                        if rate != 100.0:
-                            aggregated_values[key]['rates'].append(rate)
-                    # Sumar al total devengado
-                    source_data['accrued_total_numeric'] += line.total
-                elif concept_type == 'deduction':
-                    ded_category = getattr(rule, 'deduction_category', None)
-                    if not ded_category:
-                        continue
-                    key = ('ded_calc', ded_category)
-                    # Deducciones son positivas en XML
-                    aggregated_values[key]['total'] += abs(line.total)
-                    aggregated_values[key]['quantity'] += getattr(
-                        line, 'edi_quantity', line.quantity)
-                    rate = getattr(line, 'edi_rate', line.rate)
-                    if rate != 100.0:
-                        aggregated_values[key]['rates'].append(rate)
-                    # Sumar al total deducciones
-                    source_data['deductions_total_numeric'] += abs(line.total)
-
-            # Procesar earn_ids (Detalles manuales) - Tienen prioridad para detalles, pero su total se suma
-            if hasattr(payslip_obj, 'earn_ids'):
-                for earn_line in payslip_obj.earn_ids:
-                    category = earn_line.category
-                    if not category:
-                        continue
-                    key = ('earn_detail', category)
-                    amount = abs(earn_line.total)
-                    quantity = abs(earn_line.quantity)
-                    aggregated_values[key]['total'] += amount
-                    aggregated_values[key]['quantity'] += quantity
-                    aggregated_values[key]['details'].append({
-                        'payment': amount, 'quantity': quantity,
-                        'start': earn_line.date_start, 'end': earn_line.date_end,
-                        'time_start': earn_line.time_start, 'time_end': earn_line.time_end,
-                        'description': earn_line.name,
-                    })
-                    # Solo sumar al total global si no es básico, para evitar duplicidad si ya viene de rule line
-                    if category != 'basic':
-                        source_data['accrued_total_numeric'] += amount
-
-            # Procesar deduction_ids (Detalles manuales)
-            if hasattr(payslip_obj, 'deduction_ids'):
-                for ded_line in payslip_obj.deduction_ids:
-                    category = ded_line.category
-                    if not category:
-                        continue
-                    key = ('ded_detail', category)
-                    amount = abs(ded_line.amount)
-                    aggregated_values[key]['total'] += amount
-                    # Asumimos 1 por cada línea manual
-                    aggregated_values[key]['quantity'] += 1
-                    aggregated_values[key]['details'].append({
-                        'payment': amount, 'description': ded_line.name,
-                    })
-                    source_data['deductions_total_numeric'] += amount
+            # --- Agregar Devengos y Deducciones NUMÉRICOS (documento intermedio, una sola pasada) ---
+            payroll_doc = build_payroll_document(payslip_obj)
+            aggregated_values = payroll_doc.as_aggregated_values()
+            if payroll_doc.basic_days or payroll_doc.basic_salary:
+                source_data['earn']['basic']['worked_days'] = float(payroll_doc.basic_days)
+                source_data['earn']['basic']['worker_salary'] = float(payroll_doc.basic_salary)
+            source_data['accrued_total_numeric'] = float(
+                payroll_doc.accrued_total + payroll_doc.accrued_detail_total)
+            source_data['deductions_total_numeric'] = float(
+                payroll_doc.deductions_total + payroll_doc.deductions_detail_total)
 
             # --- Construir estructura detallada en source_data['earn'] y source_data['deduction'] ---
             # Ahora usamos los valores agregados de aggregated_values
@@ -1221,6 +1419,103 @@ class Edi(models.AbstractModel):
         _logger.info("Datos XML preparados para: %s", self.display_name)
         return xml_data
 
+    def _get_payroll_xml_engine(self):
+        """
+        Motor de render del XML de nómina: 'qweb' (por defecto) o 'lxml'.
+        Configurable con el parámetro de sistema 'l10n_co_nomina.payroll_xml_engine';
+        la equivalencia de ambos motores la cubre tests/test_payroll_xml_builder.py.
+        """
+        engine = self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_co_nomina.payroll_xml_engine', 'qweb')
+        return engine if engine in ('lxml', 'qweb') else 'qweb'
+
+    def _render_payroll_xml(self, xml_data):
+        """
+        Renderiza el XML de nómina (bytes UTF-8) a partir de `xml_data`.
+        El constructor lxml genera el mismo árbol que la plantilla QWeb sin
+        el costo por documento del motor de plantillas (opcional).
+        """
+        self.ensure_one()
+        is_credit_note = bool(getattr(self, 'credit_note', False))
+        if self._get_payroll_xml_engine() == 'qweb':
+            xml_content = self.env['ir.qweb']._render(
+                self._get_xml_template_ref(), qweb_values(xml_data))
+            return xml_content.encode('utf-8') if isinstance(xml_content, str) else xml_content
+        return build_payroll_xml(xml_data, adjustment=is_credit_note)
+
+    # --- Autochequeo local contra los XSD del módulo ---
+    # Los XSD de data/xsd los escribió el módulo a partir del Anexo Técnico y
+    # de su propia salida; no son los XSD oficiales de la DIAN. Sirven para
+    # detectar regresiones del XML generado, no para certificar el documento.
+
+    def _is_payroll_xsd_validation_enabled(self):
+        """
+        Parámetro de sistema 'l10n_co_nomina.payroll_xsd_validation'
+        (inactivo por defecto): bloquea la firma si el XML no pasa el
+        autochequeo del módulo.
+        """
+        value = self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_co_nomina.payroll_xsd_validation', '0')
+        return value not in ('0', 'false', 'False')
+
+    def _get_payroll_xml_schema_errors(self, xml_content_bytes):
+        """Violaciones del autochequeo (XSD del módulo) para el XML ya renderizado (sin red)."""
+        self.ensure_one()
+        is_credit_note = bool(getattr(self, 'credit_note', False))
+        return validate_payroll_xml(xml_content_bytes, adjustment=is_credit_note)
+
+    def _check_payroll_xml_schema(self, xml_content_bytes):
+        """Autochequeo antes de firmar, si está activo; lanza UserError con todas las violaciones."""
+        self.ensure_one()
+        if not self._is_payroll_xsd_validation_enabled():
+            return
+        errors = self._get_payroll_xml_schema_errors(xml_content_bytes)
+        if errors:
+            raise UserError(_("El XML de %s no pasa el autochequeo del módulo (XSD no oficial):\n%s")
+                            % (self.display_name, "\n".join(errors)))
+
+    def _collect_payroll_xml_schema_errors(self):
+        """
+        Modo lote: prepara y renderiza el XML de cada registro y le aplica el
+        autochequeo del módulo, sin firmar ni enviar. Devuelve ``{registro: [errores]}``
+        solo con los documentos que fallan (incluidos errores de preparación).
+        """
+        errors_by_record = {}
+        consolidated_by_id = self._get_consolidated_payroll_data_batch()
+        for rec in self:
+            try:
+                consolidated_data = consolidated_by_id.get(rec.id)
+                if consolidated_data is None and hasattr(rec, '_get_consolidated_payroll_data'):
+                    consolidated_data = rec._get_consolidated_payroll_data()
+                xml_data = rec._prepare_xml_data(consolidated_data)
+                errors = rec._get_payroll_xml_schema_errors(rec._render_payroll_xml(xml_data))
+            except UserError as e:
+                errors = [str(e)]
+            if errors:
+                errors_by_record[rec] = errors
+        return errors_by_record
+
+    def action_check_payroll_xml_schema(self):
+        """Autochequeo del XML de los documentos seleccionados; reporta todas las violaciones."""
+        errors_by_record = self._collect_payroll_xml_schema_errors()
+        if errors_by_record:
+            lines = []
+            for rec, errors in errors_by_record.items():
+                lines.append("%s:" % rec.display_name)
+                lines.extend("  - %s" % error for error in errors)
+            raise UserError(_("%s de %s documento(s) no pasan el autochequeo del módulo (XSD no oficial):\n%s")
+                            % (len(errors_by_record), len(self), "\n".join(lines)))
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Autochequeo del XML"),
+                'message': _("%s documento(s) pasan el autochequeo del módulo.") % len(self),
+                'type': 'success',
+                'sticky': False,
+            },
+        }
+
     def _get_xml_template_ref(self):
         """Devuelve la referencia a la plantilla QWeb XML correcta."""
         self.ensure_one()
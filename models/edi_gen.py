@@ -7,7 +7,13 @@
 #
 
 import logging
-from odoo import fields, models, api, _
+from collections import defaultdict
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import fields, models, api, Command, _
+from odoo.tools import SQL
 
 _logger = logging.getLogger(__name__)
 
@@ -36,6 +42,104 @@ class EdiGen(models.TransientModel):
         ('103', 'Nómina Individual de Ajuste (103)'),
     ], string='Tipo de Documento NE', required=True, default='102')
 
+    generation_mode = fields.Selection([
+        ('incremental', 'Incremental'),
+        ('full', 'Regenerar todo'),
+    ], string='Modo', required=True, default='incremental',
+        help="Incremental: conserva los borradores cuyas nóminas no cambiaron, actualiza los "
+             "que cambiaron y crea solo los faltantes. Regenerar todo: elimina los borradores "
+             "del período y los vuelve a crear.")
+
+    # ---------------------------------------------------------------------------------
+    # Agrupación en SQL
+    # ---------------------------------------------------------------------------------
+    def _get_payslip_type_condition(self):
+        """Condición SQL que separa nóminas individuales (102) de ajustes (103)."""
+        if self.payroll_type == '103':
+            return SQL("p.credit_note IS TRUE AND p.origin_payslip_id IS NOT NULL")
+        return SQL("p.credit_note IS NOT TRUE AND p.origin_payslip_id IS NULL")
+
+    def _get_period_bounds(self):
+        month_start = date(int(self.year), int(self.month), 1)
+        month_end = month_start + relativedelta(months=1, days=-1)
+        return month_start, month_end
+
+    def _fetch_payslip_groups(self, company):
+        """
+        Nóminas hechas/pagadas del período agrupadas por empleado en una sola
+        consulta. Cada fila trae:
+
+        * ``payslip_ids`` ordenadas por fecha y ``contract_id`` de la más reciente;
+        * ``fingerprint``: resumen de ids y ``write_date`` de las nóminas (si
+          coincide con la del consolidado, su contenido no cambió);
+        * ``period_codes``: periodicidades DIAN de los contratos involucrados;
+        * ``skip_reason``: ``None`` si las nóminas cubren el mes, o el motivo
+          (``'overlap'``, ``'gap'``, ``'coverage'``).
+
+        La cobertura se valida por rangos de fechas, no por cantidad de
+        nóminas: los periodos (recortados al mes) deben encadenarse sin
+        traslaparse, salvo saltos que empiezan con un nuevo contrato, y cubrir
+        desde el inicio del mes o del contrato hasta el fin del mes o del
+        contrato. Para periodicidades semanal, decenal y catorcenal se tolera
+        una cola descubierta menor a un periodo, que se liquida en el mes
+        siguiente. La periodicidad sale de ``payroll_period_id`` del contrato
+        o, si está vacío, de la periodicidad de la compañía.
+        """
+        self.env['hr.payslip'].flush_model(
+            ['employee_id', 'contract_id', 'company_id', 'year', 'month', 'state',
+             'credit_note', 'origin_payslip_id', 'date_from', 'date_to'])
+        self.env['hr.contract'].flush_model(['date_start', 'date_end', 'payroll_period_id'])
+        month_start, month_end = self._get_period_bounds()
+        default_code = {'mensual': '5', 'quincenal': '4'}.get(
+            getattr(company, 'payroll_periodicity', 'quincenal'), '4')
+        self.env.cr.execute(SQL("""
+            WITH slips AS (
+                SELECT p.id, p.employee_id, p.contract_id, p.date_to, p.write_date,
+                       GREATEST(p.date_from, %(month_start)s::date) AS span_start,
+                       LEAST(p.date_to, %(month_end)s::date) AS span_end,
+                       GREATEST(%(month_start)s::date, COALESCE(c.date_start, %(month_start)s::date)) AS due_start,
+                       LEAST(%(month_end)s::date, COALESCE(c.date_end, %(month_end)s::date)) AS due_end,
+                       COALESCE(pp.code, %(default_code)s) AS period_code
+                  FROM hr_payslip p
+             LEFT JOIN hr_contract c ON c.id = p.contract_id
+             LEFT JOIN l10n_co_nomina_payroll_period pp ON pp.id = c.payroll_period_id
+                 WHERE p.company_id = %(company_id)s
+                   AND p.year = %(year)s
+                   AND p.month = %(month)s
+                   AND p.state IN ('done', 'paid')
+                   AND %(type_condition)s
+            ), chained AS (
+                SELECT s.*,
+                       MAX(s.span_end) OVER (
+                           PARTITION BY s.employee_id ORDER BY s.span_start, s.id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS covered_until,
+                       CASE s.period_code WHEN '1' THEN 6 WHEN '2' THEN 9 WHEN '3' THEN 13 ELSE 0 END AS tail_days
+                  FROM slips s
+            ), grouped AS (
+                SELECT employee_id,
+                       array_agg(id ORDER BY date_to, id) AS payslip_ids,
+                       (array_agg(contract_id ORDER BY date_to DESC, id DESC))[1] AS contract_id,
+                       md5(string_agg(id || ':' || COALESCE(write_date::text, ''), ',' ORDER BY id)) AS fingerprint,
+                       array_agg(DISTINCT period_code) AS period_codes,
+                       bool_or(span_start <= covered_until) AS has_overlap,
+                       bool_or(span_start > covered_until + 1 AND span_start > due_start) AS has_gap,
+                       MIN(span_start) <= MIN(due_start)
+                           AND MAX(span_end) + (array_agg(tail_days ORDER BY span_end DESC, id DESC))[1] >= MAX(due_end)
+                           AS is_covered
+                  FROM chained
+              GROUP BY employee_id
+            )
+            SELECT employee_id, payslip_ids, contract_id, fingerprint, period_codes,
+                   CASE WHEN has_overlap THEN 'overlap'
+                        WHEN has_gap THEN 'gap'
+                        WHEN NOT is_covered THEN 'coverage'
+                   END AS skip_reason
+              FROM grouped
+        """, company_id=company.id, year=int(self.year), month=self.month,
+            month_start=month_start, month_end=month_end, default_code=default_code,
+            type_condition=self._get_payslip_type_condition()))
+        return self.env.cr.dictfetchall()
+
     # ---------------------------------------------------------------------------------
     # MÉTODO PRINCIPAL: Generar registros hr.payslip.edi según los criterios del wizard
     # ---------------------------------------------------------------------------------
@@ -45,90 +149,97 @@ class EdiGen(models.TransientModel):
             f"[EDI] Iniciando generación EDI - Mes: {self.month}, Año: {self.year}, Tipo: {self.payroll_type}"
         )
 
-        payslip_env = self.env['hr.payslip']
-        edi_payslip_env = self.env['hr.payslip.edi']
+        edi_payslip_env = self.env['hr.payslip.edi'].with_context(tracking_disable=True)
         company = self.env.company
-        periodicidad = getattr(company, 'payroll_periodicity', 'quincenal')
-
-        # --- Filtrar nóminas según payroll_type ---
-        payslip_domain = [
+        period_domain = [
+            ('company_id', '=', company.id),
             ('year', '=', int(self.year)),
             ('month', '=', self.month),
-            ('state', 'in', ('done', 'paid')),
         ]
-        if self.payroll_type == '102':
-            payslip_domain += [
-                ('credit_note', '=', False),
-                ('origin_payslip_id', '=', False),
-            ]
-            _logger.info("[EDI] Filtrado: Nómina Individual (102)")
-        elif self.payroll_type == '103':
-            payslip_domain += [
-                ('credit_note', '=', True),
-                ('origin_payslip_id', '!=', False),
-            ]
-            _logger.info("[EDI] Filtrado: Nómina Ajuste (103)")
-
-        payslips = payslip_env.search(payslip_domain)
-        _logger.info(f"[EDI] Nóminas a procesar encontradas: {len(payslips)}")
-
-        # Eliminar EDI draft antiguos de ese mes/año/tipo
-        edi_draft_domain = [
-            ('year', '=', int(self.year)),
-            ('month', '=', self.month),
-            ('state', '=', 'draft'),
-        ]
-        edi_payslips_draft = edi_payslip_env.search(edi_draft_domain)
-        if edi_payslips_draft:
-            _logger.info(
-                f"[EDI] Borrando {len(edi_payslips_draft)} EDI en borrador antiguos.")
-            edi_payslips_draft.unlink()
-
-        # Agrupar payslips por empleado
-        payslips_by_employee = {}
-        for payslip in payslips:
-            emp_id = payslip.employee_id.id
-            payslips_by_employee.setdefault(emp_id, []).append(payslip)
-
-        edi_created = []
-        for emp_id, payslip_list in payslips_by_employee.items():
-            crear_edi = False
-            # Valida periodicidad
-            if periodicidad == 'quincenal' and len(payslip_list) == 2:
-                crear_edi = True
-            elif periodicidad == 'mensual' and len(payslip_list) == 1:
-                crear_edi = True
-
-            if crear_edi:
-                # Previene duplicados
-                existing_edi = edi_payslip_env.search([
-                    ('year', '=', int(self.year)),
-                    ('month', '=', self.month),
-                    ('employee_id', '=', emp_id),
-                    # ('document_type', '=', self.payroll_type), # Si tu modelo lo tiene
-                ], limit=1)
-                if existing_edi:
-                    continue
-
-                new_edi = edi_payslip_env.create({
-                    'year': int(self.year),
-                    'month': self.month,
-                    'employee_id': emp_id,
-                    # 'document_type': self.payroll_type,
-                })
-                # Asociar los payslips al EDI
-                new_edi.payslip_ids = [(6, 0, [ps.id for ps in payslip_list])]
-                # Asignar último contrato
-                if payslip_list:
-                    new_edi.contract_id = payslip_list[-1].contract_id.id
-                edi_created.append(new_edi)
+
+        if self.generation_mode == 'full':
+            # Eliminar EDI draft antiguos de ese mes/año
+            edi_payslips_draft = edi_payslip_env.search(period_domain + [('state', '=', 'draft')])
+            if edi_payslips_draft:
+                _logger.info(
+                    f"[EDI] Borrando {len(edi_payslips_draft)} EDI en borrador antiguos.")
+                edi_payslips_draft.unlink()
+
+        groups = self._fetch_payslip_groups(company)
+        _logger.info(f"[EDI] Empleados con nóminas a procesar: {len(groups)}")
+
+        # Una sola consulta por los EDI ya existentes del período
+        existing_by_employee = {}
+        stale_drafts = edi_payslip_env.browse()
+        for edi in edi_payslip_env.search_fetch(
+                period_domain, ['employee_id', 'state', 'payslip_fingerprint'], order='id'):
+            current = existing_by_employee.get(edi.employee_id.id)
+            if current is None or (current.state == 'draft' and edi.state != 'draft'):
+                if current is not None:
+                    stale_drafts |= current
+                existing_by_employee[edi.employee_id.id] = edi
+            elif edi.state == 'draft':
+                # Borrador duplicado del mismo empleado
+                stale_drafts |= edi
+
+        counts = dict.fromkeys(
+            ('created', 'updated', 'unchanged', 'removed', 'existing',
+             'overlap', 'gap', 'coverage'), 0)
+        skipped = defaultdict(list)
+        vals_list = []
+        valid_employee_ids = set()
+        mixed_periodicity = 0
+        for group in groups:
+            employee_id = group['employee_id']
+            # Valida la cobertura del mes por rangos de fechas
+            if group['skip_reason']:
+                skipped[group['skip_reason']].append(employee_id)
+                continue
+            if len(group['period_codes']) > 1:
+                mixed_periodicity += 1
+            valid_employee_ids.add(employee_id)
+            fingerprint = group['fingerprint']
+            vals = {
+                'payslip_ids': [Command.set(group['payslip_ids'])],
+                'contract_id': group['contract_id'],
+                'payslip_fingerprint': fingerprint,
+            }
+            existing = existing_by_employee.get(employee_id)
+            if not existing:
+                vals_list.append(dict(vals, year=int(self.year), month=self.month,
+                                      employee_id=employee_id, company_id=company.id))
+            elif existing.state != 'draft':
+                counts['existing'] += 1
+            elif existing.payslip_fingerprint == fingerprint:
+                counts['unchanged'] += 1
             else:
-                _logger.warning(
-                    f"[EDI] Empleado {emp_id} no tiene la cantidad adecuada de payslips: encontrados {len(payslip_list)}"
-                )
+                existing.write(vals)
+                counts['updated'] += 1
 
+        # Borradores cuyo empleado ya no tiene nóminas válidas en el período
+        stale_drafts |= edi_payslip_env.browse([
+            edi.id for employee_id, edi in existing_by_employee.items()
+            if edi.state == 'draft' and employee_id not in valid_employee_ids
+        ])
+        if stale_drafts:
+            stale_drafts.unlink()
+        counts['removed'] = len(stale_drafts)
+
+        edi_created = edi_payslip_env.create(vals_list)
+        counts['created'] = len(edi_created)
+        for reason, employee_ids in skipped.items():
+            counts[reason] = len(employee_ids)
+            _logger.warning(
+                f"[EDI] {len(employee_ids)} empleado(s) omitido(s) por '{reason}' "
+                f"(nóminas que no cubren el mes): {employee_ids[:50]}"
+            )
         _logger.info(
-            "[EDI] Proceso de generación EDI completado correctamente.")
+            "[EDI] Proceso de generación EDI (%s) completado: %s creado(s), %s actualizado(s), "
+            "%s sin cambios, %s eliminado(s), %s con periodicidad mixta. Omitidos: %s por traslape, "
+            "%s por huecos, %s por cobertura incompleta, %s por EDI no borrador.",
+            self.generation_mode, counts['created'], counts['updated'], counts['unchanged'],
+            counts['removed'], mixed_periodicity, counts['overlap'], counts['gap'],
+            counts['coverage'], counts['existing'])
 
         # Acción de retorno
         action = {
@@ -139,4 +250,19 @@ class EdiGen(models.TransientModel):
             "domain": [('year', '=', int(self.year)), ('month', '=', self.month)],
             "context": {'search_default_year': int(self.year), 'search_default_month': self.month},
         }
-        return action
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Generación de Nómina Electrónica"),
+                'message': _(
+                    "%(created)s consolidado(s) creado(s), %(updated)s actualizado(s), "
+                    "%(unchanged)s sin cambios y %(removed)s borrador(es) obsoleto(s) eliminado(s). "
+                    "Omitidos: %(overlap)s por nóminas traslapadas, %(gap)s por huecos entre "
+                    "periodos, %(coverage)s por no cubrir el mes y %(existing)s por EDI ya "
+                    "validado o cancelado.", **counts),
+                'type': 'warning' if skipped else 'success',
+                'sticky': False,
+                'next': action,
+            },
+        }
@@ -22,6 +22,12 @@ class Contract(models.Model):
         string='Tipo Contrato (NE)',
         tracking=True,
         help="Clasificación del tipo de contrato según DIAN.")
+    payroll_period_id = fields.Many2one(
+        'l10n_co_nomina.payroll.period',
+        string='Periodo de Nómina (NE)',
+        tracking=True,
+        help="Periodicidad de pago del contrato según DIAN. Si está vacío se usa la "
+             "periodicidad de nómina de la compañía.")
 
     # Campos Boolean existentes (asegúrate de que existan)
     high_risk_pension = fields.Boolean(
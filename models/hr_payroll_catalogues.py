@@ -21,7 +21,7 @@ class L10nCoNominaPayrollPeriod(models.Model):
     _description = 'Periodo de Nómina (Nómina Electrónica)'
     name = fields.Char(required=True, translate=True)
     code = fields.Char(
-        required=True, help="Código DIAN ('1', '3', '4', '5', '6')")
+        required=True, help="Código DIAN ('1', '2', '3', '4', '5', '6')")
 
 # --- También necesitaríamos añadir datos iniciales (XML) para estos modelos ---
 # Ej: <record id="payroll_period_5" model="l10n_co_nomina.payroll.period">
@@ -17,7 +17,9 @@
 #
 
 
+import base64
 import calendar
+import json
 import logging
 from collections import defaultdict
 from datetime import date, timedelta, datetime
@@ -33,9 +35,12 @@ except ImportError:
     relativedelta = None
 
 # --- Imports de Odoo ---
-from odoo import api, fields, models, _
+from odoo import api, fields, models, Command, _
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_compare, float_is_zero
+from odoo.tools import SQL, float_compare, float_is_zero
+
+from .payroll_document import DED_CALC, DED_DETAIL, EARN_CALC, build_payroll_document, money
+from .payroll_json_schema import PAYROLL, validate_payloads
 
 # --- Definir _logger principal ---
 _logger = logging.getLogger(__name__)
@@ -117,13 +122,18 @@ class HrPayslip(models.Model):
     l10n_co_edi_qr_code_url = fields.Char(
         string='URL QR DIAN', copy=False, help="URL para consultar el documento en el portal de la DIAN.")
     l10n_co_edi_xml_file = fields.Binary(
-        string='XML DIAN', attachment=True, copy=False, help="Archivo XML de la Nómina Electrónica.")
+        string='XML DIAN', copy=False,
+        compute='_compute_edi_artifact_files', inverse='_inverse_edi_artifact_files',
+        help="Archivo XML de la Nómina Electrónica.")
     l10n_co_edi_pdf_file = fields.Binary(
-        string='PDF DIAN', attachment=True, copy=False, help="Representación gráfica en PDF de la Nómina Electrónica.")
+        string='PDF DIAN', copy=False,
+        compute='_compute_edi_artifact_files', inverse='_inverse_edi_artifact_files',
+        help="Representación gráfica en PDF de la Nómina Electrónica.")
     # Si lo usas en el XML, debe estar aquí.
     edi_uuid = fields.Char(string='UUID EDI', copy=False,
                            help="UUID del documento electrónico.")
     edi_payload = fields.Text(string='Payload EDI (Debug)', groups="base.group_no_one",
+                              compute='_compute_edi_payload', inverse='_inverse_edi_payload',
                               copy=False, help="Contenido del payload enviado/recibido para depuración.")
 
     @api.depends('date_to')
@@ -246,6 +256,34 @@ class HrPayslip(models.Model):
             payslip.others_total_amount = currency.round(
                 others) if currency else round(others, 2)
 
+    def _assign_resolution_numbers(self):
+        """
+        Numera en bloque las nóminas sin número de las compañías que numeran
+        con la resolución DIAN: un solo ``_allocate_numbers`` por resolución
+        (nómina individual '9' o nota de ajuste '10'), de modo que los lotes
+        concurrentes consumen bloques distintos en lugar de turnarse la fila
+        de la secuencia. Las demás siguen con la secuencia en ``compute_sheet``.
+        """
+        Resolution = self.env['l10n_co_nomina.resolution']
+        pending = defaultdict(list)
+        for payslip in self:
+            if payslip.number and payslip.number not in ('New', _('New')):
+                continue
+            company = payslip.company_id
+            if not company.l10n_co_nomina_payslip_resolution_numbering:
+                continue
+            resolution = Resolution._get_numbering_resolution(
+                company, '10' if payslip.credit_note else '9')
+            if resolution:
+                pending[resolution].append(payslip)
+        for resolution, payslips in pending.items():
+            # Los bloques los gestiona el asignador, no el usuario de nómina
+            numbers = resolution.sudo()._allocate_numbers(len(payslips))
+            for payslip, number in zip(payslips, numbers):
+                payslip.number = number
+            _logger.info("Resolución %s: asignados %s números de nómina (%s ... %s).",
+                         resolution.prefix, len(numbers), numbers[0], numbers[-1])
+
     # =========================================================================
     # MÉTODO compute_sheet - ACTUALIZADO CON CARGA DE RECURRENTES Y LOGS DE DEBUG
     # =========================================================================
@@ -253,6 +291,8 @@ class HrPayslip(models.Model):
         # ¡AJUSTA ESTA LISTA CON TUS CÓDIGOS!
         recurring_input_codes_to_manage = ['LIBRANZA']
 
+        self._assign_resolution_numbers()
+
         for payslip_rec in self:
             _logger.info(
                 "Iniciando compute_sheet para Recibo ID: %s, Número: %s, Empleado: %s (ID: %s), Contrato: %s (ID: %s), Periodo: %s a %s",
@@ -1586,6 +1626,196 @@ class HrPayslip(models.Model):
             raise UserError(
                 _("Fallo al crear el asiento contable borrador: %s") % e)
 
+    # =========================================================================
+    # CONTABILIZACIÓN EN LOTE (UN ASIENTO POR DIARIO / LOTE / CENTRO DE COSTO)
+    # =========================================================================
+
+    def _get_batch_move_cost_center(self):
+        """Centro de costo de la nómina: cuenta analítica del contrato, si el modelo la tiene."""
+        self.ensure_one()
+        contract = self.contract_id
+        if 'analytic_account_id' in contract._fields:
+            return contract.analytic_account_id.id or False
+        return False
+
+    def _get_batch_move_groups(self, by_cost_center=None):
+        """
+        Agrupa las nóminas por asiento: ``(compañía, diario, fecha, lote[,
+        centro de costo])``. Sin ``by_cost_center`` explícito se usa la opción
+        de la compañía. Devuelve ``{clave: [ids]}`` y ``{id: analítica}``.
+        """
+        groups = defaultdict(list)
+        analytic_by_slip = {}
+        for slip in self:
+            journal = slip.struct_id.journal_id
+            if not journal:
+                raise UserError(_("La estructura %s no tiene diario contable configurado.") % slip.struct_id.name)
+            move_date = slip.date or (slip.date_to + relativedelta(day=31))
+            cost_center = slip._get_batch_move_cost_center()
+            analytic_by_slip[slip.id] = cost_center or 0
+            split = by_cost_center if by_cost_center is not None \
+                else slip.company_id.l10n_co_nomina_batch_move_by_cost_center
+            key = (slip.company_id.id, journal.id, move_date, slip.payslip_run_id.id or False,
+                   cost_center if split else False)
+            groups[key].append(slip.id)
+        return groups, analytic_by_slip
+
+    def _read_batch_move_totals(self, group_by_slip, analytic_by_slip):
+        """
+        Suma en SQL las líneas de nómina por ``(grupo, regla, tercero,
+        analítica)``. El tercero ya viene resuelto en ``hr_payslip_line.partner_id``
+        (``co_partner_select`` se evalúa al crear la línea), así que el
+        resultado crece con reglas y terceros, no con empleados.
+
+        Cada importe sigue a ``_prepare_slip_lines`` del asiento individual:
+        solo líneas con categoría, signo invertido en las notas de ajuste
+        (``credit_note``) y, en la línea ``NET``, descontadas las reglas
+        marcadas ``not_computed_in_net``.
+        """
+        self.env['hr.payslip'].flush_model(['credit_note'])
+        self.env['hr.payslip.line'].flush_model(
+            ['slip_id', 'salary_rule_id', 'partner_id', 'category_id', 'code', 'total'])
+        self.env['hr.salary.rule'].flush_model(['not_computed_in_net'])
+        slip_ids = list(group_by_slip)
+        self.env.cr.execute(SQL("""
+            WITH lines AS (
+                SELECT g.group_index, g.analytic_id, l.slip_id, l.salary_rule_id, l.partner_id, l.code,
+                       CASE WHEN p.credit_note THEN -l.total ELSE l.total END AS amount
+                  FROM unnest(%(slip_ids)s::int[], %(group_indexes)s::int[], %(analytic_ids)s::int[])
+                       AS g(slip_id, group_index, analytic_id)
+                  JOIN hr_payslip p ON p.id = g.slip_id
+                  JOIN hr_payslip_line l ON l.slip_id = g.slip_id
+                 WHERE l.category_id IS NOT NULL
+            ), not_in_net AS (
+                SELECT l.slip_id, SUM(ABS(l.total)) AS total
+                  FROM hr_payslip_line l
+                  JOIN hr_salary_rule r ON r.id = l.salary_rule_id
+                 WHERE l.slip_id = ANY(%(slip_ids)s)
+                   AND l.category_id IS NOT NULL
+                   AND r.not_computed_in_net
+              GROUP BY l.slip_id
+            ), adjusted AS (
+                SELECT x.group_index, x.salary_rule_id, x.partner_id, x.analytic_id,
+                       CASE WHEN x.code = 'NET' AND x.amount > 0 THEN x.amount - COALESCE(n.total, 0)
+                            WHEN x.code = 'NET' AND x.amount < 0 THEN x.amount + COALESCE(n.total, 0)
+                            ELSE x.amount END AS amount
+                  FROM lines x
+             LEFT JOIN not_in_net n ON n.slip_id = x.slip_id
+            )
+            SELECT group_index, salary_rule_id, partner_id, analytic_id, SUM(amount)::float
+              FROM adjusted
+             WHERE amount <> 0
+          GROUP BY group_index, salary_rule_id, partner_id, analytic_id
+        """, slip_ids=slip_ids,
+            group_indexes=[group_by_slip[slip_id] for slip_id in slip_ids],
+            analytic_ids=[analytic_by_slip[slip_id] for slip_id in slip_ids]))
+        totals = defaultdict(list)
+        for group_index, rule_id, partner_id, analytic_id, total in self.env.cr.fetchall():
+            totals[group_index].append((rule_id, partner_id, analytic_id or False, total))
+        return totals
+
+    def _prepare_batch_move_vals(self, company, journal, move_date, name, rows, rules):
+        """Valores del asiento agrupado: una línea por (cuenta, tercero, analítica) con su saldo neto."""
+        currency = company.currency_id
+        balances = defaultdict(float)
+        for rule_id, partner_id, analytic_id, total in rows:
+            rule = rules[rule_id]
+            if 'analytic_account_id' in rule._fields and rule.analytic_account_id:
+                analytic_id = rule.analytic_account_id.id
+            if rule.account_debit:
+                balances[(rule.account_debit.id, partner_id, analytic_id)] += total
+            if rule.account_credit:
+                balances[(rule.account_credit.id, partner_id, analytic_id)] -= total
+
+        line_vals = []
+        total_balance = 0.0
+        for (account_id, partner_id, analytic_id), balance in balances.items():
+            balance = currency.round(balance)
+            if currency.is_zero(balance):
+                continue
+            total_balance += balance
+            line_vals.append({
+                'name': name,
+                'account_id': account_id,
+                'partner_id': partner_id,
+                'analytic_distribution': {str(analytic_id): 100} if analytic_id else False,
+                'debit': balance if balance > 0 else 0.0,
+                'credit': -balance if balance < 0 else 0.0,
+            })
+        total_balance = currency.round(total_balance)
+        if not currency.is_zero(total_balance):
+            if not journal.default_account_id:
+                raise UserError(_(
+                    "El diario %s no tiene cuenta por defecto para registrar el ajuste del asiento de nómina.")
+                    % journal.name)
+            line_vals.append({
+                'name': _('Asiento de ajuste'),
+                'account_id': journal.default_account_id.id,
+                'debit': -total_balance if total_balance < 0 else 0.0,
+                'credit': total_balance if total_balance > 0 else 0.0,
+            })
+        return {
+            'move_type': 'entry',
+            'journal_id': journal.id,
+            'date': move_date,
+            'ref': name,
+            'company_id': company.id,
+            'is_payroll_document_proxy': True,
+            'line_ids': [Command.create(vals) for vals in line_vals],
+        }
+
+    def _create_batch_account_moves(self, by_cost_center=None):
+        """
+        Modo de contabilización en lote: crea un asiento borrador por
+        ``(diario, fecha, lote[, centro de costo])`` con las líneas agregadas
+        en SQL, y enlaza las nóminas con una escritura por asiento. Como el
+        asiento individual, solo contabiliza nóminas hechas o pagadas.
+        """
+        slips = self.filtered(lambda s: not s.move_id and s.state in ('done', 'paid'))
+        if not slips:
+            return self.env['account.move']
+        groups, analytic_by_slip = slips._get_batch_move_groups(by_cost_center)
+        group_keys = list(groups)
+        group_by_slip = {slip_id: index for index, key in enumerate(group_keys) for slip_id in groups[key]}
+        totals = slips._read_batch_move_totals(group_by_slip, analytic_by_slip)
+
+        move_vals_list = []
+        moved_keys = []
+        for index, (company_id, journal_id, move_date, run_id, cost_center) in enumerate(group_keys):
+            if not totals.get(index):
+                continue
+            company = self.env['res.company'].browse(company_id)
+            journal = self.env['account.journal'].browse(journal_id)
+            rules = {rule.id: rule for rule in self.env['hr.salary.rule'].with_company(company).browse(
+                list({row[0] for row in totals[index]}))}
+            run = self.env['hr.payslip.run'].browse(run_id)
+            name = run.name if run else _('Nómina %s') % fields.Date.to_string(move_date)
+            if cost_center:
+                name = '%s - %s' % (name, self.env['account.analytic.account'].browse(cost_center).display_name)
+            move_vals_list.append(slips._prepare_batch_move_vals(
+                company, journal, move_date, name, totals[index], rules))
+            moved_keys.append(group_keys[index])
+
+        moves = self.env['account.move'].create(move_vals_list)
+        for move, key in zip(moves, moved_keys):
+            self.browse(groups[key]).write({'move_id': move.id})
+        _logger.info("Contabilización en lote: %s nóminas en %s asientos.", len(slips), len(moves))
+        return moves
+
+    def action_generate_batch_account_move(self):
+        """Contabiliza las nóminas seleccionadas en asientos agrupados y los abre."""
+        moves = self._create_batch_account_moves() | self.mapped('move_id')
+        if not moves:
+            raise UserError(_("No se generó ningún asiento: las nóminas seleccionadas no tienen líneas por contabilizar."))
+        return {
+            'name': _('Journal Entries'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'account.move',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', moves.ids)],
+            'target': 'current',
+        }
+
     def action_print_payslip_account_move(self):
         self.ensure_one()
         if not self.move_id:
@@ -1624,7 +1854,12 @@ class HrPayslip(models.Model):
     # NUEVO MÉTODO: PREPARAR JSON PARA LA API DE NÓMINA ELECTRÓNICA
     # =========================================================================
 
-    def _prepare_payroll_json_data(self):
+    def _prepare_payroll_json_data(self, number_parts=None):
+        """
+        :param number_parts: ``(resolución, prefijo, consecutivo)`` del número
+            de la nómina ya resuelto por el lote (``_prepare_payroll_json_batch``);
+            si no se pasa se consulta aquí.
+        """
         self.ensure_one()
 
         def _clean_dict(d):
@@ -1673,46 +1908,34 @@ class HrPayslip(models.Model):
             f"Preparando JSON para Nómina Individual: {payslip.number}")
 
         # --- 1. Agregar y Estructurar Datos de Líneas ---
-        # Usamos un defaultdict para simplificar la agregación
-        aggregated_values = defaultdict(
-            lambda: {'total': 0.0, 'quantity': 0.0, 'details': []})
+        # Documento intermedio compartido con el XML y el consolidado.
+        # Devengos y deducciones quedan separados (p. ej. 'refund' o 'advances'
+        # existen en ambos lados y no deben sumarse entre sí).
+        payroll_doc = build_payroll_document(payslip)
 
-        for line in payslip.line_ids:
-            rule = line.salary_rule_id
-            if not rule:
-                continue
+        def _earn(category):
+            return payroll_doc.get(EARN_CALC, category)
 
-            concept_type = getattr(rule, 'type_concept', None)
-            if concept_type == 'earn':
-                category = getattr(rule, 'earn_category', None)
-                if category:
-                    # Los totales de devengos son positivos
-                    aggregated_values[category]['total'] += line.total
-                    aggregated_values[category]['quantity'] += line.quantity
-            elif concept_type == 'deduction':
-                category = getattr(rule, 'deduction_category', None)
-                if category:
-                    # Los totales de deducción en Odoo son negativos, los necesitamos positivos para la API
-                    aggregated_values[category]['total'] += abs(line.total)
-                    aggregated_values[category]['quantity'] += line.quantity
+        def _ded(category):
+            return payroll_doc.get(DED_CALC, category)
 
         # --- 2. Construir los diccionarios para el JSON final ---
 
         # -- SECCIÓN DE DEVENGADOS (Accrued) --
         accrued_data = {}
         accrued_data['worked_days'] = int(payslip.worked_days_total)
-        accrued_data['salary'] = str(aggregated_values['basic']['total'])
+        accrued_data['salary'] = money(_earn('basic').total)
 
         # Transporte
-        transportation_allowance = aggregated_values['transports_assistance']['total']
-        viatic_s = aggregated_values['transports_viatic']['total']
-        viatic_ns = aggregated_values['transports_non_salary_viatic']['total']
+        transportation_allowance = _earn('transports_assistance').total
+        viatic_s = _earn('transports_viatic').total
+        viatic_ns = _earn('transports_non_salary_viatic').total
         if transportation_allowance > 0:
-            accrued_data['transportation_allowance'] = str(transportation_allowance)
+            accrued_data['transportation_allowance'] = money(transportation_allowance)
         if viatic_s > 0:
-            accrued_data['viatic_salary'] = str(viatic_s)
+            accrued_data['viatic_salary'] = money(viatic_s)
         if viatic_ns > 0:
-            accrued_data['viatic_non_salary'] = str(viatic_ns)
+            accrued_data['viatic_non_salary'] = money(viatic_ns)
 
         # Horas Extras y Recargos (La API espera una lista)
         def _pct(v, default):
@@ -1738,44 +1961,44 @@ class HrPayslip(models.Model):
 
         hed_list = []
         for cat, pct in hed_config.items():
-            total_cat = aggregated_values[cat]['total']
-            qty_cat = aggregated_values[cat]['quantity']
+            total_cat = _earn(cat).total
+            qty_cat = float(_earn(cat).line_quantity)
             if total_cat > 0:
                 # APIDIAN acepta enteros; si tienes decimales, puedes redondear
                 hed_list.append({
                     "quantity": qty_cat,
                     "percentage": float(pct),   # o deja pct si quieres float
-                    "payment": str(total_cat),
+                    "payment": money(total_cat),
                 })
 
         if hed_list:
             accrued_data['HEDs'] = hed_list
 
         # Vacaciones
-        vac_common = aggregated_values['vacation_common']
-        vac_comp = aggregated_values['vacation_compensated']
-        if vac_common['total'] > 0:
+        vac_common = _earn('vacation_common')
+        vac_comp = _earn('vacation_compensated')
+        if vac_common.total > 0:
             accrued_data['common_vacation'] = [
-                {"quantity": vac_common['quantity'], "payment": str(vac_common['total'])}]
-        if vac_comp['total'] > 0:
+                {"quantity": float(vac_common.line_quantity), "payment": money(vac_common.total)}]
+        if vac_comp.total > 0:
             accrued_data['paid_vacation'] = [
-                {"quantity": vac_comp['quantity'], "payment": str(vac_comp['total'])}]
+                {"quantity": float(vac_comp.line_quantity), "payment": money(vac_comp.total)}]
 
         # Primas
-        primas_s = aggregated_values['primas']
-        primas_ns = aggregated_values['primas_non_salary']
-        if primas_s['total'] > 0 or primas_ns['total'] > 0:
-            accrued_data['service_bonus'] = [{"quantity": int(round(primas_s['quantity'])), "payment": str(
-                primas_s['total']), "paymentNS": str(primas_ns['total'])}]
+        primas_s = _earn('primas')
+        primas_ns = _earn('primas_non_salary')
+        if primas_s.total > 0 or primas_ns.total > 0:
+            accrued_data['service_bonus'] = [{"quantity": int(round(primas_s.line_quantity)), "payment": money(
+                primas_s.total), "paymentNS": money(primas_ns.total)}]
 
         # Cesantías
-        layoffs = aggregated_values['layoffs']
-        layoffs_interest = aggregated_values['layoffs_interest']
-        if layoffs['total'] > 0 or layoffs_interest['total'] > 0:
+        layoffs = _earn('layoffs')
+        layoffs_interest = _earn('layoffs_interest')
+        if layoffs.total > 0 or layoffs_interest.total > 0:
             accrued_data['severance'] = [{
-                "payment": str(layoffs['total']),
+                "payment": money(layoffs.total),
                 "percentage": "12.00",  # Asumido, podrías hacerlo dinámico
-                "interest_payment": str(layoffs_interest['total'])
+                "interest_payment": money(layoffs_interest.total)
             }]
 
         # Incapacidades
@@ -1783,37 +2006,37 @@ class HrPayslip(models.Model):
                                  'incapacities_professional': 2, 'incapacities_working': 3}
         incapacity_list = []
         for cat, code in incapacity_categories.items():
-            if aggregated_values[cat]['total'] > 0:
+            if _earn(cat).total > 0:
                 incapacity_list.append({
                     "type": code,
-                    "quantity": aggregated_values[cat]['quantity'],
-                    "payment": str(aggregated_values[cat]['total'])
+                    "quantity": float(_earn(cat).line_quantity),
+                    "payment": money(_earn(cat).total)
                 })
         if incapacity_list:
             accrued_data['work_disabilities'] = incapacity_list
         
         # Licencias (Agrupadas)
-        licensing_maternity = aggregated_values['licensings_maternity_or_paternity_leaves']['total']
-        licensing_paid = aggregated_values['licensings_permit_or_paid_licenses']['total']
+        licensing_maternity = _earn('licensings_maternity_or_paternity_leaves').total
+        licensing_paid = _earn('licensings_permit_or_paid_licenses').total
         # La licencia no remunerada es informativa, no suma al devengado
         if licensing_maternity > 0:
-            accrued_data['maternity_leave'] = str(licensing_maternity)
+            accrued_data['maternity_leave'] = money(licensing_maternity)
         if licensing_paid > 0:
-            accrued_data['paid_leave'] = str(licensing_paid)
+            accrued_data['paid_leave'] = money(licensing_paid)
 
         # Otros conceptos... (Bonos, auxilios, etc.)
         # Se agrupan aquí los que son listas de diccionarios en la API
-        bonuses_s = aggregated_values['bonuses']['total']
-        bonuses_ns = aggregated_values['bonuses_non_salary']['total']
+        bonuses_s = _earn('bonuses').total
+        bonuses_ns = _earn('bonuses_non_salary').total
         if bonuses_s > 0 or bonuses_ns > 0:
-            accrued_data['bonuses'] = [{"salary_bonus": str(
-                bonuses_s), "non_salary_bonus": str(bonuses_ns)}]
+            accrued_data['bonuses'] = [{"salary_bonus": money(
+                bonuses_s), "non_salary_bonus": money(bonuses_ns)}]
 
-        assist_s = aggregated_values['assistances']['total']
-        assist_ns = aggregated_values['assistances_non_salary']['total']
+        assist_s = _earn('assistances').total
+        assist_ns = _earn('assistances_non_salary').total
         if assist_s > 0 or assist_ns > 0:
-            accrued_data['aid'] = [{"salary_assistance": str(
-                assist_s), "non_salary_assistance": str(assist_ns)}]
+            accrued_data['aid'] = [{"salary_assistance": money(
+                assist_s), "non_salary_assistance": money(assist_ns)}]
         
         single_earn_mapping = {
             'endowment': 'endowment',
@@ -1827,48 +2050,47 @@ class HrPayslip(models.Model):
             'advances': 'advances'
         }
         for odoo_cat, api_key in single_earn_mapping.items():
-            if aggregated_values[odoo_cat]['total'] > 0:
-                accrued_data[api_key] = str(aggregated_values[odoo_cat]['total'])
+            if _earn(odoo_cat).total > 0:
+                accrued_data[api_key] = money(_earn(odoo_cat).total)
 
         # Total devengado final
-        accrued_data['accrued_total'] = str(payslip.accrued_total_amount)
+        accrued_data['accrued_total'] = money(payslip.accrued_total_amount)
 
         # -- SECCIÓN DE DEDUCCIONES (Deductions) --
         deductions_data = {}
-        deductions_data['eps_deduction'] = str(
-            aggregated_values['health']['total'])
-        deductions_data['pension_deduction'] = str(
-            aggregated_values['pension_fund']['total'])
+        deductions_data['eps_deduction'] = money(
+            _ded('health').total)
+        deductions_data['pension_deduction'] = money(
+            _ded('pension_fund').total)
     
         tipo_cotizante = int(contract.type_worker_id.code) if contract.type_worker_id and contract.type_worker_id.code.isdigit() else 1
         deductions_data['eps_type_law_deductions_id'] = tipo_cotizante
         deductions_data['pension_type_law_deductions_id'] = tipo_cotizante
 
         # FSP
-        fsp_sol = aggregated_values['pension_security_fund']['total']
-        fsp_sub = aggregated_values['pension_security_fund_subsistence']['total']
+        fsp_sol = _ded('pension_security_fund').total
+        fsp_sub = _ded('pension_security_fund_subsistence').total
         if fsp_sol > 0 or fsp_sub > 0:
-            deductions_data['fondosp_deduction_SP'] = str(fsp_sol)
-            deductions_data['fondosp_deduction_sub'] = str(fsp_sub)
+            deductions_data['fondosp_deduction_SP'] = money(fsp_sol)
+            deductions_data['fondosp_deduction_sub'] = money(fsp_sub)
 
         # Sindicatos
-        trade_unions = aggregated_values['trade_unions']['total']
+        trade_unions = _ded('trade_unions').total
         if trade_unions > 0:
-            deductions_data['labor_union'] = [{"deduction": str(trade_unions)}]
+            deductions_data['labor_union'] = [{"deduction": money(trade_unions)}]
 
-        # Libranzas y Sanciones (Ejemplo de cómo manejar detalles si los tuvieras en deduction_ids)
-        libranzas_bucket = aggregated_values.get(('ded_detail', 'libranzas'), {'details': []})
-        libranzas_details = libranzas_bucket.get('details', [])
+        # Libranzas (detalles manuales de deduction_ids) y Sanciones
+        libranzas_details = payroll_doc.get(DED_DETAIL, 'libranzas').details
         if libranzas_details:
             deductions_data['orders'] = [
-                {"description": d.get('description', ''), "deduction": str(d.get('payment', 0))}
+                {"description": d.description, "deduction": money(d.payment)}
                 for d in libranzas_details
             ]
 
-        sanctions_public = aggregated_values['sanctions_public']['total']
-        sanctions_private = aggregated_values['sanctions_private']['total']
+        sanctions_public = _ded('sanctions_public').total
+        sanctions_private = _ded('sanctions_private').total
         if sanctions_public > 0 or sanctions_private > 0:
-            deductions_data['sanction'] = [{"public_sanction": str(sanctions_public), "private_sanction": str(sanctions_private)}]
+            deductions_data['sanction'] = [{"public_sanction": money(sanctions_public), "private_sanction": money(sanctions_private)}]
 
         # Otros campos de deducción (mapeo directo)
         single_ded_mapping = {
@@ -1881,12 +2103,12 @@ class HrPayslip(models.Model):
             'other_deductions': 'other_deduction'
         }
         for odoo_cat, api_key in single_ded_mapping.items():
-            if aggregated_values[odoo_cat]['total'] > 0:
-                deductions_data[api_key] = str(
-                    aggregated_values[odoo_cat]['total'])
+            if _ded(odoo_cat).total > 0:
+                deductions_data[api_key] = money(
+                    _ded(odoo_cat).total)
 
         # Total deducciones final
-        deductions_data['deductions_total'] = str(
+        deductions_data['deductions_total'] = money(
             payslip.deductions_total_amount)
         
         # --- 2.5 Construir el diccionario del trabajador (worker_data) ---
@@ -1941,7 +2163,18 @@ class HrPayslip(models.Model):
         resolution_number_str = resolution.resolution_number or ''
         prefix = resolution.prefix or ''
 
-        consecutive = 1 
+        consecutive = 1
+        # Con numeración por resolución el número de la nómina es prefijo + consecutivo:
+        # se toman de la resolución que autoriza ese consecutivo
+        if number_parts is None:
+            number_parts = self.env['l10n_co_nomina.resolution']._split_document_number(
+                payslip.company_id, '10' if payslip.credit_note else '9', payslip.number)
+        owner, number_prefix, number_consecutive = number_parts
+        if owner:
+            resolution = owner
+            resolution_number_str = owner.resolution_number or ''
+            prefix = number_prefix
+            consecutive = number_consecutive
 
         # Validar rango si la resolución lo tiene (ajusta los nombres de campos a tu modelo)
         range_from = getattr(resolution, 'from_number', None)
@@ -2008,6 +2241,143 @@ class HrPayslip(models.Model):
         _logger.info("JSON de nómina individual preparado para envío: %s", payroll_json)
         return payroll_json
 
+    # =========================================================================
+    # CONSTRUCCIÓN DEL JSON EN LOTE
+    # =========================================================================
+
+    def _prefetch_payroll_json_data(self):
+        """
+        Precarga en lecturas agrupadas todo lo que ``_prepare_payroll_json_data``
+        consulta por nómina (empleado, contrato, ciudad, banco, catálogos,
+        líneas y reglas). Los registros resultantes comparten el conjunto de
+        prefetch del lote, de modo que el constructor individual ya no dispara
+        una consulta por campo y por nómina.
+        """
+        if not self:
+            return
+        self.mapped('company_id.l10n_co_nomina_default_resolution_id')
+        self.mapped('payment_method_id')
+
+        employees = self.mapped('employee_id')
+        employees.mapped('private_type_document_identification_id')
+        employees.mapped('address_id.city_id')
+        employees.mapped('bank_account_id.bank_id')
+
+        contracts = self.mapped('contract_id')
+        contracts.mapped('type_worker_id')
+        contracts.mapped('subtype_worker_id')
+        contracts.mapped('type_contract_id')
+        contracts.mapped('arl_risk_level')
+
+        self.mapped('line_ids.salary_rule_id')
+        self.mapped('earn_ids')
+        self.mapped('deduction_ids')
+
+    def _split_payroll_numbers(self):
+        """
+        Resuelve prefijo, consecutivo y resolución de los números del lote con
+        una lectura de resoluciones por compañía y tipo de documento.
+        Devuelve ``{payslip: (resolución, prefijo, consecutivo)}``.
+        """
+        Resolution = self.env['l10n_co_nomina.resolution']
+        result = {}
+        for (company, credit_note), payslips in self.grouped(lambda p: (p.company_id, p.credit_note)).items():
+            parts = Resolution._split_document_numbers(
+                company, '10' if credit_note else '9', payslips.mapped('number'))
+            for payslip in payslips:
+                result[payslip] = parts[payslip.number]
+        return result
+
+    def _prepare_payroll_json_batch(self, build_errors=None):
+        """
+        Versión de ``_prepare_payroll_json_data`` a nivel de recordset.
+
+        Precarga los datos relacionados del lote y devuelve una lista de
+        payloads en el mismo orden que ``self``. Se usa tanto para el envío a
+        APIDIAN como para la exportación en seco (``action_export_payroll_json``).
+
+        :param build_errors: si se pasa un dict, los ``UserError`` de
+            construcción se acumulan en él (``{payslip: [mensaje]}``) y el
+            payload correspondiente queda en ``None`` en lugar de abortar.
+        """
+        self._prefetch_payroll_json_data()
+        number_parts = self._split_payroll_numbers()
+        payloads = []
+        for payslip in self:
+            try:
+                payloads.append(payslip._prepare_payroll_json_data(number_parts=number_parts[payslip]))
+            except UserError as e:
+                if build_errors is None:
+                    raise UserError(_("Nómina %s: %s") % (payslip.number or payslip.name, e))
+                build_errors[payslip] = [str(e)]
+                payloads.append(None)
+        return payloads
+
+    def _preflight_payroll_json_batch(self, payloads=None, kind=PAYROLL):
+        """
+        Valida localmente contra el esquema de APIDIAN los payloads del lote
+        (los construye si no se pasan). Devuelve ``{payslip: [errores]}``
+        solo con las nóminas que tienen errores.
+        """
+        errors_by_payslip = {}
+        if payloads is None:
+            payloads = self._prepare_payroll_json_batch(build_errors=errors_by_payslip)
+        to_check = [(payslip, payload) for payslip, payload in zip(self, payloads)
+                    if payload is not None]
+        errors_by_index = validate_payloads([payload for __, payload in to_check], kind)
+        for index, errors in errors_by_index.items():
+            errors_by_payslip[to_check[index][0]] = errors
+        return errors_by_payslip
+
+    def _raise_payroll_preflight_errors(self, errors_by_payslip):
+        if not errors_by_payslip:
+            return
+        lines = []
+        for payslip, errors in errors_by_payslip.items():
+            lines.append(_("Nómina %s:") % (payslip.number or payslip.name))
+            lines.extend("  - %s" % error for error in errors)
+        raise UserError(_("El JSON de %s nómina(s) no cumple el esquema de APIDIAN:\n%s")
+                        % (len(errors_by_payslip), "\n".join(lines)))
+
+    def action_preflight_payroll_json(self):
+        """Valida el lote seleccionado sin enviarlo y reporta todos los errores."""
+        self._raise_payroll_preflight_errors(self._preflight_payroll_json_batch())
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Validación local"),
+                'message': _("%s nómina(s) cumplen el esquema de APIDIAN.") % len(self),
+                'type': 'success',
+                'sticky': False,
+            },
+        }
+
+    def action_export_payroll_json(self):
+        """
+        Exportación en seco: genera el JSON de APIDIAN de las nóminas
+        seleccionadas sin enviarlo y lo deja como adjunto descargable.
+        """
+        if not self:
+            raise UserError(_("Seleccione al menos una nómina para exportar."))
+        payloads = self._prepare_payroll_json_batch()
+        content = json.dumps(
+            [{'payslip': payslip.number or payslip.name, 'payload': payload}
+             for payslip, payload in zip(self, payloads)],
+            ensure_ascii=False, indent=2, default=str)
+        attachment = self.env['ir.attachment'].create({
+            'name': 'nomina_electronica_%s.json' % fields.Date.context_today(self).strftime('%Y%m%d'),
+            'raw': content.encode('utf-8'),
+            'mimetype': 'application/json',
+        })
+        _logger.info("Exportación en seco de %s nóminas a JSON (adjunto %s).",
+                     len(payloads), attachment.id)
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % attachment.id,
+            'target': 'self',
+        }
+
     # =========================================================================
     # MODIFICAR MÉTODO validate_dian_generic PARA USAR LA NUEVA API
     # =========================================================================
@@ -2016,82 +2386,110 @@ class HrPayslip(models.Model):
 
     def _validate_dian_generic(self):
         self.ensure_one()
-        payslip = self
+        failed = self._send_payroll_batch_to_dian()
+        if failed:
+            raise UserError(failed.edi_status_message or _("El envío de la Nómina Electrónica falló."))
 
-        # --- Validaciones Previas ---
-        if not (payslip.company_id and payslip.company_id.edi_payroll_enable):
-            _logger.info(
-                "Nómina Electrónica no habilitada para la compañía %s.", payslip.company_id.name)
-            return
-        if payslip.edi_is_valid:
-            _logger.info(
-                "La nómina %s ya fue validada por DIAN.", payslip.name)
-            return
-        if payslip.state not in ('done', 'paid'):
-            raise UserError(
-                _("Solo se pueden validar nóminas en estado 'Hecho' o 'Pagado'."))
+    def _get_payroll_test_set_id(self):
+        """TestSetId de habilitación de la compañía de la nómina, o ``None`` en producción."""
+        self.ensure_one()
+        company = self.company_id
+        if company.edi_payroll_is_not_test:
+            return None
+        if not company.l10n_co_payroll_test_set_id:
+            raise UserError(_(
+                "El entorno está configurado para pruebas (Habilitación), pero no se ha proporcionado un 'ID del Set de Pruebas DIAN' en los Ajustes de Nómina."))
+        return company.l10n_co_payroll_test_set_id
 
-        _logger.info(
-            "Iniciando envío de Nómina Electrónica %s a APIDIAN.", payslip.name)
+    def _send_payroll_batch_to_dian(self):
+        """
+        Envía a APIDIAN las nóminas del lote.
 
-        try:
-            # 1. Determinar si estamos en modo de prueba y obtener el TestSetId
-            test_set_id = None
-            if not payslip.company_id.edi_payroll_is_not_test:  # Si "Entorno en Producción" NO está marcado
-                test_set_id = payslip.company_id.l10n_co_payroll_test_set_id
-                if not test_set_id:
-                    raise UserError(_(
-                        "El entorno está configurado para pruebas (Habilitación), pero no se ha proporcionado un 'ID del Set de Pruebas DIAN' en los Ajustes de Nómina."))
-            
-            # 2. Preparar el JSON de la nómina (tu código original)
-            # payroll_json_data = payslip._prepare_payroll_json_data() # Esta línea no es necesaria aquí, se llama dentro del conector
-
-            # 3. Llamar al conector, pasándole el test_set_id (tu código original)
-            identifier, api_response = self.env['l10n_co_nomina.payroll.api.connector'].send_payroll_document(
-                payslip,
-                test_set_id=test_set_id
-            )
+        Los payloads se construyen con ``_prepare_payroll_json_batch`` y se
+        validan contra el esquema local antes de enviar nada; luego cada
+        compañía envía los suyos en paralelo (``send_payroll_documents``). Un
+        envío fallido queda registrado en su nómina sin deshacer los envíos ya
+        hechos. Devuelve las nóminas cuyo envío falló.
+        """
+        to_send = self.browse()
+        for payslip in self:
+            if not (payslip.company_id and payslip.company_id.edi_payroll_enable):
+                _logger.info(
+                    "Nómina Electrónica no habilitada para la compañía %s.", payslip.company_id.name)
+                continue
+            if payslip.edi_is_valid:
+                _logger.info(
+                    "La nómina %s ya fue validada por DIAN.", payslip.name)
+                continue
+            if payslip.state not in ('done', 'paid'):
+                raise UserError(
+                    _("Solo se pueden validar nóminas en estado 'Hecho' o 'Pagado'."))
+            to_send |= payslip
+        if not to_send:
+            return to_send
+
+        test_set_ids = {payslip.company_id: payslip._get_payroll_test_set_id()
+                        for payslip in to_send}
+        payloads = to_send._prepare_payroll_json_batch()
+        to_send._raise_payroll_preflight_errors(to_send._preflight_payroll_json_batch(payloads))
+        payload_by_payslip = dict(zip(to_send, payloads))
+
+        _logger.info("Iniciando envío de %s Nóminas Electrónicas a APIDIAN.", len(to_send))
+        connector = self.env['l10n_co_nomina.payroll.api.connector']
+        failed = self.browse()
+        for company, payslips in to_send.grouped('company_id').items():
+            results = connector.send_payroll_documents(
+                payslips, test_set_id=test_set_ids[company],
+                payloads=[payload_by_payslip[payslip] for payslip in payslips])
+            for payslip, identifier, api_response in results:
+                if not payslip._process_payroll_send_response(identifier, api_response):
+                    failed |= payslip
+        return failed
+
+    def _process_payroll_send_response(self, identifier, api_response):
+        """Registra en la nómina la respuesta de su envío. Devuelve ``False`` si falló."""
+        self.ensure_one()
+        payslip = self
 
-            # 4. Procesar la respuesta de la API (tu código original, sin cambios)
-            if identifier:
-                # Si el 'identifier' NO es un UUID de 36 caracteres, asumimos que es un CUNE (síncrono)
-                if len(identifier) > 36:
-                    payslip.write({
-                        'l10n_co_edi_cune': identifier,
-                        'edi_is_valid': True,
-                        'edi_state': 'accepted',
-                        'l10n_co_edi_qr_code_url': api_response.get('qr_code_url', ''),
-                        'l10n_co_edi_xml_file': base64.b64encode(api_response.get('xml_file', b'')),
-                        'l10n_co_edi_pdf_file': base64.b64encode(api_response.get('pdf_file', b'')),
-                    })
-                    payslip.message_post(body=_(
-                        "Nómina Electrónica ACEPTADA por la DIAN (síncrono). CUNE: %s") % identifier)
-                # Si SÍ es un UUID, es un zip_key (asíncrono)
-                else:
-                    payslip.write({
-                        'edi_zip_key': identifier,
-                        'edi_is_valid': False,
-                        'edi_state': 'sent',
-                    })
-                    payslip.message_post(body=_(
-                        "Nómina Electrónica ENVIADA a la DIAN (asíncrono). ZipKey: %s. Use el botón 'Consultar Estado' para obtener el resultado final.") % identifier)
+        def _b64(content):
+            # La respuesta JSON de APIDIAN trae texto; los binarios se guardan en base64
+            if not content:
+                return False
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            return base64.b64encode(content)
+
+        if identifier:
+            # Si el 'identifier' NO es un UUID de 36 caracteres, asumimos que es un CUNE (síncrono)
+            if len(identifier) > 36:
+                payslip.write({
+                    'l10n_co_edi_cune': identifier,
+                    'edi_is_valid': True,
+                    'edi_state': 'accepted',
+                    'l10n_co_edi_qr_code_url': api_response.get('qr_code_url', ''),
+                    'l10n_co_edi_xml_file': _b64(api_response.get('xml_file')),
+                    'l10n_co_edi_pdf_file': _b64(api_response.get('pdf_file')),
+                })
+                payslip.message_post(body=_(
+                    "Nómina Electrónica ACEPTADA por la DIAN (síncrono). CUNE: %s") % identifier)
+            # Si SÍ es un UUID, es un zip_key (asíncrono)
             else:
-                _logger.warning(
-                    "El envío para la nómina %s no devolvió CUNE ni ZIP_KEY.", payslip.name)
-                payslip.write({'edi_state': 'error'})
+                payslip.write({
+                    'edi_zip_key': identifier,
+                    'edi_is_valid': False,
+                    'edi_state': 'sent',
+                })
+                payslip.message_post(body=_(
+                    "Nómina Electrónica ENVIADA a la DIAN (asíncrono). ZipKey: %s. Use el botón 'Consultar Estado' para obtener el resultado final.") % identifier)
+            return True
+
+        message = (api_response or {}).get('message') or _(
+            "El envío no devolvió CUNE ni ZIP_KEY.")
+        _logger.warning("Falló el envío de la nómina %s: %s", payslip.name, message)
+        payslip.write({'edi_state': 'error', 'edi_status_message': message})
+        payslip.message_post(body=_("Error al enviar la Nómina Electrónica: %s") % message)
+        return False
 
-        except UserError as e:
-            _logger.error(
-                "Error de usuario al enviar Nómina Electrónica %s: %s", payslip.name, str(e))
-            payslip.write({'edi_state': 'error'})
-            raise e
-        except Exception as e:
-            _logger.error("Error inesperado al enviar Nómina Electrónica %s: %s",
-                          payslip.name, e, exc_info=True)
-            payslip.write({'edi_state': 'error'})
-            raise UserError(
-                _("Ocurrió un error inesperado al enviar la Nómina Electrónica: %s") % e)
-    
     # =========================================================================
     # NUEVO MÉTODO: PREPARAR JSON PARA NOTAS DE AJUSTE/ELIMINACIÓN
     # =========================================================================
@@ -2177,10 +2575,22 @@ class HrPayslip(models.Model):
         Acción del botón "Validar DIAN" para la nómina individual.
         Llama al método genérico de validación.
         """
-        # El método _validate_dian_generic ya maneja el bucle, pero es buena práctica
-        # iterar aquí por si se seleccionan varias nóminas desde la vista de lista.
-        for payslip in self:
-            payslip._validate_dian_generic()
+        # Todo el lote se construye, valida y envía junto (ver _send_payroll_batch_to_dian)
+        failed = self._send_payroll_batch_to_dian()
+        if failed and len(self) == 1:
+            raise UserError(failed.edi_status_message or _("El envío de la Nómina Electrónica falló."))
+        if failed:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _("Envío DIAN"),
+                    'message': _("%s de %s nómina(s) no se pudieron enviar: %s") % (
+                        len(failed), len(self), ", ".join(failed.mapped(lambda p: p.number or p.name))),
+                    'type': 'warning',
+                    'sticky': True,
+                },
+            }
         return True
 
     def get_dian_status(self):
@@ -2199,7 +2609,7 @@ class HrPayslip(models.Model):
             try:
                 # Llamar al conector para consultar el estado
                 api_response = self.env['l10n_co_nomina.payroll.api.connector'].get_payroll_status(
-                    payslip.edi_zip_key)
+                    payslip.edi_zip_key, company=payslip.company_id)
 
                 # Procesar la respuesta del status
                 if api_response and api_response.get('success'):
@@ -8,14 +8,28 @@ import datetime as dt
 import json  # Necesario para _get_consolidated_payroll_data si procesamos detalles
 import logging
 from collections import defaultdict  # Útil para agregar datos
+from hashlib import sha256
 
 import babel
 from dateutil.relativedelta import relativedelta  # Asegurar importación
 from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+from .l10n_co_nomina_edi_artifact import compact_payload
+from .payroll_document import (
+    DED_CALC, DED_DETAIL, EARN_CALC, EARN_DETAIL, PayrollDocument, to_decimal)
 
 _logger = logging.getLogger(__name__)
 
+# Subir al cambiar la forma de la estructura consolidada (invalida las cachés guardadas)
+CONSOLIDATED_CACHE_VERSION = 1
+CACHED_RECORD_MARKER = '__record__'
+
+# Tipos de entrada de trabajo que cuentan como ausencia en el consolidado mensual
+ABSENCE_WORK_ENTRY_CODES = (
+    'LNR', 'SUS', 'IGE1_2', 'IGE3_90', 'IGE91_180', 'IGE181_MAS', 'LMA', 'LR', 'ATEP', 'VACDISF')
+
 
 class HrPayslipEdi(models.Model):
     _name = "hr.payslip.edi"
@@ -55,6 +69,19 @@ class HrPayslipEdi(models.Model):
     payslip_ids = fields.Many2many(comodel_name='hr.payslip', string='Nóminas Individuales',
                                    relation='hr_payslip_hr_payslip_edi_rel', readonly=True, copy=False,
                                    help="Nóminas individuales que componen este consolidado mensual.")
+    consolidated_cache_key = fields.Char(
+        string='Clave Caché Consolidado', readonly=True, copy=False,
+        help="Huella de las nóminas (ids y fechas de modificación, incluidas sus líneas de detalle) "
+             "y de los datos propios del consolidado con que se calculó la caché.")
+    consolidated_cache_artifact_id = fields.Many2one(
+        'l10n_co_nomina.edi.artifact', string='Caché Consolidado', readonly=True, copy=False,
+        index='btree_not_null', ondelete='restrict',
+        help="Estructura consolidada ya agregada (JSON comprimido). Se reutiliza en reintentos, "
+             "previsualizaciones y envíos mientras la clave no cambie.")
+    payslip_fingerprint = fields.Char(
+        string='Huella de Nóminas', readonly=True, copy=False,
+        help="Resumen de los ids y fechas de modificación de las nóminas individuales al generar "
+             "el consolidado. El asistente de generación lo usa para no rehacer borradores sin cambios.")
     month = fields.Selection([
         ('1', 'Enero'), ('2', 'Febrero'), ('3', 'Marzo'), ('4', 'Abril'),
         ('5', 'Mayo'), ('6', 'Junio'), ('7', 'Julio'), ('8', 'Agosto'),
@@ -85,10 +112,15 @@ class HrPayslipEdi(models.Model):
     l10n_co_edi_qr_code_url = fields.Char(
         string='URL QR DIAN', copy=False, help="URL para consultar el documento en el portal de la DIAN.")
     l10n_co_edi_xml_file = fields.Binary(
-        string='XML DIAN', attachment=True, copy=False, help="Archivo XML de la Nómina Electrónica.")
+        string='XML DIAN', copy=False,
+        compute='_compute_edi_artifact_files', inverse='_inverse_edi_artifact_files',
+        help="Archivo XML de la Nómina Electrónica.")
     l10n_co_edi_pdf_file = fields.Binary(
-        string='PDF DIAN', attachment=True, copy=False, help="Representación gráfica en PDF de la Nómina Electrónica.")
+        string='PDF DIAN', copy=False,
+        compute='_compute_edi_artifact_files', inverse='_inverse_edi_artifact_files',
+        help="Representación gráfica en PDF de la Nómina Electrónica.")
     edi_payload = fields.Text(string='Payload EDI (Debug)', groups="base.group_no_one",
+                              compute='_compute_edi_payload', inverse='_inverse_edi_payload',
                               copy=False, help="Contenido del payload enviado/recibido para depuración.")
 
     @api.depends('month', 'year', 'employee_id')
@@ -150,7 +182,7 @@ class HrPayslipEdi(models.Model):
                 # 3. Procesar la respuesta (similar a hr.payslip)
                 if identifier:
                     vals_to_write = {
-                        'edi_payload': json.dumps(consolidated_json_data, indent=2), # Guardar el JSON para debug
+                        'edi_payload': compact_payload(consolidated_json_data),  # JSON compacto para debug
                     }
                     if len(identifier) > 36: # Es un CUNE (síncrono)
                         vals_to_write.update({
@@ -194,7 +226,8 @@ class HrPayslipEdi(models.Model):
             
             try:
                 # Llamar al conector para consultar el estado
-                api_response = self.env['l10n_co_nomina.payroll.api.connector'].get_payroll_status(rec.edi_zip_key)
+                api_response = self.env['l10n_co_nomina.payroll.api.connector'].get_payroll_status(
+                    rec.edi_zip_key, company=rec.company_id)
 
                 # Procesar la respuesta del status (esto es un ejemplo, debes adaptarlo a la respuesta real)
                 if api_response and api_response.get('success'):
@@ -328,18 +361,281 @@ class HrPayslipEdi(models.Model):
                 rec.date = fields.Date.context_today(self)
         return True
 
-    # --- MÉTODO _get_consolidated_payroll_data (AJUSTADO) ---
-    def _get_consolidated_payroll_data(self):
+    # --- Agregación en SQL de las nóminas de varios consolidados a la vez ---
+    def _get_consolidated_sources(self):
         """
-        Agrega los datos de las nóminas individuales (payslip_ids)
-        para generar un diccionario con la información consolidada del mes.
+        Agrega con consultas agrupadas las nóminas individuales de todos los
+        consolidados de ``self``: líneas calculadas, devengos y deducciones
+        detallados por categoría, días de ausencia, periodos, fechas de pago y
+        notas. Devuelve ``{edi_id: fuentes}``; los consolidados sin nóminas no
+        aparecen. El resultado equivale a ``build_payroll_document(...,
+        skip_detailed_rules=True)`` sin recorrer cada línea en Python.
         """
+        if not self.ids:
+            return {}
+        self.env['hr.payslip'].flush_model()
+        self.env['hr.payslip.line'].flush_model()
+        self.env['hr.payslip.worked_days'].flush_model()
+        self.env['l10n_co_hr_payroll.earn.line'].flush_model()
+        self.env['l10n_co_hr_payroll.deduction.line'].flush_model()
+        self.env['hr.salary.rule'].flush_model(
+            ['type_concept', 'earn_category', 'deduction_category', 'edi_is_detailed'])
+        self.flush_model(['payslip_ids'])
+
+        payslips_field = self._fields['payslip_ids']
+        rel = SQL(
+            "%s AS rel", SQL.identifier(payslips_field.relation))
+        rel_edi = SQL.identifier('rel', payslips_field.column1)
+        rel_slip = SQL.identifier('rel', payslips_field.column2)
+        edi_ids = list(self.ids)
+        cr = self.env.cr
+
+        # Nóminas: periodos, fechas de pago y notas
+        cr.execute(SQL("""
+            SELECT %(rel_edi)s,
+                   array_agg(p.date_from ORDER BY p.date_to, p.id),
+                   array_agg(p.date_to ORDER BY p.date_to, p.id),
+                   array_agg(DISTINCT p.payment_date) FILTER (WHERE p.payment_date IS NOT NULL),
+                   array_agg(p.note ORDER BY p.date_to, p.id) FILTER (WHERE COALESCE(p.note, '') <> '')
+              FROM %(rel)s
+              JOIN hr_payslip p ON p.id = %(rel_slip)s
+             WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+          GROUP BY %(rel_edi)s
+        """, rel=rel, rel_edi=rel_edi, rel_slip=rel_slip, edi_ids=edi_ids))
+        sources = {}
+        for edi_id, dates_from, dates_to, payment_dates, notes in cr.fetchall():
+            sources[edi_id] = {
+                'document': PayrollDocument(),
+                'periods': list(zip(dates_from, dates_to)),
+                'payment_dates': sorted(payment_dates or []),
+                'notes': notes or [],
+                'absent_days': 0.0,
+            }
+
+        # Días de ausencia (incapacidades, licencias, vacaciones disfrutadas)
+        cr.execute(SQL("""
+            SELECT %(rel_edi)s, SUM(wd.number_of_days)
+              FROM %(rel)s
+              JOIN hr_payslip_worked_days wd ON wd.payslip_id = %(rel_slip)s
+              JOIN hr_work_entry_type wet ON wet.id = wd.work_entry_type_id
+             WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+               AND wet.code = ANY(%(codes)s)
+          GROUP BY %(rel_edi)s
+        """, rel=rel, rel_edi=rel_edi, rel_slip=rel_slip, edi_ids=edi_ids,
+            codes=list(ABSENCE_WORK_ENTRY_CODES)))
+        for edi_id, absent_days in cr.fetchall():
+            sources[edi_id]['absent_days'] = float(absent_days or 0.0)
+
+        # Líneas calculadas por regla, agrupadas por tipo y categoría EDI. El
+        # porcentaje es el último distinto de 100 de la nómina más reciente.
+        # Las líneas sin categoría forman su propio grupo: suman a los totales
+        # pero no a un bucket, como en ``build_payroll_document``.
+        cr.execute(SQL("""
+            WITH lines AS (
+                SELECT %(rel_edi)s AS edi_id, p.id AS slip_id, p.date_to, l.id, l.sequence,
+                       sr.type_concept,
+                       CASE sr.type_concept WHEN 'earn' THEN sr.earn_category
+                                            ELSE sr.deduction_category END AS category,
+                       COALESCE(sr.edi_is_detailed, FALSE) AS detailed,
+                       CASE sr.type_concept WHEN 'earn' THEN l.total::numeric
+                                            ELSE ABS(l.total)::numeric END AS amount,
+                       COALESCE(NULLIF(l.edi_quantity, 0), l.quantity)::numeric AS edi_quantity,
+                       l.quantity::numeric AS quantity,
+                       CASE WHEN COALESCE(l.edi_rate, 0) NOT IN (0, 100) THEN l.edi_rate
+                            ELSE l.rate END AS rate
+                  FROM %(rel)s
+                  JOIN hr_payslip p ON p.id = %(rel_slip)s
+                  JOIN hr_payslip_line l ON l.slip_id = p.id
+                  JOIN hr_salary_rule sr ON sr.id = l.salary_rule_id
+                 WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+                   AND sr.type_concept IN ('earn', 'deduction')
+            )
+            SELECT edi_id, type_concept, category, detailed,
+                   SUM(amount), SUM(edi_quantity), SUM(quantity),
+                   (array_agg(rate ORDER BY date_to DESC, slip_id DESC, sequence DESC, id DESC)
+                        FILTER (WHERE rate <> 100))[1]
+              FROM lines
+          GROUP BY edi_id, type_concept, category, detailed
+        """, rel=rel, rel_edi=rel_edi, rel_slip=rel_slip, edi_ids=edi_ids))
+        for edi_id, concept, category, detailed, amount, edi_quantity, quantity, rate in cr.fetchall():
+            doc = sources[edi_id]['document']
+            amount = to_decimal(amount)
+            if concept == 'earn':
+                kind = EARN_CALC
+                doc.accrued_total += amount
+                if category == 'basic':
+                    doc.basic_days += to_decimal(quantity)
+                    doc.basic_salary += amount
+            else:
+                kind = DED_CALC
+                doc.deductions_total += amount
+            if category and not detailed:
+                doc.add(kind, category, amount, edi_quantity, rate)
+
+        # Devengos detallados (entradas manuales)
+        cr.execute(SQL("""
+            SELECT %(rel_edi)s, e.category, SUM(ABS(e.total)::numeric), SUM(ABS(e.quantity)::numeric)
+              FROM %(rel)s
+              JOIN l10n_co_hr_payroll_earn_line e ON e.payslip_id = %(rel_slip)s
+             WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+               AND e.category IS NOT NULL
+          GROUP BY %(rel_edi)s, e.category
+        """, rel=rel, rel_edi=rel_edi, rel_slip=rel_slip, edi_ids=edi_ids))
+        for edi_id, category, amount, quantity in cr.fetchall():
+            doc = sources[edi_id]['document']
+            doc.add(EARN_DETAIL, category, amount, quantity)
+            if category != 'basic':
+                doc.accrued_detail_total += to_decimal(amount)
+
+        # Deducciones detalladas (entradas manuales)
+        cr.execute(SQL("""
+            SELECT %(rel_edi)s, d.category, SUM(ABS(d.amount)::numeric), COUNT(*)
+              FROM %(rel)s
+              JOIN l10n_co_hr_payroll_deduction_line d ON d.payslip_id = %(rel_slip)s
+             WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+               AND d.category IS NOT NULL
+          GROUP BY %(rel_edi)s, d.category
+        """, rel=rel, rel_edi=rel_edi, rel_slip=rel_slip, edi_ids=edi_ids))
+        for edi_id, category, amount, count in cr.fetchall():
+            doc = sources[edi_id]['document']
+            doc.add(DED_DETAIL, category, amount, count)
+            doc.deductions_detail_total += to_decimal(amount)
+
+        return sources
+
+    # --- Caché de la estructura consolidada ---
+    def _get_consolidated_cache_keys(self):
+        """
+        Clave de caché por consolidado (``{edi_id: clave}``), en una consulta:
+        ids y ``write_date`` de sus nóminas y de sus líneas de devengo y
+        deducción detalladas, más los datos propios del consolidado que entran
+        en la estructura. Los consolidados sin nóminas no aparecen.
+        """
+        if not self.ids:
+            return {}
+        self.env['hr.payslip'].flush_model(['write_date'])
+        self.env['l10n_co_hr_payroll.earn.line'].flush_model()
+        self.env['l10n_co_hr_payroll.deduction.line'].flush_model()
+        self.flush_model(['payslip_ids'])
+        payslips_field = self._fields['payslip_ids']
+        rel_edi = SQL.identifier('rel', payslips_field.column1)
+        self.env.cr.execute(SQL("""
+            SELECT %(rel_edi)s,
+                   md5(string_agg(
+                       concat_ws(':', p.id, p.write_date, e.changed, e.total, d.changed, d.total),
+                       ',' ORDER BY p.id))
+              FROM %(rel)s AS rel
+              JOIN hr_payslip p ON p.id = %(rel_slip)s
+         LEFT JOIN LATERAL (
+                   SELECT MAX(write_date) AS changed, COUNT(*) AS total
+                     FROM l10n_co_hr_payroll_earn_line WHERE payslip_id = p.id) e ON TRUE
+         LEFT JOIN LATERAL (
+                   SELECT MAX(write_date) AS changed, COUNT(*) AS total
+                     FROM l10n_co_hr_payroll_deduction_line WHERE payslip_id = p.id) d ON TRUE
+             WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+          GROUP BY %(rel_edi)s
+        """, rel=SQL.identifier(payslips_field.relation), rel_edi=rel_edi,
+            rel_slip=SQL.identifier('rel', payslips_field.column2), edi_ids=list(self.ids)))
+        fingerprints = dict(self.env.cr.fetchall())
+        keys = {}
+        for rec in self:
+            if rec.id not in fingerprints:
+                continue
+            own = [CONSOLIDATED_CACHE_VERSION, fingerprints[rec.id], rec.number, rec.note,
+                   rec.payment_method_id.id, rec.contract_id.id, rec.employee_id.id,
+                   rec.company_id.id, rec.month, rec.year]
+            keys[rec.id] = sha256(json.dumps(own, default=str).encode('utf-8')).hexdigest()
+        return keys
+
+    def _load_consolidated_cache(self):
+        """Estructura consolidada guardada en la caché, o ``None`` si no se puede leer."""
         self.ensure_one()
-        _logger.info("Agregando datos para Nómina EDI: %s", self.name)
+        try:
+            content = self.consolidated_cache_artifact_id._get_content()
+            return json.loads(content, object_hook=self._decode_consolidated_value)
+        except Exception as e:
+            _logger.warning("Caché consolidada ilegible para %s, se recalcula: %s", self.display_name, e)
+            return None
+
+    def _decode_consolidated_value(self, value):
+        if CACHED_RECORD_MARKER in value:
+            return self.env[value[CACHED_RECORD_MARKER]].browse(value['ids'])
+        return value
+
+    @staticmethod
+    def _encode_consolidated_value(value):
+        if isinstance(value, models.BaseModel):
+            return {CACHED_RECORD_MARKER: value._name, 'ids': value.ids}
+        raise TypeError("Valor no serializable en la caché consolidada: %r" % (value,))
+
+    def _store_consolidated_cache(self, data_by_id, keys):
+        """Guarda la estructura calculada de cada registro junto con su clave."""
+        records = self.filtered(lambda r: r.id in data_by_id)
+        contents = []
+        for rec in records:
+            try:
+                contents.append(json.dumps(
+                    data_by_id[rec.id], default=self._encode_consolidated_value,
+                    ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            except (TypeError, ValueError) as e:
+                _logger.warning("No se pudo cachear el consolidado %s: %s", rec.display_name, e)
+                contents.append(None)
+        artifacts = self.env['l10n_co_nomina.edi.artifact']._store_many(contents, 'application/json')
+        for rec, artifact in zip(records, artifacts):
+            rec.write({
+                'consolidated_cache_key': keys[rec.id] if artifact else False,
+                'consolidated_cache_artifact_id': artifact.id,
+            })
 
-        if not self.payslip_ids:
+    def _get_consolidated_payroll_data_batch(self):
+        """
+        Datos consolidados de todos los registros (``{edi_id: datos}``); omite
+        los consolidados sin nóminas. Reutiliza la caché de los que no
+        cambiaron y agrega en lote, con una sola pasada SQL, los demás.
+        """
+        keys = self._get_consolidated_cache_keys()
+        result = {}
+        for rec in self:
+            key = keys.get(rec.id)
+            if key and rec.consolidated_cache_key == key and rec.consolidated_cache_artifact_id:
+                cached = rec._load_consolidated_cache()
+                if cached is not None:
+                    result[rec.id] = cached
+        stale = self.filtered(lambda r: r.id in keys and r.id not in result)
+        if stale:
+            sources = stale._get_consolidated_sources()
+            computed = {
+                rec.id: rec._build_consolidated_payroll_data(sources[rec.id])
+                for rec in stale if rec.id in sources
+            }
+            stale._store_consolidated_cache(computed, keys)
+            result.update(computed)
+        _logger.debug("Consolidados: %s desde caché, %s recalculados.",
+                      len(self) - len(stale), len(stale))
+        return result
+
+    def _get_consolidated_payroll_data(self):
+        """
+        Datos consolidados del mes (desde la caché si las nóminas no
+        cambiaron). Ver ``_build_consolidated_payroll_data``.
+        """
+        self.ensure_one()
+        data = self._get_consolidated_payroll_data_batch().get(self.id)
+        if data is None:
             raise UserError(
                 _("Esta nómina EDI no tiene nóminas individuales asociadas."))
+        return data
+
+    # --- Construcción de la estructura consolidada (AJUSTADO) ---
+    def _build_consolidated_payroll_data(self, sources):
+        """
+        Agrega los datos de las nóminas individuales (payslip_ids)
+        para generar un diccionario con la información consolidada del mes.
+
+        :param sources: fuentes ya agregadas por ``_get_consolidated_sources``.
+        """
+        self.ensure_one()
+        _logger.debug("Agregando datos para Nómina EDI: %s", self.name)
 
         # --- Inicializar estructuras para datos agregados ---
         consolidated_data = {
@@ -355,10 +651,6 @@ class HrPayslipEdi(models.Model):
             'accrued_total_numeric': 0.0,
             'deductions_total_numeric': 0.0,
         }
-        earn_details = defaultdict(list)
-        deduction_details = defaultdict(list)
-        aggregated_values = defaultdict(
-            lambda: {'total': 0.0, 'quantity': 0.0, 'rates': []})
 
         # --- Tomar datos estáticos y de periodo ---
         sequence_number_str = ''.join(filter(str.isdigit, self.number or ''))
@@ -388,10 +680,8 @@ class HrPayslipEdi(models.Model):
         consolidated_data['payment'] = {
             'method_code': payment_method_code,
         }
-        payment_dates_set = set(slip.payment_date.strftime(
-            '%Y-%m-%d') for slip in self.payslip_ids if slip.payment_date)
         consolidated_data['payment_dates'] = [
-            {'date': d} for d in sorted(list(payment_dates_set))]
+            {'date': d.strftime('%Y-%m-%d')} for d in sources['payment_dates']]
 
         monthly_period = self.env['l10n_co_nomina.payroll.period'].search(
             [('code', '=', '5')], limit=1)
@@ -401,68 +691,19 @@ class HrPayslipEdi(models.Model):
             'trm': 0.0,
         }
 
-        # --- Iterar sobre las nóminas individuales para agregar datos ---
-        total_worked_days_calc = 0.0
-
+        # --- Días trabajados y ausencias (ya agregados en SQL) ---
         days_in_month_theory = 30.0
-        total_absent_days_in_month = 0
-
-        for payslip in self.payslip_ids:
-            total_absent_days_in_month += sum(
-                leave_line.number_of_days for leave_line in payslip.worked_days_line_ids
-                if leave_line.code in ['LNR', 'SUS', 'IGE1_2', 'IGE3_90', 'IGE91_180', 'IGE181_MAS', 'LMA', 'LR', 'ATEP', 'VACDISF']
-            )
-            # Aunque no se usa directamente para worked_days, mantener por si se necesita en otros cálculos
-            total_worked_days_calc += self.calculate_time_worked(
-                payslip.date_from, payslip.date_to)
-
-            for earn_line in payslip.earn_ids:
-                category = earn_line.category
-                key = ('earn_detail', category)
-                aggregated_values[key]['total'] += abs(earn_line.total)
-                aggregated_values[key]['quantity'] += abs(earn_line.quantity)
-
-            for ded_line in payslip.deduction_ids:
-                category = ded_line.category
-                key = ('ded_detail', category)
-                aggregated_values[key]['total'] += abs(ded_line.amount)
-                aggregated_values[key]['quantity'] += 1
-
-            for line in payslip.line_ids:
-                # CORRECCIÓN: Usar los campos personalizados para type_concept y edi_is_detailed
-                rule = line.salary_rule_id
-                concept_type = getattr(rule, 'type_concept', None)
-                is_detailed = getattr(rule, 'edi_is_detailed', False)
-
-                if concept_type == 'earn':
-                    consolidated_data['accrued_total_numeric'] += line.total
-                    if not is_detailed:
-                        category = getattr(rule, 'earn_category', None)
-                        if category:
-                            key = ('earn_calc', category)
-                            aggregated_values[key]['total'] += line.total
-                            qty = line.edi_quantity if hasattr(
-                                line, 'edi_quantity') and line.edi_quantity else line.quantity
-                            aggregated_values[key]['quantity'] += qty
-                            rate = line.edi_rate if hasattr(
-                                line, 'edi_rate') and line.edi_rate != 100.0 else line.rate
-                            if rate != 100.0:
-                                aggregated_values[key]['rates'].append(rate)
-                elif concept_type == 'deduction':
-                    consolidated_data['deductions_total_numeric'] += abs(
-                        line.total)
-                    if not is_detailed:
-                        category = getattr(rule, 'deduction_category', None)
-                        if category:
-                            key = ('ded_calc', category)
-                            aggregated_values[key]['total'] += abs(line.total)
-                            qty = line.edi_quantity if hasattr(
-                                line, 'edi_quantity') and line.edi_quantity else line.quantity
-                            aggregated_values[key]['quantity'] += qty
-                            rate = line.edi_rate if hasattr(
-                                line, 'edi_rate') and line.edi_rate != 100.0 else line.rate
-                            if rate != 100.0:
-                                aggregated_values[key]['rates'].append(rate)
+        total_absent_days_in_month = sources['absent_days']
+        total_worked_days_calc = sum(
+            self.calculate_time_worked(date_from, date_to)
+            for date_from, date_to in sources['periods'])
+
+        # Agregación por categoría de todas las nóminas del mes
+        payroll_doc = sources['document']
+        aggregated_values = payroll_doc.as_aggregated_values()
+        consolidated_data['accrued_total_numeric'] = float(payroll_doc.accrued_total)
+        consolidated_data['deductions_total_numeric'] = float(
+            payroll_doc.deductions_total)
 
         consolidated_worked_days = max(
             0.0, days_in_month_theory - total_absent_days_in_month)
@@ -844,19 +1085,21 @@ class HrPayslipEdi(models.Model):
 
         # --- Fin de la agregación ---
         notes_list = consolidated_data['notes']
-        for slip in self.payslip_ids:
-            if slip.note and slip.note not in [n['text'] for n in notes_list]:
-                notes_list.append({'text': slip.note})
-        if self.note and self.note not in [n['text'] for n in notes_list]:
-            notes_list.append({'text': self.note})
+        for note in sources['notes'] + [self.note]:
+            if note and note not in [n['text'] for n in notes_list]:
+                notes_list.append({'text': note})
         consolidated_data['notes'] = notes_list
 
-        _logger.info("Datos agregados para Nómina EDI: %s", self.name)
+        _logger.debug("Datos agregados para Nómina EDI: %s", self.name)
         return consolidated_data
 
     # --- Método validate_dian_generic (Adaptado) ---
     def validate_dian_generic(self):
         """ Inicia el proceso de validación EDI para esta nómina consolidada."""
+        to_validate = self.filtered(
+            lambda r: r.company_id.edi_payroll_enable and r.company_id.edi_payroll_consolidated_enable
+            and not r.edi_is_valid and r.state == 'done')
+        consolidated_by_id = to_validate._get_consolidated_payroll_data_batch()
         for rec in self:
             if not rec.company_id.edi_payroll_enable:
                 _logger.info(
@@ -878,7 +1121,8 @@ class HrPayslipEdi(models.Model):
                     _("No hay nóminas individuales asociadas a este consolidado."))
 
             try:
-                consolidated_data = rec._get_consolidated_payroll_data()
+                consolidated_data = consolidated_by_id.get(rec.id) \
+                    or rec._get_consolidated_payroll_data()
             except Exception as e:
                 raise UserError(
                     _("Error al consolidar datos de nóminas individuales: %s") % e)
@@ -894,41 +1138,105 @@ class HrPayslipEdi(models.Model):
         self.validate_dian_generic()
 
     # --- Método action_payslip_done (Adaptado) ---
-    def action_payslip_done(self):
-        """Confirma la nómina EDI y opcionalmente la valida."""
-        for rec in self:
-            if rec.state != 'draft':
-                continue
-
-            if not rec.number or rec.number in ('New', _('New')):
-                sequence_code = 'salary.slip.edi.note' if rec.credit_note else 'salary.slip.edi'
-                rec.number = self.env['ir.sequence'].next_by_code(
-                    sequence_code)
-                if not rec.number:
-                    raise UserError(
-                        _("Debe crear una secuencia con el código '%s'") % sequence_code)
-
-            if not rec.contract_id and rec.payslip_ids:
-                active_contracts = self.env['hr.contract'].search([
-                    ('employee_id', '=', rec.employee_id.id),
-                    ('state', 'in', ('open', 'close')),
-                    ('date_start', '<=', dt.date(rec.year, int(rec.month), 1) +
-                     relativedelta(months=1, days=-1)),
-                    '|', ('date_end', '=', False),
-                    ('date_end', '>=', dt.date(rec.year, int(rec.month), 1))
-                ], order='date_start desc', limit=1)
-                if active_contracts:
-                    rec.contract_id = active_contracts.id
-                else:
-                    # Fallback al contrato del último payslip si no se encuentra activo
-                    rec.contract_id = rec.payslip_ids[-1].contract_id.id if rec.payslip_ids else False
+    def _get_edi_sequence_code(self):
+        self.ensure_one()
+        return 'salary.slip.edi.note' if self.credit_note else 'salary.slip.edi'
 
-            rec.write({'state': 'done'})
+    def _resolve_active_contracts(self):
+        """
+        Contrato de cada consolidado en una sola consulta (``{edi_id: contract_id}``):
+        el activo en el mes con la fecha de inicio más reciente (ventana por
+        consolidado) o, si no hay, el de la nómina individual más reciente.
+        """
+        if not self.ids:
+            return {}
+        self.env['hr.contract'].flush_model(['employee_id', 'state', 'active', 'date_start', 'date_end'])
+        self.env['hr.payslip'].flush_model(['contract_id', 'date_to'])
+        self.flush_model(['employee_id', 'month', 'year', 'payslip_ids'])
+        payslips_field = self._fields['payslip_ids']
+        self.env.cr.execute(SQL("""
+            WITH docs AS (
+                SELECT e.id, e.employee_id,
+                       make_date(e.year, e.month::int, 1) AS month_start,
+                       (make_date(e.year, e.month::int, 1) + interval '1 month - 1 day')::date AS month_end
+                  FROM hr_payslip_edi e
+                 WHERE e.id = ANY(%(edi_ids)s)
+            ), ranked AS (
+                SELECT d.id AS edi_id, c.id AS contract_id,
+                       ROW_NUMBER() OVER (PARTITION BY d.id ORDER BY c.date_start DESC, c.id DESC) AS rank
+                  FROM docs d
+                  JOIN hr_contract c ON c.employee_id = d.employee_id
+                 WHERE c.active
+                   AND c.state IN ('open', 'close')
+                   AND c.date_start <= d.month_end
+                   AND (c.date_end IS NULL OR c.date_end >= d.month_start)
+            ), fallback AS (
+                SELECT %(rel_edi)s AS edi_id,
+                       (array_agg(p.contract_id ORDER BY p.date_to DESC, p.id DESC)
+                            FILTER (WHERE p.contract_id IS NOT NULL))[1] AS contract_id
+                  FROM %(rel)s AS rel
+                  JOIN hr_payslip p ON p.id = %(rel_slip)s
+                 WHERE %(rel_edi)s = ANY(%(edi_ids)s)
+              GROUP BY %(rel_edi)s
+            )
+            SELECT d.id, COALESCE(r.contract_id, f.contract_id)
+              FROM docs d
+         LEFT JOIN ranked r ON r.edi_id = d.id AND r.rank = 1
+         LEFT JOIN fallback f ON f.edi_id = d.id
+        """, edi_ids=list(self.ids), rel=SQL.identifier(payslips_field.relation),
+            rel_edi=SQL.identifier('rel', payslips_field.column1),
+            rel_slip=SQL.identifier('rel', payslips_field.column2)))
+        return {edi_id: contract_id for edi_id, contract_id in self.env.cr.fetchall() if contract_id}
+
+    def _confirm_edi_documents(self, numbers_by_id=None):
+        """
+        Pasa a 'Hecho' los consolidados en borrador de ``self``: asigna el
+        consecutivo (de ``numbers_by_id`` si se reservó antes; si no, un
+        bloque contiguo por secuencia reservado en un paso) y el contrato
+        activo del mes cuando falta (una sola consulta para todos). Devuelve
+        los registros confirmados.
+        """
+        numbers_by_id = dict(numbers_by_id or {})
+        drafts = self.filtered(lambda r: r.state == 'draft')
+
+        # Consecutivos: un bloque por compañía y secuencia para los que no lo traen
+        missing = defaultdict(list)
+        for rec in drafts:
+            if (not rec.number or rec.number in ('New', _('New'))) and rec.id not in numbers_by_id:
+                missing[(rec.company_id, rec._get_edi_sequence_code())].append(rec.id)
+        Sequence = self.env['ir.sequence']
+        for (company, sequence_code), edi_ids in missing.items():
+            numbers_by_id.update(zip(
+                edi_ids, Sequence._l10n_co_reserve_numbers_by_code(sequence_code, len(edi_ids), company)))
+
+        # Contratos: resolución en lote para los que no lo tienen
+        without_contract = drafts.filtered(lambda r: not r.contract_id)
+        contracts_by_id = without_contract._resolve_active_contracts()
+
+        # Escrituras agrupadas: una por contrato y una para el estado
+        edi_ids_by_contract = defaultdict(list)
+        for edi_id, contract_id in contracts_by_id.items():
+            edi_ids_by_contract[contract_id].append(edi_id)
+        for contract_id, edi_ids in edi_ids_by_contract.items():
+            self.browse(edi_ids).write({'contract_id': contract_id})
+        for rec in drafts:
+            number = numbers_by_id.get(rec.id)
+            if number and (not rec.number or rec.number in ('New', _('New'))):
+                rec.number = number
+        drafts.write({'state': 'done'})
+        return drafts
+
+    def _should_auto_validate(self):
+        """Validación automática si está habilitada y no se usa estado intermedio."""
+        self.ensure_one()
+        company = self.company_id
+        return company.edi_payroll_enable and company.edi_payroll_consolidated_enable \
+            and not company.edi_payroll_enable_validate_state
 
-            # Validación automática si está habilitada y no se usa estado intermedio
-            if rec.company_id.edi_payroll_enable \
-                    and rec.company_id.edi_payroll_consolidated_enable \
-                    and not rec.company_id.edi_payroll_enable_validate_state:
+    def action_payslip_done(self):
+        """Confirma la nómina EDI y opcionalmente la valida."""
+        for rec in self._confirm_edi_documents():
+            if rec._should_auto_validate():
                 try:
                     rec.validate_dian_generic()
                 except Exception as e:
@@ -961,7 +1269,7 @@ class HrPayslipEdi(models.Model):
                 'payslip_ids': [(6, 0, payslip_edi.payslip_ids.ids)],
                 'edi_is_valid': False, 'edi_uuid': False, 'edi_status_code': False,
                 'edi_status_message': False, 'edi_errors_messages': False,
-                'edi_xml_attachment_id': False, 'edi_response_attachment_id': False,
+                'edi_xml_artifact_id': False, 'edi_response_attachment_id': False,
                 # Copiar otros campos relevantes si es necesario
                 'employee_id': payslip_edi.employee_id.id,
                 'month': payslip_edi.month,
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+import logging
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    def _l10n_co_reserve_numbers(self, count):
+        """
+        Reserva ``count`` consecutivos de la secuencia en un solo paso y
+        devuelve los nombres ya formateados (prefijo, relleno y sufijo).
+
+        * ``no_gap``: bloquea la fila de la secuencia y avanza ``number_next``
+          una sola vez, así que el bloque es contiguo.
+        * ``standard``: toma los valores de la secuencia de PostgreSQL en una
+          consulta (únicos; contiguos salvo envíos concurrentes).
+        * Con rangos de fechas se delega en ``next_by_id`` por cada número.
+        """
+        self.ensure_one()
+        if count <= 0:
+            return []
+        if self.use_date_range:
+            return [self.next_by_id() for __ in range(count)]
+
+        increment = self.number_increment or 1
+        if self.implementation == 'standard':
+            self.env.cr.execute(SQL(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                'ir_sequence_%03d' % self.id, count))
+            numbers = sorted(row[0] for row in self.env.cr.fetchall())
+        else:
+            self.flush_recordset(['number_next'])
+            self.env.cr.execute(
+                "SELECT number_next FROM ir_sequence WHERE id = %s FOR UPDATE", (self.id,))
+            first = self.env.cr.fetchone()[0]
+            self.env.cr.execute(
+                "UPDATE ir_sequence SET number_next = number_next + %s WHERE id = %s",
+                (increment * count, self.id))
+            self.invalidate_recordset(['number_next'])
+            numbers = [first + increment * index for index in range(count)]
+
+        _logger.info("Secuencia %s: reservados %s consecutivos (%s ... %s).",
+                     self.code, count, numbers[0], numbers[-1])
+        return [self.get_next_char(number) for number in numbers]
+
+    def _l10n_co_reserve_numbers_by_code(self, sequence_code, count, company=None):
+        """Como ``_l10n_co_reserve_numbers`` a partir del código (misma búsqueda que ``next_by_code``)."""
+        if count <= 0:
+            return []
+        company_id = (company or self.env.company).id
+        sequence = self.sudo().search([
+            ('code', '=', sequence_code),
+            ('company_id', 'in', [company_id, False]),
+        ], order='company_id', limit=1)
+        if not sequence:
+            raise UserError(_("Debe crear una secuencia con el código '%s'") % sequence_code)
+        return sequence.with_context(ir_sequence_date=fields.Date.context_today(self))._l10n_co_reserve_numbers(count)
@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, models, _
+from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 import logging
-from hashlib import sha384
+import threading
+from hashlib import sha256, sha384
 from lxml import etree
 
+from .payroll_edi_proxy import PayrollEdiProxy
+
 try:
     import zeep
+    from zeep.cache import InMemoryCache
     from zeep.transports import Transport
 except ImportError:
     _logger = logging.getLogger(__name__)
@@ -16,6 +20,23 @@ except ImportError:
 
 _logger = logging.getLogger(__name__)
 
+# Cache por proceso de clientes SOAP de nómina:
+# (bd, compañía, modo de operación, ambiente, checksum del certificado, wsdl, credenciales)
+# -> (service, kwargs)
+_PAYROLL_SERVICE_CACHE = {}
+_PAYROLL_SERVICE_CACHE_LOCK = threading.Lock()
+
+# Campos de res.company que invalidan el cliente cacheado al cambiar
+PAYROLL_SERVICE_FIELDS = frozenset([
+    'l10n_co_payroll_certificate_file',
+    'l10n_co_payroll_certificate_password',
+    'edi_payroll_id',
+    'edi_payroll_pin',
+    'edi_payroll_is_not_test',
+    'l10n_co_edi_payroll_wsdl_url_prod',
+    'l10n_co_edi_payroll_wsdl_url_test',
+])
+
 
 class AccountEdiXmlUblDianPatch(models.AbstractModel):
     _inherit = 'account.edi.xml.ubl_dian'
@@ -97,13 +118,117 @@ class AccountEdiXmlUblDianPatch(models.AbstractModel):
         return qr_url_base + clean_identifier
 
 
+    def _export_invoice_filename(self, invoice):
+        """El proxy de nómina no es un account.move: el nombre sale de su número."""
+        if isinstance(invoice, PayrollEdiProxy):
+            return '%s.xml' % invoice.name
+        return super()._export_invoice_filename(invoice)
+
+
+class L10nCoDianDocumentPayrollPatch(models.Model):
+    _inherit = 'l10n_co_dian.document'
+
+    @api.model
+    def _create_document(self, xml, move, state, **kwargs):
+        """
+        SOBRESCRITO para el proxy de nómina (``PayrollEdiProxy``): no hay
+        account.move, así que el documento queda sin ``move_id``, el
+        identificador es el CUNE del XML y el adjunto se liga al registro de
+        nómina que originó el envío.
+        """
+        if not isinstance(move, PayrollEdiProxy):
+            return super()._create_document(xml, move, state, **kwargs)
+        root = etree.fromstring(xml)
+        general_info = root.find('.//{*}InformacionGeneral')
+        cune = general_info.get('CUNE') if general_info is not None else None
+        document = self.create({
+            'identifier': cune or move.name,
+            'state': state,
+            'datetime': fields.Datetime.now(),
+            **kwargs,
+        })
+        source = move.source
+        document.attachment_id = self.env['ir.attachment'].create({
+            'raw': xml,
+            'name': self.env['account.edi.xml.ubl_dian']._export_invoice_filename(move),
+            'res_model': source._name if source else document._name,
+            'res_id': source.id if source else document.id,
+        })
+        return document
+
+
 class ResCompanyDianPayrollPatch(models.Model):
     _inherit = 'res.company'
 
+    def write(self, vals):
+        res = super(ResCompanyDianPayrollPatch, self).write(vals)
+        if PAYROLL_SERVICE_FIELDS.intersection(vals):
+            self._invalidate_payroll_dian_service_cache()
+            self._invalidate_payroll_certificate_cache()
+        return res
+
+    def _invalidate_payroll_dian_service_cache(self):
+        """Descarta los clientes SOAP cacheados de estas compañías en este proceso."""
+        dbname = self.env.cr.dbname
+        company_ids = set(self.ids)
+        with _PAYROLL_SERVICE_CACHE_LOCK:
+            for key in [k for k in _PAYROLL_SERVICE_CACHE
+                        if k[0] == dbname and k[1] in company_ids]:
+                _PAYROLL_SERVICE_CACHE.pop(key, None)
+        _logger.info("PARCHE NÓMINA: cache de clientes DIAN invalidada para compañías %s.", list(company_ids))
+
+    def _get_payroll_certificate_checksum(self):
+        """
+        Checksum del certificado .p12 leído del ir.attachment (sin cargar el
+        binario). Forma parte de la clave de cache, así que otros workers
+        también descartan su cliente cuando el certificado cambia.
+        """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', 'res.company'),
+            ('res_id', '=', self.id),
+            ('res_field', '=', 'l10n_co_payroll_certificate_file'),
+        ], limit=1)
+        return attachment.checksum or ''
+
+    def _build_payroll_dian_service(self, wsdl_location, software_id, software_pin):
+        """Construye el cliente zeep y la cabecera WS-Security de nómina."""
+        # InMemoryCache: los XSD importados por el WSDL se descargan una vez por proceso
+        transport = Transport(timeout=30, operation_timeout=30, cache=InMemoryCache(timeout=None))
+        client = zeep.Client(wsdl_location, transport=transport)
+        header = zeep.xsd.Element(
+            '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Security',
+            zeep.xsd.ComplexType([
+                zeep.xsd.Attribute(
+                    '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd}mustUnderstand',
+                    zeep.xsd.String()),
+                zeep.xsd.Element(
+                    '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}UsernameToken',
+                    zeep.xsd.ComplexType([
+                        zeep.xsd.Element(
+                            '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Username',
+                            zeep.xsd.String()),
+                        zeep.xsd.Element(
+                            '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Password',
+                            zeep.xsd.String()),
+                    ])
+                ),
+            ])
+        )
+        header_value = header(
+            mustUnderstand='1',
+            UsernameToken={
+                'Username': software_id,
+                'Password': software_pin
+            }
+        )
+        return client.service, {'soapheaders': [header_value]}
+
     def _get_l10n_co_dian_service(self, operation_mode):
         """
         SOBRESCRITO para Nómina Electrónica.
-        Si es nómina, construye el cliente del servicio web manualmente.
+        Si es nómina, devuelve el cliente del servicio web desde la cache del
+        proceso (se construye una vez por compañía/modo/certificado).
         Si no, deja que la lógica original de l10n_co_dian funcione.
         """
         self.ensure_one()
@@ -112,8 +237,6 @@ class ResCompanyDianPayrollPatch(models.Model):
             'is_l10n_co_payroll', False)
 
         if is_payroll_operation:
-            _logger.info(
-                "PARCHE NÓMINA: Construyendo servicio DIAN manualmente para nómina.")
             if not zeep:
                 raise UserError(
                     _("La librería 'zeep' es necesaria. Por favor, instálela (pip install zeep)."))
@@ -135,39 +258,34 @@ class ResCompanyDianPayrollPatch(models.Model):
                 raise UserError(
                     _("El Software ID o el PIN para Nómina Electrónica no están configurados en la compañía."))
 
-            transport = Transport(timeout=30, operation_timeout=30)
+            cache_key = (
+                self.env.cr.dbname,
+                self.id,
+                operation_mode,
+                bool(self.edi_payroll_is_not_test),
+                self._get_payroll_certificate_checksum(),
+                wsdl_url,
+                sha256(('%s:%s' % (software_id, software_pin)).encode('utf-8')).hexdigest(),
+            )
+            with _PAYROLL_SERVICE_CACHE_LOCK:
+                cached = _PAYROLL_SERVICE_CACHE.get(cache_key)
+            if cached:
+                return cached
+
+            _logger.info(
+                "PARCHE NÓMINA: Construyendo servicio DIAN para nómina (compañía %s, modo %s).",
+                self.id, operation_mode)
             try:
-                client = zeep.Client(wsdl_url, transport=transport)
-                header = zeep.xsd.Element(
-                    '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Security',
-                    zeep.xsd.ComplexType([
-                        zeep.xsd.Attribute(
-                            '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd}mustUnderstand',
-                            zeep.xsd.String()),
-                        zeep.xsd.Element(
-                            '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}UsernameToken',
-                            zeep.xsd.ComplexType([
-                                zeep.xsd.Element(
-                                    '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Username',
-                                    zeep.xsd.String()),
-                                zeep.xsd.Element(
-                                    '{http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd}Password',
-                                    zeep.xsd.String()),
-                            ])
-                        ),
-                    ])
-                )
-                header_value = header(
-                    mustUnderstand='1',
-                    UsernameToken={
-                        'Username': software_id,
-                        'Password': software_pin
-                    }
-                )
-                return client.service, {'soapheaders': [header_value]}
+                service = self._build_payroll_dian_service(wsdl_url, software_id, software_pin)
             except Exception as e:
                 raise UserError(
                     _("No se pudo conectar al servicio de la DIAN en la URL: %s. Error: %s") % (wsdl_url, e))
+            with _PAYROLL_SERVICE_CACHE_LOCK:
+                # Descarta entradas obsoletas de la misma compañía y modo (certificado anterior)
+                for key in [k for k in _PAYROLL_SERVICE_CACHE if k[:3] == cache_key[:3]]:
+                    _PAYROLL_SERVICE_CACHE.pop(key, None)
+                _PAYROLL_SERVICE_CACHE[cache_key] = service
+            return service
         else:
             return super(ResCompanyDianPayrollPatch, self)._get_l10n_co_dian_service(operation_mode)
 
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+import base64
+import json
+import logging
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models
+from odoo.tools import SQL
+
+from .payroll_compression import (
+    CODEC_GZIP, CODEC_NONE, CODEC_ZSTD, compress, content_checksum, decompress, open_stream)
+
+_logger = logging.getLogger(__name__)
+
+# Campos binarios/texto que antes se guardaban directamente en cada documento
+LEGACY_FILE_FIELDS = {
+    'l10n_co_edi_xml_file': ('edi_xml_artifact_id', 'application/xml'),
+    'l10n_co_edi_pdf_file': ('edi_pdf_artifact_id', 'application/pdf'),
+}
+LEGACY_PAYLOAD_COLUMN = 'edi_payload'
+# Columna del antiguo Many2one ``edi_xml_attachment_id`` hacia el adjunto del XML firmado
+LEGACY_XML_ATTACHMENT_COLUMN = 'edi_xml_attachment_id'
+
+
+def compact_payload(payload):
+    """Payload de depuración en JSON compacto (sin indentación) si es JSON válido."""
+    if not isinstance(payload, str):
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+    try:
+        return json.dumps(json.loads(payload), ensure_ascii=False, separators=(',', ':'))
+    except ValueError:
+        return payload
+
+
+class L10nCoNominaEdiArtifact(models.Model):
+    """
+    Blob EDI (XML, PDF o payload) comprimido y direccionado por contenido.
+
+    El SHA-256 del contenido sin comprimir es único: documentos con el mismo
+    XML/PDF/payload comparten un solo registro y un solo archivo en el
+    filestore. Los documentos lo referencian por ``Many2one`` y lo
+    descomprimen solo cuando se lee el campo.
+    """
+    _name = 'l10n_co_nomina.edi.artifact'
+    _description = 'Artefacto EDI de Nómina (comprimido)'
+    _rec_name = 'checksum'
+    _order = 'id desc'
+
+    checksum = fields.Char(string='SHA-256', required=True, readonly=True, index=True)
+    codec = fields.Selection(
+        [(CODEC_ZSTD, 'zstd'), (CODEC_GZIP, 'gzip'), (CODEC_NONE, 'Sin compresión')],
+        string='Compresión', required=True, readonly=True)
+    mimetype = fields.Char(string='Tipo MIME', readonly=True)
+    raw_size = fields.Integer(string='Tamaño Original', readonly=True)
+    stored_size = fields.Integer(string='Tamaño Almacenado', readonly=True)
+    data = fields.Binary(string='Contenido Comprimido', attachment=True, readonly=True)
+
+    _sql_constraints = [
+        ('checksum_unique', 'UNIQUE(checksum)', 'Ya existe un artefacto con este contenido.'),
+    ]
+
+    # -------------------------------------------------------------------------
+    # Escritura / lectura
+    # -------------------------------------------------------------------------
+
+    @api.model
+    def _prepare_artifact_vals(self, content, mimetype):
+        codec, packed = compress(content)
+        return {
+            'checksum': content_checksum(content),
+            'codec': codec,
+            'mimetype': mimetype,
+            'raw_size': len(content),
+            'stored_size': len(packed),
+            'data': base64.b64encode(packed),
+        }
+
+    @api.model
+    def _store_many(self, contents, mimetype=None):
+        """
+        Guarda una lista de contenidos (``bytes`` o ``None``) y devuelve los
+        artefactos en el mismo orden (vacío para ``None``). Una sola búsqueda
+        de los existentes y un solo ``create`` para los nuevos.
+        """
+        Artifact = self.sudo()
+        checksums = [content_checksum(content) if content else None for content in contents]
+        wanted = {checksum for checksum in checksums if checksum}
+        by_checksum = {}
+        if wanted:
+            by_checksum = {artifact.checksum: artifact
+                           for artifact in Artifact.search([('checksum', 'in', list(wanted))])}
+
+        new_vals = {}
+        for checksum, content in zip(checksums, contents):
+            if checksum and checksum not in by_checksum and checksum not in new_vals:
+                new_vals[checksum] = self._prepare_artifact_vals(content, mimetype)
+        if new_vals:
+            try:
+                with self.env.cr.savepoint():
+                    created = Artifact.create(list(new_vals.values()))
+            except psycopg2.IntegrityError:
+                # Otro worker guardó alguno de estos contenidos en paralelo
+                created = Artifact
+                for vals in new_vals.values():
+                    try:
+                        with self.env.cr.savepoint():
+                            created |= Artifact.create(vals)
+                    except psycopg2.IntegrityError:
+                        created |= Artifact.search([('checksum', '=', vals['checksum'])], limit=1)
+            by_checksum.update((artifact.checksum, artifact) for artifact in created)
+
+        empty = self.browse()
+        return [by_checksum[checksum].with_env(self.env) if checksum else empty
+                for checksum in checksums]
+
+    @api.model
+    def _store(self, content, mimetype=None):
+        return self._store_many([content], mimetype)[0]
+
+    @api.model
+    def _store_payload(self, payload):
+        """Guarda un payload de depuración (dict o texto) como JSON compacto."""
+        if not payload:
+            return self.browse()
+        return self._store(compact_payload(payload).encode('utf-8'), 'application/json')
+
+    def _get_packed(self):
+        self.ensure_one()
+        data = self.sudo().data
+        return base64.b64decode(data) if data else b''
+
+    def _get_content(self):
+        """Contenido original (descomprimido)."""
+        self.ensure_one()
+        return decompress(self.codec, self._get_packed())
+
+    def _open(self):
+        """Flujo de lectura que descomprime a demanda."""
+        self.ensure_one()
+        return open_stream(self.codec, self._get_packed())
+
+    # -------------------------------------------------------------------------
+    # Retención y compactación
+    # -------------------------------------------------------------------------
+
+    @api.model
+    def _get_owner_models(self):
+        """Modelos que referencian artefactos (los que heredan la clase EDI)."""
+        return [
+            model_name for model_name, model in self.env.registry.items()
+            if not model._abstract and not model._transient and model._auto
+            and 'edi_payload_artifact_id' in model._fields
+        ]
+
+    @api.model
+    def _get_referencing_columns(self):
+        """``[(tabla, columna)]`` de todos los Many2one almacenados hacia artefactos."""
+        columns = []
+        for model in self.env.registry.values():
+            if model._abstract or not model._auto:
+                continue
+            for field in model._fields.values():
+                if field.type == 'many2one' and field.store and field.comodel_name == self._name:
+                    columns.append((model._table, field.name))
+        return columns
+
+    @api.model
+    def _purge_old_payloads(self, days):
+        """Desvincula los payloads de depuración de documentos sin cambios en ``days`` días."""
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        purged = 0
+        for model_name in self._get_owner_models():
+            Model = self.env[model_name]
+            self.env.cr.execute(SQL(
+                "UPDATE %s SET edi_payload_artifact_id = NULL "
+                "WHERE edi_payload_artifact_id IS NOT NULL AND write_date < %s",
+                SQL.identifier(Model._table), cutoff))
+            purged += self.env.cr.rowcount
+            Model.invalidate_model(['edi_payload_artifact_id'])
+        return purged
+
+    @api.model
+    def _collect_garbage(self, grace_hours=24):
+        """
+        Elimina en una sola sentencia los artefactos que ya ningún documento
+        referencia (``NOT EXISTS`` por cada columna que apunta a artefactos) y
+        luego sus adjuntos en el filestore.
+        """
+        cutoff = fields.Datetime.now() - timedelta(hours=grace_hours)
+        conditions = [SQL(
+            "NOT EXISTS (SELECT 1 FROM %s ref WHERE ref.%s = artifact.id)",
+            SQL.identifier(table), SQL.identifier(column))
+            for table, column in self._get_referencing_columns()]
+        self.env.flush_all()
+        self.env.cr.execute(SQL(
+            "DELETE FROM %s artifact WHERE artifact.create_date < %s%s RETURNING artifact.id",
+            SQL.identifier(self._table), cutoff,
+            SQL("").join(SQL(" AND %s", condition) for condition in conditions)))
+        removed_ids = [row[0] for row in self.env.cr.fetchall()]
+        if removed_ids:
+            self.env['ir.attachment'].sudo().search([
+                ('res_model', '=', self._name),
+                ('res_field', '=', 'data'),
+                ('res_id', 'in', removed_ids),
+            ]).unlink()
+            self.invalidate_model()
+        return len(removed_ids)
+
+    @api.model
+    def _migrate_legacy_edi_files(self, limit=500):
+        """
+        Mueve a artefactos los XML/PDF guardados como adjuntos por campo y los
+        payloads en la columna de texto anterior. Procesa hasta ``limit``
+        documentos por modelo y campo (``None``: todos). Devuelve cuántos movió.
+        """
+        Attachment = self.env['ir.attachment'].sudo()
+        moved = 0
+        for model_name in self._get_owner_models():
+            Model = self.env[model_name].sudo()
+            for legacy_field, (artifact_field, mimetype) in LEGACY_FILE_FIELDS.items():
+                attachments = Attachment.search([
+                    ('res_model', '=', model_name),
+                    ('res_field', '=', legacy_field),
+                ], limit=limit)
+                if not attachments:
+                    continue
+                artifacts = self._store_many([attachment.raw or None for attachment in attachments], mimetype)
+                for attachment, artifact in zip(attachments, artifacts):
+                    self.env.cr.execute(SQL(
+                        "UPDATE %s SET %s = %s WHERE id = %s",
+                        SQL.identifier(Model._table), SQL.identifier(artifact_field),
+                        artifact.id or None, attachment.res_id))
+                moved += len(attachments)
+                attachments.unlink()
+                Model.invalidate_model([artifact_field])
+            moved += self._migrate_legacy_payload_column(Model, limit)
+            moved += self._migrate_legacy_xml_attachment_column(Model, limit)
+        if moved:
+            _logger.info("Artefactos EDI: %s valor(es) heredado(s) migrado(s) a almacenamiento comprimido.", moved)
+        return moved
+
+    @api.model
+    def _migrate_legacy_payload_column(self, Model, limit):
+        table = Model._table
+        self.env.cr.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, LEGACY_PAYLOAD_COLUMN))
+        if not self.env.cr.fetchone():
+            return 0
+        self.env.cr.execute(SQL(
+            "SELECT id, %s FROM %s WHERE %s IS NOT NULL ORDER BY id LIMIT %s",
+            SQL.identifier(LEGACY_PAYLOAD_COLUMN), SQL.identifier(table),
+            SQL.identifier(LEGACY_PAYLOAD_COLUMN), limit))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return 0
+        artifacts = self._store_many(
+            [compact_payload(payload).encode('utf-8') if payload else None for __, payload in rows],
+            'application/json')
+        for (record_id, __), artifact in zip(rows, artifacts):
+            self.env.cr.execute(SQL(
+                "UPDATE %s SET edi_payload_artifact_id = %s, %s = NULL WHERE id = %s",
+                SQL.identifier(table), artifact.id or None,
+                SQL.identifier(LEGACY_PAYLOAD_COLUMN), record_id))
+        Model.invalidate_model(['edi_payload_artifact_id'])
+        return len(rows)
+
+    @api.model
+    def _migrate_legacy_xml_attachment_column(self, Model, limit):
+        """
+        Copia a ``edi_xml_artifact_id`` el XML firmado que antes se enlazaba en
+        ``edi_xml_attachment_id`` y vacía esa columna. El adjunto no se borra:
+        pertenece al documento de ``l10n_co_dian``.
+        """
+        table = Model._table
+        self.env.cr.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, LEGACY_XML_ATTACHMENT_COLUMN))
+        if not self.env.cr.fetchone():
+            return 0
+        self.env.cr.execute(SQL(
+            "SELECT id, %s FROM %s WHERE %s IS NOT NULL ORDER BY id LIMIT %s",
+            SQL.identifier(LEGACY_XML_ATTACHMENT_COLUMN), SQL.identifier(table),
+            SQL.identifier(LEGACY_XML_ATTACHMENT_COLUMN), limit))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return 0
+        attachments = self.env['ir.attachment'].sudo().browse(
+            [attachment_id for __, attachment_id in rows]).exists()
+        contents = {attachment.id: attachment.raw or None for attachment in attachments}
+        artifacts = self._store_many(
+            [contents.get(attachment_id) for __, attachment_id in rows], 'application/xml')
+        for (record_id, __), artifact in zip(rows, artifacts):
+            self.env.cr.execute(SQL(
+                "UPDATE %s SET edi_xml_artifact_id = COALESCE(edi_xml_artifact_id, %s), %s = NULL WHERE id = %s",
+                SQL.identifier(table), artifact.id or None,
+                SQL.identifier(LEGACY_XML_ATTACHMENT_COLUMN), record_id))
+        Model.invalidate_model(['edi_xml_artifact_id'])
+        return len(rows)
+
+    @api.model
+    def _cron_edi_artifact_retention(self):
+        """
+        Tarea programada: migra valores heredados en lotes, desvincula los
+        payloads de depuración más antiguos que
+        ``l10n_co_nomina.edi_payload_retention_days`` (90 por defecto; 0 los
+        conserva) y elimina los artefactos huérfanos.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        days = int(get_param('l10n_co_nomina.edi_payload_retention_days', 90))
+        migrated = self._migrate_legacy_edi_files()
+        purged = self._purge_old_payloads(days) if days > 0 else 0
+        removed = self._collect_garbage()
+        _logger.info(
+            "Retención de artefactos EDI: %s migrado(s), %s payload(s) purgado(s), %s artefacto(s) eliminado(s).",
+            migrated, purged, removed)
+        return True
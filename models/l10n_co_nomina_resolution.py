@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import logging
+
+import psycopg2
+
 from odoo import fields, models, api, _
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+from odoo.tools.sql import constraint_definition
+
+_logger = logging.getLogger(__name__)
+
+# Tamaño por defecto del bloque que reserva cada proceso (ir.config_parameter
+# l10n_co_nomina.numbering_block_size)
+DEFAULT_BLOCK_SIZE = 50
+
+# Restricción de exclusión (btree_gist) que impide rangos solapados entre
+# resoluciones activas de la misma compañía, tipo de documento y prefijo
+RANGE_EXCLUSION = 'l10n_co_nomina_resolution_active_range_excl'
+
+# Exclusión que impide que dos bloques de una resolución cubran el mismo número
+BLOCK_RANGE_EXCLUSION = 'l10n_co_nomina_resolution_block_block_range_excl'
 
 
 class PayrollResolution(models.Model):
@@ -54,6 +73,27 @@ class PayrollResolution(models.Model):
         default='active',
         help="Estado de vigencia de la resolución en la plataforma."
     )
+    next_number = fields.Integer(
+        string="Siguiente Bloque Desde",
+        readonly=True, copy=False,
+        help="Primer número aún no reservado en bloques. Vacío o menor que 'Desde' "
+             "significa que la numeración comienza en 'Desde'."
+    )
+    warning_threshold = fields.Integer(
+        string="Alerta de Agotamiento",
+        default=100,
+        help="Cuando quedan esta cantidad de números disponibles o menos, se advierte "
+             "del agotamiento del rango autorizado."
+    )
+    block_ids = fields.One2many(
+        'l10n_co_nomina.resolution.block', 'resolution_id',
+        string="Bloques Reservados", readonly=True
+    )
+    remaining_count = fields.Integer(
+        string="Números Disponibles",
+        compute='_compute_remaining_count',
+        help="Números del rango sin asignar: los no reservados más los pendientes de los bloques abiertos."
+    )
 
     _sql_constraints = [
         (
@@ -61,14 +101,55 @@ class PayrollResolution(models.Model):
             'UNIQUE(company_id, type_document_id, prefix, from_number, to_number)',
             '¡Ya existe una resolución para este rango, tipo de documento y prefijo en esta compañía!'
         ),
+        (
+            'valid_number_range',
+            'CHECK(from_number <= to_number)',
+            'El número inicial de la resolución no puede ser mayor que el final.'
+        ),
+        (
+            'active_range_excl',
+            "EXCLUDE USING gist (company_id WITH =, type_document_id WITH =, prefix WITH =, "
+            "int4range(from_number, to_number, '[]') WITH &&) WHERE (state = 'active')",
+            'El rango de numeración se solapa con otra resolución activa de la misma compañía, '
+            'tipo de documento y prefijo.'
+        ),
     ]
 
-    @api.constrains('company_id', 'type_document_id', 'prefix', 'from_number', 'to_number')
+    def _auto_init(self):
+        # La exclusión por igualdad sobre company/tipo/prefijo necesita btree_gist.
+        # Sin permisos para crearla, Odoo registra la restricción como no aplicada
+        # y la validación ORM de _check_overlapping_ranges sigue cubriendo el caso.
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+        except Exception:  # noqa: BLE001
+            _logger.warning("No se pudo crear la extensión btree_gist; los rangos de resolución "
+                            "se validarán solo desde el ORM.", exc_info=True)
+        return super()._auto_init()
+
+    def _has_range_exclusion(self):
+        """Indica si la base de datos aplica la restricción de exclusión de rangos."""
+        return bool(constraint_definition(self.env.cr, self._table, RANGE_EXCLUSION))
+
+    @api.depends('from_number', 'to_number', 'next_number', 'block_ids.state', 'block_ids.next_number')
+    def _compute_remaining_count(self):
+        for rec in self:
+            first_free = max(rec.next_number or 0, rec.from_number)
+            unreserved = max(rec.to_number - first_free + 1, 0)
+            pending = sum(block.number_to - block.next_number + 1
+                          for block in rec.block_ids if block.state == 'open')
+            rec.remaining_count = unreserved + pending
+
+    @api.constrains('company_id', 'type_document_id', 'prefix', 'from_number', 'to_number', 'state')
     def _check_overlapping_ranges(self):
         """
-        Evita que se creen resoluciones con rangos solapados para el mismo prefijo, tipo de documento y compañía.
+        Respaldo de la restricción de exclusión para bases de datos sin
+        btree_gist: con ella activa el solapamiento lo rechaza PostgreSQL
+        (también entre ediciones concurrentes) y aquí no se consulta nada.
         """
-        for rec in self:
+        if self._has_range_exclusion():
+            return
+        for rec in self.filtered(lambda r: r.state == 'active'):
             domain = [
                 ('company_id', '=', rec.company_id.id),
                 ('type_document_id', '=', rec.type_document_id),
@@ -84,3 +165,328 @@ class PayrollResolution(models.Model):
                 raise ValidationError(_(
                     "El rango de numeración definido (%s - %s) para el prefijo %s y tipo %s se solapa con otra resolución activa en la misma compañía."
                 ) % (rec.from_number, rec.to_number, rec.prefix, rec.type_document_id))
+
+    @api.model
+    def _find_number_owner(self, company, type_document_id, prefix, number):
+        """
+        Resolución activa que autoriza el consecutivo ``number`` para
+        compañía, tipo y prefijo. La consulta usa el índice GiST de la
+        restricción de exclusión, que además garantiza un único dueño.
+        """
+        self.flush_model(['company_id', 'type_document_id', 'prefix', 'from_number', 'to_number', 'state'])
+        self.env.cr.execute(SQL("""
+            SELECT id
+              FROM l10n_co_nomina_resolution
+             WHERE company_id = %(company)s
+               AND type_document_id = %(type)s
+               AND prefix = %(prefix)s
+               AND state = 'active'
+               AND int4range(from_number, to_number, '[]') @> %(number)s
+             LIMIT 1
+        """, company=company.id, type=type_document_id, prefix=prefix or '', number=number))
+        row = self.env.cr.fetchone()
+        return self.browse(row[0]) if row else self
+
+    @api.model
+    def _split_document_number(self, company, type_document_id, document_number):
+        """
+        Separa un número de documento (``prefijo + consecutivo``) y devuelve
+        ``(resolución, prefijo, consecutivo)`` si alguna resolución activa lo
+        autoriza; si no, ``(vacío, None, None)``.
+        """
+        return self._split_document_numbers(company, type_document_id, [document_number])[document_number]
+
+    @api.model
+    def _split_document_numbers(self, company, type_document_id, document_numbers):
+        """
+        Versión por lote de ``_split_document_number``: una sola lectura de las
+        resoluciones activas de la compañía y el tipo, y el cruce de rangos en
+        memoria. Devuelve ``{número: (resolución, prefijo, consecutivo)}``.
+        """
+        resolutions = self.search_fetch([
+            ('company_id', '=', company.id),
+            ('type_document_id', '=', type_document_id),
+            ('state', '=', 'active'),
+        ], ['prefix', 'from_number', 'to_number'])
+        # El prefijo DIAN puede tener dígitos: se prueba primero el más largo
+        prefixes = sorted(set(resolutions.mapped('prefix')), key=len, reverse=True)
+        result = {}
+        for document_number in document_numbers:
+            result[document_number] = (self, None, None)
+            number = document_number or ''
+            for prefix in prefixes:
+                digits = number[len(prefix):]
+                if not number.startswith(prefix) or not digits.isdigit():
+                    continue
+                consecutive = int(digits)
+                owner = resolutions.filtered(
+                    lambda r: r.prefix == prefix and r.from_number <= consecutive <= r.to_number)[:1]
+                if owner:
+                    result[document_number] = (owner, prefix, consecutive)
+                    break
+        return result
+
+    # -------------------------------------------------------------------------
+    # Numeración por bloques
+    # -------------------------------------------------------------------------
+    @api.model
+    def _get_numbering_resolution(self, company, type_document_id):
+        """Resolución activa de la compañía para el tipo de documento (la por defecto primero)."""
+        default = company.l10n_co_nomina_default_resolution_id
+        if default and default.state == 'active' and default.type_document_id == type_document_id:
+            return default
+        return self.search([
+            ('company_id', '=', company.id),
+            ('type_document_id', '=', type_document_id),
+            ('state', '=', 'active'),
+        ], order='from_number', limit=1)
+
+    def _get_block_size(self):
+        value = self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_co_nomina.numbering_block_size', DEFAULT_BLOCK_SIZE)
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return DEFAULT_BLOCK_SIZE
+
+    def _claim_open_block(self):
+        """
+        Toma un bloque abierto de la resolución que ningún otro proceso tenga
+        bloqueado (``SKIP LOCKED``). El bloqueo dura hasta el fin de la
+        transacción, así cada proceso consume su propio bloque sin esperar.
+        """
+        Block = self.env['l10n_co_nomina.resolution.block']
+        Block.flush_model(['resolution_id', 'state', 'number_from'])
+        self.env.cr.execute(SQL("""
+            SELECT id
+              FROM l10n_co_nomina_resolution_block
+             WHERE resolution_id = %s AND state = 'open'
+          ORDER BY number_from
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """, self.id))
+        row = self.env.cr.fetchone()
+        return Block.browse(row[0]) if row else Block
+
+    def _reserve_block(self, size, count):
+        """
+        Reserva el siguiente tramo libre del rango autorizado (como máximo
+        ``size`` números) para un llamador que tomará ``count`` de ellos. El avance de ``next_number`` se confirma de
+        inmediato en una transacción propia, así la fila de la resolución
+        queda bloqueada solo durante la reserva y no hasta el fin de la
+        transacción del llamador (p. ej. ``compute_sheet``).
+
+        El bloque se crea en la transacción del llamador, que es la que toma
+        sus números: si se revierte, el tramo queda reservado sin bloque y
+        ``_get_unused_ranges`` lo informa hasta que ``action_release_blocks``
+        lo recupere. Devuelve el bloque o un recordset vacío si el rango se
+        agotó.
+        """
+        self.ensure_one()
+        Block = self.env['l10n_co_nomina.resolution.block']
+        with self.env.registry.cursor() as cr:
+            resolution = self.with_env(self.env(cr=cr))
+            cr.execute(SQL("""
+                SELECT GREATEST(COALESCE(next_number, 0), from_number), to_number
+                  FROM l10n_co_nomina_resolution
+                 WHERE id = %s
+                   FOR UPDATE
+            """, resolution.id))
+            first, last_allowed = cr.fetchone()
+            if first > last_allowed:
+                return Block
+            if resolution._find_number_owner(
+                    resolution.company_id, resolution.type_document_id, resolution.prefix, first) != resolution:
+                raise UserError(_(
+                    "El consecutivo %(number)s no pertenece a una resolución activa con prefijo %(prefix)s.",
+                    number=first, prefix=resolution.prefix))
+            last = min(first + size - 1, last_allowed)
+            cr.execute(SQL(
+                "UPDATE l10n_co_nomina_resolution SET next_number = %s WHERE id = %s",
+                last + 1, resolution.id))
+            resolution.invalidate_recordset(['next_number', 'remaining_count'])
+            resolution._warn_if_exhausting(pending=max(last - first + 1 - count, 0))
+            _logger.info("Resolución %s: reservado el bloque %s-%s.", resolution.prefix, first, last)
+        self.invalidate_recordset(['next_number', 'block_ids', 'remaining_count'])
+        return Block.create({
+            'resolution_id': self.id,
+            'number_from': first,
+            'number_to': last,
+            'next_number': first,
+        })
+
+    def _allocate_numbers(self, count):
+        """
+        Asigna ``count`` consecutivos de la resolución y devuelve los números
+        ya formateados (``prefijo + consecutivo``). Consume primero los bloques
+        abiertos (incluidos los sobrantes de procesos anteriores) y reserva
+        bloques nuevos solo cuando hacen falta.
+        """
+        self.ensure_one()
+        if count <= 0:
+            return []
+        numbers = []
+        reserved = False
+        block_size = self._get_block_size()
+        while len(numbers) < count:
+            needed = count - len(numbers)
+            block = self._claim_open_block()
+            if not block:
+                block = self._reserve_block(max(needed, block_size), needed)
+                if not block:
+                    raise UserError(_(
+                        "La resolución %(prefix)s (%(first)s - %(last)s) agotó su rango autorizado. "
+                        "Registre una nueva resolución DIAN para continuar numerando.",
+                        prefix=self.prefix, first=self.from_number, last=self.to_number))
+                reserved = True
+            numbers.extend(block._take(needed))
+        if not reserved:
+            # Con reserva, la alerta ya se evaluó en su propia transacción
+            self._warn_if_exhausting()
+        return ['%s%s' % (self.prefix or '', number) for number in numbers]
+
+    def _warn_if_exhausting(self, pending=0):
+        """
+        Advierte si quedan ``warning_threshold`` números o menos. ``pending``
+        suma el sobrante de un bloque reservado que esta transacción aún no ve.
+        """
+        self.ensure_one()
+        self.invalidate_recordset(['remaining_count'])
+        remaining = self.remaining_count + pending
+        if remaining <= self.warning_threshold:
+            _logger.warning(
+                "Resolución de nómina %s (%s - %s): quedan %s números disponibles.",
+                self.prefix, self.from_number, self.to_number, remaining)
+        return remaining
+
+    def _get_orphan_ranges(self):
+        """
+        Tramos ya reservados en ``next_number`` que no cubre ningún bloque
+        visible: reservas cuya transacción se revirtió o sigue en curso.
+        """
+        self.ensure_one()
+        ranges = []
+        expected = self.from_number
+        for block in self.block_ids.sorted('number_from'):
+            if block.number_from > expected:
+                ranges.append((expected, block.number_from - 1))
+            expected = max(expected, block.number_to + 1)
+        reserved_to = max(self.next_number or 0, self.from_number) - 1
+        if reserved_to >= expected:
+            ranges.append((expected, reserved_to))
+        return ranges
+
+    def _get_unused_ranges(self):
+        """
+        Tramos reservados y no asignados: ``[(desde, hasta), ...]`` con los
+        sobrantes de los bloques abiertos y los tramos reservados sin bloque.
+        """
+        self.ensure_one()
+        ranges = [(block.next_number, block.number_to)
+                  for block in self.block_ids if block.state == 'open']
+        return sorted(ranges + self._get_orphan_ranges())
+
+    def action_release_blocks(self):
+        """
+        Devuelve al rango los sobrantes de bloques abiertos que no use ningún
+        proceso: los que están al final del rango reservado se recuperan
+        retrocediendo ``next_number``; los demás quedan abiertos para la
+        siguiente asignación y se informan como pendientes. Los tramos
+        reservados sin bloque se recuperan como bloques abiertos.
+        """
+        Block = self.env['l10n_co_nomina.resolution.block']
+        for rec in self:
+            if rec._reclaim_orphan_ranges():
+                rec.invalidate_recordset(['block_ids'])
+            blocks = rec.block_ids.filtered(lambda b: b.state == 'open').sorted('number_from', reverse=True)
+            rec.flush_recordset(['next_number'])
+            for block in blocks:
+                rec.env.cr.execute(SQL(
+                    "SELECT id FROM l10n_co_nomina_resolution_block WHERE id = %s FOR UPDATE SKIP LOCKED",
+                    block.id))
+                if not rec.env.cr.fetchone() or block.number_to + 1 != rec.next_number:
+                    continue
+                rec.next_number = block.next_number
+                if block.next_number == block.number_from:
+                    block.unlink()
+                else:
+                    block.write({'number_to': block.next_number - 1, 'state': 'exhausted'})
+            Block.flush_model()
+            rec.invalidate_recordset(['block_ids'])
+            unused = rec._get_unused_ranges()
+            if unused:
+                _logger.info("Resolución %s: números reservados sin asignar: %s", rec.prefix,
+                             ', '.join('%s-%s' % tramo for tramo in unused))
+        return True
+
+    def _reclaim_orphan_ranges(self):
+        """
+        Crea bloques abiertos para los tramos reservados sin bloque. Un tramo
+        sin bloque visible puede pertenecer a una reserva aún en curso: la
+        exclusión de rangos de los bloques hace esperar el alta hasta que esa
+        transacción termine y la rechaza si confirmó su bloque. Sin la
+        exclusión (base sin btree_gist) los tramos solo se informan.
+        """
+        self.ensure_one()
+        Block = self.env['l10n_co_nomina.resolution.block']
+        if not Block._has_range_exclusion():
+            return Block
+        reclaimed = Block
+        for first, last in self._get_orphan_ranges():
+            try:
+                with self.env.cr.savepoint():
+                    reclaimed |= Block.create({
+                        'resolution_id': self.id,
+                        'number_from': first,
+                        'number_to': last,
+                        'next_number': first,
+                    })
+            except psycopg2.IntegrityError:
+                _logger.info("Resolución %s: el tramo %s-%s pertenece a una reserva en curso.",
+                             self.prefix, first, last)
+        return reclaimed
+
+class PayrollResolutionBlock(models.Model):
+    _name = 'l10n_co_nomina.resolution.block'
+    _description = 'Bloque de Numeración de Resolución de Nómina'
+    _order = 'resolution_id, number_from'
+
+    resolution_id = fields.Many2one(
+        'l10n_co_nomina.resolution', string="Resolución",
+        required=True, ondelete='cascade', index=True
+    )
+    company_id = fields.Many2one(related='resolution_id.company_id', store=True)
+    number_from = fields.Integer(string="Desde", required=True, readonly=True)
+    number_to = fields.Integer(string="Hasta", required=True, readonly=True)
+    next_number = fields.Integer(
+        string="Siguiente", required=True, readonly=True,
+        help="Siguiente número del bloque por asignar."
+    )
+    state = fields.Selection(
+        [('open', 'Abierto'), ('exhausted', 'Agotado')],
+        string="Estado", default='open', required=True, index=True
+    )
+
+    _sql_constraints = [
+        ('valid_block_range',
+         'CHECK(number_from <= next_number AND next_number <= number_to + 1)',
+         'El siguiente número del bloque debe estar dentro de su rango.'),
+        ('block_range_excl',
+         "EXCLUDE USING gist (resolution_id WITH =, int4range(number_from, number_to, '[]') WITH &&)",
+         'Los bloques de numeración de una resolución no pueden solaparse.'),
+    ]
+
+    def _has_range_exclusion(self):
+        """Indica si la base de datos aplica la exclusión de rangos entre bloques."""
+        return bool(constraint_definition(self.env.cr, self._table, BLOCK_RANGE_EXCLUSION))
+
+    def _take(self, count):
+        """Consume hasta ``count`` números del bloque (ya bloqueado por el llamador)."""
+        self.ensure_one()
+        last = min(self.next_number + count - 1, self.number_to)
+        numbers = list(range(self.next_number, last + 1))
+        self.write({
+            'next_number': last + 1,
+            'state': 'exhausted' if last == self.number_to else 'open',
+        })
+        return numbers
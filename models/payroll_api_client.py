@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Cliente HTTP de APIDIAN sin dependencias del ORM.
+
+Las funciones de este módulo solo reciben datos planos (URL, token, payload),
+de modo que pueden ejecutarse desde hilos de trabajo sin tocar el ``env`` ni
+el cursor de Odoo. El conector (``l10n_co_nomina.payroll.api.connector``)
+las usa en el hilo principal y traduce ``PayrollApiError`` a ``UserError``.
+"""
+
+import logging
+import threading
+from dataclasses import dataclass, field
+from hashlib import sha256
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .payroll_api_guard import CircuitOpenError, RateLimitedError, parse_retry_after
+
+_logger = logging.getLogger(__name__)
+
+API_PREFIX = 'api/ubl2.1'
+# (conexión, lectura): un host caído no debe esperar el timeout de lectura completo
+DEFAULT_TIMEOUT = (10, 90)
+
+# Tipos de error de transporte (el conector los traduce a mensajes de usuario)
+ERROR_VALIDATION = 'validation'
+ERROR_HTTP = 'http'
+ERROR_TIMEOUT = 'timeout'
+ERROR_CONNECTION = 'connection'
+ERROR_INVALID_JSON = 'invalid_json'
+ERROR_RATE_LIMITED = 'rate_limited'
+ERROR_CIRCUIT_OPEN = 'circuit_open'
+
+# Fallos que indican una API degradada y cuentan para el interruptor de circuito
+_INFRASTRUCTURE_ERRORS = frozenset({ERROR_TIMEOUT, ERROR_CONNECTION, ERROR_INVALID_JSON})
+
+# Estados normalizados de un documento en la DIAN
+STATUS_ACCEPTED = 'accepted'
+STATUS_REJECTED = 'rejected'
+STATUS_PENDING = 'pending'
+
+# Códigos de GetStatusZip que indican que el lote sigue en proceso
+PENDING_STATUS_CODES = frozenset({'98'})
+
+
+class PayrollApiError(Exception):
+    """Fallo de una llamada a APIDIAN (tipo de error + detalle)."""
+
+    def __init__(self, kind, detail='', status_code=None, retry_in=None):
+        super().__init__(detail)
+        self.kind = kind
+        self.detail = detail
+        self.status_code = status_code
+        self.retry_in = retry_in
+
+    @property
+    def is_infrastructure_failure(self):
+        if self.kind == ERROR_HTTP:
+            return (self.status_code or 500) >= 500
+        return self.kind in _INFRASTRUCTURE_ERRORS
+
+
+def build_url(api_url, endpoint):
+    return f"{api_url.rstrip('/')}/{API_PREFIX}/{endpoint}"
+
+
+def _format_validation_error(response):
+    """Mensaje de un 422 de APIDIAN con el detalle por campo, si viene en JSON."""
+    try:
+        error_data = response.json()
+    except ValueError:
+        return response.text
+    error_msg = error_data.get('message', 'La API rechazó los datos.')
+    errors_dict = error_data.get('errors') or {}
+    if errors_dict:
+        error_details = "; ".join(
+            f"{campo}: {', '.join(mensajes)}" for campo, mensajes in errors_dict.items())
+        error_msg = f"{error_msg} Detalles: {error_details}"
+    return error_msg
+
+
+def _perform_request(api_url, api_token, endpoint, method, json_data, timeout, session=None):
+    full_url = build_url(api_url, endpoint)
+    headers = {
+        'Authorization': f'Bearer {api_token}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    _logger.info("API Request: %s %s", method, full_url)
+    _logger.debug("API JSON Data: %s", json_data)
+
+    try:
+        response = (session or requests).request(
+            method, full_url, headers=headers, json=json_data, timeout=timeout)
+        if not response.ok:
+            if response.status_code == 422:
+                raise PayrollApiError(ERROR_VALIDATION, _format_validation_error(response), 422)
+            if response.status_code == 429:
+                raise PayrollApiError(
+                    ERROR_RATE_LIMITED, response.text, 429,
+                    retry_in=parse_retry_after(response.headers.get('Retry-After')))
+            response.raise_for_status()
+        api_response = response.json()
+    except requests.exceptions.HTTPError as e:
+        _logger.error("Error HTTP de la API de Nómina: %s", e)
+        raise PayrollApiError(ERROR_HTTP, str(e), e.response.status_code if e.response is not None else None) from e
+    except requests.exceptions.Timeout as e:
+        _logger.error("API request timed out.")
+        raise PayrollApiError(ERROR_TIMEOUT) from e
+    except requests.exceptions.RequestException as e:
+        _logger.error("Error de conexión con la API de Nómina: %s", e)
+        raise PayrollApiError(ERROR_CONNECTION, str(e)) from e
+    except ValueError as e:
+        _logger.error("La respuesta de la API no es un JSON válido: %s", response.text)
+        raise PayrollApiError(ERROR_INVALID_JSON, response.text, response.status_code) from e
+
+    _logger.info("API Response (%s): %s", response.status_code, api_response)
+    return api_response
+
+
+def api_request(api_url, api_token, endpoint, method='POST', json_data=None,
+                timeout=DEFAULT_TIMEOUT, guard=None, session=None):
+    """
+    Ejecuta una llamada a APIDIAN y devuelve el JSON de respuesta.
+
+    Seguro para hilos: no usa el ORM. Lanza ``PayrollApiError`` ante errores
+    de validación (422), HTTP, tiempo de espera, conexión o JSON inválido.
+
+    Con ``guard`` (``payroll_api_guard.ApiGuard``) la llamada falla de
+    inmediato si el circuito está abierto, espera cupo en la cubeta de
+    fichas y, ante un 429, reduce la tasa y reintenta tras ``Retry-After``.
+    Con ``session`` se reutilizan las conexiones de su pool.
+    """
+    if guard is None:
+        return _perform_request(api_url, api_token, endpoint, method, json_data, timeout, session)
+
+    throttled = 0
+    while True:
+        try:
+            guard.before_call()
+            guard.acquire()
+        except CircuitOpenError as e:
+            raise PayrollApiError(ERROR_CIRCUIT_OPEN, str(e.failures), retry_in=e.retry_in) from e
+        except RateLimitedError as e:
+            raise PayrollApiError(ERROR_RATE_LIMITED, retry_in=e.retry_in) from e
+        try:
+            api_response = _perform_request(api_url, api_token, endpoint, method, json_data, timeout, session)
+        except PayrollApiError as e:
+            if e.kind == ERROR_RATE_LIMITED:
+                guard.record_throttled(e.retry_in)
+                throttled += 1
+                if throttled <= guard.max_retries and (e.retry_in or 0) <= guard.max_wait:
+                    continue
+            elif e.is_infrastructure_failure:
+                guard.record_failure()
+            else:
+                # 4xx distinto de 429: la API está viva
+                guard.record_success()
+            raise
+        guard.record_success()
+        return api_response
+
+
+# -------------------------------------------------------------------------
+# Clientes por compañía
+# -------------------------------------------------------------------------
+
+_CLIENT_CACHE = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+
+@dataclass(slots=True)
+class ApiClient:
+    """
+    Configuración resuelta de APIDIAN para una compañía: URL, token, pool de
+    conexiones propio (``requests.Session``), límite de llamadas simultáneas
+    y protección compartida. Es seguro usarlo desde varios hilos.
+    """
+    company_id: int
+    api_url: str
+    api_token: str
+    max_connections: int = 4
+    guard: object = None
+    session: requests.Session = field(default=None, repr=False)
+    semaphore: threading.BoundedSemaphore = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        if self.semaphore is None:
+            self.semaphore = threading.BoundedSemaphore(self.max_connections)
+
+    def request(self, endpoint, method='POST', json_data=None, timeout=DEFAULT_TIMEOUT):
+        with self.semaphore:
+            return api_request(self.api_url, self.api_token, endpoint, method=method,
+                               json_data=json_data, timeout=timeout, guard=self.guard,
+                               session=self.session)
+
+    def close(self):
+        self.session.close()
+
+
+def client_fingerprint(api_url, api_token, max_connections, *extra):
+    """Huella de la configuración; si cambia, el cliente cacheado se reconstruye."""
+    return (api_url.rstrip('/'), sha256(api_token.encode('utf-8')).hexdigest(), max_connections) + extra
+
+
+def get_cached_client(cache_key, fingerprint, factory):
+    """
+    Cliente cacheado por proceso para ``cache_key`` (``(db, company_id)``).
+    Se reconstruye cuando cambia ``fingerprint``. El cliente anterior no se
+    cierra: otros hilos pueden estar a mitad de una llamada con él; su pool
+    se libera cuando deja de usarse y lo recoge el recolector de basura.
+    """
+    with _CLIENT_CACHE_LOCK:
+        cached = _CLIENT_CACHE.get(cache_key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        client = factory()
+        _CLIENT_CACHE[cache_key] = (fingerprint, client)
+    return client
+
+
+# -------------------------------------------------------------------------
+# Lectura de respuestas
+# -------------------------------------------------------------------------
+
+def _dig(data, *path):
+    """Recorre ``path`` en dicts anidados; ``None`` si falta algún nivel."""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def extract_zip_key(api_response):
+    """ZipKey de un envío asíncrono (campo plano o dentro de ``ResponseDian``)."""
+    if not api_response:
+        return None
+    zip_key = api_response.get('zip_key') or api_response.get('ZipKey')
+    if zip_key:
+        return zip_key
+    body = _dig(api_response, 'ResponseDian', 'Envelope', 'Body') or {}
+    for response_name, result_name in (
+            ('SendTestSetAsyncResponse', 'SendTestSetAsyncResult'),
+            ('SendNominaSyncResponse', 'SendNominaSyncResult'),
+            ('SendBillAsyncResponse', 'SendBillAsyncResult')):
+        zip_key = _dig(body, response_name, result_name, 'ZipKey')
+        if zip_key:
+            return zip_key
+    return None
+
+
+def _error_list(error_message):
+    """Normaliza ``ErrorMessage`` de la DIAN (``{'string': [...]}``, lista o texto)."""
+    if not error_message:
+        return []
+    if isinstance(error_message, dict):
+        error_message = error_message.get('string') or []
+    if isinstance(error_message, str):
+        return [error_message]
+    return [str(error) for error in error_message if error]
+
+
+def normalize_status_response(api_response):
+    """
+    Convierte la respuesta de ``status/zip`` en
+    ``{'success', 'status', 'is_valid', 'cune', 'message', 'errors'}``.
+
+    ``status`` es ``accepted``, ``rejected`` o ``pending`` (lote aún en proceso).
+    """
+    if not api_response:
+        return {'success': False, 'status': STATUS_PENDING, 'is_valid': False,
+                'cune': None, 'message': 'Respuesta vacía de la API.', 'errors': []}
+    if 'is_valid' in api_response:
+        # Respuesta ya plana (versiones de APIDIAN o stubs que no anidan ResponseDian)
+        dian_response = {
+            'IsValid': api_response.get('is_valid'),
+            'StatusCode': api_response.get('status_code'),
+            'StatusDescription': api_response.get('message'),
+            'XmlDocumentKey': api_response.get('cune'),
+            'ErrorMessage': api_response.get('errors'),
+        }
+    else:
+        dian_response = _dig(
+            api_response, 'ResponseDian', 'Envelope', 'Body',
+            'GetStatusZipResponse', 'GetStatusZipResult', 'DianResponse')
+        if isinstance(dian_response, list):
+            dian_response = dian_response[0] if dian_response else None
+    if not dian_response:
+        return {'success': True, 'status': STATUS_PENDING, 'is_valid': False,
+                'cune': None, 'message': api_response.get('message') or '', 'errors': []}
+
+    is_valid = str(dian_response.get('IsValid')).lower() == 'true'
+    status_code = str(dian_response.get('StatusCode') or '')
+    if is_valid:
+        status = STATUS_ACCEPTED
+    elif not status_code or status_code in PENDING_STATUS_CODES:
+        status = STATUS_PENDING
+    else:
+        status = STATUS_REJECTED
+    return {
+        'success': True,
+        'status': status,
+        'is_valid': is_valid,
+        'cune': dian_response.get('XmlDocumentKey') or None,
+        'message': dian_response.get('StatusDescription') or dian_response.get('StatusMessage') or '',
+        'errors': _error_list(dian_response.get('ErrorMessage')),
+    }
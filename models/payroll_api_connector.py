@@ -1,9 +1,21 @@
 # l10n_co_nomina/models/payroll_api_connector.py
-import requests
 import base64
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.tools import config
+
+from .payroll_api_client import (
+    ERROR_CIRCUIT_OPEN, ERROR_CONNECTION, ERROR_HTTP, ERROR_RATE_LIMITED, ERROR_TIMEOUT,
+    ERROR_VALIDATION, ApiClient, PayrollApiError, client_fingerprint, extract_zip_key,
+    get_cached_client, normalize_status_response,
+)
+from .payroll_api_guard import ApiGuard
+from .payroll_json_schema import PAYROLL, PAYROLL_ADJUST, validate_payload
 
 _logger = logging.getLogger(__name__)
 
@@ -13,8 +25,8 @@ class L10nCoPayrollApiConnector(models.AbstractModel):
     _description = 'Conector para API de Nómina Electrónica Factura Fácil'
 
     @api.model
-    def _get_api_config(self):
-        company = self.env.company
+    def _get_api_config(self, company=None):
+        company = company or self.env.company
         api_url = company.l10n_co_payroll_api_url
         api_token = company.l10n_co_payroll_api_token
         if not api_url or not api_token:
@@ -23,84 +35,127 @@ class L10nCoPayrollApiConnector(models.AbstractModel):
         return api_url, api_token
 
     @api.model
-    def _send_api_request(self, endpoint, method='POST', json_data=None):
-        api_url, api_token = self._get_api_config()
-        full_url = f"{api_url.rstrip('/')}/api/ubl2.1/{endpoint}"
-
-        headers = {
-            'Authorization': f'Bearer {api_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
+    def _get_api_guard(self, api_url):
+        """
+        Interruptor de circuito y limitador de tasa de ``api_url``, compartidos
+        por todos los workers del host (estado en ``data_dir``). Se ajustan con
+        los parámetros de sistema ``l10n_co_nomina.apidian_*``.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return ApiGuard(
+            api_url.rstrip('/'),
+            os.path.join(config['data_dir'], 'l10n_co_nomina'),
+            failure_threshold=int(get_param('l10n_co_nomina.apidian_failure_threshold', 5)),
+            reset_timeout=float(get_param('l10n_co_nomina.apidian_reset_timeout', 60)),
+            rate=float(get_param('l10n_co_nomina.apidian_rate_limit', 10)),
+            burst=int(get_param('l10n_co_nomina.apidian_rate_burst', 10)),
+            max_wait=float(get_param('l10n_co_nomina.apidian_max_wait', 30)),
+        )
 
-        _logger.info("API Request: %s %s", method, full_url)
-        _logger.debug("API JSON Data: %s", json_data)
+    @api.model
+    def _get_api_client(self, company=None):
+        """
+        Cliente APIDIAN de ``company`` (por defecto la compañía activa):
+        URL y token de esa compañía, su propio pool de conexiones y su límite
+        de llamadas simultáneas (``l10n_co_payroll_api_max_connections``).
+        Se cachea por proceso y se reconstruye si cambia la configuración.
+        """
+        company = (company or self.env.company).sudo()
+        api_url, api_token = self._get_api_config(company)
+        max_connections = max(1, company.l10n_co_payroll_api_max_connections or 4)
+        guard = self._get_api_guard(api_url)
+        guard_settings = (guard.failure_threshold, guard.reset_timeout, guard.base_rate,
+                          guard.burst, guard.max_wait)
+        return get_cached_client(
+            (self.env.cr.dbname, company.id),
+            client_fingerprint(api_url, api_token, max_connections, *guard_settings),
+            lambda: ApiClient(company.id, api_url, api_token,
+                              max_connections=max_connections, guard=guard))
 
+    @api.model
+    def _send_api_request(self, endpoint, method='POST', json_data=None, company=None):
+        client = self._get_api_client(company)
         try:
-            response = requests.request(
-                method, full_url, headers=headers, json=json_data, timeout=90)
-            if not response.ok: # Si el código no es 2xx
-                if response.status_code == 422:
-                    try:
-                        error_data = response.json()
-                        error_msg = error_data.get('message', 'La API rechazó los datos.')
-                        errors_dict = error_data.get('errors', {})
-                        if errors_dict:
-                            # Formatear los errores detallados
-                            error_details = "; ".join(
-                                [f"{campo}: {', '.join(mensajes)}" for campo, mensajes in errors_dict.items()]
-                            )
-                            error_msg = f"{error_msg} Detalles: {error_details}"
-                        raise UserError(_("Error de Validación de la API (422): %s") % error_msg)
-                    except ValueError: # Si la respuesta de error no es un JSON
-                        raise UserError(_("Error de Validación de la API (422): %s") % response.text)
-                else:
-                    # Para otros errores HTTP (401, 404, 500, etc.)
-                    response.raise_for_status()
-
-            api_response = response.json()
-            _logger.info("API Response (%s): %s", response.status_code, api_response)
-            
-            return api_response
-            
-        except requests.exceptions.HTTPError as e:
-            _logger.error("Error HTTP de la API de Nómina: %s", e)
-            raise UserError(_("La API devolvió un error: %s") % e)
-        except requests.exceptions.Timeout:
-            _logger.error("API request timed out.")
-            raise UserError(_("La API de Nómina no respondió a tiempo."))
-        except requests.exceptions.RequestException as e:
-            _logger.error("Error de conexión con la API de Nómina: %s", e)
-            raise UserError(_("No se pudo conectar con la API de Nómina: %s") % e)
-        except ValueError:
-            _logger.error("La respuesta de la API no es un JSON válido: %s", response.text)
-            raise UserError(_("La API de Nómina devolvió una respuesta inválida."))
-
-    @api.model
-    def config_software_payroll(self, software_id, software_pin):
-        """ Endpoint: PUT /api/ubl2.1/config/softwarepayroll """
-        data = {
+            return client.request(endpoint, method=method, json_data=json_data)
+        except PayrollApiError as e:
+            raise UserError(self._format_api_error(e))
+
+    @api.model
+    def _check_payroll_payload(self, record, payroll_json_data, kind=PAYROLL):
+        """Preflight local de un payload antes de enviarlo; reporta todos sus errores."""
+        errors = validate_payload(payroll_json_data, kind)
+        if errors:
+            raise UserError(_("El JSON de %s no cumple el esquema de APIDIAN:\n%s") % (
+                record.display_name, "\n".join("  - %s" % error for error in errors)))
+
+    @api.model
+    def _format_api_error(self, error):
+        """Mensaje de usuario para un ``PayrollApiError`` del cliente HTTP."""
+        if error.kind == ERROR_VALIDATION:
+            return _("Error de Validación de la API (422): %s") % error.detail
+        if error.kind == ERROR_HTTP:
+            return _("La API devolvió un error: %s") % error.detail
+        if error.kind == ERROR_TIMEOUT:
+            return _("La API de Nómina no respondió a tiempo.")
+        if error.kind == ERROR_CONNECTION:
+            return _("No se pudo conectar con la API de Nómina: %s") % error.detail
+        if error.kind == ERROR_CIRCUIT_OPEN:
+            return _("La API de Nómina está fuera de servicio (%s fallos consecutivos). "
+                     "No se enviarán peticiones durante %s segundos.") % (
+                error.detail, int(error.retry_in or 0))
+        if error.kind == ERROR_RATE_LIMITED:
+            return _("La API de Nómina está limitando las peticiones. Reintente en %s segundos.") % (
+                int(error.retry_in or 0) or 1)
+        return _("La API de Nómina devolvió una respuesta inválida.")
+
+    # -------------------------------------------------------------------------
+    # Configuración (software, certificado, resoluciones)
+    # -------------------------------------------------------------------------
+
+    @api.model
+    def _prepare_config_software(self, software_id, software_pin):
+        return "config/softwarepayroll", {
             "idpayroll": software_id,
             "pinpayroll": int(software_pin)  # El API espera un entero
         }
-        return self._send_api_request("config/softwarepayroll", method='PUT', json_data=data)
 
     @api.model
-    def config_certificate(self):
+    def _prepare_config_certificate(self, company):
+        # Verifica localmente certificado y contraseña; el material cacheado por
+        # worker ya trae el .p12 en base64, sin leer ni decodificar el binario
+        key_material = company._get_payroll_key_material()
+        return "config/certificate", {
+            "certificate": key_material.pkcs12_b64,
+            "password": company.l10n_co_payroll_certificate_password
+        }
+
+    @api.model
+    def _prepare_config_resolution(self, resolution):
+        # La Nómina Individual (9) y la Nota de Ajuste (10) usan el mismo cuerpo;
+        # los ejemplos de nómina de la API no incluyen número ni fecha de resolución.
+        return "config/resolution", {
+            "type_document_id": int(resolution.type_document_id),
+            "prefix": resolution.prefix,
+            "from": resolution.from_number,
+            "to": resolution.to_number,
+        }
+
+    @api.model
+    def config_software_payroll(self, software_id, software_pin, company=None):
+        """ Endpoint: PUT /api/ubl2.1/config/softwarepayroll """
+        endpoint, data = self._prepare_config_software(software_id, software_pin)
+        return self._send_api_request(endpoint, method='PUT', json_data=data, company=company)
+
+    @api.model
+    def config_certificate(self, company=None):
         """ Endpoint: PUT /api/ubl2.1/config/certificate """
-        company = self.env.company
+        company = company or self.env.company
         if not company.l10n_co_payroll_certificate_file or not company.l10n_co_payroll_certificate_password:
             _logger.warning(
                 "No se encontró certificado o contraseña para enviar a la API.")
             return
-
-        certificate_b64 = company.l10n_co_payroll_certificate_file.decode(
-            'utf-8')
-        data = {
-            "certificate": certificate_b64,
-            "password": company.l10n_co_payroll_certificate_password
-        }
-        return self._send_api_request("config/certificate", method='PUT', json_data=data)
+        endpoint, data = self._prepare_config_certificate(company)
+        return self._send_api_request(endpoint, method='PUT', json_data=data, company=company)
 
     @api.model
     def config_resolution_payroll(self, resolution_records):
@@ -110,41 +165,196 @@ class L10nCoPayrollApiConnector(models.AbstractModel):
         Itera sobre los registros del modelo l10n_co_nomina.resolution.
         """
         for res in resolution_records:
-            data = {
-                "type_document_id": int(res.type_document_id),
-                "prefix": res.prefix,
-                "from": res.from_number,
-                "to": res.to_number,
-            }
-            # La Nómina Individual (9) puede tener más datos, la Nota de Ajuste (10) no.
-            if res.type_document_id == '9':
-                # El JSON de ejemplo de la API no muestra estos, pero los añadimos por si acaso
-                # data.update({
-                #     "resolution": res.resolution_number,
-                #     "resolution_date": res.resolution_date.strftime('%Y-%m-%d') if res.resolution_date else None,
-                # })
-                pass  # Por ahora no se añaden campos extra que no están en los ejemplos de nómina de la API
-
-            self._send_api_request("config/resolution",
-                                   method='PUT', json_data=data)
+            endpoint, data = self._prepare_config_resolution(res)
+            self._send_api_request(endpoint, method='PUT', json_data=data, company=res.company_id)
 
         return True
 
     @api.model
-    def send_payroll_document(self, payslip_record, test_set_id=None):
+    def _prepare_config_items(self, company):
+        """
+        Elementos de configuración de la compañía como
+        ``[(clave, etiqueta, endpoint, datos)]``, uno por PUT independiente.
+        """
+        items = []
+        if company.l10n_co_payroll_software_id and company.l10n_co_payroll_software_pin:
+            items.append(('software', _("Software de nómina"), *self._prepare_config_software(
+                company.l10n_co_payroll_software_id, company.l10n_co_payroll_software_pin)))
+        if company.l10n_co_payroll_certificate_file and company.l10n_co_payroll_certificate_password:
+            items.append(('certificate', _("Certificado digital"),
+                          *self._prepare_config_certificate(company)))
+        for resolution in company.l10n_co_payroll_resolution_ids:
+            items.append((
+                'resolution:%s' % resolution.id,
+                _("Resolución %s %s-%s") % (resolution.prefix, resolution.from_number, resolution.to_number),
+                *self._prepare_config_resolution(resolution)))
+        return items
+
+    @staticmethod
+    def _config_item_digest(api_url, api_token, endpoint, data):
+        """Huella del último estado enviado (incluye destino y token)."""
+        return sha256(json.dumps({
+            'url': api_url.rstrip('/'),
+            'token': sha256(api_token.encode('utf-8')).hexdigest(),
+            'endpoint': endpoint,
+            'data': data,
+        }, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @api.model
+    def sync_company_config(self, companies, force=False):
+        """
+        Sincroniza la configuración de ``companies`` con APIDIAN enviando solo
+        los elementos cuyo hash difiere del último envío exitoso. Los PUT
+        son independientes y se ejecutan en paralelo (sin ORM en los hilos).
+
+        Devuelve una lista de dicts ``{'company', 'key', 'label', 'status', 'message'}``
+        con ``status`` en ``sent`` / ``unchanged`` / ``error``.
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        max_workers = int(get_param('l10n_co_nomina.apidian_sync_workers', 8))
+
+        results = []
+        jobs = []
+        hashes_by_company = {}
+        for company in companies:
+            client = self._get_api_client(company)
+            stored = company._get_payroll_api_sync_hashes()
+            current = {}
+            for key, label, endpoint, data in self._prepare_config_items(company):
+                digest = self._config_item_digest(client.api_url, client.api_token, endpoint, data)
+                result = {'company': company, 'key': key, 'label': label,
+                          'status': 'unchanged', 'message': ''}
+                results.append(result)
+                if not force and stored.get(key) == digest:
+                    current[key] = digest
+                    continue
+                jobs.append((result, digest, (client, endpoint, data)))
+            hashes_by_company[company] = current
+
+        def _put(job):
+            client, endpoint, data = job[2]
+            try:
+                return client.request(endpoint, method='PUT', json_data=data), None
+            except PayrollApiError as e:
+                return None, e
+
+        if jobs:
+            _logger.info("Sincronizando %s elemento(s) de configuración con APIDIAN (%s sin cambios).",
+                         len(jobs), len(results) - len(jobs))
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+                outcomes = list(executor.map(_put, jobs))
+            for (result, digest, __), (response, error) in zip(jobs, outcomes):
+                if error is not None:
+                    result.update(status='error', message=self._format_api_error(error))
+                    continue
+                result.update(status='sent', message=(response or {}).get('message') or '')
+                hashes_by_company[result['company']][result['key']] = digest
+
+        # Se guardan solo los hashes de lo enviado con éxito o sin cambios;
+        # los elementos eliminados desaparecen del estado.
+        for company, current in hashes_by_company.items():
+            company._set_payroll_api_sync_hashes(current)
+        return results
+
+    @api.model
+    def send_payroll_document(self, payslip_record, test_set_id=None, payroll_json_data=None):
         """ Endpoint: POST /api/ubl2.1/payroll """
-        payroll_json_data = payslip_record._prepare_payroll_json_data()
+        if payroll_json_data is None:
+            payroll_json_data = payslip_record._prepare_payroll_json_data()
+        self._check_payroll_payload(payslip_record, payroll_json_data, PAYROLL)
         endpoint = "payroll"
         if test_set_id:
             endpoint = f"payroll/{test_set_id}"
 
+        # URL y token de la compañía del documento, no de la compañía activa
         api_response = self._send_api_request(
-            endpoint, method='POST', json_data=payroll_json_data)
+            endpoint, method='POST', json_data=payroll_json_data,
+            company=payslip_record.company_id)
 
         if api_response:
             # La API devuelve 'cune' o 'zip_key' dependiendo del modo
-            cune = api_response.get('cune') or api_response.get('zip_key')
+            cune = api_response.get('cune') or extract_zip_key(api_response)
             return cune, api_response
         return None, api_response
 
-    # ... (resto de métodos como get_payroll_status, send_payroll_adjust_note_document, etc.) ...
+    @api.model
+    def send_payroll_documents(self, payslip_records, test_set_id=None, payloads=None):
+        """
+        Envía un lote de nóminas, posiblemente de varias compañías. Los
+        payloads se construyen con ``_prepare_payroll_json_batch`` (lecturas
+        agrupadas) y se validan localmente contra el esquema, salvo que se
+        pasen ya validados en ``payloads``; luego los envíos corren en
+        paralelo, cada uno con el cliente (URL, token, pool y límite de
+        concurrencia) de la compañía de su nómina.
+
+        Devuelve una lista de ``(payslip, cune, respuesta)`` en el orden del
+        lote; si un envío falla, ``cune`` es ``None`` y la respuesta es
+        ``{'success': False, 'message': ...}``.
+        """
+        if payloads is None:
+            payloads = payslip_records._prepare_payroll_json_batch()
+            # Preflight local: ningún documento sale si alguno incumple el esquema
+            payslip_records._raise_payroll_preflight_errors(
+                payslip_records._preflight_payroll_json_batch(payloads))
+
+        endpoint = f"payroll/{test_set_id}" if test_set_id else "payroll"
+        clients = {company: self._get_api_client(company)
+                   for company in payslip_records.mapped('company_id')}
+        jobs = [(clients[payslip.company_id], payroll_json_data)
+                for payslip, payroll_json_data in zip(payslip_records, payloads)]
+
+        def _send(job):
+            client, payroll_json_data = job
+            try:
+                return client.request(endpoint, method='POST', json_data=payroll_json_data), None
+            except PayrollApiError as e:
+                return None, e
+
+        # Cada cliente limita sus propias llamadas; el pool cubre la suma
+        max_workers = sum(client.max_connections for client in clients.values()) or 1
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs) or 1)) as executor:
+            outcomes = list(executor.map(_send, jobs))
+
+        results = []
+        for payslip, (api_response, error) in zip(payslip_records, outcomes):
+            if error is not None:
+                message = self._format_api_error(error)
+                _logger.error("Fallo el envío de la nómina %s: %s", payslip.number or payslip.name, message)
+                results.append((payslip, None, {'success': False, 'message': message}))
+                continue
+            cune = (api_response or {}).get('cune') or extract_zip_key(api_response)
+            results.append((payslip, cune, api_response))
+        return results
+
+    @api.model
+    def send_payroll_adjust_note_document(self, payslip_record, predecessor_cune, type_note,
+                                          test_set_id=None, payroll_json_data=None):
+        """ Endpoint: POST /api/ubl2.1/payroll-adjust-note """
+        if payroll_json_data is None:
+            payroll_json_data = payslip_record._prepare_payroll_adjust_json_data(
+                predecessor_cune, type_note)
+        self._check_payroll_payload(payslip_record, payroll_json_data, PAYROLL_ADJUST)
+        endpoint = "payroll-adjust-note"
+        if test_set_id:
+            endpoint = f"payroll-adjust-note/{test_set_id}"
+
+        api_response = self._send_api_request(
+            endpoint, method='POST', json_data=payroll_json_data,
+            company=payslip_record.company_id)
+        if api_response:
+            cune = api_response.get('cune') or extract_zip_key(api_response)
+            return cune, api_response
+        return None, api_response
+
+    @api.model
+    def get_payroll_status(self, zip_key, company=None):
+        """
+        Endpoint: POST /api/ubl2.1/status/zip/{zip_key}
+
+        Devuelve la respuesta normalizada
+        ``{'success', 'status', 'is_valid', 'cune', 'message', 'errors'}``.
+        ``company`` debe ser la compañía que envió el documento.
+        """
+        api_response = self._send_api_request(
+            f"status/zip/{zip_key}", method='POST', json_data={}, company=company)
+        return normalize_status_response(api_response)
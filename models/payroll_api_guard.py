@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Protección de las llamadas a APIDIAN: interruptor de circuito y limitador
+de tasa adaptativo, compartidos por todos los workers de un mismo host.
+
+El estado vive en un pequeño archivo JSON por API (bajo el ``data_dir`` de
+Odoo) protegido con ``flock``; así un APIDIAN caído se detecta una sola vez
+para todos los procesos y los hilos, y las llamadas siguientes fallan de
+inmediato en lugar de esperar el timeout completo. No usa el ORM, por lo
+que es seguro desde hilos de trabajo.
+
+- Circuito: ``closed`` → ``open`` tras ``failure_threshold`` fallos de
+  infraestructura consecutivos (timeout, conexión, 5xx); tras
+  ``reset_timeout`` segundos pasa a ``half_open`` y deja pasar una sola
+  petición de prueba, que lo cierra o lo vuelve a abrir.
+- Cubeta de fichas: ``rate`` peticiones/s con ráfaga ``burst``. Un 429
+  reduce la tasa a la mitad y respeta ``Retry-After``; cada éxito la
+  recupera de forma aditiva hasta ``max_rate``.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - plataformas sin flock
+    fcntl = None
+
+_logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_THREAD_LOCKS = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: no se intenta la llamada."""
+
+    def __init__(self, retry_in, failures):
+        super().__init__(retry_in)
+        self.retry_in = retry_in
+        self.failures = failures
+
+
+class RateLimitedError(Exception):
+    """La espera por cupo supera el máximo permitido."""
+
+    def __init__(self, retry_in):
+        super().__init__(retry_in)
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value, now=None):
+    """Segundos indicados por ``Retry-After`` (entero o fecha HTTP); ``None`` si no hay."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (now or time.time()))
+
+
+class _SharedState:
+    """Archivo JSON con bloqueo exclusivo entre procesos (flock) e hilos."""
+
+    def __init__(self, path):
+        self.path = path
+        with _THREAD_LOCKS_GUARD:
+            self._thread_lock = _THREAD_LOCKS.setdefault(path, threading.Lock())
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._thread_lock:
+            with open(self.path, 'a+', encoding='utf-8') as state_file:
+                if fcntl is not None:
+                    fcntl.flock(state_file, fcntl.LOCK_EX)
+                try:
+                    state_file.seek(0)
+                    raw = state_file.read()
+                    try:
+                        data = json.loads(raw) if raw else {}
+                    except ValueError:
+                        _logger.warning("Estado de protección de APIDIAN corrupto en %s; se reinicia.", self.path)
+                        data = {}
+                    before = dict(data)
+                    yield data
+                    if data != before:
+                        state_file.seek(0)
+                        state_file.truncate()
+                        state_file.write(json.dumps(data))
+                        state_file.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(state_file, fcntl.LOCK_UN)
+
+
+class ApiGuard:
+    """Interruptor de circuito + cubeta de fichas adaptativa de una API."""
+
+    def __init__(self, name, state_dir, failure_threshold=5, reset_timeout=60.0,
+                 rate=10.0, burst=10, min_rate=0.5, max_rate=None, recovery_step=0.5,
+                 max_wait=30.0, max_retries=3):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        self.name = name
+        self.state = _SharedState(os.path.join(state_dir, 'apidian_guard_%s.json' % digest))
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.base_rate = rate
+        self.burst = max(int(burst), 1)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.recovery_step = recovery_step
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+
+    # ------------------------------------------------------------------
+    # Circuito
+    # ------------------------------------------------------------------
+
+    def before_call(self):
+        """Lanza ``CircuitOpenError`` si no se debe intentar la llamada."""
+        now = time.time()
+        with self.state.locked() as data:
+            state = data.get('state', CLOSED)
+            if state == CLOSED:
+                return
+            opened_at = data.get('opened_at', 0.0)
+            if state == OPEN and now - opened_at >= self.reset_timeout:
+                # Se concede la única petición de prueba
+                data['state'] = HALF_OPEN
+                data['probe_at'] = now
+                _logger.info("Circuito APIDIAN %s en semiapertura: enviando petición de prueba.", self.name)
+                return
+            if state == HALF_OPEN and now - data.get('probe_at', 0.0) >= self.reset_timeout:
+                # La prueba anterior nunca respondió: se concede otra
+                data['probe_at'] = now
+                return
+            retry_in = max(0.0, self.reset_timeout - (now - opened_at)) if state == OPEN else self.reset_timeout
+            raise CircuitOpenError(retry_in, data.get('failures', 0))
+
+    def record_success(self):
+        with self.state.locked() as data:
+            if data.get('state', CLOSED) != CLOSED:
+                _logger.info("Circuito APIDIAN %s cerrado de nuevo.", self.name)
+            data.update(state=CLOSED, failures=0)
+            data.pop('opened_at', None)
+            data.pop('probe_at', None)
+            rate = data.get('rate', self.base_rate)
+            if rate < self.max_rate:
+                data['rate'] = min(self.max_rate, rate + self.recovery_step)
+
+    def record_failure(self):
+        now = time.time()
+        with self.state.locked() as data:
+            failures = data.get('failures', 0) + 1
+            data['failures'] = failures
+            if data.get('state') == HALF_OPEN or failures >= self.failure_threshold:
+                if data.get('state') != OPEN:
+                    _logger.warning("Circuito APIDIAN %s abierto tras %s fallo(s) consecutivo(s).",
+                                    self.name, failures)
+                data.update(state=OPEN, opened_at=now)
+                data.pop('probe_at', None)
+
+    def status(self):
+        """Estado actual (para diagnóstico)."""
+        with self.state.locked() as data:
+            return {
+                'state': data.get('state', CLOSED),
+                'failures': data.get('failures', 0),
+                'opened_at': data.get('opened_at'),
+                'rate': data.get('rate', self.base_rate),
+                'blocked_until': data.get('blocked_until'),
+            }
+
+    # ------------------------------------------------------------------
+    # Limitador de tasa
+    # ------------------------------------------------------------------
+
+    def _reserve(self, now):
+        """Toma una ficha; devuelve la espera necesaria (0 si la tomó)."""
+        with self.state.locked() as data:
+            blocked_until = data.get('blocked_until', 0.0)
+            if blocked_until > now:
+                return blocked_until - now
+            rate = data.get('rate', self.base_rate)
+            updated = data.get('updated', now)
+            tokens = min(float(self.burst), data.get('tokens', float(self.burst)) + (now - updated) * rate)
+            data['updated'] = now
+            if tokens >= 1:
+                data['tokens'] = tokens - 1
+                return 0.0
+            data['tokens'] = tokens
+            return (1 - tokens) / rate
+
+    def acquire(self):
+        """Espera una ficha; lanza ``RateLimitedError`` si la espera excede ``max_wait``."""
+        waited = 0.0
+        while True:
+            wait = self._reserve(time.time())
+            if not wait:
+                return waited
+            if waited + wait > self.max_wait:
+                raise RateLimitedError(wait)
+            time.sleep(wait)
+            waited += wait
+
+    def record_throttled(self, retry_after=None):
+        """
+        Un 429: reduce la tasa a la mitad y bloquea hasta ``Retry-After``.
+        La API respondió, así que el circuito queda cerrado.
+        """
+        now = time.time()
+        with self.state.locked() as data:
+            data.update(state=CLOSED, failures=0)
+            data.pop('opened_at', None)
+            data.pop('probe_at', None)
+            rate = data.get('rate', self.base_rate)
+            data['rate'] = max(self.min_rate, rate / 2.0)
+            data['tokens'] = 0.0
+            data['updated'] = now
+            if retry_after:
+                data['blocked_until'] = max(data.get('blocked_until', 0.0), now + retry_after)
+            _logger.info("APIDIAN %s respondió 429; tasa reducida a %.2f req/s (Retry-After: %s).",
+                         self.name, data['rate'], retry_after)
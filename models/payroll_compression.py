@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Compresión de artefactos EDI (XML, PDF, payloads).
+
+Usa zstd si la librería ``zstandard`` está instalada y gzip en caso
+contrario; el códec queda registrado junto a cada blob, así que los datos
+escritos con uno se siguen leyendo aunque cambie la instalación (siempre
+que el códec esté disponible para leer).
+"""
+
+import gzip
+import hashlib
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_ZSTD = 'zstd'
+CODEC_GZIP = 'gzip'
+CODEC_NONE = 'none'
+
+# Por debajo de este tamaño la compresión no compensa la cabecera
+MIN_COMPRESS_SIZE = 256
+
+
+def content_checksum(content):
+    """Dirección del contenido: SHA-256 de los bytes sin comprimir."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def default_codec():
+    return CODEC_ZSTD if zstandard is not None else CODEC_GZIP
+
+
+def compress(content, codec=None):
+    """Devuelve ``(codec, bytes_comprimidos)``; guarda en claro si no hay ganancia."""
+    codec = codec or default_codec()
+    if len(content) < MIN_COMPRESS_SIZE:
+        return CODEC_NONE, content
+    if codec == CODEC_ZSTD:
+        packed = zstandard.ZstdCompressor(level=10).compress(content)
+    elif codec == CODEC_GZIP:
+        packed = gzip.compress(content, compresslevel=9, mtime=0)
+    else:
+        return CODEC_NONE, content
+    if len(packed) >= len(content):
+        return CODEC_NONE, content
+    return codec, packed
+
+
+def open_stream(codec, packed):
+    """Flujo de lectura que descomprime a demanda (sin materializar todo el blob)."""
+    raw = io.BytesIO(packed)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("El artefacto está comprimido con zstd y la librería 'zstandard' no está instalada.")
+        return zstandard.ZstdDecompressor().stream_reader(raw)
+    if codec == CODEC_GZIP:
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+def decompress(codec, packed):
+    with open_stream(codec, packed) as stream:
+        return stream.read()
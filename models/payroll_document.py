@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Documento intermedio de nómina electrónica.
+
+Agrega en una sola pasada las líneas calculadas (``line_ids``) y los detalles
+manuales (``earn_ids`` / ``deduction_ids``) de una o varias nóminas por
+``earn_category`` / ``deduction_category``. Los constructores del JSON de
+APIDIAN, del XML DIAN y del consolidado mensual leen de esta estructura en
+lugar de repetir cada uno su propia agregación.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+
+ZERO = Decimal('0')
+
+# Tipos de bucket, compatibles con las claves usadas en _prepare_xml_data
+EARN_CALC = 'earn_calc'
+EARN_DETAIL = 'earn_detail'
+DED_CALC = 'ded_calc'
+DED_DETAIL = 'ded_detail'
+
+
+def to_decimal(value):
+    """Convierte un float/int de Odoo a Decimal sin arrastrar error binario."""
+    if not value:
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def money(value):
+    """
+    Monto como texto en notación fija para APIDIAN. ``str(Decimal)`` puede
+    dar exponentes (``'1E-7'``) que no cumplen el patrón ``money`` del esquema.
+    """
+    return format(to_decimal(value), 'f')
+
+
+@dataclass(slots=True)
+class PayrollLineDetail:
+    """Detalle manual (línea de devengo o deducción)."""
+    payment: Decimal
+    quantity: Decimal = ZERO
+    start: date = None
+    end: date = None
+    time_start: float = None
+    time_end: float = None
+    description: str = ''
+
+    def as_dict(self):
+        return {
+            'payment': float(self.payment),
+            'quantity': float(self.quantity),
+            'start': self.start,
+            'end': self.end,
+            'time_start': self.time_start,
+            'time_end': self.time_end,
+            'description': self.description,
+        }
+
+
+@dataclass(slots=True)
+class PayrollBucket:
+    """Acumulado de una categoría (total, cantidad, porcentajes y detalles)."""
+    total: Decimal = ZERO
+    quantity: Decimal = ZERO
+    # Suma de ``line.quantity`` sin ``edi_quantity`` (la que usa el JSON de APIDIAN)
+    line_quantity: Decimal = ZERO
+    rates: list = field(default_factory=list)
+    details: list = field(default_factory=list)
+
+    @property
+    def last_rate(self):
+        return self.rates[-1] if self.rates else 0.0
+
+    def as_dict(self):
+        return {
+            'total': float(self.total),
+            'quantity': float(self.quantity),
+            'rates': list(self.rates),
+            'details': [detail.as_dict() for detail in self.details],
+        }
+
+
+_EMPTY_BUCKET = PayrollBucket()
+
+
+@dataclass(slots=True)
+class PayrollDocument:
+    """Agregado por categoría de un documento de nómina (individual o consolidado)."""
+    buckets: dict = field(default_factory=dict)
+    accrued_total: Decimal = ZERO
+    deductions_total: Decimal = ZERO
+    # Totales de detalles manuales, separados de los calculados por reglas
+    accrued_detail_total: Decimal = ZERO
+    deductions_detail_total: Decimal = ZERO
+    basic_days: Decimal = ZERO
+    basic_salary: Decimal = ZERO
+
+    def _bucket(self, kind, category):
+        key = (kind, category)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = PayrollBucket()
+        return bucket
+
+    def add(self, kind, category, total, quantity=ZERO, rate=None):
+        """Suma un total ya agregado (p. ej. desde SQL) al bucket de la categoría."""
+        bucket = self._bucket(kind, category)
+        bucket.total += to_decimal(total)
+        bucket.quantity += to_decimal(quantity)
+        bucket.line_quantity += to_decimal(quantity)
+        if rate is not None and rate != 100.0:
+            bucket.rates.append(float(rate))
+        return bucket
+
+    def get(self, kind, category):
+        """Devuelve el bucket o uno vacío (sin crearlo)."""
+        return self.buckets.get((kind, category), _EMPTY_BUCKET)
+
+    def earn(self, category):
+        """Total devengado de la categoría (calculado + detalle)."""
+        return self.get(EARN_CALC, category).total + self.get(EARN_DETAIL, category).total
+
+    def deduction(self, category):
+        """Total deducido de la categoría (calculado + detalle)."""
+        return self.get(DED_CALC, category).total + self.get(DED_DETAIL, category).total
+
+    def earn_quantity(self, category):
+        return self.get(EARN_CALC, category).quantity + self.get(EARN_DETAIL, category).quantity
+
+    def as_aggregated_values(self):
+        """
+        Vista compatible con el formato histórico ``aggregated_values``:
+        ``{(tipo, categoría): {'total', 'quantity', 'rates', 'details'}}`` con floats.
+        """
+        aggregated = defaultdict(
+            lambda: {'total': 0.0, 'quantity': 0.0, 'rates': [], 'details': []})
+        for key, bucket in self.buckets.items():
+            aggregated[key] = bucket.as_dict()
+        return aggregated
+
+
+def _line_rate(line):
+    """
+    Porcentaje EDI de la línea: ``edi_rate`` si difiere de 100 (un 0 también
+    cuenta, como en el consolidado original), si no ``rate``.
+    """
+    edi_rate = getattr(line, 'edi_rate', None)
+    if edi_rate is not None and edi_rate is not False and edi_rate != 100.0:
+        return edi_rate
+    return line.rate
+
+
+def build_payroll_document(payslips, skip_detailed_rules=False):
+    """
+    Construye el ``PayrollDocument`` de ``payslips`` en una sola pasada.
+
+    :param payslips: recordset de ``hr.payslip`` (una o varias nóminas).
+    :param skip_detailed_rules: si es verdadero, las reglas marcadas como
+        ``edi_is_detailed`` suman al total pero no a su categoría (su detalle
+        llega por ``earn_ids`` / ``deduction_ids``).
+
+    Como el consolidado original, ``accrued_total`` / ``deductions_total``
+    suman todas las líneas de devengo/deducción, tengan o no categoría; las
+    líneas sin categoría solo quedan fuera de los buckets. ``quantity`` usa
+    ``edi_quantity`` cuando no es cero y ``line_quantity`` guarda la cantidad
+    de la línea tal cual.
+    """
+    doc = PayrollDocument()
+
+    # Precarga en bloque de líneas, reglas y detalles de todas las nóminas
+    lines = payslips.mapped('line_ids')
+    lines.mapped('salary_rule_id')
+    earn_lines = payslips.mapped('earn_ids')
+    deduction_lines = payslips.mapped('deduction_ids')
+
+    for line in lines:
+        rule = line.salary_rule_id
+        if not rule:
+            continue
+        concept_type = rule.type_concept
+        if concept_type == 'earn':
+            category = rule.earn_category
+            kind = EARN_CALC
+            amount = to_decimal(line.total)
+        elif concept_type == 'deduction':
+            category = rule.deduction_category
+            kind = DED_CALC
+            amount = abs(to_decimal(line.total))
+        else:
+            continue
+
+        # Los totales incluyen las líneas sin categoría; estas no llevan bucket
+        if kind == EARN_CALC:
+            doc.accrued_total += amount
+            if category == 'basic':
+                doc.basic_days += to_decimal(line.quantity)
+                doc.basic_salary += amount
+        else:
+            doc.deductions_total += amount
+        if not category:
+            continue
+
+        quantity = to_decimal(getattr(line, 'edi_quantity', 0) or line.quantity)
+        if skip_detailed_rules and getattr(rule, 'edi_is_detailed', False):
+            continue
+        bucket = doc._bucket(kind, category)
+        bucket.total += amount
+        bucket.quantity += quantity
+        bucket.line_quantity += to_decimal(line.quantity)
+        rate = _line_rate(line)
+        if rate != 100.0:
+            bucket.rates.append(rate)
+
+    for earn_line in earn_lines:
+        category = earn_line.category
+        if not category:
+            continue
+        amount = abs(to_decimal(earn_line.total))
+        quantity = abs(to_decimal(earn_line.quantity))
+        bucket = doc._bucket(EARN_DETAIL, category)
+        bucket.total += amount
+        bucket.quantity += quantity
+        bucket.line_quantity += quantity
+        bucket.details.append(PayrollLineDetail(
+            payment=amount, quantity=quantity,
+            start=earn_line.date_start, end=earn_line.date_end,
+            time_start=earn_line.time_start, time_end=earn_line.time_end,
+            description=earn_line.name or '',
+        ))
+        if category != 'basic':
+            doc.accrued_detail_total += amount
+
+    for ded_line in deduction_lines:
+        category = ded_line.category
+        if not category:
+            continue
+        amount = abs(to_decimal(ded_line.amount))
+        bucket = doc._bucket(DED_DETAIL, category)
+        bucket.total += amount
+        bucket.quantity += 1
+        bucket.line_quantity += 1
+        bucket.details.append(PayrollLineDetail(
+            payment=amount, quantity=Decimal(1), description=ded_line.name or ''))
+        doc.deductions_detail_total += amount
+
+    return doc
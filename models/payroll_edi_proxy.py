@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Proxy liviano de documento para el framework ``l10n_co_dian``.
+
+Antes, cada envío creaba un ``account.move`` temporal con
+``is_payroll_document_proxy=True``, lo publicaba y lo borraba al final
+(validaciones de diario, secuencia y un unlink por documento). Este objeto en
+memoria expone solo lo que leen los hooks de ``l10n_co_dian_patch.py``
+(``company_id``, ``is_payroll_document_proxy``, ``journal_id``...) y no toca
+``account.move``.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+_logger = logging.getLogger(__name__)
+
+# Estado de aceptación de l10n_co_dian.document
+DIAN_ACCEPTED_STATE = 'invoice_accepted'
+
+
+@dataclass(slots=True)
+class PayrollEdiProxy:
+    """Sustituto en memoria del ``account.move`` temporal de nómina."""
+    env: object
+    company_id: object
+    journal_id: object
+    name: str = ''
+    date: object = None
+    source: object = None
+    is_payroll_document_proxy: bool = True
+    move_type: str = 'entry'
+    dian_document: object = field(default=None)
+
+    # --- Interfaz mínima de registro que consultan los hooks ---
+
+    @property
+    def id(self):
+        return False
+
+    @property
+    def ids(self):
+        return []
+
+    def ensure_one(self):
+        return self
+
+    def exists(self):
+        return self
+
+    def is_sale_document(self, include_receipts=False):
+        return False
+
+    def is_purchase_document(self, include_receipts=False):
+        return False
+
+    # --- Envío ---
+
+    def _post(self, attachment):
+        """
+        Envía a través de ``l10n_co_dian`` el XML del adjunto, ya firmado
+        con la llave cacheada de la compañía.
+        Devuelve el mismo dict que esperaba el flujo anterior:
+        ``{'success', 'message', 'error'}``.
+        """
+        DianDocument = self.env['l10n_co_dian.document'].with_context(
+            is_l10n_co_payroll=True)
+        try:
+            document = DianDocument._send_to_dian(xml=attachment.raw, move=self)
+        except Exception as e:
+            _logger.exception("Fallo enviando %s a la DIAN mediante el proxy de nómina.", self.name)
+            return {'success': False, 'error': str(e)}
+
+        self.dian_document = document
+        message_json = document.message_json or {}
+        success = document.state == DIAN_ACCEPTED_STATE
+        message = message_json.get('status') or document.state
+        result = {'success': success, 'message': message, 'document': document}
+        if not success and message_json.get('errors'):
+            result['message'] = '%s: %s' % (message, '; '.join(
+                str(error) for error in message_json['errors']))
+        return result
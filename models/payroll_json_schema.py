@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Validación local (preflight) de los payloads JSON de APIDIAN.
+
+El esquema ``data/apidian_payroll_schema.json`` describe el cuerpo de la
+nómina individual (``payroll``) y de la nota de ajuste (``payroll_adjust``).
+Los validadores se compilan una sola vez por proceso y reportan todos los
+errores de cada documento en una pasada, antes de cualquier envío.
+"""
+
+import json
+import logging
+import os
+from functools import lru_cache
+
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+_logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'data', 'apidian_payroll_schema.json')
+
+PAYROLL = 'payroll'
+PAYROLL_ADJUST = 'payroll_adjust'
+
+
+@lru_cache(maxsize=None)
+def _load_schema():
+    with open(SCHEMA_PATH, encoding='utf-8') as schema_file:
+        return json.load(schema_file)
+
+
+@lru_cache(maxsize=None)
+def get_validator(kind=PAYROLL):
+    """
+    Validador compilado para ``kind`` (``'payroll'`` o ``'payroll_adjust'``).
+    Devuelve ``None`` si la librería ``jsonschema`` no está instalada.
+    """
+    if jsonschema is None:
+        _logger.warning(
+            "La librería 'jsonschema' no está instalada; se omite la validación "
+            "local de los payloads de APIDIAN.")
+        return None
+    schema = _load_schema()
+    if kind not in schema['definitions']:
+        raise KeyError(kind)
+    root = {
+        '$schema': schema['$schema'],
+        'definitions': schema['definitions'],
+        '$ref': '#/definitions/%s' % kind,
+    }
+    validator_cls = jsonschema.validators.validator_for(root)
+    validator_cls.check_schema(root)
+    return validator_cls(root)
+
+
+def _format_error(error):
+    path = '.'.join(str(part) for part in error.absolute_path)
+    return '%s: %s' % (path or '(raíz)', error.message)
+
+
+def validate_payload(payload, kind=PAYROLL):
+    """Lista de mensajes de error del payload (vacía si es válido)."""
+    validator = get_validator(kind)
+    if validator is None:
+        return []
+    errors = sorted(validator.iter_errors(payload), key=lambda e: [str(part) for part in e.absolute_path])
+    return [_format_error(error) for error in errors]
+
+
+def validate_payloads(payloads, kind=PAYROLL):
+    """
+    Valida un lote completo. Devuelve ``{índice: [errores]}`` solo con los
+    documentos que tienen errores.
+    """
+    result = {}
+    for index, payload in enumerate(payloads):
+        errors = validate_payload(payload, kind)
+        if errors:
+            result[index] = errors
+    return result
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Cierre de mes de la Nómina Electrónica consolidada en paralelo.
+
+Un ``l10n_co_nomina.month.end.run`` divide los consolidados en borrador del
+período en lotes (``l10n_co_nomina.month.end.chunk``). Al iniciar se
+reservan de una vez los consecutivos de todos los documentos y cada lote
+guarda el bloque que le corresponde. Los lotes los procesan tareas
+programadas: cada una toma un lote libre con ``FOR UPDATE SKIP LOCKED``, así
+que varias tareas (una por trabajador de cron) avanzan en paralelo sin
+pisarse. Cada lote confirma sus documentos con el bloque reservado, agrega
+los consolidados (quedan en caché), renderiza y valida el XML y, si se
+pidió, los envía a la DIAN confirmando documento por documento.
+
+Un lote que falla se reintenta hasta ``MAX_ATTEMPTS`` veces; el cierre se
+puede reanudar en cualquier momento y los documentos ya confirmados o
+enviados no se repiten.
+"""
+
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+# Un lote en envío sin avances durante este tiempo se considera abandonado
+STALE_SENDING_MINUTES = 60
+
+MONTHS = [
+    ('1', 'Enero'), ('2', 'Febrero'), ('3', 'Marzo'), ('4', 'Abril'),
+    ('5', 'Mayo'), ('6', 'Junio'), ('7', 'Julio'), ('8', 'Agosto'),
+    ('9', 'Septiembre'), ('10', 'Octubre'), ('11', 'Noviembre'), ('12', 'Diciembre'),
+]
+
+
+class L10nCoNominaMonthEndRun(models.Model):
+    _name = 'l10n_co_nomina.month.end.run'
+    _description = 'Cierre de Mes de Nómina Electrónica'
+    _order = 'id desc'
+
+    name = fields.Char(string='Nombre', compute='_compute_name', store=True)
+    company_id = fields.Many2one(
+        'res.company', string='Compañía', required=True, default=lambda self: self.env.company)
+    month = fields.Selection(
+        MONTHS, string='Mes', required=True,
+        default=lambda self: str(fields.Date.context_today(self).month))
+    year = fields.Integer(
+        string='Año', required=True, default=lambda self: fields.Date.context_today(self).year)
+    chunk_size = fields.Integer(
+        string='Documentos por Lote', default=200, required=True,
+        help="Cantidad de consolidados que procesa cada tarea en una transacción.")
+    send_documents = fields.Boolean(
+        string='Enviar a la DIAN',
+        default=lambda self: self.env.company.edi_payroll_consolidated_enable
+        and not self.env.company.edi_payroll_enable_validate_state,
+        help="Si está marcado, cada lote envía sus documentos al terminar de confirmarlos. "
+             "Si no, solo los confirma, consolida y les aplica el autochequeo del XML.")
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('running', 'En Proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Con Errores'),
+        ('cancel', 'Cancelado'),
+    ], string='Estado', default='draft', required=True, readonly=True, copy=False)
+    chunk_ids = fields.One2many(
+        'l10n_co_nomina.month.end.chunk', 'run_id', string='Lotes', readonly=True, copy=False)
+    total_count = fields.Integer(string='Documentos', readonly=True, copy=False)
+    processed_count = fields.Integer(string='Procesados', compute='_compute_progress')
+    failed_count = fields.Integer(string='Con Error', compute='_compute_progress')
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress')
+    started_at = fields.Datetime(string='Inicio', readonly=True, copy=False)
+    finished_at = fields.Datetime(string='Fin', readonly=True, copy=False)
+
+    @api.depends('company_id', 'month', 'year')
+    def _compute_name(self):
+        for run in self:
+            run.name = _("Cierre %(month)s/%(year)s - %(company)s",
+                         month=run.month, year=run.year, company=run.company_id.name)
+
+    @api.depends('total_count', 'chunk_ids.state', 'chunk_ids.edi_count', 'chunk_ids.failed_count')
+    def _compute_progress(self):
+        for run in self:
+            done_chunks = run.chunk_ids.filtered(lambda c: c.state == 'done')
+            run.processed_count = sum(done_chunks.mapped('edi_count'))
+            run.failed_count = sum(run.chunk_ids.mapped('failed_count'))
+            run.progress = 100.0 * run.processed_count / run.total_count if run.total_count else 0.0
+
+    # -------------------------------------------------------------------------
+    # Planeación
+    # -------------------------------------------------------------------------
+
+    def _get_draft_documents(self):
+        self.ensure_one()
+        return self.env['hr.payslip.edi'].search([
+            ('company_id', '=', self.company_id.id),
+            ('year', '=', self.year),
+            ('month', '=', self.month),
+            ('state', '=', 'draft'),
+        ], order='id')
+
+    def _reserve_numbers(self, documents):
+        """Reserva en un paso, por secuencia, los consecutivos de los documentos sin número."""
+        by_code = defaultdict(list)
+        for doc in documents:
+            if not doc.number or doc.number in ('New', _('New')):
+                by_code[doc._get_edi_sequence_code()].append(doc.id)
+        numbers_by_id = {}
+        Sequence = self.env['ir.sequence']
+        for code, doc_ids in by_code.items():
+            numbers = Sequence._l10n_co_reserve_numbers_by_code(code, len(doc_ids), self.company_id)
+            numbers_by_id.update(zip(doc_ids, numbers))
+        return numbers_by_id
+
+    def action_start(self):
+        self.ensure_one()
+        if self.state != 'draft':
+            raise UserError(_("El cierre ya fue iniciado."))
+        if self.chunk_size <= 0:
+            raise UserError(_("La cantidad de documentos por lote debe ser mayor que cero."))
+        documents = self._get_draft_documents()
+        if not documents:
+            raise UserError(_("No hay nóminas electrónicas en borrador para %s/%s.") % (self.month, self.year))
+
+        numbers_by_id = self._reserve_numbers(documents)
+        vals_list = []
+        for index in range(0, len(documents), self.chunk_size):
+            chunk_docs = documents[index:index + self.chunk_size]
+            vals_list.append({
+                'run_id': self.id,
+                'sequence': len(vals_list) + 1,
+                'edi_ids': [fields.Command.set(chunk_docs.ids)],
+                'edi_count': len(chunk_docs),
+                'reserved_numbers': json.dumps(
+                    {str(doc_id): numbers_by_id[doc_id] for doc_id in chunk_docs.ids if doc_id in numbers_by_id}),
+            })
+        self.env['l10n_co_nomina.month.end.chunk'].create(vals_list)
+        self.write({
+            'state': 'running',
+            'total_count': len(documents),
+            'started_at': fields.Datetime.now(),
+        })
+        _logger.info("Cierre de mes %s: %s documentos en %s lotes.", self.name, len(documents), len(vals_list))
+        self._trigger_workers()
+        return True
+
+    def action_resume(self):
+        """
+        Reanuda el cierre: vuelven a la cola los lotes fallidos y los que
+        quedaron en envío sin avances durante ``STALE_SENDING_MINUTES`` (la
+        misma prueba de ``_claim_next``). Los lotes que otra tarea está
+        enviando no se tocan.
+        """
+        if any(run.state not in ('running', 'failed') for run in self):
+            raise UserError(_("Solo se pueden reanudar cierres en proceso o con errores."))
+        for run in self:
+            run.chunk_ids.filtered(lambda c: c.state == 'failed' or c._is_stale_sending()).write({
+                'state': 'pending', 'attempts': 0,
+            })
+            run.write({'state': 'running', 'finished_at': False})
+        self._update_state_from_chunks()
+        self._trigger_workers()
+        return True
+
+    def action_cancel(self):
+        """
+        Cancela el cierre. Los consecutivos reservados al iniciar que ningún
+        lote llegó a usar quedan en sus consolidados en borrador, que los
+        conservan al confirmarse después (a mano o en otro cierre).
+        """
+        runs = self.filtered(lambda r: r.state in ('draft', 'running', 'failed'))
+        for run in runs:
+            run._release_reserved_numbers()
+        runs.write({'state': 'cancel'})
+        return True
+
+    def _release_reserved_numbers(self):
+        """
+        Asigna a los consolidados aún en borrador y sin número el consecutivo
+        que les reservó el cierre y deja en el log los que no pudieron
+        conservarse (consolidado eliminado o numerado por otra vía).
+        Devuelve los consecutivos conservados.
+        """
+        self.ensure_one()
+        Edi = self.env['hr.payslip.edi']
+        kept, lost = [], []
+        for chunk in self.chunk_ids.filtered(lambda c: c.state != 'done'):
+            reserved = chunk._get_reserved_numbers()
+            documents = {doc.id: doc for doc in Edi.browse(list(reserved)).exists()}
+            for doc_id, number in reserved.items():
+                doc = documents.get(doc_id, Edi)
+                if doc.number == number:
+                    continue
+                if doc.state == 'draft' and (not doc.number or doc.number in ('New', _('New'))):
+                    doc.number = number
+                    kept.append(number)
+                else:
+                    lost.append(number)
+        if kept:
+            _logger.warning("Cierre de mes %s cancelado: los consolidados en borrador conservan "
+                            "sus consecutivos reservados: %s", self.name, ', '.join(kept))
+        if lost:
+            _logger.warning("Cierre de mes %s cancelado: consecutivos reservados sin usar: %s",
+                            self.name, ', '.join(lost))
+        return kept
+
+    # -------------------------------------------------------------------------
+    # Trabajadores (tareas programadas)
+    # -------------------------------------------------------------------------
+
+    @api.model
+    def _get_worker_crons(self):
+        """
+        Tareas programadas que procesan lotes. Crea copias de la tarea base
+        hasta completar ``l10n_co_nomina.month_end_workers`` (2 por defecto):
+        una tarea no corre en paralelo consigo misma, varias sí.
+        """
+        base = self.env.ref('l10n_co_nomina.ir_cron_month_end_worker', raise_if_not_found=False)
+        if not base:
+            return self.env['ir.cron']
+        base = base.sudo()
+        workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_co_nomina.month_end_workers', 2))
+        crons = base | base.search([('code', '=', base.code), ('id', '!=', base.id)], order='id')
+        for index in range(len(crons), max(workers, 1)):
+            crons |= base.copy({'name': '%s (%s)' % (base.name, index + 1)})
+        return crons[:max(workers, 1)]
+
+    def _trigger_workers(self):
+        for cron in self._get_worker_crons():
+            cron._trigger()
+
+    def _update_state_from_chunks(self):
+        for run in self.filtered(lambda r: r.state == 'running'):
+            states = set(run.chunk_ids.mapped('state'))
+            if states & {'pending', 'sending'}:
+                continue
+            run.write({
+                'state': 'failed' if 'failed' in states else 'done',
+                'finished_at': fields.Datetime.now(),
+            })
+
+    @api.model
+    def _cron_process_chunks(self, time_limit=None):
+        """
+        Procesa lotes pendientes hasta agotar el tiempo (``time_limit``
+        segundos o ``l10n_co_nomina.month_end_time_limit``, 240 por defecto).
+        Confirma la transacción después de cada lote y de cada envío, y se
+        vuelve a programar si queda trabajo.
+        """
+        if time_limit is None:
+            time_limit = int(self.env['ir.config_parameter'].sudo().get_param(
+                'l10n_co_nomina.month_end_time_limit', 240))
+        Chunk = self.env['l10n_co_nomina.month.end.chunk']
+        deadline = time.monotonic() + time_limit
+        processed = 0
+        while time.monotonic() < deadline:
+            chunk = Chunk._claim_next()
+            if not chunk:
+                break
+            chunk._run()
+            processed += 1
+        if processed and Chunk._claim_next(lock=False):
+            self._trigger_workers()
+        return True
+
+
+class L10nCoNominaMonthEndChunk(models.Model):
+    _name = 'l10n_co_nomina.month.end.chunk'
+    _description = 'Lote de Cierre de Mes de Nómina Electrónica'
+    _order = 'run_id, sequence, id'
+
+    run_id = fields.Many2one(
+        'l10n_co_nomina.month.end.run', string='Cierre', required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(string='Lote', default=1)
+    edi_ids = fields.Many2many(
+        'hr.payslip.edi', 'l10n_co_nomina_month_end_chunk_edi_rel', 'chunk_id', 'edi_id',
+        string='Documentos', readonly=True)
+    edi_count = fields.Integer(string='Documentos', readonly=True)
+    reserved_numbers = fields.Text(
+        string='Consecutivos Reservados', readonly=True,
+        help="JSON {id del consolidado: consecutivo} con el bloque reservado al iniciar el cierre.")
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('sending', 'Enviando'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', required=True, readonly=True, index=True)
+    attempts = fields.Integer(string='Intentos', readonly=True)
+    failed_count = fields.Integer(string='Con Error', readonly=True)
+    duration = fields.Float(string='Duración (s)', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    @api.model
+    def _claim_next(self, lock=True):
+        """
+        Siguiente lote libre de un cierre en proceso. Con ``lock`` queda
+        bloqueado hasta el siguiente commit; los lotes que otra tarea tiene
+        bloqueados se saltan (``SKIP LOCKED``).
+        """
+        self.env.flush_all()
+        self.env.cr.execute(SQL("""
+            SELECT c.id
+              FROM l10n_co_nomina_month_end_chunk c
+              JOIN l10n_co_nomina_month_end_run r ON r.id = c.run_id
+             WHERE r.state = 'running'
+               AND (c.state = 'pending'
+                    OR (c.state = 'sending'
+                        AND c.write_date < (now() at time zone 'UTC') - make_interval(mins => %(stale)s)))
+          ORDER BY r.id, c.sequence, c.id
+             LIMIT 1
+             %(lock)s
+        """, stale=STALE_SENDING_MINUTES, lock=SQL("FOR UPDATE OF c SKIP LOCKED") if lock else SQL()))
+        row = self.env.cr.fetchone()
+        return self.browse(row[0] if row else [])
+
+    def _is_stale_sending(self):
+        """Lote en envío sin avances durante ``STALE_SENDING_MINUTES`` (como en ``_claim_next``)."""
+        self.ensure_one()
+        cutoff = fields.Datetime.now() - timedelta(minutes=STALE_SENDING_MINUTES)
+        return self.state == 'sending' and self.write_date < cutoff
+
+    def _get_reserved_numbers(self):
+        self.ensure_one()
+        return {int(doc_id): number for doc_id, number in json.loads(self.reserved_numbers or '{}').items()}
+
+    def _run(self):
+        """Procesa el lote en su propia transacción; un fallo solo afecta a este lote."""
+        self.ensure_one()
+        started = time.monotonic()
+        cr = self.env.cr
+        try:
+            self._confirm_and_prepare()
+            if self.run_id.send_documents:
+                self.write({'state': 'sending'})
+                cr.commit()  # pylint: disable=invalid-commit
+                self._send_documents()
+            self.write({'state': 'done', 'error': False,
+                        'duration': self.duration + time.monotonic() - started})
+            self.run_id._update_state_from_chunks()
+            cr.commit()  # pylint: disable=invalid-commit
+        except Exception as e:
+            cr.rollback()
+            _logger.exception("Cierre de mes: fallo en el lote %s de %s.", self.sequence, self.run_id.name)
+            attempts = self.attempts + 1
+            self.write({
+                'state': 'pending' if attempts < MAX_ATTEMPTS else 'failed',
+                'attempts': attempts,
+                'error': str(e),
+                'duration': self.duration + time.monotonic() - started,
+            })
+            self.run_id._update_state_from_chunks()
+            cr.commit()  # pylint: disable=invalid-commit
+
+    def _confirm_and_prepare(self):
+        """Confirma con el bloque reservado, consolida (caché) y, sin envío, aplica el autochequeo del XML."""
+        documents = self.edi_ids
+        documents._confirm_edi_documents(self._get_reserved_numbers())
+        pending = documents.filtered(lambda r: r.state == 'done' and not r.edi_is_valid)
+        pending._get_consolidated_payroll_data_batch()
+        if self.run_id.send_documents:
+            return
+        errors_by_record = pending._collect_payroll_xml_schema_errors()
+        for rec, errors in errors_by_record.items():
+            rec.message_post(body=_("El XML no pasa el autochequeo del módulo (XSD no oficial):\n%s") % "\n".join(errors))
+        self.failed_count = len(errors_by_record)
+
+    def _send_documents(self):
+        """Envía uno a uno los documentos aún no enviados, confirmando cada envío."""
+        cr = self.env.cr
+        to_send = self.edi_ids.filtered(
+            lambda r: r.state == 'done' and not r.edi_is_valid and not r.edi_zip_key)
+        failed = 0
+        for rec in to_send:
+            try:
+                rec.validate_dian_generic()
+            except Exception as e:
+                cr.rollback()
+                failed += 1
+                _logger.error("Fallo en el envío DIAN de %s durante el cierre de mes: %s", rec.name, e)
+                rec.message_post(body=_("Fallo en el envío DIAN durante el cierre de mes: %s") % e)
+            # Tocar el lote mantiene fresca su marca de tiempo mientras envía
+            self.write({'failed_count': failed})
+            cr.commit()  # pylint: disable=invalid-commit
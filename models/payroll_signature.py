@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Firma XAdES-EPES del XML de nómina electrónica.
+
+El material de la llave (PKCS#12) se parsea una sola vez y queda en memoria
+del worker, indexado por compañía y checksum del certificado; nunca se
+persiste en claro. ``sign_payroll_xml_batch`` firma N documentos con una
+sola carga de la llave.
+"""
+
+import base64
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+
+from lxml import etree
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+NS_DS = 'http://www.w3.org/2000/09/xmldsig#'
+NS_XADES = 'http://uri.etsi.org/01903/v1.3.2#'
+NS_EXT = 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2'
+
+C14N_ALGORITHM = 'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+SIGNATURE_ALGORITHM = 'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256'
+DIGEST_ALGORITHM = 'http://www.w3.org/2001/04/xmlenc#sha256'
+ENVELOPED_TRANSFORM = 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+SIGNED_PROPERTIES_TYPE = 'http://uri.etsi.org/01903#SignedProperties'
+
+# Política de firma DIAN v2
+POLICY_IDENTIFIER = 'https://facturaelectronica.dian.gov.co/politicadefirma/v2/politicadefirmav2.pdf'
+POLICY_DIGEST = 'dMoMvtcG5aIzgYo0tIsSQeVJBDnUnfSOfBpxXrmor0Y='
+
+COLOMBIA_TZ = timezone(timedelta(hours=-5))
+
+
+@dataclass(slots=True, frozen=True)
+class PayrollKeyMaterial:
+    """
+    Llave privada y certificado ya parseados (solo en memoria). ``pkcs12_b64``
+    es el archivo .p12 tal como está almacenado (cifrado con su contraseña),
+    para no volver a leer el binario al reenviarlo a APIDIAN.
+    """
+    private_key: object
+    certificate: object
+    certificate_b64: str
+    certificate_digest_b64: str
+    issuer_name: str
+    serial_number: int
+    pkcs12_b64: str = ''
+
+
+def load_key_material(p12_bytes, password):
+    """Parsea un PKCS#12 (bytes crudos) y devuelve un ``PayrollKeyMaterial``."""
+    password_bytes = password.encode('utf-8') if isinstance(password, str) else password
+    private_key, certificate, _chain = pkcs12.load_key_and_certificates(
+        p12_bytes, password_bytes or None)
+    if private_key is None or certificate is None:
+        raise ValueError("El archivo PKCS#12 no contiene llave privada y certificado.")
+    der = certificate.public_bytes(serialization.Encoding.DER)
+    return PayrollKeyMaterial(
+        private_key=private_key,
+        certificate=certificate,
+        certificate_b64=base64.b64encode(der).decode('ascii'),
+        certificate_digest_b64=base64.b64encode(sha256(der).digest()).decode('ascii'),
+        issuer_name=certificate.issuer.rfc4514_string(),
+        serial_number=certificate.serial_number,
+        pkcs12_b64=base64.b64encode(p12_bytes).decode('ascii'),
+    )
+
+
+# --- Cache por proceso: (bd, compañía, checksum, hash contraseña) -> PayrollKeyMaterial ---
+
+_KEY_CACHE = {}
+_KEY_CACHE_LOCK = threading.Lock()
+
+
+def get_cached_key_material(cache_key, loader):
+    """Devuelve el material cacheado para ``cache_key`` o lo carga con ``loader()``."""
+    with _KEY_CACHE_LOCK:
+        material = _KEY_CACHE.get(cache_key)
+    if material is not None:
+        return material
+    material = loader()
+    with _KEY_CACHE_LOCK:
+        # Un solo certificado vigente por (bd, compañía)
+        for key in [k for k in _KEY_CACHE if k[:2] == cache_key[:2]]:
+            _KEY_CACHE.pop(key, None)
+        _KEY_CACHE[cache_key] = material
+    return material
+
+
+def invalidate_key_material(dbname, company_ids):
+    """Descarta el material de llave cacheado de las compañías indicadas."""
+    company_ids = set(company_ids)
+    with _KEY_CACHE_LOCK:
+        for key in [k for k in _KEY_CACHE if k[0] == dbname and k[1] in company_ids]:
+            _KEY_CACHE.pop(key, None)
+
+
+# --- Firma ---
+
+def _c14n(element):
+    return etree.tostring(element, method='c14n', exclusive=False, with_comments=False)
+
+
+def _digest_b64(data):
+    return base64.b64encode(sha256(data).digest()).decode('ascii')
+
+
+def _sub(parent, ns, tag, attrs=None, text=None):
+    node = etree.SubElement(parent, '{%s}%s' % (ns, tag), attrs or {})
+    if text is not None:
+        node.text = text
+    return node
+
+
+def _get_extension_content(root):
+    """Crea (o reutiliza) ext:UBLExtensions/ext:UBLExtension/ext:ExtensionContent al inicio del documento."""
+    extensions = root.find('{%s}UBLExtensions' % NS_EXT)
+    if extensions is None:
+        extensions = etree.Element('{%s}UBLExtensions' % NS_EXT)
+        root.insert(0, extensions)
+    extension = etree.SubElement(extensions, '{%s}UBLExtension' % NS_EXT)
+    return etree.SubElement(extension, '{%s}ExtensionContent' % NS_EXT)
+
+
+def _add_reference(signed_info, uri, digest, reference_id=None, reference_type=None, enveloped=False):
+    attrs = {}
+    if reference_id:
+        attrs['Id'] = reference_id
+    if reference_type:
+        attrs['Type'] = reference_type
+    attrs['URI'] = uri
+    reference = _sub(signed_info, NS_DS, 'Reference', attrs)
+    if enveloped:
+        transforms = _sub(reference, NS_DS, 'Transforms')
+        _sub(transforms, NS_DS, 'Transform', {'Algorithm': ENVELOPED_TRANSFORM})
+    _sub(reference, NS_DS, 'DigestMethod', {'Algorithm': DIGEST_ALGORITHM})
+    return _sub(reference, NS_DS, 'DigestValue', text=digest)
+
+
+def sign_payroll_root(root, key_material, signing_time=None, role='supplier'):
+    """
+    Firma en sitio el elemento raíz de un documento de nómina (XAdES-EPES,
+    RSA-SHA256, firma envuelta en ext:ExtensionContent) y lo devuelve.
+    """
+    signature_id = 'xmldsig-%s' % uuid.uuid4()
+    signing_time = signing_time or datetime.now(COLOMBIA_TZ)
+
+    extension_content = _get_extension_content(root)
+    # Referencia al documento: se calcula antes de insertar la firma (transformación enveloped)
+    document_digest = _digest_b64(_c14n(root))
+
+    signature = _sub(extension_content, NS_DS, 'Signature', {'Id': signature_id})
+    signed_info = _sub(signature, NS_DS, 'SignedInfo')
+    _sub(signed_info, NS_DS, 'CanonicalizationMethod', {'Algorithm': C14N_ALGORITHM})
+    _sub(signed_info, NS_DS, 'SignatureMethod', {'Algorithm': SIGNATURE_ALGORITHM})
+    _add_reference(signed_info, '', document_digest,
+                   reference_id='%s-ref0' % signature_id, enveloped=True)
+    keyinfo_digest = _add_reference(signed_info, '#%s-keyinfo' % signature_id, '')
+    signedprops_digest = _add_reference(
+        signed_info, '#%s-signedprops' % signature_id, '',
+        reference_type=SIGNED_PROPERTIES_TYPE)
+
+    signature_value = _sub(signature, NS_DS, 'SignatureValue',
+                           {'Id': '%s-sigvalue' % signature_id})
+
+    key_info = _sub(signature, NS_DS, 'KeyInfo', {'Id': '%s-keyinfo' % signature_id})
+    x509_data = _sub(key_info, NS_DS, 'X509Data')
+    _sub(x509_data, NS_DS, 'X509Certificate', text=key_material.certificate_b64)
+
+    ds_object = _sub(signature, NS_DS, 'Object')
+    qualifying = _sub(ds_object, NS_XADES, 'QualifyingProperties', {'Target': '#%s' % signature_id})
+    signed_props = _sub(qualifying, NS_XADES, 'SignedProperties',
+                        {'Id': '%s-signedprops' % signature_id})
+    signed_sig_props = _sub(signed_props, NS_XADES, 'SignedSignatureProperties')
+    _sub(signed_sig_props, NS_XADES, 'SigningTime',
+         text=signing_time.isoformat(timespec='seconds'))
+    signing_cert = _sub(signed_sig_props, NS_XADES, 'SigningCertificate')
+    cert = _sub(signing_cert, NS_XADES, 'Cert')
+    cert_digest = _sub(cert, NS_XADES, 'CertDigest')
+    _sub(cert_digest, NS_DS, 'DigestMethod', {'Algorithm': DIGEST_ALGORITHM})
+    _sub(cert_digest, NS_DS, 'DigestValue', text=key_material.certificate_digest_b64)
+    issuer_serial = _sub(cert, NS_XADES, 'IssuerSerial')
+    _sub(issuer_serial, NS_DS, 'X509IssuerName', text=key_material.issuer_name)
+    _sub(issuer_serial, NS_DS, 'X509SerialNumber', text=str(key_material.serial_number))
+    policy_identifier = _sub(signed_sig_props, NS_XADES, 'SignaturePolicyIdentifier')
+    policy_id = _sub(policy_identifier, NS_XADES, 'SignaturePolicyId')
+    sig_policy_id = _sub(policy_id, NS_XADES, 'SigPolicyId')
+    _sub(sig_policy_id, NS_XADES, 'Identifier', text=POLICY_IDENTIFIER)
+    policy_hash = _sub(policy_id, NS_XADES, 'SigPolicyHash')
+    _sub(policy_hash, NS_DS, 'DigestMethod', {'Algorithm': DIGEST_ALGORITHM})
+    _sub(policy_hash, NS_DS, 'DigestValue', text=POLICY_DIGEST)
+    signer_role = _sub(signed_sig_props, NS_XADES, 'SignerRole')
+    claimed_roles = _sub(signer_role, NS_XADES, 'ClaimedRoles')
+    _sub(claimed_roles, NS_XADES, 'ClaimedRole', text=role)
+
+    # Los digest se calculan con los nodos ya ubicados (c14n inclusivo hereda los namespaces)
+    keyinfo_digest.text = _digest_b64(_c14n(key_info))
+    signedprops_digest.text = _digest_b64(_c14n(signed_props))
+
+    raw_signature = key_material.private_key.sign(
+        _c14n(signed_info), padding.PKCS1v15(), hashes.SHA256())
+    signature_value.text = base64.b64encode(raw_signature).decode('ascii')
+    return root
+
+
+def sign_payroll_xml(xml_content, key_material, signing_time=None):
+    """Firma un documento (bytes) y devuelve los bytes firmados."""
+    parser = etree.XMLParser(no_network=True, resolve_entities=False, remove_blank_text=True)
+    root = etree.fromstring(xml_content, parser)
+    sign_payroll_root(root, key_material, signing_time=signing_time)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def sign_payroll_xml_batch(xml_documents, key_material, signing_time=None):
+    """Firma una lista de documentos con una sola carga de la llave."""
+    signing_time = signing_time or datetime.now(COLOMBIA_TZ)
+    return [sign_payroll_xml(xml_content, key_material, signing_time=signing_time)
+            for xml_content in xml_documents]
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Ejecutor automático del set de pruebas de habilitación DIAN.
+
+Genera documentos sintéticos de Nómina Individual y de Nota de Ajuste a
+partir de las últimas nóminas confirmadas de unos empleados de prueba, los
+envía en paralelo al endpoint del set de pruebas de APIDIAN y deja un
+reporte de aprobado / fallido. La consulta de estado no duerme dentro de la
+petición HTTP: cada pulsación de "Consultar Estado" hace una sola ronda y
+los documentos pendientes quedan guardados en el asistente entre rondas.
+
+Los hilos de envío solo reciben el cliente APIDIAN de la compañía
+(``payroll_api_client.ApiClient``) y el payload; toda lectura o escritura
+del ORM ocurre en el hilo principal.
+"""
+
+import copy
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError, ValidationError
+
+from .payroll_api_client import (
+    STATUS_ACCEPTED, STATUS_PENDING, STATUS_REJECTED,
+    PayrollApiError, extract_zip_key, normalize_status_response,
+)
+from .payroll_json_schema import PAYROLL, PAYROLL_ADJUST, validate_payloads
+
+_logger = logging.getLogger(__name__)
+
+STATUS_ERROR = 'error'
+
+
+@dataclass(slots=True)
+class TestSetDocument:
+    """Documento sintético del set de pruebas y su resultado."""
+    index: int
+    kind: str
+    number: str
+    payload: dict
+    zip_key: str = None
+    cune: str = None
+    status: str = STATUS_PENDING
+    message: str = ''
+    errors: list = field(default_factory=list)
+
+
+class PayrollTestSetRunner(models.TransientModel):
+    _name = 'l10n_co_nomina.test.set.runner'
+    _description = 'Ejecutor del Set de Pruebas de Nómina Electrónica'
+
+    company_id = fields.Many2one(
+        'res.company', string='Compañía', required=True,
+        default=lambda self: self.env.company)
+    test_set_id = fields.Char(
+        string='ID del Set de Pruebas', required=True,
+        default=lambda self: self.env.company.l10n_co_payroll_test_set_id)
+    employee_ids = fields.Many2many(
+        'hr.employee', string='Empleados de Prueba', required=True,
+        help="Se toma la última nómina confirmada de cada empleado como plantilla "
+             "de los documentos sintéticos.")
+    individual_count = fields.Integer(
+        string='Nóminas Individuales', default=8, required=True)
+    adjustment_count = fields.Integer(
+        string='Notas de Ajuste', default=2, required=True,
+        help="Cada nota reemplaza (type_note 1) una nómina individual aceptada del mismo set.")
+    consecutive_start = fields.Integer(
+        string='Consecutivo Inicial (Nómina)',
+        default=lambda self: self.env.company.l10n_co_nomina_default_resolution_id.from_number or 1)
+    adjustment_consecutive_start = fields.Integer(
+        string='Consecutivo Inicial (Ajuste)', default=1)
+    max_workers = fields.Integer(string='Envíos en Paralelo', default=4)
+    poll_attempts = fields.Integer(
+        string='Consultas de Estado', default=10,
+        help="Rondas de consulta antes de cerrar el set con los documentos aún sin respuesta.")
+    poll_count = fields.Integer(string='Consultas Realizadas', readonly=True)
+
+    state = fields.Selection(
+        [('draft', 'Borrador'), ('sent', 'Enviado'), ('done', 'Ejecutado')],
+        default='draft', readonly=True)
+    documents_data = fields.Text(readonly=True, help="Documentos enviados y su estado (JSON).")
+    passed = fields.Boolean(string='Aprobado', readonly=True)
+    accepted_count = fields.Integer(string='Aceptados', readonly=True)
+    rejected_count = fields.Integer(string='Rechazados', readonly=True)
+    pending_count = fields.Integer(string='Sin Respuesta', readonly=True)
+    error_count = fields.Integer(string='Con Error de Envío', readonly=True)
+    report = fields.Text(string='Reporte', readonly=True)
+
+    @api.constrains('individual_count', 'adjustment_count', 'max_workers', 'poll_attempts')
+    def _check_counts(self):
+        for runner in self:
+            if runner.individual_count < 1:
+                raise ValidationError(_("Debe generarse al menos una nómina individual."))
+            if runner.adjustment_count < 0 or runner.adjustment_count > runner.individual_count:
+                raise ValidationError(_("Las notas de ajuste deben estar entre 0 y el número de nóminas individuales."))
+            if runner.max_workers < 1 or runner.poll_attempts < 1:
+                raise ValidationError(_("Los parámetros de paralelismo y consulta deben ser positivos."))
+
+    # -------------------------------------------------------------------------
+    # Generación de documentos sintéticos
+    # -------------------------------------------------------------------------
+
+    def _get_fixture_payslips(self):
+        """Última nómina confirmada de cada empleado de prueba."""
+        Payslip = self.env['hr.payslip']
+        templates = Payslip
+        missing = []
+        for employee in self.employee_ids:
+            payslip = Payslip.search([
+                ('employee_id', '=', employee.id),
+                ('company_id', '=', self.company_id.id),
+                ('state', 'in', ('done', 'paid')),
+                ('credit_note', '=', False),
+            ], order='date_to desc, id desc', limit=1)
+            if payslip:
+                templates |= payslip
+            else:
+                missing.append(employee.name)
+        if missing:
+            raise UserError(_("Los siguientes empleados de prueba no tienen nóminas confirmadas: %s")
+                            % ", ".join(missing))
+        return templates
+
+    def _get_adjustment_prefix(self):
+        resolution = self.env['l10n_co_nomina.resolution'].search([
+            ('company_id', '=', self.company_id.id),
+            ('type_document_id', '=', '10'),
+            ('state', '=', 'active'),
+        ], limit=1)
+        return resolution.prefix or "NA"
+
+    def _build_individual_documents(self):
+        templates = self._get_fixture_payslips().with_company(self.company_id)
+        base_payloads = templates._prepare_payroll_json_batch()
+        documents = []
+        for index in range(self.individual_count):
+            payload = copy.deepcopy(base_payloads[index % len(base_payloads)])
+            consecutive = self.consecutive_start + index
+            payload.update({
+                "consecutive": consecutive,
+                "notes": _("Set de pruebas de habilitación - documento %s") % (index + 1),
+                "sendmail": False,
+                "sendmailtome": False,
+            })
+            documents.append(TestSetDocument(
+                index=index + 1, kind=PAYROLL,
+                number=f"{payload.get('prefix') or ''}{consecutive}", payload=payload))
+        return documents
+
+    def _build_adjustment_documents(self, individual_documents):
+        """Notas de reemplazo sobre las primeras nóminas individuales aceptadas."""
+        accepted = [doc for doc in individual_documents if doc.status == STATUS_ACCEPTED and doc.cune]
+        prefix = self._get_adjustment_prefix()
+        documents = []
+        for offset in range(self.adjustment_count):
+            index = self.individual_count + offset + 1
+            consecutive = self.adjustment_consecutive_start + offset
+            if offset >= len(accepted):
+                documents.append(TestSetDocument(
+                    index=index, kind=PAYROLL_ADJUST, number=f"{prefix}{consecutive}", payload={},
+                    status=STATUS_ERROR,
+                    message=_("No hay una nómina individual aceptada para ajustar.")))
+                continue
+            predecessor = accepted[offset]
+            payload = copy.deepcopy(predecessor.payload)
+            payload.update({
+                "type_document_id": 10,
+                "type_note": 1,
+                "prefix": prefix,
+                "consecutive": consecutive,
+                "predecessor": {
+                    "predecessor_number": predecessor.number,
+                    "predecessor_cune": predecessor.cune,
+                    "predecessor_issue_date": predecessor.payload["period"]["issue_date"],
+                },
+                "notes": _("Set de pruebas de habilitación - ajuste de %s") % predecessor.number,
+            })
+            documents.append(TestSetDocument(
+                index=index, kind=PAYROLL_ADJUST, number=f"{prefix}{consecutive}", payload=payload))
+        return documents
+
+    def _build_unsent_adjustments(self):
+        """Notas que no llegaron a enviarse porque las individuales siguen sin respuesta."""
+        prefix = self._get_adjustment_prefix()
+        return [
+            TestSetDocument(
+                index=self.individual_count + offset + 1, kind=PAYROLL_ADJUST,
+                number=f"{prefix}{self.adjustment_consecutive_start + offset}", payload={},
+                status=STATUS_ERROR,
+                message=_("No se envió: las nóminas individuales siguen sin respuesta."))
+            for offset in range(self.adjustment_count)
+        ]
+
+    @staticmethod
+    def _check_payloads(documents, kind):
+        errors_by_index = validate_payloads([doc.payload for doc in documents], kind)
+        if not errors_by_index:
+            return
+        lines = []
+        for index, errors in sorted(errors_by_index.items()):
+            lines.append(_("Documento %s:") % documents[index].number)
+            lines.extend("  - %s" % error for error in errors)
+        raise UserError(_("Los documentos sintéticos no cumplen el esquema de APIDIAN:\n%s")
+                        % "\n".join(lines))
+
+    # -------------------------------------------------------------------------
+    # Envío y consulta concurrentes (sin ORM en los hilos)
+    # -------------------------------------------------------------------------
+
+    def _run_concurrently(self, func, items):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def _send_documents(self, documents, endpoint, client):
+        to_send = [doc for doc in documents if doc.status != STATUS_ERROR]
+
+        def _send(document):
+            try:
+                return client.request(endpoint, json_data=document.payload), None
+            except PayrollApiError as e:
+                return None, e
+
+        for document, (response, error) in zip(to_send, self._run_concurrently(_send, to_send)):
+            if error is not None:
+                document.status = STATUS_ERROR
+                document.message = self.env['l10n_co_nomina.payroll.api.connector']._format_api_error(error)
+                continue
+            document.zip_key = extract_zip_key(response)
+            document.cune = response.get('cune') or None
+            document.message = response.get('message') or ''
+            if not document.zip_key:
+                document.status = STATUS_ERROR
+                document.message = document.message or _("La API no devolvió ZipKey.")
+
+    def _poll_documents(self, documents, client):
+        """Una sola ronda de consulta de estado de los documentos pendientes."""
+        pending = [doc for doc in documents if doc.status == STATUS_PENDING and doc.zip_key]
+        if not pending:
+            return
+
+        def _status(document):
+            try:
+                return normalize_status_response(client.request(
+                    f"status/zip/{document.zip_key}", json_data={})), None
+            except PayrollApiError as e:
+                return None, e
+
+        for document, (status, error) in zip(pending, self._run_concurrently(_status, pending)):
+            if error is not None:
+                # Error transitorio: se reintenta en la siguiente ronda
+                document.message = error.detail or error.kind
+                continue
+            document.status = status['status']
+            document.message = status['message']
+            document.errors = status['errors']
+            document.cune = status['cune'] or document.cune
+
+    # -------------------------------------------------------------------------
+    # Estado entre rondas
+    # -------------------------------------------------------------------------
+
+    def _load_documents(self):
+        return [TestSetDocument(**data) for data in json.loads(self.documents_data or '[]')]
+
+    def _store_documents(self, documents, **vals):
+        vals['documents_data'] = json.dumps([asdict(doc) for doc in documents], default=str)
+        self.write(vals)
+
+    # -------------------------------------------------------------------------
+    # Reporte
+    # -------------------------------------------------------------------------
+
+    def _render_report(self, documents):
+        labels = {
+            STATUS_ACCEPTED: _("ACEPTADO"),
+            STATUS_REJECTED: _("RECHAZADO"),
+            STATUS_PENDING: _("SIN RESPUESTA"),
+            STATUS_ERROR: _("ERROR"),
+        }
+        kinds = {PAYROLL: _("Individual"), PAYROLL_ADJUST: _("Ajuste")}
+        lines = []
+        for doc in documents:
+            lines.append("%3s  %-10s  %-12s  %-13s  %s" % (
+                doc.index, kinds[doc.kind], doc.number, labels[doc.status], doc.zip_key or ''))
+            if doc.cune:
+                lines.append("     CUNE: %s" % doc.cune)
+            if doc.message:
+                lines.append("     %s" % doc.message)
+            lines.extend("     - %s" % error for error in doc.errors)
+        return "\n".join(lines)
+
+    def _write_results(self, documents):
+        counts = {STATUS_ACCEPTED: 0, STATUS_REJECTED: 0, STATUS_PENDING: 0, STATUS_ERROR: 0}
+        for doc in documents:
+            counts[doc.status] += 1
+        passed = counts[STATUS_ACCEPTED] == len(documents)
+        summary = _("Set de pruebas %s: %s (%s de %s documentos aceptados)") % (
+            self.test_set_id, _("APROBADO") if passed else _("FALLIDO"),
+            counts[STATUS_ACCEPTED], len(documents))
+        self._store_documents(
+            documents,
+            state='done',
+            passed=passed,
+            accepted_count=counts[STATUS_ACCEPTED],
+            rejected_count=counts[STATUS_REJECTED],
+            pending_count=counts[STATUS_PENDING],
+            error_count=counts[STATUS_ERROR],
+            report="%s\n\n%s" % (summary, self._render_report(documents)),
+        )
+        _logger.info(summary)
+
+    def _write_progress(self, documents):
+        pending = sum(1 for doc in documents if doc.status == STATUS_PENDING)
+        summary = _("Set de pruebas %s: consulta %s de %s, %s documento(s) sin respuesta.") % (
+            self.test_set_id, self.poll_count, self.poll_attempts, pending)
+        self._store_documents(
+            documents,
+            state='sent',
+            pending_count=pending,
+            report="%s\n\n%s" % (summary, self._render_report(documents)),
+        )
+
+    # -------------------------------------------------------------------------
+    # Acciones
+    # -------------------------------------------------------------------------
+
+    def _reopen(self):
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_run(self):
+        """Envía las nóminas individuales; el estado se consulta con ``action_poll``."""
+        self.ensure_one()
+        if self.state != 'draft':
+            raise UserError(_("El set de pruebas ya fue enviado."))
+        connector = self.env['l10n_co_nomina.payroll.api.connector'].with_company(self.company_id)
+        client = connector._get_api_client(self.company_id)
+
+        individual = self._build_individual_documents()
+        self._check_payloads(individual, PAYROLL)
+        _logger.info("Set de pruebas %s: enviando %s nómina(s) individual(es) con %s hilo(s).",
+                     self.test_set_id, len(individual), self.max_workers)
+        self._send_documents(individual, f"payroll/{self.test_set_id}", client)
+        self.poll_count = 0
+        self._write_progress(individual)
+        return self._reopen()
+
+    def action_poll(self):
+        """
+        Una ronda de consulta de estado. Cuando las nóminas individuales ya
+        tienen respuesta se envían las notas de ajuste; el set se cierra al no
+        quedar pendientes o al agotar ``poll_attempts``.
+        """
+        self.ensure_one()
+        if self.state != 'sent':
+            raise UserError(_("No hay documentos enviados pendientes de consulta."))
+        connector = self.env['l10n_co_nomina.payroll.api.connector'].with_company(self.company_id)
+        client = connector._get_api_client(self.company_id)
+
+        documents = self._load_documents()
+        self.poll_count += 1
+        _logger.info("Set de pruebas %s: consulta %s de %s.",
+                     self.test_set_id, self.poll_count, self.poll_attempts)
+        self._poll_documents(documents, client)
+
+        individual = [doc for doc in documents if doc.kind == PAYROLL]
+        adjustments = [doc for doc in documents if doc.kind == PAYROLL_ADJUST]
+        individual_pending = any(doc.status == STATUS_PENDING for doc in individual)
+        if not adjustments and self.adjustment_count and not individual_pending:
+            adjustments = self._build_adjustment_documents(individual)
+            sendable = [doc for doc in adjustments if doc.status != STATUS_ERROR]
+            if sendable:
+                self._check_payloads(sendable, PAYROLL_ADJUST)
+                self._send_documents(adjustments, f"payroll-adjust-note/{self.test_set_id}", client)
+            documents = individual + adjustments
+
+        finished = not any(doc.status == STATUS_PENDING for doc in documents) and (
+            adjustments or not self.adjustment_count)
+        if finished or self.poll_count >= self.poll_attempts:
+            if not adjustments and self.adjustment_count:
+                documents = individual + self._build_unsent_adjustments()
+            self._write_results(documents)
+        else:
+            self._write_progress(documents)
+        return self._reopen()
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Constructor lxml del XML de Nómina Individual / Nómina Individual de Ajuste.
+
+Genera el mismo árbol que las plantillas QWeb de
+``views/payroll_electronic_templates.xml`` directamente a partir del
+diccionario devuelto por ``_prepare_xml_data``, sin pasar por el motor QWeb.
+Las horas extras se agrupan una sola vez por código de tiempo en lugar de
+filtrar la lista siete veces.
+"""
+
+from collections import defaultdict
+
+from lxml import etree
+
+NS_NOMINA = 'dian:gov:co:facturaelectronica:NominaIndividual'
+NS_NOMINA_AJUSTE = 'dian:gov:co:facturaelectronica:NominaIndividualDeAjuste'
+
+NSMAP_EXTRA = {
+    'xs': 'http://www.w3.org/2001/XMLSchema-instance',
+    'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2',
+    'ds': 'http://www.w3.org/2000/09/xmldsig#',
+    'xades': 'http://uri.etsi.org/01903/v1.3.2#',
+    'xades141': 'http://uri.etsi.org/01903/v1.4.1#',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+}
+
+# (código de tiempo, contenedor, elemento, porcentaje por defecto)
+OVERTIME_ELEMENTS = (
+    ('1', 'HEDs', 'HED', '25.00'),
+    ('2', 'HENs', 'HEN', '75.00'),
+    ('3', 'HRNs', 'HRN', '35.00'),
+    ('4', 'HEDDFs', 'HEDDF', '100.00'),
+    ('5', 'HRDDFs', 'HRDDF', '75.00'),
+    ('6', 'HENDFs', 'HENDF', '150.00'),
+    ('7', 'HRNDFs', 'HRNDF', '110.00'),
+)
+
+# Devengados de valor único (clave en xml_data['earn'], elemento XML)
+SINGLE_EARN_ELEMENTS = (
+    ('endowment', 'Dotacion'),
+    ('sustainment_support', 'ApoyoSost'),
+    ('telecommuting', 'Teletrabajo'),
+    ('company_withdrawal_bonus', 'BonifRetiro'),
+    ('compensation', 'Indemnizacion'),
+    ('refund', 'Reintegro'),
+)
+
+# Deducciones de valor único (clave en xml_data['deduction'], elemento XML)
+SINGLE_DEDUCTION_ELEMENTS = (
+    ('voluntary_pension', 'PensionVoluntaria'),
+    ('withholding_source', 'RetencionFuente'),
+    ('afc', 'AFC'),
+    ('cooperative', 'Cooperativa'),
+    ('tax_lien', 'EmbargoFiscal'),
+    ('complementary_plans', 'PlanComplementariosSalud'),
+    ('education', 'Educacion'),
+    ('refund', 'Reintegro'),
+    ('debt', 'Deuda'),
+)
+
+LICENSE_ELEMENTS = (
+    ('licensings_maternity_or_paternity_leaves', 'LicenciaMP', True),
+    ('licensings_permit_or_paid_licenses', 'LicenciaR', True),
+    ('licensings_suspension_or_unpaid_leaves', 'LicenciaNR', False),
+)
+
+
+def bucket_overtimes(overtimes):
+    """Agrupa las horas extras/recargos por código de tiempo ('1'..'7')."""
+    buckets = defaultdict(list)
+    for extra in overtimes or []:
+        buckets[str(extra.get('time_code'))].append(extra)
+    return buckets
+
+
+def _sum_values(items, key):
+    """Suma un monto ya formateado sobre una lista de diccionarios."""
+    return '%.2f' % sum(float(item.get(key) or 0.0) for item in items)
+
+
+def transport_totals(transports):
+    """
+    Totales del elemento ``Transporte``: ``_prepare_xml_data`` entrega una
+    lista de diccionarios y el XML lleva un único elemento con las sumas.
+    """
+    return {
+        'assistance': _sum_values(transports, 'assistance'),
+        'viatic': _sum_values(transports, 'viatic'),
+        'non_salary_viatic': _sum_values(transports, 'non_salary_viatic'),
+    }
+
+
+def qweb_values(xml_data):
+    """
+    Aplana ``xml_data['earn']`` y ``xml_data['deduction']`` en las variables
+    ``earn_*`` / ``deduction_*`` que esperan las plantillas QWeb, para que
+    ambos motores de render reciban exactamente los mismos datos.
+    """
+    values = dict(xml_data)
+    for key, value in (xml_data.get('earn') or {}).items():
+        values['earn_%s' % key] = value
+    for key, value in (xml_data.get('deduction') or {}).items():
+        values['deduction_%s' % key] = value
+    if values.get('earn_transports'):
+        values['earn_transports'] = transport_totals(values['earn_transports'])
+    return values
+
+
+class PayrollXmlBuilder(object):
+    """Construye el árbol XML de un documento de nómina electrónica."""
+
+    def __init__(self, xml_data, adjustment=False):
+        self.data = xml_data
+        self.adjustment = adjustment
+        self.ns = NS_NOMINA_AJUSTE if adjustment else NS_NOMINA
+
+    # --- Helpers ---
+
+    def _el(self, parent, tag, attrs=(), text=None):
+        """
+        Crea un subelemento. Los atributos con valor None/False se omiten,
+        igual que hace QWeb con ``t-att-*``.
+        """
+        node = etree.SubElement(parent, '{%s}%s' % (self.ns, tag))
+        for name, value in attrs:
+            if value is None or value is False:
+                continue
+            node.set(name, str(value))
+        if text is not None and text is not False:
+            node.text = str(text)
+        return node
+
+    # --- Secciones ---
+
+    def _build_header(self, root):
+        data = self.data
+        sequence = data.get('sequence') or {}
+        employer = data.get('employer') or {}
+        employee = data.get('employee') or {}
+        provider = data.get('provider') or {}
+        environment = data.get('environment') or {}
+        period = data.get('period') or {}
+        information = data.get('information') or {}
+
+        self._el(root, 'NumeroSecuenciaXML', (
+            ('Numero', sequence.get('number')),
+            ('Prefijo', sequence.get('prefix')),
+            ('CodigoTrabajador', employee.get('worker_code', '')),
+        ))
+        self._el(root, 'LugarGeneracionXML', (
+            ('Pais', employer.get('country_code', 'CO')),
+            ('Departamento', employer.get('department_code')),
+            ('Municipio', employer.get('municipality_code')),
+            ('Idioma', employer.get('language_code', 'es')),
+        ))
+        if provider.get('nit'):
+            self._el(root, 'ProveedorXML', (
+                ('NIT', provider.get('nit')),
+                ('DV', provider.get('dv')),
+                ('SoftwareID', provider.get('software_id')),
+                ('SoftwareSC', provider.get('software_security_code')),
+            ))
+        self._el(root, 'QR')
+
+        general_attrs = [
+            ('Version', 'V1.0: NominaIndividualDeAjuste' if self.adjustment
+             else 'V1.0: NominaIndividual'),
+            ('Ambiente', environment.get('code', '2')),
+            ('TipoXML', data.get('tip_xml')),
+            ('CUNE', data.get('cune')),
+            ('EncripCUNE', 'CONTENIDO_ENCRIPCUNE'),
+            ('FechaGen', period.get('date_issue')),
+            ('HoraGen', period.get('time_issue')),
+            ('PeriodoNomina', information.get('payroll_period_code')),
+            ('TipoMoneda', information.get('currency_code_alpha', 'COP')),
+            ('TRM', information.get('trm', '0.00')),
+        ]
+        if self.adjustment:
+            general_attrs.append(('TipoNota', data.get('note_type')))
+        self._el(root, 'InformacionGeneral', general_attrs)
+
+        predecessor = data.get('predecessor')
+        if self.adjustment and predecessor:
+            self._el(root, 'Predecesor', (
+                ('NumeroSecuenciaXMLPred', predecessor.get('sequence_number')),
+                ('PrefijoPred', predecessor.get('sequence_prefix')),
+                ('CUNEPred', predecessor.get('cune')),
+                ('FechaGenPred', predecessor.get('issue_date')),
+            ))
+
+        novelty = data.get('novelty')
+        if novelty:
+            self._el(root, 'Novedad', (('Codigo', novelty.get('code')),),
+                     novelty.get('text'))
+
+        self._el(root, 'Empleador', (
+            ('RazonSocial', employer.get('name')),
+            ('NIT', employer.get('id_number')),
+            ('DV', employer.get('dv')),
+            ('Pais', employer.get('country_code', 'CO')),
+            ('Departamento', employer.get('department_code')),
+            ('Municipio', employer.get('municipality_code')),
+            ('Direccion', employer.get('address')),
+        ))
+        self._el(root, 'Trabajador', (
+            ('TipoTrabajador', employee.get('type_worker_code')),
+            ('SubTipoTrabajador', employee.get('subtype_worker_code')),
+            ('AltoRiesgoPension', employee.get('high_risk_pension', 'false')),
+            ('TipoDocumento', employee.get('id_code')),
+            ('NumeroDocumento', employee.get('id_number')),
+            ('PrimerApellido', employee.get('surname')),
+            ('SegundoApellido', employee.get('second_surname', '')),
+            ('PrimerNombre', employee.get('first_name')),
+            ('OtrosNombres', employee.get('other_names', '')),
+            ('LugarTrabajoPais', employee.get('country_code', 'CO')),
+            ('LugarTrabajoDepartamento', employee.get('department_code')),
+            ('LugarTrabajoMunicipio', employee.get('municipality_code')),
+            ('LugarTrabajoDireccion', employee.get('address')),
+            ('SalarioIntegral', employee.get('integral_salary', 'false')),
+            ('TipoContrato', employee.get('contract_code')),
+            ('Sueldo', employee.get('salary', '0.00')),
+            ('CodigoTrabajador', employee.get('worker_code', '')),
+        ))
+
+        payment = data.get('payment') or {}
+        self._el(root, 'Pago', (
+            ('Metodo', payment.get('method_code')),
+            ('Banco', payment.get('bank', '')),
+            ('TipoCuenta', payment.get('account_type', '')),
+            ('NumeroCuenta', payment.get('account_number', '')),
+        ))
+        payment_dates = self._el(root, 'FechasPagos')
+        for pay_date in data.get('payment_dates') or []:
+            self._el(payment_dates, 'FechaPago',
+                     (('FechaPago', pay_date.get('date')),))
+
+        self._el(root, 'Periodo', (
+            ('FechaIngreso', period.get('admission_date')),
+            ('FechaRetiro', period.get('withdrawal_date', '')),
+            ('FechaLiquidacionInicio', period.get('settlement_start_date')),
+            ('FechaLiquidacionFin', period.get('settlement_end_date')),
+            ('TiempoLaborado', period.get('amount_time')),
+            ('FechaGen', period.get('date_issue')),
+        ))
+
+    def _build_earn(self, root):
+        earn = self.data.get('earn') or {}
+        node = self._el(root, 'Devengados')
+
+        basic = earn.get('basic')
+        if basic:
+            self._el(node, 'Basico', (
+                ('DiasTrabajados', basic.get('worked_days', 0)),
+                ('SueldoTrabajado', basic.get('worker_salary', '0.00')),
+            ))
+
+        transports = earn.get('transports')
+        if transports:
+            totals = transport_totals(transports)
+            self._el(node, 'Transporte', (
+                ('AuxilioTransporte', totals['assistance']),
+                ('ViaticoManuAlojS', totals['viatic']),
+                ('ViaticoManuAlojNS', totals['non_salary_viatic']),
+            ))
+
+        # Las horas extras se agrupan una sola vez. Como la plantilla QWeb,
+        # si hay alguna se emiten los siete contenedores (vacíos incluidos).
+        overtimes = earn.get('overtimes_surcharges')
+        buckets = bucket_overtimes(overtimes)
+        for time_code, container_tag, tag, default_pct in OVERTIME_ELEMENTS:
+            if not overtimes:
+                break
+            container = self._el(node, container_tag)
+            for extra in buckets.get(time_code, ()):
+                self._el(container, tag, (
+                    ('Cantidad', extra.get('quantity', '0.00')),
+                    ('Porcentaje', extra.get('percentage', default_pct)),
+                    ('Pago', extra.get('payment', '0.00')),
+                    ('HoraInicio', extra.get('start', '')),
+                    ('HoraFin', extra.get('end', '')),
+                ))
+
+        vacation = earn.get('vacation')
+        if vacation:
+            vac_node = self._el(node, 'Vacaciones')
+            if vacation.get('common'):
+                common = self._el(vac_node, 'VacacionesComunes')
+                for vac in vacation['common']:
+                    self._el(common, 'Vacaciones', (
+                        ('Cantidad', vac.get('quantity', 0)),
+                        ('Pago', vac.get('payment', '0.00')),
+                        ('FechaInicio', vac.get('start', '')),
+                        ('FechaFin', vac.get('end', '')),
+                    ))
+            if vacation.get('compensated'):
+                compensated = self._el(vac_node, 'VacacionesCompensadas')
+                for vac in vacation['compensated']:
+                    self._el(compensated, 'Vacaciones', (
+                        ('Cantidad', vac.get('quantity', 0)),
+                        ('Pago', vac.get('payment', '0.00')),
+                    ))
+
+        primas = earn.get('primas')
+        if primas:
+            self._el(node, 'Primas', (
+                ('Cantidad', primas.get('quantity', 0)),
+                ('Pago', primas.get('payment', '0.00')),
+                ('PagoNS', primas.get('non_salary_payment', '0.00')),
+            ))
+
+        layoffs = earn.get('layoffs')
+        if layoffs:
+            self._el(node, 'Cesantias', (
+                ('Pago', layoffs.get('payment', '0.00')),
+                ('Porcentaje', layoffs.get('percentage', '0.00')),
+                ('PagoIntereses', layoffs.get('interest_payment', '0.00')),
+            ))
+
+        incapacities = earn.get('incapacities')
+        if incapacities:
+            inc_node = self._el(node, 'Incapacidades')
+            for inc in incapacities:
+                self._el(inc_node, 'Incapacidad', (
+                    ('Cantidad', inc.get('quantity', 0)),
+                    ('Tipo', inc.get('incapacity_code')),
+                    ('Pago', inc.get('payment', '0.00')),
+                    ('FechaInicio', inc.get('start', '')),
+                    ('FechaFin', inc.get('end', '')),
+                ))
+
+        licensings = earn.get('licensings')
+        if licensings:
+            lic_node = self._el(node, 'Licencias')
+            for key, tag, with_payment in LICENSE_ELEMENTS:
+                items = licensings.get(key)
+                if not items:
+                    continue
+                group = self._el(lic_node, tag)
+                for lic in items:
+                    attrs = [('Cantidad', lic.get('quantity', 0))]
+                    if with_payment:
+                        attrs.append(('Pago', lic.get('payment', '0.00')))
+                    attrs += [('FechaInicio', lic.get('start', '')),
+                              ('FechaFin', lic.get('end', ''))]
+                    self._el(group, 'Licencia', attrs)
+
+        self._build_list(node, earn.get('bonuses'), 'Bonificaciones', 'Bonificacion', (
+            ('BonoS', 'payment', '0.00'), ('BonoNS', 'non_salary_payment', '0.00')))
+        self._build_list(node, earn.get('assistances'), 'Auxilios', 'Auxilio', (
+            ('AuxilioS', 'payment', '0.00'), ('AuxilioNS', 'non_salary_payment', '0.00')))
+        self._build_list(node, earn.get('legal_strikes'), 'HuelgasLegales', 'HuelgaLegal', (
+            ('Cantidad', 'quantity', 0), ('FechaInicio', 'start', ''), ('FechaFin', 'end', '')))
+        self._build_list(node, earn.get('other_concepts'), 'OtrosConceptos', 'OtroConcepto', (
+            ('DescripcionConcepto', 'description', 'Otros Conceptos'),
+            ('ConceptoS', 'payment', '0.00'), ('ConceptoNS', 'non_salary_payment', '0.00')))
+        self._build_list(node, earn.get('compensations'), 'Compensaciones', 'Compensacion', (
+            ('CompensacionO', 'ordinary', '0.00'), ('CompensacionE', 'extraordinary', '0.00')))
+        self._build_list(node, earn.get('vouchers'), 'BonoEPCTVs', 'BonoEPCTV', (
+            ('PagoS', 'payment', '0.00'), ('PagoNS', 'non_salary_payment', '0.00'),
+            ('PagoAlimentacionS', 'salary_food_payment', '0.00'),
+            ('PagoAlimentacionNS', 'non_salary_food_payment', '0.00')))
+        self._build_list(node, earn.get('commissions'), 'Comisiones', 'Comision', (
+            ('Valor', 'payment', '0.00'),))
+        self._build_list(node, earn.get('third_party_payments'), 'PagosTerceros', 'PagoTercero', (
+            ('Valor', 'payment', '0.00'),))
+        self._build_list(node, earn.get('advances'), 'Anticipos', 'Anticipo', (
+            ('Valor', 'payment', '0.00'),))
+
+        for key, tag in SINGLE_EARN_ELEMENTS:
+            if earn.get(key):
+                self._el(node, tag, (('Valor', earn[key]),))
+
+        self._el(node, 'DevengadosTotal', text=self.data.get('accrued_total'))
+
+    def _build_deduction(self, root):
+        deduction = self.data.get('deduction') or {}
+        node = self._el(root, 'Deducciones')
+
+        health = deduction.get('health')
+        if health:
+            self._el(node, 'Salud', (
+                ('Porcentaje', health.get('percentage', '0.00')),
+                ('Deduccion', health.get('payment', '0.00')),
+            ))
+
+        pension = deduction.get('pension_fund')
+        if pension:
+            pension_node = self._el(node, 'FondoPension')
+            self._el(pension_node, 'Pension', (
+                ('Porcentaje', pension.get('percentage', '0.00')),
+                ('Deduccion', pension.get('payment', '0.00')),
+            ))
+
+        fsp = deduction.get('pension_security_fund')
+        if fsp:
+            fsp_node = self._el(node, 'FondoSP')
+            self._el(fsp_node, 'FondoSP', (
+                ('Porcentaje', fsp.get('percentage', '0.00')),
+                ('DeduccionSP', fsp.get('payment', '0.00')),
+                ('PorcentajeSub', fsp.get('percentage_subsistence', '0.00')),
+                ('DeduccionSub', fsp.get('payment_subsistence', '0.00')),
+            ))
+
+        self._build_list(node, deduction.get('trade_unions'), 'Sindicatos', 'Sindicato', (
+            ('Porcentaje', 'percentage', '0.00'), ('Deduccion', 'payment', '0.00')))
+        self._build_list(node, deduction.get('sanctions'), 'Sanciones', 'Sancion', (
+            ('SancionPublica', 'payment_public', '0.00'),
+            ('SancionPrivada', 'payment_private', '0.00')))
+        self._build_list(node, deduction.get('libranzas'), 'Libranzas', 'Libranza', (
+            ('Descripcion', 'description', ''), ('Valor', 'payment', '0.00')))
+        self._build_list(node, deduction.get('third_party_payments'), 'PagosTerceros', 'PagoTercero', (
+            ('Valor', 'payment', '0.00'),))
+        self._build_list(node, deduction.get('advances'), 'Anticipos', 'Anticipo', (
+            ('Valor', 'payment', '0.00'),))
+        self._build_list(node, deduction.get('other_deductions'), 'OtrasDeducciones', 'OtraDeduccion', (
+            ('Valor', 'payment', '0.00'),))
+
+        for key, tag in SINGLE_DEDUCTION_ELEMENTS:
+            if deduction.get(key):
+                self._el(node, tag, (('Valor', deduction[key]),))
+
+        self._el(node, 'DeduccionesTotal', text=self.data.get('deductions_total'))
+
+    def _build_list(self, parent, items, container_tag, tag, attr_spec):
+        """Emite un contenedor con un elemento por cada diccionario de ``items``."""
+        if not items:
+            return
+        container = self._el(parent, container_tag)
+        for item in items:
+            self._el(container, tag, [
+                (attr, item.get(key, default)) for attr, key, default in attr_spec
+            ])
+
+    # --- API pública ---
+
+    def build(self):
+        """Devuelve el elemento raíz del documento."""
+        root_tag = 'NominaIndividualDeAjuste' if self.adjustment else 'NominaIndividual'
+        nsmap = dict(NSMAP_EXTRA)
+        nsmap[None] = self.ns
+        root = etree.Element('{%s}%s' % (self.ns, root_tag), nsmap=nsmap)
+
+        self._build_header(root)
+        self._build_earn(root)
+        self._build_deduction(root)
+
+        self._el(root, 'Redondeo', text=self.data.get('rounding') or '0.00')
+        self._el(root, 'ComprobanteTotal', text=self.data.get('total'))
+
+        notes = self.data.get('notes')
+        if notes:
+            notes_node = self._el(root, 'Notas')
+            for note_item in notes:
+                self._el(notes_node, 'Nota', text=note_item.get('text'))
+        return root
+
+    def tostring(self):
+        """Serializa el documento a bytes UTF-8 con declaración XML."""
+        return etree.tostring(self.build(), xml_declaration=True, encoding='UTF-8')
+
+
+def build_payroll_xml(xml_data, adjustment=False):
+    """Atajo: construye y serializa el XML de nómina a partir de ``xml_data``."""
+    return PayrollXmlBuilder(xml_data, adjustment=adjustment).tostring()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Autochequeo local del XML de nómina contra los XSD incluidos en ``data/xsd``.
+
+Esos XSD los escribió el módulo siguiendo el Anexo Técnico y el orden en que
+él mismo genera el XML; no son los esquemas oficiales de la DIAN (por ejemplo,
+la nota de ajuste no distingue Reemplazar/Eliminar). Detectan regresiones del
+XML generado, pero no garantizan que la DIAN lo acepte.
+
+Cada esquema se compila una sola vez por proceso en un ``etree.XMLSchema``
+y se reutiliza para todos los documentos, antes de firmar y sin ninguna
+llamada de red.
+"""
+
+import os
+from functools import lru_cache
+
+from lxml import etree
+
+XSD_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'xsd')
+
+XSD_NOMINA = 'NominaIndividualElectronicaXSD.xsd'
+XSD_NOMINA_AJUSTE = 'NominaIndividualDeAjusteElectronicaXSD.xsd'
+
+
+@lru_cache(maxsize=None)
+def get_payroll_schema(adjustment=False):
+    """``etree.XMLSchema`` compilado (cacheado) para nómina o nota de ajuste."""
+    xsd_path = os.path.join(XSD_DIR, XSD_NOMINA_AJUSTE if adjustment else XSD_NOMINA)
+    # Parser sin red: los XSD y sus include se resuelven solo en disco
+    parser = etree.XMLParser(no_network=True, resolve_entities=False)
+    return etree.XMLSchema(etree.parse(xsd_path, parser))
+
+
+def validate_payroll_xml(xml_content, adjustment=False):
+    """
+    Valida ``xml_content`` (bytes o elemento lxml). Devuelve la lista de
+    violaciones como ``'ruta: mensaje'`` (vacía si el documento es válido).
+    """
+    if isinstance(xml_content, (bytes, str)):
+        if isinstance(xml_content, str):
+            xml_content = xml_content.encode('utf-8')
+        parser = etree.XMLParser(no_network=True, resolve_entities=False)
+        try:
+            document = etree.fromstring(xml_content, parser)
+        except etree.XMLSyntaxError as e:
+            return ['XML mal formado: %s' % e]
+    else:
+        document = xml_content
+
+    schema = get_payroll_schema(adjustment)
+    if schema.validate(document):
+        return []
+    return ['%s: %s' % (error.path, error.message) for error in schema.error_log]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+"""
+Empaquetado en memoria de varios XML firmados en sobres ZIP para la DIAN.
+
+Los sobres se arman en ``io.BytesIO`` (sin archivos temporales) respetando
+los límites de documentos y tamaño por envío. Cada sobre conserva la
+referencia de los registros que contiene para enlazar el ZipKey devuelto
+en una sola escritura.
+"""
+
+import io
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+
+# Límites por sobre (envíos asíncronos / set de pruebas DIAN)
+MAX_DOCUMENTS_PER_ZIP = 50
+MAX_ZIP_BYTES = 2 * 1024 * 1024
+
+# Cabecera local + entrada del directorio central por archivo (aprox., sin el nombre)
+_ZIP_ENTRY_OVERHEAD = 80
+
+
+@dataclass(slots=True)
+class PayrollZipEnvelope:
+    """Sobre ZIP listo para enviar y los documentos que contiene."""
+    name: str
+    content: bytes = b''
+    filenames: list = field(default_factory=list)
+    refs: list = field(default_factory=list)
+
+
+def zip_envelope_name(nit, index, when=None):
+    """Nombre del sobre: z + NIT (10 dígitos) + fecha/hora + índice."""
+    when = when or datetime.now()
+    digits = ''.join(ch for ch in str(nit or '') if ch.isdigit())
+    return 'z%010d%s%03d.zip' % (int(digits or 0), when.strftime('%y%m%d%H%M%S'), index)
+
+
+class PayrollZipPackager(object):
+    """
+    Agrupa documentos ``(nombre_xml, bytes_xml, ref)`` en sobres ZIP
+    comprimidos sin superar ``max_documents`` ni ``max_bytes`` por sobre.
+    """
+
+    def __init__(self, nit, max_documents=MAX_DOCUMENTS_PER_ZIP, max_bytes=MAX_ZIP_BYTES):
+        self.nit = nit
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.when = datetime.now()
+
+    def _new_envelope(self, index):
+        return PayrollZipEnvelope(name=zip_envelope_name(self.nit, index, self.when))
+
+    @staticmethod
+    def _write(entries):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for filename, xml_content in entries:
+                archive.writestr(filename, xml_content)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _entry_size(filename, xml_content):
+        """Tamaño estimado del miembro dentro del ZIP (cada miembro se comprime por separado)."""
+        return len(zlib.compress(xml_content)) + _ZIP_ENTRY_OVERHEAD + 2 * len(filename)
+
+    def package(self, documents):
+        """Devuelve la lista de ``PayrollZipEnvelope`` para ``documents``."""
+        envelopes = []
+        entries = []
+        size = 0
+        envelope = self._new_envelope(1)
+        for filename, xml_content, ref in documents:
+            entry_size = self._entry_size(filename, xml_content)
+            # Un documento solo siempre cabe, aunque supere el límite de tamaño
+            if entries and (len(entries) >= self.max_documents
+                            or size + entry_size > self.max_bytes):
+                envelope.content = self._write(entries)
+                envelopes.append(envelope)
+                envelope = self._new_envelope(len(envelopes) + 1)
+                entries = []
+                size = 0
+            entries.append((filename, xml_content))
+            size += entry_size
+            envelope.filenames.append(filename)
+            envelope.refs.append(ref)
+        if entries:
+            envelope.content = self._write(entries)
+            envelopes.append(envelope)
+        return envelopes
@@ -1,5 +1,13 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models, api
+import base64
+import json
+from hashlib import sha256
+
+from odoo import fields, models, api, _
+from odoo.exceptions import UserError
+
+from .payroll_signature import (
+    get_cached_key_material, invalidate_key_material, load_key_material, sign_payroll_xml_batch)
 
 
 class ResCompany(models.Model):
@@ -36,6 +44,12 @@ class ResCompany(models.Model):
         groups="base.group_system",  # Solo visible para administradores del sistema
         help="Token de autorización Bearer para la APIDIAN. Se obtiene al configurar la compañía en la API."
     )
+    l10n_co_payroll_api_max_connections = fields.Integer(
+        string="Conexiones Simultáneas (APIDIAN)",
+        default=4,
+        help="Máximo de llamadas simultáneas a la APIDIAN de esta compañía en envíos por lote. "
+             "Cada compañía usa su propio pool de conexiones."
+    )
     l10n_co_payroll_software_id = fields.Char(
         string="Software ID DIAN (API Nómina)",
         help="ID del software asignado por la DIAN para Nómina Electrónica, usado por la API."
@@ -79,6 +93,16 @@ class ResCompany(models.Model):
         string="Resolución de Nómina por Defecto",
         help="Seleccione la resolución que se usará por defecto para los documentos de nómina electrónica."
     )
+    l10n_co_nomina_payslip_resolution_numbering = fields.Boolean(
+        string="Numerar Nóminas con la Resolución DIAN",
+        help="Si está activo, las nóminas toman su número (prefijo + consecutivo) de la resolución "
+             "activa en bloques reservados, en lugar de la secuencia 'salary.slip'."
+    )
+    l10n_co_nomina_batch_move_by_cost_center = fields.Boolean(
+        string="Asiento de Nómina por Centro de Costo",
+        help="En la contabilización en lote, genera un asiento por centro de costo (cuenta analítica "
+             "del contrato) dentro de cada diario y lote, en lugar de uno solo."
+    )
     l10n_co_payroll_test_set_id = fields.Char(
         string="ID del Set de Pruebas DIAN",
         help="Introduce el Identificador del Set de Pruebas (TestSetId) proporcionado por la DIAN para el ambiente de habilitación."
@@ -98,3 +122,60 @@ class ResCompany(models.Model):
         ('mensual', 'Mensual'),
         ('quincenal', 'Quincenal')
     ], default='quincenal', string="Periodicidad de Nómina")
+
+    l10n_co_payroll_api_sync_hashes = fields.Text(
+        string="Estado de Sincronización APIDIAN",
+        copy=False, readonly=True,
+        help="Hash por elemento (software, certificado, resoluciones) del último envío "
+             "exitoso a APIDIAN. Solo se reenvía lo que cambió."
+    )
+
+    def _get_payroll_api_sync_hashes(self):
+        self.ensure_one()
+        try:
+            return json.loads(self.sudo().l10n_co_payroll_api_sync_hashes or '{}')
+        except ValueError:
+            return {}
+
+    def _set_payroll_api_sync_hashes(self, hashes):
+        self.ensure_one()
+        value = json.dumps(hashes, sort_keys=True)
+        if value != (self.sudo().l10n_co_payroll_api_sync_hashes or ''):
+            self.sudo().write({'l10n_co_payroll_api_sync_hashes': value})
+
+    # === Material del certificado (cache en memoria del worker) ===
+
+    def _get_payroll_key_material(self):
+        """
+        Llave privada y certificado .p12 parseados, cacheados por proceso
+        según el checksum del certificado. Nunca se guardan en claro.
+        """
+        self.ensure_one()
+        # El checksum del adjunto evita leer el binario cuando ya está en cache
+        checksum = self._get_payroll_certificate_checksum()
+        if not checksum:
+            raise UserError(_("La compañía %s no tiene certificado digital (.p12) cargado.") % self.name)
+        password = self.l10n_co_payroll_certificate_password or ''
+        cache_key = (
+            self.env.cr.dbname,
+            self.id,
+            checksum,
+            sha256(password.encode('utf-8')).hexdigest(),
+        )
+
+        def _loader():
+            try:
+                return load_key_material(
+                    base64.b64decode(self.l10n_co_payroll_certificate_file), password)
+            except ValueError as e:
+                raise UserError(_("No se pudo abrir el certificado .p12 (¿contraseña incorrecta?): %s") % e)
+
+        return get_cached_key_material(cache_key, _loader)
+
+    def _invalidate_payroll_certificate_cache(self):
+        invalidate_key_material(self.env.cr.dbname, self.ids)
+
+    def _l10n_co_payroll_sign_xml_batch(self, xml_documents):
+        """Firma (XAdES-EPES) una lista de XML de nómina con una sola carga de la llave."""
+        self.ensure_one()
+        return sign_payroll_xml_batch(xml_documents, self._get_payroll_key_material())
@@ -48,6 +48,11 @@ class ResConfigSettings(models.TransientModel):
         readonly=False,
         groups="base.group_system"
     )
+    l10n_co_payroll_api_max_connections = fields.Integer(
+        related='company_id.l10n_co_payroll_api_max_connections',
+        string="Conexiones Simultáneas (APIDIAN)",
+        readonly=False
+    )
     l10n_co_payroll_software_id = fields.Char(
         related='company_id.l10n_co_payroll_software_id',
         string="Software ID DIAN (API Nómina)",
@@ -90,6 +95,14 @@ class ResConfigSettings(models.TransientModel):
         readonly=False,
         string="Resolución de Nómina por Defecto"
     )
+    l10n_co_nomina_payslip_resolution_numbering = fields.Boolean(
+        related='company_id.l10n_co_nomina_payslip_resolution_numbering',
+        readonly=False
+    )
+    l10n_co_nomina_batch_move_by_cost_center = fields.Boolean(
+        related='company_id.l10n_co_nomina_batch_move_by_cost_center',
+        readonly=False
+    )
     prefix = fields.Char(
         string="Prefijo (de la resolución por defecto)",
         related='company_id.l10n_co_nomina_default_resolution_id.prefix',
@@ -128,49 +141,52 @@ class ResConfigSettings(models.TransientModel):
     def action_sync_apidian_config(self):
         """
         Llamado por el botón en la vista de configuración.
-        Envía toda la configuración de la compañía a la API de APIDIAN.
+        Envía a APIDIAN solo los elementos de configuración de la compañía
+        (software, certificado, resoluciones) que cambiaron desde el último
+        envío exitoso, en paralelo, y reporta el resultado de cada uno.
         """
         self.ensure_one()
+        return self._sync_apidian_config(force=False)
+
+    def action_force_sync_apidian_config(self):
+        """Reenvía toda la configuración aunque no haya cambiado."""
+        self.ensure_one()
+        return self._sync_apidian_config(force=True)
+
+    def _sync_apidian_config(self, force=False):
         _logger.info(
             "Iniciando sincronización de configuración con APIDIAN...")
         company = self.env.company
         connector = self.env['l10n_co_nomina.payroll.api.connector']
 
         try:
-            # 1. Configurar Software de Nómina
-            if company.l10n_co_payroll_software_id and company.l10n_co_payroll_software_pin:
-                _logger.info("Enviando configuración de Software de Nómina...")
-                connector.config_software_payroll(
-                    company.l10n_co_payroll_software_id,
-                    company.l10n_co_payroll_software_pin
-                )
-
-            # 2. Configurar Certificado Digital (Usando el método que crearemos en el conector)
-            if company.l10n_co_payroll_certificate_file and company.l10n_co_payroll_certificate_password:
-                _logger.info("Enviando Certificado Digital...")
-                connector.config_certificate()  # Este método lo crearemos a continuación
-
-            # 3. Configurar Resoluciones (Iterando sobre el nuevo modelo)
-            if company.l10n_co_payroll_resolution_ids:
-                _logger.info("Enviando %d resoluciones...", len(
-                    company.l10n_co_payroll_resolution_ids))
-                # Pasamos el recordset completo al método del conector
-                connector.config_resolution_payroll(
-                    company.l10n_co_payroll_resolution_ids)
-
-            _logger.info("Sincronización con APIDIAN completada exitosamente.")
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Éxito'),
-                    'message': _('La configuración se ha sincronizado correctamente con la API.'),
-                    'type': 'success',
-                    'sticky': False,
-                }
-            }
+            results = connector.sync_company_config(company, force=force)
+        except UserError:
+            raise
         except Exception as e:
             _logger.error(
                 "Error durante la sincronización con APIDIAN: %s", str(e))
             raise UserError(
                 _("Fallo la sincronización con la API: %s") % str(e))
+
+        labels = {'sent': _("enviado"), 'unchanged': _("sin cambios"), 'error': _("error")}
+        lines = []
+        for result in results:
+            line = "%s: %s" % (result['label'], labels[result['status']])
+            if result['status'] == 'error':
+                line = "%s (%s)" % (line, result['message'])
+            lines.append(line)
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        errors = sum(1 for result in results if result['status'] == 'error')
+        _logger.info("Sincronización con APIDIAN: %s enviado(s), %s sin cambios, %s con error.",
+                     sent, len(results) - sent - errors, errors)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Sincronización con APIDIAN') if errors else _('Éxito'),
+                'message': "\n".join(lines) or _('No hay configuración para sincronizar.'),
+                'type': 'warning' if errors else 'success',
+                'sticky': bool(errors),
+            }
+        }
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+from . import test_payroll_document
+from . import test_payroll_xml_builder
+from . import test_payroll_json_batch
+from . import test_payroll_edi_proxy
+from . import test_payroll_signature
+from . import test_payroll_zip_send
+from . import test_payroll_test_set_runner
+from . import test_payroll_edi_gen
+from . import test_payroll_edi_consolidated
+from . import test_payroll_resolution
+from . import test_payroll_batch_move
+from . import test_payroll_month_end_run
+from . import test_payroll_api_connector
+from . import test_payroll_api_guard
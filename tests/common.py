@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from odoo.tests import TransactionCase
+
+
+class PayrollCommon(TransactionCase):
+    """
+    Datos mínimos para probar nóminas hechas sin pasar por el cálculo de
+    reglas: estructura y reglas propias, resolución, ciudad con código
+    APIDIAN y empleados con contrato. Las líneas de cada nómina se crean
+    directamente con ``_create_payslip``.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.company
+        cls.country_co = cls.env.ref('base.co')
+        cls.city = cls.env['res.city'].create({
+            'name': 'Bogotá', 'country_id': cls.country_co.id, 'apidian_code': '149',
+        })
+        cls.resolution = cls.env['l10n_co_nomina.resolution'].create({
+            'company_id': cls.company.id,
+            'type_document_id': '9',
+            'prefix': 'NE',
+            'resolution_number': '18760000001',
+            'from_number': 1,
+            'to_number': 5000,
+        })
+        cls.company.write({
+            'edi_payroll_enable': True,
+            'l10n_co_nomina_default_resolution_id': cls.resolution.id,
+        })
+
+        cls.structure_type = cls.env['hr.payroll.structure.type'].create({'name': 'CO Test'})
+        cls.structure = cls.env['hr.payroll.structure'].create({
+            'name': 'CO Test', 'type_id': cls.structure_type.id,
+        })
+        category = cls.env['hr.salary.rule.category'].create({'name': 'Test', 'code': 'TESTCO'})
+
+        def _rule(code, **vals):
+            return cls.env['hr.salary.rule'].create(dict({
+                'name': code, 'code': code, 'struct_id': cls.structure.id,
+                'category_id': category.id,
+            }, **vals))
+
+        cls.rule_basic = _rule('TBASIC', type_concept='earn', earn_category='basic')
+        cls.rule_transport = _rule('TAUX', type_concept='earn', earn_category='transports_assistance')
+        cls.rule_bonus = _rule('TBONO', type_concept='earn', earn_category=False)
+        cls.rule_health = _rule('TSALUD', type_concept='deduction', deduction_category='health')
+        cls.rule_pension = _rule('TPENSION', type_concept='deduction', deduction_category='pension_fund')
+        cls.rule_net = _rule('TNETO', type_concept='other')
+
+        cls.period_monthly = cls.env.ref('l10n_co_nomina.payroll_period_5')
+        cls.period_biweekly = cls.env.ref('l10n_co_nomina.payroll_period_4')
+        cls.period_weekly = cls.env.ref('l10n_co_nomina.payroll_period_1')
+        cls._employee_seq = 0
+        cls._number_seq = 0
+
+    @classmethod
+    def _create_employee(cls, name=None):
+        cls._employee_seq += 1
+        name = name or 'Empleado %s' % cls._employee_seq
+        address = cls.env['res.partner'].create({
+            'name': name, 'street': 'Calle %s' % cls._employee_seq,
+            'city_id': cls.city.id, 'country_id': cls.country_co.id,
+        })
+        return cls.env['hr.employee'].create({
+            'name': name,
+            'company_id': cls.company.id,
+            'address_id': address.id,
+            'identification_id': str(1000000000 + cls._employee_seq),
+        })
+
+    @classmethod
+    def _create_contract(cls, employee, date_start, date_end=False, period=None, wage=1423500.0):
+        return cls.env['hr.contract'].create({
+            'name': 'Contrato %s' % employee.name,
+            'employee_id': employee.id,
+            'company_id': cls.company.id,
+            'structure_type_id': cls.structure_type.id,
+            'payroll_period_id': (period or cls.period_monthly).id,
+            'date_start': date_start,
+            'date_end': date_end,
+            'wage': wage,
+            'state': 'open',
+        })
+
+    @classmethod
+    def _create_payslip(cls, contract, date_from, date_to, lines=None, state='done', number=None, **vals):
+        """
+        Nómina de ``contract`` con las líneas ``lines`` (lista de
+        ``(regla, importe, cantidad)``), llevada directamente a ``state``.
+        """
+        payslip = cls.env['hr.payslip'].create(dict({
+            'name': 'Nómina %s %s' % (contract.employee_id.name, date_from),
+            'employee_id': contract.employee_id.id,
+            'contract_id': contract.id,
+            'struct_id': cls.structure.id,
+            'company_id': cls.company.id,
+            'date_from': date_from,
+            'date_to': date_to,
+            'payment_date': date_to,
+        }, **vals))
+        if lines is None:
+            lines = [
+                (cls.rule_basic, 1423500.0, 30.0),
+                (cls.rule_transport, 200000.0, 1.0),
+                (cls.rule_health, -56940.0, 1.0),
+                (cls.rule_pension, -56940.0, 1.0),
+            ]
+        cls.env['hr.payslip.line'].create([{
+            'slip_id': payslip.id,
+            'salary_rule_id': rule.id,
+            'name': rule.name,
+            'code': rule.code,
+            'amount': amount,
+            'quantity': quantity,
+            'rate': 100.0,
+        } for rule, amount, quantity in lines])
+        if number is None:
+            cls._number_seq += 1
+            number = 'NE%s' % cls._number_seq
+        payslip.write({'state': state, 'number': number})
+        return payslip
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from ..models import payroll_api_client
+from ..models.payroll_api_client import ERROR_VALIDATION, ApiClient, PayrollApiError
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollApiClients(PayrollCommon):
+    """Un cliente APIDIAN por compañía: configuración, pool y límite de concurrencia propios."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company.write({
+            'l10n_co_payroll_api_url': 'https://apidian-a.test/',
+            'l10n_co_payroll_api_token': 'token-a',
+            'l10n_co_payroll_api_max_connections': 3,
+        })
+        cls.company_b = cls.env['res.company'].create({
+            'name': 'Compañía B',
+            'l10n_co_payroll_api_url': 'https://apidian-b.test',
+            'l10n_co_payroll_api_token': 'token-b',
+            'l10n_co_payroll_api_max_connections': 2,
+        })
+        cls.Connector = cls.env['l10n_co_nomina.payroll.api.connector']
+
+    def setUp(self):
+        super().setUp()
+        self.startPatcher(patch.dict(payroll_api_client._CLIENT_CACHE, clear=True))
+
+    def _slots(self, client):
+        """Llamadas simultáneas que admite el semáforo del cliente."""
+        acquired = 0
+        while client.semaphore.acquire(blocking=False):
+            acquired += 1
+        for __ in range(acquired):
+            client.semaphore.release()
+        return acquired
+
+    def test_one_client_per_company(self):
+        client_a = self.Connector._get_api_client(self.company)
+        client_b = self.Connector._get_api_client(self.company_b)
+
+        self.assertEqual((client_a.company_id, client_a.api_url, client_a.api_token),
+                         (self.company.id, 'https://apidian-a.test/', 'token-a'))
+        self.assertEqual((client_b.company_id, client_b.api_url, client_b.api_token),
+                         (self.company_b.id, 'https://apidian-b.test', 'token-b'))
+        self.assertIsNot(client_a.session, client_b.session)
+        self.assertEqual(self._slots(client_a), 3)
+        self.assertEqual(self._slots(client_b), 2)
+        self.assertEqual(client_b.session.get_adapter('https://apidian-b.test')._pool_maxsize, 2)
+        # Por defecto, la compañía activa
+        self.assertIs(self.Connector._get_api_client(), client_a)
+
+    def test_client_is_cached_until_config_changes(self):
+        client = self.Connector._get_api_client(self.company_b)
+        self.assertIs(self.Connector._get_api_client(self.company_b), client)
+
+        # El cliente anterior no se cierra: otro hilo puede estar usándolo
+        with patch.object(client.session, 'close') as close:
+            self.company_b.l10n_co_payroll_api_token = 'token-b2'
+            rebuilt = self.Connector._get_api_client(self.company_b)
+        close.assert_not_called()
+        self.assertIsNot(rebuilt, client)
+        self.assertEqual(rebuilt.api_token, 'token-b2')
+
+        self.company_b.l10n_co_payroll_api_max_connections = 5
+        resized = self.Connector._get_api_client(self.company_b)
+        self.assertIsNot(resized, rebuilt)
+        self.assertEqual(self._slots(resized), 5)
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollConfigSync(PayrollCommon):
+    """Sincronización de configuración con APIDIAN: solo se reenvía lo que cambió."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company.write({
+            'l10n_co_payroll_api_url': 'https://apidian.test',
+            'l10n_co_payroll_api_token': 'token',
+            'l10n_co_payroll_software_id': 'software-nomina',
+            'l10n_co_payroll_software_pin': '12345',
+        })
+        cls.Connector = cls.env['l10n_co_nomina.payroll.api.connector']
+        cls.resolution_key = 'resolution:%s' % cls.resolution.id
+
+    def setUp(self):
+        super().setUp()
+        self.startPatcher(patch.dict(payroll_api_client._CLIENT_CACHE, clear=True))
+        self.calls = []
+        self.failing_endpoints = set()
+
+        def request(client, endpoint, method='POST', json_data=None, **kwargs):
+            self.calls.append((endpoint, method, json_data))
+            if endpoint in self.failing_endpoints:
+                raise PayrollApiError(ERROR_VALIDATION, 'El prefijo no es válido', 422)
+            return {'success': True, 'message': '%s actualizado' % endpoint}
+
+        self.startPatcher(patch.object(ApiClient, 'request', autospec=True, side_effect=request))
+
+    def _sync(self, force=False):
+        self.calls = []
+        results = self.Connector.sync_company_config(self.company, force=force)
+        return {result['key']: result for result in results}
+
+    def test_only_changed_items_are_sent(self):
+        results = self._sync()
+        self.assertEqual(results['software']['status'], 'sent')
+        self.assertEqual(results['software']['message'], 'config/softwarepayroll actualizado')
+        self.assertEqual(results[self.resolution_key]['status'], 'sent')
+        self.assertEqual(len(self.calls), len(results))
+        self.assertEqual({method for __, method, __ in self.calls}, {'PUT'})
+
+        # Sin cambios no se llama a la API
+        results = self._sync()
+        self.assertEqual({result['status'] for result in results.values()}, {'unchanged'})
+        self.assertFalse(self.calls)
+
+        # Una resolución modificada se reenvía sola
+        self.resolution.to_number = 6000
+        results = self._sync()
+        self.assertEqual(results[self.resolution_key]['status'], 'sent')
+        self.assertEqual(self.calls, [('config/resolution', 'PUT', {
+            'type_document_id': 9, 'prefix': 'NE', 'from': 1, 'to': 6000,
+        })])
+        self.assertEqual(results['software']['status'], 'unchanged')
+
+        # Con force se reenvía todo
+        results = self._sync(force=True)
+        self.assertEqual({result['status'] for result in results.values()}, {'sent'})
+        self.assertEqual(len(self.calls), len(results))
+
+    def test_each_item_reports_its_result(self):
+        self.failing_endpoints.add('config/resolution')
+        results = self._sync()
+        self.assertEqual(results['software']['status'], 'sent')
+        self.assertEqual(results[self.resolution_key]['status'], 'error')
+        self.assertIn('El prefijo no es válido', results[self.resolution_key]['message'])
+        self.assertEqual(results[self.resolution_key]['company'], self.company)
+
+        # El elemento fallido no guarda hash: se reintenta en la siguiente sincronización
+        self.failing_endpoints.clear()
+        results = self._sync()
+        self.assertEqual(results[self.resolution_key]['status'], 'sent')
+        self.assertEqual(results['software']['status'], 'unchanged')
+        self.assertEqual([endpoint for endpoint, __, __ in self.calls], ['config/resolution'])
+
+        # Cambiar el token invalida todos los hashes
+        self.company.l10n_co_payroll_api_token = 'otro-token'
+        results = self._sync()
+        self.assertEqual({result['status'] for result in results.values()}, {'sent'})
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+import os
+import tempfile
+from email.utils import formatdate
+from unittest.mock import patch
+
+from odoo.tests import BaseCase, tagged
+
+from ..models import payroll_api_client, payroll_api_guard
+from ..models.payroll_api_client import ERROR_HTTP, ERROR_RATE_LIMITED, PayrollApiError, api_request
+from ..models.payroll_api_guard import (
+    CLOSED, HALF_OPEN, OPEN, ApiGuard, CircuitOpenError, RateLimitedError, parse_retry_after)
+
+
+class FakeClock:
+    """Reloj manual: ``sleep`` avanza el tiempo en lugar de esperar."""
+
+    def __init__(self, now=1700000000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollApiGuard(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(state_dir.cleanup)
+        self.state_dir = state_dir.name
+        self.clock = FakeClock()
+        self.startPatcher(patch.object(payroll_api_guard, 'time', self.clock))
+
+    def _guard(self, name='https://apidian.test', **kwargs):
+        kwargs = dict({'failure_threshold': 3, 'reset_timeout': 60.0, 'rate': 2.0, 'burst': 2,
+                       'max_wait': 10.0}, **kwargs)
+        return ApiGuard(name, self.state_dir, **kwargs)
+
+    # ------------------------------------------------------------------
+    # Circuito
+    # ------------------------------------------------------------------
+
+    def test_circuit_opens_after_threshold(self):
+        guard = self._guard()
+        for __ in range(2):
+            guard.record_failure()
+            guard.before_call()
+        self.assertEqual(guard.status()['state'], CLOSED)
+
+        with self.assertLogs(payroll_api_guard.__name__, 'WARNING'):
+            guard.record_failure()
+        self.assertEqual(guard.status()['state'], OPEN)
+        with self.assertRaises(CircuitOpenError) as caught:
+            guard.before_call()
+        self.assertEqual((caught.exception.retry_in, caught.exception.failures), (60.0, 3))
+
+        self.clock.now += 20
+        with self.assertRaises(CircuitOpenError) as caught:
+            guard.before_call()
+        self.assertEqual(caught.exception.retry_in, 40.0)
+
+        # Un éxito antes del umbral reinicia la cuenta
+        other = self._guard('https://otra.test')
+        other.record_failure()
+        other.record_failure()
+        other.record_success()
+        other.record_failure()
+        self.assertEqual(other.status(), dict(other.status(), state=CLOSED, failures=1))
+
+    def test_half_open_allows_a_single_probe(self):
+        guard = self._guard()
+        with self.assertLogs(payroll_api_guard.__name__, 'WARNING'):
+            for __ in range(3):
+                guard.record_failure()
+
+        self.clock.now += 60
+        guard.before_call()
+        self.assertEqual(guard.status()['state'], HALF_OPEN)
+        # Mientras la prueba está en curso no pasa nadie más
+        with self.assertRaises(CircuitOpenError):
+            guard.before_call()
+
+        # La prueba falla: el circuito se abre otra vez
+        guard.record_failure()
+        self.assertEqual(guard.status()['state'], OPEN)
+        with self.assertRaises(CircuitOpenError):
+            guard.before_call()
+
+        # Una prueba que nunca respondió se reemplaza tras reset_timeout
+        self.clock.now += 60
+        guard.before_call()
+        self.clock.now += 60
+        guard.before_call()
+        self.assertEqual(guard.status()['state'], HALF_OPEN)
+
+        # La prueba responde: el circuito se cierra
+        guard.record_success()
+        self.assertEqual(guard.status()['state'], CLOSED)
+        self.assertEqual(guard.status()['failures'], 0)
+        guard.before_call()
+
+    def test_state_is_shared_through_the_file(self):
+        with self.assertLogs(payroll_api_guard.__name__, 'WARNING'):
+            for __ in range(3):
+                self._guard().record_failure()
+        # Otra instancia (otro worker) de la misma API ve el circuito abierto
+        with self.assertRaises(CircuitOpenError):
+            self._guard().before_call()
+        self._guard('https://otra.test').before_call()
+
+        # Un archivo corrupto se reinicia
+        with open(self._guard().state.path, 'w', encoding='utf-8') as state_file:
+            state_file.write('{no es json')
+        with self.assertLogs(payroll_api_guard.__name__, 'WARNING'):
+            self.assertEqual(self._guard().status()['state'], CLOSED)
+
+    # ------------------------------------------------------------------
+    # Limitador de tasa
+    # ------------------------------------------------------------------
+
+    def test_token_bucket_refills(self):
+        guard = self._guard()
+        now = self.clock.now
+        self.assertEqual(guard._reserve(now), 0.0)
+        self.assertEqual(guard._reserve(now), 0.0)
+        # Ráfaga agotada: a 2 req/s la siguiente ficha llega en medio segundo
+        self.assertEqual(guard._reserve(now), 0.5)
+        self.assertEqual(guard._reserve(now + 0.5), 0.0)
+        # Tras una pausa larga se recupera solo hasta la ráfaga
+        self.assertEqual(guard._reserve(now + 100), 0.0)
+        self.assertEqual(guard._reserve(now + 100), 0.0)
+        self.assertEqual(guard._reserve(now + 100), 0.5)
+
+    def test_acquire_waits_or_gives_up(self):
+        guard = self._guard()
+        self.assertEqual(guard.acquire(), 0.0)
+        self.assertEqual(guard.acquire(), 0.0)
+        self.assertEqual(guard.acquire(), 0.5)
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+        impatient = self._guard('https://otra.test', max_wait=0.1)
+        impatient.acquire()
+        impatient.acquire()
+        with self.assertRaises(RateLimitedError) as caught:
+            impatient.acquire()
+        self.assertEqual(caught.exception.retry_in, 0.5)
+
+    def test_throttled_halves_rate_and_honours_retry_after(self):
+        guard = self._guard(rate=4.0, burst=4, min_rate=1.5)
+        guard.record_throttled(5)
+        status = guard.status()
+        self.assertEqual(status['rate'], 2.0)
+        self.assertEqual(status['blocked_until'], self.clock.now + 5)
+        self.assertEqual(guard._reserve(self.clock.now + 1), 4.0)
+
+        # Otro 429 no baja del mínimo; cada éxito recupera la tasa poco a poco
+        guard.record_throttled()
+        self.assertEqual(guard.status()['rate'], 1.5)
+        guard.record_success()
+        self.assertEqual(guard.status()['rate'], 2.0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120.0)
+        now = 1700000000.0
+        self.assertEqual(parse_retry_after(formatdate(now + 30, usegmt=True), now=now), 30.0)
+        self.assertEqual(parse_retry_after(formatdate(now - 30, usegmt=True), now=now), 0.0)
+        self.assertIsNone(parse_retry_after(''))
+        self.assertIsNone(parse_retry_after('mañana'))
+
+    # ------------------------------------------------------------------
+    # Integración con api_request
+    # ------------------------------------------------------------------
+
+    def _request(self, guard, responses):
+        with patch.object(payroll_api_client, '_perform_request', side_effect=responses) as perform:
+            try:
+                return api_request('https://apidian.test', 'token', 'payroll', guard=guard)
+            finally:
+                self.calls = perform.call_count
+
+    def test_request_retries_after_429(self):
+        guard = self._guard(max_retries=2)
+        throttled = PayrollApiError(ERROR_RATE_LIMITED, 'Too Many Requests', 429, retry_in=3.0)
+        self.assertEqual(self._request(guard, [throttled, {'success': True}]), {'success': True})
+        self.assertEqual(self.calls, 2)
+        # El reintento esperó el Retry-After
+        self.assertEqual(sum(self.clock.sleeps), 3.0)
+
+        # Agotados los reintentos el 429 llega al llamador
+        with self.assertRaises(PayrollApiError) as caught:
+            self._request(guard, [throttled] * 3)
+        self.assertEqual(caught.exception.kind, ERROR_RATE_LIMITED)
+        self.assertEqual(self.calls, 3)
+
+        # Un Retry-After mayor que max_wait no se espera
+        with self.assertRaises(PayrollApiError):
+            self._request(guard, [PayrollApiError(ERROR_RATE_LIMITED, '', 429, retry_in=60.0)])
+        self.assertEqual(self.calls, 1)
+
+    def test_request_failures_feed_the_circuit(self):
+        guard = self._guard()
+        server_error = PayrollApiError(ERROR_HTTP, '502 Bad Gateway', 502)
+        with self.assertLogs(payroll_api_guard.__name__, 'WARNING'):
+            for __ in range(3):
+                with self.assertRaises(PayrollApiError):
+                    self._request(guard, [server_error])
+        with self.assertRaises(PayrollApiError) as caught:
+            self._request(guard, [{'success': True}])
+        self.assertEqual(caught.exception.kind, payroll_api_client.ERROR_CIRCUIT_OPEN)
+        self.assertEqual(self.calls, 0)
+
+        # Un 4xx muestra que la API está viva
+        guard = self._guard('https://otra.test')
+        for __ in range(2):
+            with self.assertRaises(PayrollApiError):
+                self._request(guard, [server_error])
+        with self.assertRaises(PayrollApiError):
+            self._request(guard, [PayrollApiError(ERROR_HTTP, '404 Not Found', 404)])
+        self.assertEqual(guard.status()['failures'], 0)
+        self.assertTrue(os.path.exists(guard.state.path))
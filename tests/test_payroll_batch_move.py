@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from collections import defaultdict
+from datetime import date
+from unittest import SkipTest
+
+from odoo.tests import tagged
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollBatchMove(PayrollCommon):
+    """El asiento en lote debe sumar lo mismo que los asientos individuales de ``hr_payroll_account``."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if 'account_debit' not in cls.env['hr.salary.rule']._fields:
+            raise SkipTest("hr_payroll_account no está instalado")
+
+        def _account(code, account_type):
+            return cls.env['account.account'].create({
+                'name': 'Nómina %s' % code, 'code': code, 'account_type': account_type,
+            })
+
+        cls.account_expense = _account('510506', 'expense')
+        cls.account_payable = _account('250505', 'liability_current')
+        cls.account_social = _account('237005', 'liability_current')
+        cls.account_provision = _account('261005', 'liability_current')
+        cls.account_suspense = _account('299999', 'liability_current')
+        cls.journal = cls.env['account.journal'].create({
+            'name': 'Nómina Test', 'code': 'TNOM', 'type': 'general',
+            'default_account_id': cls.account_suspense.id,
+        })
+        cls.structure.journal_id = cls.journal
+
+        cls.rule_basic.write({
+            'account_debit': cls.account_expense.id, 'account_credit': cls.account_payable.id})
+        (cls.rule_health | cls.rule_pension).write({
+            'account_debit': cls.account_payable.id, 'account_credit': cls.account_social.id})
+        cls.rule_provision = cls.env['hr.salary.rule'].create({
+            'name': 'TPROV', 'code': 'TPROV', 'struct_id': cls.structure.id,
+            'category_id': cls.rule_basic.category_id.id, 'type_concept': 'other',
+            'not_computed_in_net': True,
+            'account_debit': cls.account_expense.id, 'account_credit': cls.account_provision.id,
+        })
+        cls.rule_net_code = cls.env['hr.salary.rule'].create({
+            'name': 'NET', 'code': 'NET', 'struct_id': cls.structure.id,
+            'category_id': cls.rule_basic.category_id.id, 'type_concept': 'other',
+            'account_credit': cls.account_payable.id,
+        })
+
+        cls.slips = cls.env['hr.payslip']
+        for index, credit_note in enumerate((False, False, True)):
+            contract = cls._create_contract(cls._create_employee(), date(2024, 1, 1))
+            basic = 1423500.0 + 100000.0 * index
+            cls.slips |= cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30), lines=[
+                (cls.rule_basic, basic, 30.0),
+                (cls.rule_health, -56940.0, 1.0),
+                (cls.rule_pension, -56940.0, 1.0),
+                (cls.rule_provision, 120000.0, 1.0),
+                # La provisión se descuenta del neto al contabilizar
+                (cls.rule_net_code, basic - 113880.0 + 120000.0, 1.0),
+            ], credit_note=credit_note)
+        contract = cls._create_contract(cls._create_employee(), date(2024, 1, 1))
+        cls.draft_slip = cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30), state='draft')
+
+    @staticmethod
+    def _balances(line_vals):
+        balances = defaultdict(float)
+        for vals in line_vals:
+            balances[vals['account_id']] += vals['debit'] - vals['credit']
+        return {account_id: round(balance, 2) for account_id, balance in balances.items()
+                if round(balance, 2)}
+
+    def test_batch_move_matches_single_moves(self):
+        single_lines = []
+        for slip in self.slips:
+            single_lines += slip._prepare_slip_lines(date(2024, 6, 30), [])
+        expected = self._balances(single_lines)
+        expected.pop(self.account_suspense.id, None)
+
+        moves = (self.slips | self.draft_slip)._create_batch_account_moves(by_cost_center=False)
+
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(self.slips.move_id, moves)
+        self.assertFalse(self.draft_slip.move_id, "Las nóminas en borrador no se contabilizan")
+        actual = self._balances([{
+            'account_id': line.account_id.id, 'debit': line.debit, 'credit': line.credit,
+        } for line in moves.line_ids])
+        actual.pop(self.account_suspense.id, None)
+        self.assertEqual(actual, expected)
+
+        # Dos nóminas acreditan la provisión y la nota de ajuste la revierte
+        self.assertEqual(actual[self.account_provision.id], -120000.0)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+from decimal import Decimal
+from types import SimpleNamespace
+
+from odoo.tests import BaseCase, tagged
+
+from ..models.payroll_document import (
+    DED_CALC, EARN_CALC, build_payroll_document, money)
+
+
+class FakeRecords(list):
+    """Lista con el ``mapped`` mínimo que usa ``build_payroll_document``."""
+
+    def mapped(self, name):
+        result = FakeRecords()
+        for record in self:
+            value = getattr(record, name)
+            result.extend(value if isinstance(value, list) else [value])
+        return result
+
+
+def rule(concept, category=None, detailed=False):
+    return SimpleNamespace(
+        type_concept=concept,
+        earn_category=category if concept == 'earn' else None,
+        deduction_category=category if concept == 'deduction' else None,
+        edi_is_detailed=detailed)
+
+
+def line(salary_rule, total, quantity=1.0, rate=100.0, edi_quantity=0.0, edi_rate=100.0):
+    return SimpleNamespace(salary_rule_id=salary_rule, total=total, quantity=quantity, rate=rate,
+                           edi_quantity=edi_quantity, edi_rate=edi_rate)
+
+
+def payslip(lines, earn_ids=(), deduction_ids=()):
+    return SimpleNamespace(line_ids=FakeRecords(lines), earn_ids=FakeRecords(earn_ids),
+                           deduction_ids=FakeRecords(deduction_ids))
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollDocument(BaseCase):
+
+    def test_uncategorized_lines_count_in_totals(self):
+        slip = payslip([
+            line(rule('earn', 'basic'), 1000000.0, quantity=30),
+            line(rule('earn'), 50000.0),                  # devengo sin categoría
+            line(rule('deduction', 'health'), -40000.0),
+            line(rule('deduction'), -7000.0),             # deducción sin categoría
+            line(rule('other'), 999.0),
+        ])
+        doc = build_payroll_document(FakeRecords([slip]))
+        self.assertEqual(doc.accrued_total, Decimal('1050000.0'))
+        self.assertEqual(doc.deductions_total, Decimal('47000.0'))
+        self.assertEqual(doc.basic_days, Decimal('30'))
+        self.assertEqual(set(doc.buckets), {(EARN_CALC, 'basic'), (DED_CALC, 'health')})
+
+    def test_quantities_and_rates(self):
+        slip = payslip([
+            line(rule('earn', 'daily_overtime'), 20000.0, quantity=2, rate=125.0, edi_quantity=4, edi_rate=25.0),
+            line(rule('earn', 'daily_overtime'), 10000.0, quantity=1, rate=125.0, edi_quantity=0, edi_rate=0.0),
+        ])
+        bucket = build_payroll_document(FakeRecords([slip])).get(EARN_CALC, 'daily_overtime')
+        # edi_quantity = 0 usa la cantidad de la línea; line_quantity nunca usa edi_quantity
+        self.assertEqual(bucket.quantity, Decimal('5'))
+        self.assertEqual(bucket.line_quantity, Decimal('3'))
+        # edi_rate = 0 difiere de 100, así que se conserva (como el consolidado original)
+        self.assertEqual(bucket.rates, [25.0, 0.0])
+
+    def test_money_is_fixed_point(self):
+        self.assertEqual(money(1e-07), '0.0000001')
+        self.assertEqual(money(Decimal('1E+3')), '1000')
+        self.assertEqual(money(1423500.5), '1423500.5')
+        self.assertEqual(money(0), '0')
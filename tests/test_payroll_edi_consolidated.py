@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from datetime import date
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tools import SQL
+
+from ..models.hr_payslip_edi import CACHED_RECORD_MARKER
+from ..models.payroll_document import build_payroll_document
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollEdiConsolidated(PayrollCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.rule_overtime = cls.env['hr.salary.rule'].create({
+            'name': 'TEXTRA', 'code': 'TEXTRA', 'struct_id': cls.structure.id,
+            'category_id': cls.rule_basic.category_id.id,
+            'type_concept': 'earn', 'earn_category': 'daily_overtime', 'edi_is_detailed': True,
+        })
+        cls.rule_loan = cls.env['hr.salary.rule'].create({
+            'name': 'TPRESTAMO', 'code': 'TPRESTAMO', 'struct_id': cls.structure.id,
+            'category_id': cls.rule_basic.category_id.id,
+            'type_concept': 'deduction', 'deduction_category': False,
+        })
+
+    def _create_edi(self, employee, contract, payslips):
+        return self.env['hr.payslip.edi'].create({
+            'employee_id': employee.id,
+            'contract_id': contract.id if contract else False,
+            'company_id': self.company.id,
+            'year': 2024,
+            'month': '6',
+            'payslip_ids': [(6, 0, payslips.ids)],
+        })
+
+    def test_sources_match_document_builder(self):
+        edis = self.env['hr.payslip.edi']
+        for extra in (0.0, 150000.0):
+            employee = self._create_employee()
+            contract = self._create_contract(employee, date(2024, 1, 1), period=self.period_biweekly)
+            payslips = self.env['hr.payslip']
+            for date_from, date_to in ((date(2024, 6, 1), date(2024, 6, 15)),
+                                       (date(2024, 6, 16), date(2024, 6, 30))):
+                payslips |= self._create_payslip(contract, date_from, date_to, lines=[
+                    (self.rule_basic, 711750.0, 15.0),
+                    (self.rule_transport, 100000.0, 1.0),
+                    # Sin categoría EDI: cuenta en los totales, no en un bucket
+                    (self.rule_bonus, 50000.0 + extra, 1.0),
+                    (self.rule_loan, -20000.0, 1.0),
+                    # Detallada: su bucket llega por las entradas manuales
+                    (self.rule_overtime, 35000.0, 2.0),
+                    (self.rule_health, -28470.0, 1.0),
+                    (self.rule_pension, -28470.0, 1.0),
+                    (self.rule_net, 790000.0, 1.0),
+                ])
+            edis |= self._create_edi(employee, contract, payslips)
+
+        sources = edis._get_consolidated_sources()
+        for edi in edis:
+            expected = build_payroll_document(edi.payslip_ids, skip_detailed_rules=True)
+            doc = sources[edi.id]['document']
+            for attribute in ('accrued_total', 'deductions_total', 'basic_days', 'basic_salary',
+                              'accrued_detail_total', 'deductions_detail_total'):
+                self.assertEqual(getattr(doc, attribute), getattr(expected, attribute), attribute)
+            self.assertEqual(set(doc.buckets), set(expected.buckets))
+            for key, bucket in expected.buckets.items():
+                self.assertEqual(doc.buckets[key].total, bucket.total, key)
+                self.assertEqual(doc.buckets[key].quantity, bucket.quantity, key)
+
+        # Las líneas sin categoría sí entran en los totales
+        first = sources[edis[0].id]['document']
+        self.assertEqual(first.accrued_total, 2 * (711750 + 100000 + 50000 + 35000))
+        self.assertEqual(first.deductions_total, 2 * (20000 + 28470 + 28470))
+
+    # -------------------------------------------------------------------------
+    # Caché de la estructura consolidada
+    # -------------------------------------------------------------------------
+
+    def _touch(self, records):
+        """Simula una escritura de una transacción posterior (aquí write_date no avanza)."""
+        records.flush_recordset()
+        self.env.cr.execute(SQL(
+            "UPDATE %s SET write_date = write_date + interval '1 minute' WHERE id = ANY(%s)",
+            SQL.identifier(records._table), records.ids))
+        records.invalidate_recordset(['write_date'])
+
+    def _create_rule_input(self, rule):
+        input_type = self.env['hr.payslip.input.type'].create({'name': rule.name, 'code': rule.code})
+        return self.env['hr.rule.input'].create({'input_type_id': input_type.id, 'input_id': rule.id})
+
+    def test_consolidated_cache(self):
+        employee = self._create_employee()
+        contract = self._create_contract(employee, date(2024, 1, 1))
+        payslip = self._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+        edi = self._create_edi(employee, contract, payslip)
+        Edi = type(edi)
+
+        with patch.object(Edi, '_get_consolidated_sources', autospec=True,
+                          side_effect=Edi._get_consolidated_sources) as aggregate:
+            def assert_rebuilds(expected):
+                edi._get_consolidated_payroll_data()
+                self.assertEqual(aggregate.call_count, expected)
+
+            computed = edi._get_consolidated_payroll_data()
+            self.assertEqual(aggregate.call_count, 1)
+            self.assertTrue(edi.consolidated_cache_key)
+            self.assertIn(CACHED_RECORD_MARKER, edi.consolidated_cache_artifact_id._get_content().decode())
+
+            # Acierto: la segunda lectura sale de la caché y los registros se reconstruyen
+            cached = edi._get_consolidated_payroll_data()
+            self.assertEqual(aggregate.call_count, 1)
+            self.assertEqual(cached['contract_id'], contract)
+            self.assertEqual(cached['employee_id'], employee)
+            self.assertEqual(cached['company_id'], self.company)
+            self.assertEqual(cached['accrued_total_numeric'], computed['accrued_total_numeric'])
+            self.assertEqual(cached['deductions_total_numeric'], computed['deductions_total_numeric'])
+
+            # Una nómina modificada invalida la caché
+            payslip.name = 'Nómina reliquidada'
+            self._touch(payslip)
+            assert_rebuilds(2)
+            assert_rebuilds(2)
+
+            # También una línea de devengo o deducción nueva o modificada
+            earn = self.env['l10n_co_hr_payroll.earn.line'].create({
+                'name': 'Horas extra', 'payslip_id': payslip.id, 'category': 'daily_overtime',
+                'rule_input_id': self._create_rule_input(self.rule_basic).id,
+                'amount': 35000.0, 'quantity': 2,
+            })
+            assert_rebuilds(3)
+            earn.amount = 40000.0
+            self._touch(earn)
+            assert_rebuilds(4)
+            self.env['l10n_co_hr_payroll.deduction.line'].create({
+                'name': 'Libranza', 'payslip_id': payslip.id, 'category': 'health',
+                'rule_input_id': self._create_rule_input(self.rule_health).id,
+                'amount': 20000.0,
+            })
+            assert_rebuilds(5)
+            assert_rebuilds(5)
+
+            # Y los datos propios del consolidado
+            edi.note = 'Observación'
+            assert_rebuilds(6)
+
+    # -------------------------------------------------------------------------
+    # Confirmación: contratos y consecutivos en lote
+    # -------------------------------------------------------------------------
+
+    def test_resolve_active_contracts(self):
+        # Cambio de contrato a mitad de mes: gana el de inicio más reciente
+        changed = self._create_employee()
+        ended = self._create_contract(changed, date(2023, 1, 1), date(2024, 6, 15))
+        current = self._create_contract(changed, date(2024, 6, 16))
+        changed_edi = self._create_edi(changed, False, self._create_payslip(
+            ended, date(2024, 6, 1), date(2024, 6, 15)))
+
+        # Sin contrato vigente en el mes: el de la nómina con fecha final más reciente
+        retired = self._create_employee()
+        first = self._create_contract(retired, date(2023, 1, 1), date(2024, 3, 31))
+        last = self._create_contract(retired, date(2024, 4, 1), date(2024, 5, 31))
+        (first | last).write({'state': 'close'})
+        latest_slip = self._create_payslip(last, date(2024, 6, 16), date(2024, 6, 30))
+        earlier_slip = self._create_payslip(first, date(2024, 6, 1), date(2024, 6, 15))
+        retired_edi = self._create_edi(retired, False, latest_slip | earlier_slip)
+
+        contracts = (changed_edi | retired_edi)._resolve_active_contracts()
+        self.assertEqual(contracts, {changed_edi.id: current.id, retired_edi.id: last.id})
+
+    def test_confirm_reserves_contiguous_numbers(self):
+        sequence = self.env['ir.sequence'].create({
+            'name': 'EDI Test', 'code': 'salary.slip.edi', 'company_id': self.company.id,
+            'implementation': 'no_gap', 'prefix': 'TEST', 'padding': 1, 'number_next': 41,
+        })
+        edis = self.env['hr.payslip.edi']
+        for __ in range(3):
+            employee = self._create_employee()
+            contract = self._create_contract(employee, date(2024, 1, 1))
+            edis |= self._create_edi(employee, contract, self._create_payslip(
+                contract, date(2024, 6, 1), date(2024, 6, 30)))
+        edis |= self._create_edi(self._create_employee(), False, self.env['hr.payslip'])
+        numbered, reserved, *to_number = edis
+        numbered.number = 'KEEP1'
+
+        confirmed = edis._confirm_edi_documents({reserved.id: 'RES7'})
+
+        self.assertEqual(confirmed, edis)
+        self.assertEqual(set(edis.mapped('state')), {'done'})
+        self.assertEqual(numbered.number, 'KEEP1')
+        self.assertEqual(reserved.number, 'RES7')
+        self.assertEqual([rec.number for rec in to_number], ['TEST41', 'TEST42'])
+        self.assertEqual(sequence.number_next, 43)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import PayrollCommon
+
+YEAR = 2019
+MONTH = '6'
+
+
+class PayrollEdiGenCommon(PayrollCommon):
+    """Ayudas para probar el asistente de generación de consolidados (junio de 2019)."""
+
+    def _create_wizard(self, mode='incremental'):
+        return self.env['l10n_co_hr_payroll.edi_gen'].create({
+            'month': MONTH,
+            'year': YEAR,
+            'payroll_type': '102',
+            'generation_mode': mode,
+        })
+
+    def _groups(self, employees):
+        rows = self._create_wizard()._fetch_payslip_groups(self.company)
+        return {row['employee_id']: row for row in rows if row['employee_id'] in employees.ids}
+
+    def _employee_with_slips(self, periods, spans, date_start=date(2019, 1, 1)):
+        """Empleado con contrato de periodicidad ``periods`` y nóminas en ``spans`` (días de junio)."""
+        employee = self._create_employee()
+        contract = self._create_contract(employee, date_start, period=periods)
+        slips = self.env['hr.payslip']
+        for day_from, day_to in spans:
+            slips |= self._create_payslip(contract, date(YEAR, 6, day_from), date(YEAR, 6, day_to))
+        return employee, contract, slips
+
+    def _edi_of(self, employee):
+        return self.env['hr.payslip.edi'].search([
+            ('employee_id', 'in', employee.ids), ('year', '=', YEAR), ('month', '=', MONTH)])
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollEdiGenGrouping(PayrollEdiGenCommon):
+    """Agrupación en SQL por empleado y creación en lote de los consolidados."""
+
+    def test_mid_month_contract_change(self):
+        employee = self._create_employee()
+        old_contract = self._create_contract(
+            employee, date(2019, 1, 1), date(2019, 6, 15), period=self.period_biweekly)
+        new_contract = self._create_contract(employee, date(2019, 6, 16), period=self.period_monthly)
+        first = self._create_payslip(old_contract, date(2019, 6, 1), date(2019, 6, 15))
+        second = self._create_payslip(new_contract, date(2019, 6, 16), date(2019, 6, 30))
+
+        row = self._groups(employee)[employee.id]
+        self.assertIsNone(row['skip_reason'])
+        self.assertEqual(row['payslip_ids'], (first | second).ids)
+        self.assertEqual(row['contract_id'], new_contract.id, "Se toma el contrato de la nómina más reciente")
+        self.assertEqual(sorted(row['period_codes']), ['4', '5'])
+
+    def test_generate_in_bulk_and_skip_validated(self):
+        employee, contract, slips = self._employee_with_slips(self.period_biweekly, [(1, 15), (16, 30)])
+        validated, __, __ = self._employee_with_slips(self.period_monthly, [(1, 30)])
+
+        result = self._create_wizard().generate()
+        self.assertEqual(result['params']['type'], 'success')
+        self.assertIn("2 consolidado(s) creado(s)", result['params']['message'])
+        edi = self._edi_of(employee)
+        self.assertRecordValues(edi, [{'contract_id': contract.id, 'state': 'draft'}])
+        self.assertEqual(edi.payslip_ids, slips)
+
+        # Un consolidado ya validado no se toca; un borrador duplicado se elimina
+        self._edi_of(validated).write({'state': 'cancel'})
+        duplicate = self.env['hr.payslip.edi'].create({
+            'employee_id': employee.id, 'company_id': self.company.id, 'year': YEAR, 'month': MONTH,
+        })
+        result = self._create_wizard().generate()
+        self.assertIn("0 consolidado(s) creado(s), 0 actualizado(s), 1 sin cambios y "
+                      "1 borrador(es) obsoleto(s) eliminado(s)", result['params']['message'])
+        self.assertIn("y 1 por EDI ya validado o cancelado.", result['params']['message'])
+        self.assertFalse(duplicate.exists())
+        self.assertEqual(self._edi_of(employee), edi)
+        self.assertEqual(self._edi_of(validated).state, 'cancel')
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollEdiGen(PayrollEdiGenCommon):
+    """Cobertura del mes según la periodicidad de cada contrato."""
+
+    # -------------------------------------------------------------------------
+    # Cobertura por periodicidad
+    # -------------------------------------------------------------------------
+
+    def test_monthly_covers_month(self):
+        employee, contract, slips = self._employee_with_slips(self.period_monthly, [(1, 30)])
+        row = self._groups(employee)[employee.id]
+        self.assertIsNone(row['skip_reason'])
+        self.assertEqual(row['payslip_ids'], slips.ids)
+        self.assertEqual(row['contract_id'], contract.id)
+        self.assertEqual(row['period_codes'], ['5'])
+
+    def test_biweekly_covers_month(self):
+        employee, __, slips = self._employee_with_slips(self.period_biweekly, [(1, 15), (16, 30)])
+        row = self._groups(employee)[employee.id]
+        self.assertIsNone(row['skip_reason'])
+        self.assertEqual(row['payslip_ids'], slips.ids)
+        self.assertEqual(row['period_codes'], ['4'])
+
+    def test_weekly_tolerates_tail(self):
+        # La cola del 29 al 30 de junio se liquida en la semana que termina en julio
+        employee, __, __ = self._employee_with_slips(
+            self.period_weekly, [(1, 7), (8, 14), (15, 21), (22, 28)])
+        short, __, __ = self._employee_with_slips(self.period_weekly, [(1, 7), (8, 14), (15, 21)])
+        groups = self._groups(employee | short)
+        self.assertIsNone(groups[employee.id]['skip_reason'])
+        self.assertEqual(groups[employee.id]['period_codes'], ['1'])
+        self.assertEqual(groups[short.id]['skip_reason'], 'coverage')
+
+    def test_gap_between_contracts_is_allowed(self):
+        employee = self._create_employee()
+        old_contract = self._create_contract(employee, date(2019, 1, 1), date(2019, 6, 10))
+        new_contract = self._create_contract(employee, date(2019, 6, 20))
+        self._create_payslip(old_contract, date(2019, 6, 1), date(2019, 6, 10))
+        self._create_payslip(new_contract, date(2019, 6, 20), date(2019, 6, 30))
+        self.assertIsNone(self._groups(employee)[employee.id]['skip_reason'])
+
+    # -------------------------------------------------------------------------
+    # Motivos de omisión
+    # -------------------------------------------------------------------------
+
+    def test_skip_reasons(self):
+        overlap, __, __ = self._employee_with_slips(self.period_biweekly, [(1, 15), (10, 30)])
+        gap, __, __ = self._employee_with_slips(self.period_biweekly, [(1, 10), (16, 30)])
+        coverage, __, __ = self._employee_with_slips(self.period_monthly, [(1, 15)])
+        groups = self._groups(overlap | gap | coverage)
+        self.assertEqual(groups[overlap.id]['skip_reason'], 'overlap')
+        self.assertEqual(groups[gap.id]['skip_reason'], 'gap')
+        self.assertEqual(groups[coverage.id]['skip_reason'], 'coverage')
+
+        result = self._create_wizard().generate()
+        self.assertEqual(result['params']['type'], 'warning')
+        self.assertIn("1 por nóminas traslapadas, 1 por huecos entre periodos, 1 por no cubrir el mes",
+                      result['params']['message'])
+        self.assertFalse(self._edi_of(overlap | gap | coverage))
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollEdiGenIncremental(PayrollEdiGenCommon):
+    """Regeneración incremental por huella de las nóminas frente a la completa."""
+
+    def test_incremental_counts(self):
+        updated, updated_contract, updated_slips = self._employee_with_slips(
+            self.period_biweekly, [(1, 15), (16, 30)])
+        unchanged, __, __ = self._employee_with_slips(self.period_monthly, [(1, 30)])
+        removed, __, removed_slips = self._employee_with_slips(self.period_monthly, [(1, 30)])
+        employees = updated | unchanged | removed
+
+        result = self._create_wizard().generate()
+        self.assertEqual(result['params']['type'], 'success')
+        self.assertIn("3 consolidado(s) creado(s)", result['params']['message'])
+        unchanged_edi = self._edi_of(unchanged)
+        updated_edi = self._edi_of(updated)
+        self.assertEqual(len(self._edi_of(employees)), 3)
+
+        # Una quincena reliquidada cambia la huella; otra nómina se cancela
+        updated_slips[1].write({'state': 'cancel'})
+        replacement = self._create_payslip(updated_contract, date(2019, 6, 16), date(2019, 6, 30))
+        removed_slips.write({'state': 'cancel'})
+
+        result = self._create_wizard().generate()
+        self.assertIn(
+            "0 consolidado(s) creado(s), 1 actualizado(s), 1 sin cambios y "
+            "1 borrador(es) obsoleto(s) eliminado(s)", result['params']['message'])
+        self.assertEqual(self._edi_of(unchanged), unchanged_edi)
+        self.assertEqual(self._edi_of(updated), updated_edi)
+        self.assertEqual(updated_edi.payslip_ids, updated_slips[0] | replacement)
+        self.assertFalse(self._edi_of(removed))
+
+    def test_full_mode_recreates_drafts(self):
+        employee, __, slips = self._employee_with_slips(self.period_monthly, [(1, 30)])
+        self._create_wizard().generate()
+        first = self._edi_of(employee)
+
+        result = self._create_wizard('full').generate()
+        self.assertIn("1 consolidado(s) creado(s), 0 actualizado(s), 0 sin cambios",
+                      result['params']['message'])
+        recreated = self._edi_of(employee)
+        self.assertEqual(len(recreated), 1)
+        self.assertNotEqual(recreated, first)
+        self.assertEqual(recreated.payslip_ids, slips)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+import logging
+import time
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from odoo.tests import tagged
+
+from ..models.payroll_edi_proxy import DIAN_ACCEPTED_STATE, PayrollEdiProxy
+from ..models.payroll_xml_builder import build_payroll_xml
+from .common import PayrollCommon
+from .test_payroll_xml_builder import sample_xml_data
+
+_logger = logging.getLogger(__name__)
+
+
+class PayrollEdiProxyCommon(PayrollCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.journal = cls.env['account.journal'].create({
+            'name': 'Nómina Electrónica', 'code': 'NETST', 'type': 'general',
+            'company_id': cls.company.id,
+        })
+        cls.company.edi_payroll_journal_id = cls.journal
+        contract = cls._create_contract(cls._create_employee(), date(2024, 1, 1))
+        cls.payslip = cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+        cls.xml = build_payroll_xml(sample_xml_data())
+        cls.cune = sample_xml_data()['cune']
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollEdiProxy(PayrollEdiProxyCommon):
+    """El proxy debe ser aceptado por ``l10n_co_dian.document`` sin account.move."""
+
+    def test_create_document_without_move(self):
+        proxy = self.payslip._get_payroll_edi_proxy(self.journal)
+        moves_before = self.env['account.move'].search_count([])
+        document = self.env['l10n_co_dian.document']._create_document(
+            self.xml, proxy, state=DIAN_ACCEPTED_STATE, message_json={'status': 'Aceptado'})
+        self.assertFalse(document.move_id)
+        self.assertEqual(document.identifier, self.cune)
+        self.assertEqual(document.attachment_id.res_model, 'hr.payslip')
+        self.assertEqual(document.attachment_id.res_id, self.payslip.id)
+        self.assertEqual(document.attachment_id.name, '%s.xml' % self.payslip.number)
+        self.assertEqual(document.attachment_id.raw, self.xml)
+        self.assertEqual(self.env['account.move'].search_count([]), moves_before)
+
+    def test_post_through_send_to_dian(self):
+        DianDocument = self.env['l10n_co_dian.document']
+
+        def _send_to_dian(xml, move):
+            # Sustituye solo la llamada SOAP; el documento se crea como en l10n_co_dian
+            self.assertIsInstance(move, PayrollEdiProxy)
+            self.assertTrue(DianDocument.env.context.get('is_l10n_co_payroll'))
+            return DianDocument._create_document(
+                xml, move, state=DIAN_ACCEPTED_STATE, message_json={'status': 'Procesado Correctamente'})
+
+        proxy = self.payslip._get_payroll_edi_proxy(self.journal)
+        with patch.object(type(DianDocument), '_send_to_dian', side_effect=_send_to_dian):
+            result = proxy._post(SimpleNamespace(name='%s.xml' % self.cune, raw=self.xml))
+        self.assertTrue(result['success'])
+        self.assertEqual(result['message'], 'Procesado Correctamente')
+        self.assertEqual(result['document'].identifier, self.cune)
+        self.assertEqual(proxy.dian_document, result['document'])
+
+    def test_post_reports_errors(self):
+        DianDocument = self.env['l10n_co_dian.document']
+        proxy = self.payslip._get_payroll_edi_proxy(self.journal)
+        with patch.object(type(DianDocument), '_send_to_dian', side_effect=ValueError("sin conexión")):
+            result = proxy._post(SimpleNamespace(name='x.xml', raw=self.xml))
+        self.assertFalse(result['success'])
+        self.assertIn("sin conexión", result['error'])
+
+
+@tagged('l10n_co_nomina_bench', '-standard')
+class TestPayrollEdiProxyBenchmark(PayrollEdiProxyCommon):
+    """Sobrecosto por documento, sin red: adjunto y account.move temporal frente al proxy."""
+
+    DOCUMENTS = 200
+
+    def test_send_overhead_benchmark(self):
+        Move = self.env['account.move']
+        DianDocument = self.env['l10n_co_dian.document']
+
+        start = time.perf_counter()
+        for __ in range(self.DOCUMENTS):
+            # Flujo anterior: adjunto + asiento temporal creado y borrado por documento
+            self.env['ir.attachment'].create({'name': 'nomina.xml', 'raw': self.xml})
+            Move.create({
+                'journal_id': self.journal.id, 'move_type': 'entry', 'is_payroll_document_proxy': True,
+            }).unlink()
+        self.env.flush_all()
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for __ in range(self.DOCUMENTS):
+            self.payslip._get_payroll_edi_proxy(self.journal)
+            SimpleNamespace(name='nomina.xml', raw=self.xml)
+        self.env.flush_all()
+        current = time.perf_counter() - start
+
+        # El l10n_co_dian.document y su adjunto se crean en ambos flujos
+        start = time.perf_counter()
+        for __ in range(self.DOCUMENTS):
+            proxy = self.payslip._get_payroll_edi_proxy(self.journal)
+            DianDocument._create_document(self.xml, proxy, state=DIAN_ACCEPTED_STATE)
+        self.env.flush_all()
+        common = time.perf_counter() - start
+
+        _logger.info("Sobrecosto de envío, %s documentos: account.move %.3fs, proxy %.3fs; "
+                     "documento DIAN (común a ambos) %.3fs",
+                     self.DOCUMENTS, legacy, current, common)
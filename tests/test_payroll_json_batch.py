@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+import base64
+from datetime import date
+from unittest import skipIf
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from ..models.payroll_json_schema import jsonschema
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollJsonBatch(PayrollCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.payslips = cls.env['hr.payslip']
+        for __ in range(6):
+            contract = cls._create_contract(cls._create_employee(), date(2024, 1, 1))
+            cls.payslips |= cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+
+    def _count_batch_queries(self, payslips):
+        self.env.invalidate_all()
+        before = self.cr.sql_log_count
+        payloads = payslips._prepare_payroll_json_batch()
+        return self.cr.sql_log_count - before, payloads
+
+    def test_batch_matches_single_builder(self):
+        payloads = self.payslips._prepare_payroll_json_batch()
+        self.assertEqual(len(payloads), len(self.payslips))
+        for payslip, payload in zip(self.payslips, payloads):
+            self.assertEqual(payload, payslip._prepare_payroll_json_data())
+            self.assertEqual(payload['prefix'], 'NE')
+            self.assertEqual(payload['consecutive'], int(payslip.number[2:]))
+
+    def test_query_count_does_not_grow_with_batch(self):
+        # Calienta cachés de registro (parámetros, traducciones, etc.)
+        self._count_batch_queries(self.payslips[:1])
+        small_count, __ = self._count_batch_queries(self.payslips[:2])
+        large_count, __ = self._count_batch_queries(self.payslips)
+        self.assertLessEqual(
+            large_count, small_count,
+            "El lote de %s nóminas hizo %s consultas y el de 2 hizo %s"
+            % (len(self.payslips), large_count, small_count))
+
+
+@tagged('post_install', '-at_install')
+@skipIf(jsonschema is None, "jsonschema no está instalado")
+class TestPayrollSendPreflight(PayrollCommon):
+
+    def test_invalid_payloads_are_not_sent(self):
+        contract = self._create_contract(self._create_employee(), date(2024, 1, 1))
+        payslip = self._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+        connector = self.env['l10n_co_nomina.payroll.api.connector']
+        with patch.object(type(connector), '_send_api_request') as send:
+            with self.assertRaises(UserError):
+                connector.send_payroll_document(payslip, payroll_json_data={'prefix': 'NE'})
+            with self.assertRaises(UserError):
+                connector.send_payroll_adjust_note_document(
+                    payslip, 'a' * 96, 2, payroll_json_data={'type_note': 2})
+            send.assert_not_called()
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollBatchSend(PayrollCommon):
+
+    def test_batch_send_records_each_response(self):
+        self.company.edi_payroll_is_not_test = True
+        payslips = self.env['hr.payslip']
+        for __ in range(3):
+            contract = self._create_contract(self._create_employee(), date(2024, 1, 1))
+            payslips |= self._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+        synchronous, asynchronous, rejected = payslips
+        cune = 'c' * 96
+        zip_key = '8b2f4a3e-3f0e-4c1b-9a51-0c2d5e6f7a8b'
+
+        def fake_send(connector, records, test_set_id=None, payloads=None):
+            self.assertIsNone(test_set_id)
+            self.assertEqual(len(payloads), len(records))
+            return [
+                (synchronous, cune, {'qr_code_url': 'https://catalogo-vpfe.dian.gov.co/qr',
+                                     'xml_file': '<NominaIndividual/>'}),
+                (asynchronous, zip_key, {}),
+                (rejected, None, {'success': False, 'message': 'Documento rechazado'}),
+            ]
+
+        connector = self.env['l10n_co_nomina.payroll.api.connector']
+        with patch.object(type(connector), 'send_payroll_documents', fake_send), \
+                patch.object(type(payslips), '_preflight_payroll_json_batch', return_value={}):
+            failed = payslips._send_payroll_batch_to_dian()
+
+        self.assertEqual(failed, rejected)
+        # Aceptación síncrona: el CUNE y los archivos quedan en la nómina
+        self.assertEqual(synchronous.l10n_co_edi_cune, cune)
+        self.assertTrue(synchronous.edi_is_valid)
+        self.assertEqual(synchronous.edi_state, 'accepted')
+        self.assertEqual(base64.b64decode(synchronous.l10n_co_edi_xml_file), b'<NominaIndividual/>')
+        self.assertFalse(synchronous.l10n_co_edi_pdf_file)
+        # Envío asíncrono: queda el ZipKey para consultar después
+        self.assertEqual(asynchronous.edi_zip_key, zip_key)
+        self.assertEqual(asynchronous.edi_state, 'sent')
+        self.assertFalse(asynchronous.edi_is_valid)
+        self.assertEqual(rejected.edi_state, 'error')
+        self.assertEqual(rejected.edi_status_message, 'Documento rechazado')
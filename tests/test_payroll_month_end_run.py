@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+from datetime import date
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+from odoo.tools import SQL
+
+from ..models.payroll_month_end_run import MAX_ATTEMPTS
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollMonthEndRun(PayrollCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.sequence = cls.env['ir.sequence'].create({
+            'name': 'EDI Cierre', 'code': 'salary.slip.edi', 'company_id': cls.company.id,
+            'implementation': 'no_gap', 'prefix': 'CM', 'padding': 1, 'number_next': 1,
+        })
+        cls.edis = cls.env['hr.payslip.edi']
+        for __ in range(5):
+            employee = cls._create_employee()
+            contract = cls._create_contract(employee, date(2024, 1, 1))
+            cls.edis |= cls.env['hr.payslip.edi'].create({
+                'employee_id': employee.id,
+                'contract_id': contract.id,
+                'company_id': cls.company.id,
+                'year': 2024,
+                'month': '6',
+                'payslip_ids': [(6, 0, cls._create_payslip(
+                    contract, date(2024, 6, 1), date(2024, 6, 30)).ids)],
+            })
+
+    def setUp(self):
+        super().setUp()
+        self.run = self.env['l10n_co_nomina.month.end.run'].create({
+            'company_id': self.company.id, 'month': '6', 'year': 2024,
+            'chunk_size': 2, 'send_documents': False,
+        })
+        self.Chunk = self.env['l10n_co_nomina.month.end.chunk']
+        # _run confirma o revierte cada lote; en la prueba todo queda en su transacción
+        self.startPatcher(patch.multiple(type(self.env.cr), commit=lambda cr: None, rollback=lambda cr: None))
+        self.startPatcher(patch.object(
+            type(self.env['hr.payslip.edi']), '_collect_payroll_xml_schema_errors', return_value={}))
+
+    def _fail_chunks(self):
+        return patch.object(type(self.Chunk), '_confirm_and_prepare', side_effect=UserError("APIDIAN caído"))
+
+    def _set_stale(self, chunk):
+        chunk.flush_recordset()
+        self.env.cr.execute(SQL("""
+            UPDATE l10n_co_nomina_month_end_chunk
+               SET write_date = (now() at time zone 'UTC') - interval '2 hours'
+             WHERE id = %s
+        """, chunk.id))
+        chunk.invalidate_recordset(['write_date'])
+
+    def test_start_reserves_numbers_per_chunk(self):
+        self.run.action_start()
+
+        self.assertEqual(self.run.state, 'running')
+        self.assertEqual(self.run.total_count, 5)
+        chunks = self.run.chunk_ids
+        self.assertEqual(chunks.mapped('edi_count'), [2, 2, 1])
+        self.assertEqual(chunks.mapped('edi_ids'), self.edis)
+        reserved = {}
+        for chunk in chunks:
+            numbers = chunk._get_reserved_numbers()
+            self.assertEqual(set(numbers), set(chunk.edi_ids.ids))
+            reserved.update(numbers)
+        # Un solo bloque contiguo en el orden de los documentos
+        self.assertEqual([reserved[doc_id] for doc_id in self.edis.ids], ['CM1', 'CM2', 'CM3', 'CM4', 'CM5'])
+        self.assertEqual(self.sequence.number_next, 6)
+        # Los documentos siguen en borrador hasta que su lote se procese
+        self.assertEqual(set(self.edis.mapped('state')), {'draft'})
+
+        with self.assertRaises(UserError):
+            self.run.action_start()
+
+    def test_claim_next_in_order_and_stale_sending(self):
+        self.run.action_start()
+        first, second, third = self.run.chunk_ids
+
+        self.assertEqual(self.Chunk._claim_next(), first)
+        first.write({'state': 'sending'})
+        self.assertEqual(self.Chunk._claim_next(), second)
+        (second | third).write({'state': 'done'})
+        # Un envío reciente es de otra tarea; uno sin avances se retoma
+        self.assertFalse(self.Chunk._claim_next())
+        self._set_stale(first)
+        self.assertEqual(self.Chunk._claim_next(lock=False), first)
+
+        # Los lotes de cierres que no están en proceso no se toman
+        self.run.state = 'failed'
+        self.assertFalse(self.Chunk._claim_next())
+
+    def test_chunk_keeps_reserved_numbers_across_retry(self):
+        self.run.action_start()
+        first = self.run.chunk_ids[0]
+        reserved = first._get_reserved_numbers()
+
+        with self._fail_chunks():
+            self.Chunk._claim_next()._run()
+        self.assertRecordValues(first, [{'state': 'pending', 'attempts': 1, 'error': 'APIDIAN caído'}])
+
+        # El reintento toma el mismo lote y lo confirma con sus consecutivos
+        chunk = self.Chunk._claim_next()
+        self.assertEqual(chunk, first)
+        chunk._run()
+        self.assertRecordValues(first, [{'state': 'done', 'attempts': 1, 'error': False}])
+        for doc in first.edi_ids:
+            self.assertEqual(doc.state, 'done')
+            self.assertEqual(doc.number, reserved[doc.id])
+        self.assertEqual(self.sequence.number_next, 6)
+        self.assertEqual(self.run.state, 'running')
+
+    def test_failing_chunk_fails_after_max_attempts(self):
+        self.run.action_start()
+        first, second, third = self.run.chunk_ids
+
+        with self._fail_chunks():
+            for __ in range(MAX_ATTEMPTS):
+                chunk = self.Chunk._claim_next()
+                self.assertEqual(chunk, first)
+                chunk._run()
+        self.assertRecordValues(first, [{'state': 'failed', 'attempts': MAX_ATTEMPTS}])
+        self.assertEqual(self.Chunk._claim_next(), second)
+        self.assertEqual(self.run.state, 'running')
+
+        # Cuando no queda nada pendiente el cierre termina con errores
+        second._run()
+        third._run()
+        self.assertEqual(self.run.state, 'failed')
+        self.assertTrue(self.run.finished_at)
+        self.assertEqual(self.run.processed_count, 3)
+
+    def test_resume_requeues_failed_and_stale_chunks(self):
+        self.run.action_start()
+        failed, busy, stale = self.run.chunk_ids
+        failed.write({'state': 'failed', 'attempts': MAX_ATTEMPTS, 'error': 'APIDIAN caído'})
+        (busy | stale).write({'state': 'sending'})
+        self._set_stale(stale)
+        self.run.state = 'failed'
+
+        self.run.action_resume()
+
+        self.assertRecordValues(failed | busy | stale, [
+            {'state': 'pending', 'attempts': 0},
+            {'state': 'sending', 'attempts': 0},
+            {'state': 'pending', 'attempts': 0},
+        ])
+        self.assertEqual(self.run.state, 'running')
+        self.assertFalse(self.run.finished_at)
+
+        (failed | busy | stale).write({'state': 'done'})
+        self.run._update_state_from_chunks()
+        self.assertEqual(self.run.state, 'done')
+        with self.assertRaises(UserError):
+            self.run.action_resume()
+
+    def test_cancel_keeps_reserved_numbers_on_drafts(self):
+        self.run.action_start()
+        first, second, third = self.run.chunk_ids
+        first._run()
+        pending_docs = (second | third).edi_ids
+        reserved = {**second._get_reserved_numbers(), **third._get_reserved_numbers()}
+
+        with self.assertLogs('odoo.addons.l10n_co_nomina.models.payroll_month_end_run', 'WARNING') as logs:
+            self.run.action_cancel()
+        self.assertEqual(self.run.state, 'cancel')
+        self.assertIn('CM3, CM4, CM5', logs.output[0])
+        for doc in pending_docs:
+            self.assertEqual(doc.state, 'draft')
+            self.assertEqual(doc.number, reserved[doc.id])
+
+        # Al confirmarlos después conservan su consecutivo sin tocar la secuencia
+        pending_docs._confirm_edi_documents()
+        self.assertEqual([reserved[doc.id] for doc in pending_docs], pending_docs.mapped('number'))
+        self.assertEqual(self.sequence.number_next, 6)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from datetime import date
+
+import psycopg2
+
+from odoo.exceptions import UserError, ValidationError
+from odoo.tests import tagged
+from odoo.tools import mute_logger
+
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollResolution(PayrollCommon):
+
+    def _create_resolution(self, prefix, from_number, to_number, **vals):
+        return self.env['l10n_co_nomina.resolution'].create(dict({
+            'company_id': self.company.id,
+            'type_document_id': '9',
+            'prefix': prefix,
+            'from_number': from_number,
+            'to_number': to_number,
+        }, **vals))
+
+    def test_overlapping_active_ranges_are_rejected(self):
+        Resolution = self.env['l10n_co_nomina.resolution']
+        if not Resolution._has_range_exclusion():
+            self.skipTest("La base de datos no tiene btree_gist: aplica solo la validación del ORM")
+        # Mismo prefijo y tipo que la resolución común (NE 1-5000)
+        with self.assertRaises(psycopg2.errors.ExclusionViolation), \
+                mute_logger('odoo.sql_db'), self.cr.savepoint():
+            self._create_resolution('NE', 4000, 6000)
+
+        # Inactiva, otro prefijo u otro tipo de documento no chocan
+        self._create_resolution('NE', 4000, 6000, state='inactive')
+        self._create_resolution('NX', 1, 5000)
+        self._create_resolution('NE', 1, 5000, type_document_id='10')
+
+        # Reactivar una resolución que se solapa también se rechaza
+        inactive = self._create_resolution('NE', 5001, 7000, state='inactive')
+        with self.assertRaises(psycopg2.errors.ExclusionViolation), \
+                mute_logger('odoo.sql_db'), self.cr.savepoint():
+            inactive.write({'from_number': 4500, 'state': 'active'})
+            inactive.flush_recordset()
+
+    def test_overlap_orm_fallback(self):
+        Resolution = self.env['l10n_co_nomina.resolution']
+        if Resolution._has_range_exclusion():
+            self.skipTest("Con la restricción de exclusión el solapamiento lo rechaza PostgreSQL")
+        with self.assertRaises(ValidationError):
+            self._create_resolution('NE', 4000, 6000)
+
+    def test_split_document_number_with_digit_prefix(self):
+        # Convive con la resolución común NE 1-5000
+        digit_prefix = self._create_resolution('NE2', 1, 100)
+        Resolution = self.env['l10n_co_nomina.resolution']
+        split = Resolution._split_document_number
+
+        # El prefijo más largo se prueba primero
+        self.assertEqual(split(self.company, '9', 'NE250'), (digit_prefix, 'NE2', 50))
+        # Fuera del rango de NE2 el número se lee como NE + 2500
+        self.assertEqual(split(self.company, '9', 'NE2500'), (self.resolution, 'NE', 2500))
+        self.assertEqual(split(self.company, '9', 'NE4999'), (self.resolution, 'NE', 4999))
+        # Sin consecutivo, fuera de todo rango o sin resolución con ese prefijo
+        self.assertEqual(split(self.company, '9', 'NE2'), (self.resolution, 'NE', 2))
+        self.assertEqual(split(self.company, '9', 'NE29999'), (Resolution, None, None))
+        self.assertEqual(split(self.company, '9', 'XX10'), (Resolution, None, None))
+        self.assertEqual(split(self.company, '10', 'NE250'), (Resolution, None, None))
+
+        batch = Resolution._split_document_numbers(self.company, '9', ['NE250', 'NE2500', 'XX10'])
+        self.assertEqual(batch, {
+            'NE250': (digit_prefix, 'NE2', 50),
+            'NE2500': (self.resolution, 'NE', 2500),
+            'XX10': (Resolution, None, None),
+        })
+
+    # -------------------------------------------------------------------------
+    # Numeración por bloques (resolución común NE 1-5000)
+    # -------------------------------------------------------------------------
+    def _set_block_size(self, size):
+        self.env['ir.config_parameter'].sudo().set_param('l10n_co_nomina.numbering_block_size', size)
+
+    def test_allocate_reserves_block_and_reuses_leftover(self):
+        self._set_block_size(10)
+        self.assertEqual(self.resolution._allocate_numbers(3), ['NE1', 'NE2', 'NE3'])
+        block = self.resolution.block_ids
+        self.assertRecordValues(block, [
+            {'number_from': 1, 'number_to': 10, 'next_number': 4, 'state': 'open'},
+        ])
+        self.assertEqual(self.resolution.next_number, 11)
+        self.assertEqual(self.resolution._get_unused_ranges(), [(4, 10)])
+        self.assertEqual(self.resolution.remaining_count, 4997)
+
+        # El sobrante se consume antes de reservar otro bloque
+        self.assertEqual(self.resolution._allocate_numbers(7), ['NE%s' % n for n in range(4, 11)])
+        self.assertEqual(self.resolution.block_ids, block)
+        self.assertEqual(block.state, 'exhausted')
+        self.assertEqual(self.resolution._get_unused_ranges(), [])
+
+    def test_allocate_spans_two_blocks(self):
+        self._set_block_size(5)
+        self.resolution._allocate_numbers(3)
+        self.assertEqual(self.resolution._allocate_numbers(4), ['NE4', 'NE5', 'NE6', 'NE7'])
+        self.assertRecordValues(self.resolution.block_ids.sorted('number_from'), [
+            {'number_from': 1, 'number_to': 5, 'next_number': 6, 'state': 'exhausted'},
+            {'number_from': 6, 'number_to': 10, 'next_number': 8, 'state': 'open'},
+        ])
+        self.assertEqual(self.resolution.next_number, 11)
+
+    def test_allocate_warns_and_exhausts_range(self):
+        resolution = self._create_resolution('NX', 1, 4, warning_threshold=2)
+        self._set_block_size(3)
+        with self.assertLogs('odoo.addons.l10n_co_nomina.models.l10n_co_nomina_resolution', 'WARNING') as logs:
+            self.assertEqual(resolution._allocate_numbers(3), ['NX1', 'NX2', 'NX3'])
+        self.assertIn('quedan 1 números disponibles', logs.output[0])
+        self.assertEqual(resolution._warn_if_exhausting(), 1)
+
+        # Pide dos y solo queda uno: el rango se agota
+        with self.assertRaises(UserError):
+            resolution._allocate_numbers(2)
+        self.assertEqual(resolution.next_number, 5)
+
+    def test_release_trailing_block(self):
+        self._set_block_size(10)
+        self.resolution._allocate_numbers(3)
+        self.resolution.action_release_blocks()
+        self.assertEqual(self.resolution.next_number, 4)
+        self.assertRecordValues(self.resolution.block_ids, [
+            {'number_from': 1, 'number_to': 3, 'next_number': 4, 'state': 'exhausted'},
+        ])
+        self.assertEqual(self.resolution._get_unused_ranges(), [])
+        # El siguiente lote continúa sin hueco
+        self.assertEqual(self.resolution._allocate_numbers(1), ['NE4'])
+
+    def test_release_keeps_inner_open_block(self):
+        self._set_block_size(5)
+        self.resolution._allocate_numbers(3)
+        inner = self.resolution.block_ids
+        # Un segundo proceso reserva el bloque siguiente y toma un número
+        outer = self.resolution._reserve_block(5, 1)
+        self.assertEqual(outer._take(1), [6])
+        self.resolution.action_release_blocks()
+        # El sobrante final se devuelve; el bloque intermedio sigue abierto
+        self.assertEqual(self.resolution.next_number, 7)
+        self.assertRecordValues(outer, [{'number_to': 6, 'state': 'exhausted'}])
+        self.assertEqual(inner.state, 'open')
+        self.assertEqual(self.resolution._get_unused_ranges(), [(4, 5)])
+
+    def test_orphan_reservation_is_reported_and_reclaimed(self):
+        self._set_block_size(5)
+        self.resolution._allocate_numbers(5)
+        # Reserva confirmada cuya transacción de asignación se revirtió: no hay bloque
+        self.resolution.next_number = 11
+        self.assertEqual(self.resolution._get_unused_ranges(), [(6, 10)])
+
+        self.resolution.action_release_blocks()
+        if not self.env['l10n_co_nomina.resolution.block']._has_range_exclusion():
+            # Sin btree_gist el tramo solo se informa
+            self.assertEqual(self.resolution._get_unused_ranges(), [(6, 10)])
+            return
+        self.assertEqual(self.resolution.next_number, 6)
+        self.assertEqual(self.resolution._get_unused_ranges(), [])
+        self.assertEqual(self.resolution._allocate_numbers(1), ['NE6'])
+
+    def test_compute_sheet_numbers_from_resolution(self):
+        self._set_block_size(10)
+        self.company.l10n_co_nomina_payslip_resolution_numbering = True
+        contract = self._create_contract(self._create_employee(), date(2019, 1, 1))
+        payslips = self._create_payslip(contract, date(2019, 6, 1), date(2019, 6, 30), state='draft', number='New')
+        payslips |= self._create_payslip(contract, date(2019, 7, 1), date(2019, 7, 31), state='draft', number='New')
+        payslips.compute_sheet()
+        self.assertEqual(sorted(payslips.mapped('number')), ['NE1', 'NE2'])
+        self.assertEqual(self.resolution._get_unused_ranges(), [(3, 10)])
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+import base64
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+from cryptography.x509.oid import NameOID
+from lxml import etree
+
+from odoo.tests import BaseCase, tagged
+
+from ..models.payroll_signature import (
+    NS_DS, get_cached_key_material, invalidate_key_material, load_key_material,
+    sign_payroll_xml, sign_payroll_xml_batch)
+from ..models.payroll_xml_builder import build_payroll_xml
+from .test_payroll_xml_builder import sample_xml_data
+
+_logger = logging.getLogger(__name__)
+
+PASSWORD = 'clave-de-prueba'
+
+
+def make_pkcs12(password=PASSWORD):
+    """Certificado autofirmado de prueba empaquetado en PKCS#12."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'Nomina Electronica Pruebas')])
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    return pkcs12.serialize_key_and_certificates(
+        b'test', key, certificate, None, BestAvailableEncryption(password.encode('utf-8')))
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollSignature(BaseCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.p12 = make_pkcs12()
+        cls.key_material = load_key_material(cls.p12, PASSWORD)
+        cls.xml = build_payroll_xml(sample_xml_data())
+
+    def test_key_material_keeps_encrypted_bundle(self):
+        self.assertEqual(base64.b64decode(self.key_material.pkcs12_b64), self.p12)
+        with self.assertRaises(ValueError):
+            load_key_material(self.p12, 'otra-clave')
+
+    def test_signature_verifies(self):
+        root = etree.fromstring(sign_payroll_xml(self.xml, self.key_material))
+        signed_info = root.find('.//{%s}SignedInfo' % NS_DS)
+        signature_value = base64.b64decode(root.findtext('.//{%s}SignatureValue' % NS_DS))
+        # Lanza InvalidSignature si el SignedInfo no corresponde a la firma
+        self.key_material.certificate.public_key().verify(
+            signature_value, etree.tostring(signed_info, method='c14n'),
+            padding.PKCS1v15(), hashes.SHA256())
+
+    def test_batch_signs_every_document(self):
+        signed = sign_payroll_xml_batch([self.xml] * 3, self.key_material)
+        self.assertEqual(len(signed), 3)
+        for document in signed:
+            self.assertEqual(len(etree.fromstring(document).findall('.//{%s}Signature' % NS_DS)), 1)
+
+    def test_key_cache_loads_once(self):
+        calls = []
+
+        def _loader():
+            calls.append(1)
+            return self.key_material
+
+        cache_key = ('test_db', -1, 'checksum', 'password-hash')
+        try:
+            self.assertIs(get_cached_key_material(cache_key, _loader), self.key_material)
+            self.assertIs(get_cached_key_material(cache_key, _loader), self.key_material)
+            self.assertEqual(len(calls), 1)
+            invalidate_key_material('test_db', [-1])
+            get_cached_key_material(cache_key, _loader)
+            self.assertEqual(len(calls), 2)
+        finally:
+            invalidate_key_material('test_db', [-1])
+
+
+@tagged('l10n_co_nomina_bench', '-standard')
+class TestPayrollSignatureBenchmark(BaseCase):
+    """Firmas por segundo sobre documentos sintéticos: llave por documento frente a llave cacheada."""
+
+    DOCUMENTS = 200
+
+    def test_signing_throughput_benchmark(self):
+        p12 = make_pkcs12()
+        xml = build_payroll_xml(sample_xml_data())
+
+        start = time.perf_counter()
+        for __ in range(self.DOCUMENTS):
+            sign_payroll_xml(xml, load_key_material(p12, PASSWORD))
+        per_document = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sign_payroll_xml_batch([xml] * self.DOCUMENTS, load_key_material(p12, PASSWORD))
+        batch = time.perf_counter() - start
+
+        _logger.info("Firma de %s documentos: llave por documento %.3fs (%.0f doc/s), "
+                     "lote con una carga %.3fs (%.0f doc/s)",
+                     self.DOCUMENTS, per_document, self.DOCUMENTS / per_document,
+                     batch, self.DOCUMENTS / batch)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+import importlib.util
+from datetime import date
+
+from odoo.tests import tagged
+from odoo.tools.misc import file_path
+
+from .common import PayrollCommon
+
+
+def _load_apidian_stub():
+    """``tools/`` no es un paquete de Odoo: el stub se carga desde su ruta."""
+    spec = importlib.util.spec_from_file_location(
+        'l10n_co_nomina_apidian_stub', file_path('l10n_co_nomina/tools/apidian_stub.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+apidian_stub = _load_apidian_stub()
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollTestSetRunner(PayrollCommon):
+    """Set de pruebas completo contra ``tools/apidian_stub.py``, sin red externa."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.employees = cls.env['hr.employee']
+        for __ in range(2):
+            employee = cls._create_employee()
+            contract = cls._create_contract(employee, date(2024, 1, 1))
+            cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+            cls.employees |= employee
+
+    def _start_stub(self, **config):
+        stub = apidian_stub.ApidianStub(apidian_stub.StubConfig(token='stub-token', **config)).start()
+        self.addCleanup(stub.stop)
+        self.company.write({
+            'l10n_co_payroll_api_url': stub.url,
+            'l10n_co_payroll_api_token': 'stub-token',
+        })
+        return stub
+
+    def _create_runner(self, **vals):
+        return self.env['l10n_co_nomina.test.set.runner'].create(dict({
+            'company_id': self.company.id,
+            'test_set_id': 'set-stub-0001',
+            'employee_ids': [(6, 0, self.employees.ids)],
+            'individual_count': 3,
+            'adjustment_count': 1,
+            'consecutive_start': 900,
+            'max_workers': 2,
+            'poll_attempts': 6,
+        }, **vals))
+
+    def _poll_until_done(self, runner):
+        polls = 0
+        while runner.state == 'sent':
+            runner.action_poll()
+            polls += 1
+            self.assertLessEqual(polls, runner.poll_attempts)
+        return polls
+
+    def test_run_sends_without_polling(self):
+        stub = self._start_stub(pending_polls=1)
+        runner = self._create_runner()
+        runner.action_run()
+
+        self.assertEqual(runner.state, 'sent')
+        self.assertEqual(runner.pending_count, 3)
+        counters = stub.state.snapshot()['counters']
+        self.assertEqual(counters['documents'], 3)
+        self.assertEqual(counters['status'], 0, "action_run no debe consultar estado")
+
+        # Primera ronda: la DIAN aún procesa, el asistente sigue abierto
+        runner.action_poll()
+        self.assertEqual(runner.state, 'sent')
+        self.assertEqual(runner.poll_count, 1)
+        self.assertEqual(stub.state.snapshot()['counters']['status'], 3)
+
+    def test_full_set_accepted(self):
+        stub = self._start_stub(pending_polls=1)
+        runner = self._create_runner()
+        runner.action_run()
+        self._poll_until_done(runner)
+
+        self.assertEqual(runner.state, 'done')
+        self.assertTrue(runner.passed, runner.report)
+        self.assertEqual(runner.accepted_count, 4)
+        self.assertEqual((runner.rejected_count, runner.pending_count, runner.error_count), (0, 0, 0))
+        self.assertIn('APROBADO', runner.report)
+        self.assertEqual(stub.state.snapshot()['counters']['documents'], 4)
+
+    def test_rejected_set_skips_adjustments(self):
+        stub = self._start_stub(rejection_rate=1.0)
+        runner = self._create_runner()
+        runner.action_run()
+        self._poll_until_done(runner)
+
+        self.assertEqual(runner.state, 'done')
+        self.assertFalse(runner.passed)
+        self.assertEqual(runner.rejected_count, 3)
+        self.assertEqual(runner.error_count, 1)
+        self.assertIn('FALLIDO', runner.report)
+        self.assertEqual(stub.state.snapshot()['counters']['documents'], 3)
+
+    def test_poll_attempts_exhausted(self):
+        stub = self._start_stub(pending_polls=100)
+        runner = self._create_runner(poll_attempts=2)
+        runner.action_run()
+        polls = self._poll_until_done(runner)
+
+        self.assertEqual(polls, 2)
+        self.assertEqual(runner.state, 'done')
+        self.assertFalse(runner.passed)
+        self.assertEqual(runner.pending_count, 3)
+        self.assertEqual(runner.error_count, 1)
+        self.assertEqual(stub.state.snapshot()['counters']['documents'], 3)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+import copy
+import logging
+import time
+
+from lxml import etree
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models.payroll_xml_builder import build_payroll_xml, qweb_values
+
+_logger = logging.getLogger(__name__)
+
+TEMPLATE_INDIVIDUAL = 'l10n_co_nomina.nomina_individual_xml_template'
+TEMPLATE_ADJUSTMENT = 'l10n_co_nomina.nomina_individual_ajuste_xml_template'
+
+
+def sample_xml_data():
+    """``xml_data`` representativo de ``_prepare_xml_data`` (ya formateado)."""
+    return {
+        'sequence': {'number': 'NE15', 'prefix': 'NE'},
+        'employer': {
+            'name': 'EMPRESA DE PRUEBA S.A.S.', 'id_number': '900123456', 'dv': '7',
+            'country_code': 'CO', 'department_code': '11', 'municipality_code': '11001',
+            'language_code': 'es', 'address': 'CALLE 1 # 2-3',
+        },
+        'employee': {
+            'worker_code': 'E001', 'type_worker_code': '01', 'subtype_worker_code': '00',
+            'high_risk_pension': 'false', 'id_code': '13', 'id_number': '1020304050',
+            'surname': 'PEREZ', 'second_surname': 'GOMEZ', 'first_name': 'ANA', 'other_names': '',
+            'country_code': 'CO', 'department_code': '11', 'municipality_code': '11001',
+            'address': 'CARRERA 4 # 5-6', 'integral_salary': 'false', 'contract_code': '2',
+            'salary': '1423500.00',
+        },
+        'provider': {'nit': '900123456', 'dv': '7', 'software_id': 'SOFT-ID', 'software_security_code': 'abc'},
+        'environment': {'code': '2'},
+        'tip_xml': '102',
+        'cune': 'f' * 96,
+        'note_type': '1',
+        'predecessor': {
+            'sequence_number': 'NE14', 'sequence_prefix': 'NE', 'cune': 'e' * 96, 'issue_date': '2024-05-31',
+        },
+        'period': {
+            'date_issue': '2024-06-30', 'time_issue': '10:00:00-05:00', 'admission_date': '2023-01-16',
+            'withdrawal_date': '', 'settlement_start_date': '2024-06-01',
+            'settlement_end_date': '2024-06-30', 'amount_time': '530',
+        },
+        'information': {'payroll_period_code': '5', 'currency_code_alpha': 'COP', 'trm': '0.00'},
+        'payment': {'method_code': '42', 'bank': 'BANCO', 'account_type': 'AHORROS', 'account_number': '123'},
+        'payment_dates': [{'date': '2024-06-15'}, {'date': '2024-06-30'}],
+        'earn': {
+            'basic': {'worked_days': 30, 'worker_salary': '1423500.00'},
+            'transports': [{'assistance': '101000.00'}, {'viatic': '50000.00'}],
+            'overtimes_surcharges': [
+                {'time_code': '1', 'quantity': '4.00', 'percentage': '25.00', 'payment': '29656.25',
+                 'start': '2024-06-03T18:00:00', 'end': '2024-06-03T22:00:00'},
+                {'time_code': '3', 'quantity': '2.00', 'percentage': '35.00', 'payment': '16607.50',
+                 'start': '2024-06-10T21:00:00', 'end': '2024-06-10T23:00:00'},
+            ],
+        },
+        'deduction': {
+            'health': {'percentage': '4.00', 'payment': '56940.00'},
+            'pension_fund': {'percentage': '4.00', 'payment': '56940.00'},
+            'withholding_source': '12000.00',
+        },
+        'accrued_total': '1620763.75',
+        'deductions_total': '125880.00',
+        'rounding': '0.00',
+        'total': '1494883.75',
+        'notes': [{'text': 'Nómina de prueba'}],
+    }
+
+
+def canonical(xml):
+    """Forma canónica (C14N) sin espacios de indentación, para comparar motores."""
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.fromstring(xml.strip(), parser), method='c14n')
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollXmlBuilder(TransactionCase):
+    """El constructor lxml debe producir el mismo documento que la plantilla QWeb."""
+
+    def _render_qweb(self, template, xml_data):
+        content = self.env['ir.qweb']._render(template, qweb_values(xml_data))
+        return str(content)
+
+    def _assert_same_document(self, template, xml_data, adjustment):
+        self.assertEqual(
+            canonical(build_payroll_xml(copy.deepcopy(xml_data), adjustment=adjustment)),
+            canonical(self._render_qweb(template, copy.deepcopy(xml_data))))
+
+    def test_individual_matches_qweb(self):
+        self._assert_same_document(TEMPLATE_INDIVIDUAL, sample_xml_data(), adjustment=False)
+
+    def test_adjustment_matches_qweb(self):
+        self._assert_same_document(TEMPLATE_ADJUSTMENT, sample_xml_data(), adjustment=True)
+
+    def test_without_optional_sections(self):
+        xml_data = sample_xml_data()
+        xml_data['earn'].pop('transports')
+        xml_data['earn'].pop('overtimes_surcharges')
+        xml_data.pop('notes')
+        xml_data['provider'] = {}
+        self._assert_same_document(TEMPLATE_INDIVIDUAL, xml_data, adjustment=False)
+        root = etree.fromstring(build_payroll_xml(xml_data))
+        self.assertFalse(root.xpath('//*[local-name()="HEDs"]'))
+
+    def test_overtime_containers_and_transport_totals(self):
+        root = etree.fromstring(build_payroll_xml(sample_xml_data()))
+        # Como la plantilla: los siete contenedores, aunque algunos queden vacíos
+        for tag in ('HEDs', 'HENs', 'HRNs', 'HEDDFs', 'HRDDFs', 'HENDFs', 'HRNDFs'):
+            self.assertEqual(len(root.xpath('//*[local-name()="%s"]' % tag)), 1, tag)
+        self.assertEqual(len(root.xpath('//*[local-name()="HED"]')), 1)
+        self.assertFalse(root.xpath('//*[local-name()="HEN"]'))
+        transport = root.xpath('//*[local-name()="Transporte"]')[0]
+        self.assertEqual(transport.get('AuxilioTransporte'), '101000.00')
+        self.assertEqual(transport.get('ViaticoManuAlojS'), '50000.00')
+        self.assertEqual(transport.get('ViaticoManuAlojNS'), '0.00')
+
+
+@tagged('l10n_co_nomina_bench', '-standard')
+class TestPayrollXmlBuilderBenchmark(TransactionCase):
+    """Comparativa de tiempos QWeb vs lxml (``--test-tags l10n_co_nomina_bench``)."""
+
+    ROUNDS = 300
+
+    def test_render_benchmark(self):
+        xml_data = sample_xml_data()
+        start = time.perf_counter()
+        for __ in range(self.ROUNDS):
+            self.env['ir.qweb']._render(TEMPLATE_INDIVIDUAL, qweb_values(xml_data))
+        qweb_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for __ in range(self.ROUNDS):
+            build_payroll_xml(xml_data)
+        lxml_time = time.perf_counter() - start
+        _logger.info("XML de nómina, %s documentos: qweb %.3fs, lxml %.3fs (x%.1f)",
+                     self.ROUNDS, qweb_time, lxml_time, qweb_time / (lxml_time or 1e-9))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+from odoo.tools import mute_logger
+
+from ..models import edi as edi_module
+from ..models.payroll_zip import PayrollZipPackager
+from .common import PayrollCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPayrollZipSend(PayrollCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.payslips = cls.env['hr.payslip']
+        for __ in range(3):
+            contract = cls._create_contract(cls._create_employee(), date(2024, 1, 1))
+            cls.payslips |= cls._create_payslip(contract, date(2024, 6, 1), date(2024, 6, 30))
+
+    def _send(self, service):
+        Payslip = type(self.payslips)
+
+        def _prepare_signed(records):
+            documents = []
+            for rec in records:
+                rec.write({'edi_uuid': 'cune-%s' % rec.id, 'edi_xml_name': 'cune-%s.xml' % rec.id})
+                documents.append((rec.edi_xml_name, b'<NominaIndividual/>', rec))
+            return documents
+
+        with patch.object(Payslip, '_prepare_signed_payroll_documents', _prepare_signed), \
+                patch.object(type(self.company), '_get_l10n_co_dian_service', return_value=(service, {})), \
+                patch.object(edi_module, 'PayrollZipPackager',
+                             lambda nit: PayrollZipPackager(nit, max_documents=1)):
+            return self.payslips._send_payroll_zip_batch()
+
+    def test_failed_envelope_keeps_previous_zip_keys(self):
+        service = MagicMock()
+        service.SendBillAsync.side_effect = [
+            SimpleNamespace(ZipKey='zip-1'),
+            ConnectionError("DIAN no responde"),
+            SimpleNamespace(ZipKey=None, ErrorMessageList='sin ZipKey'),
+        ]
+        sent, failed = self._send(service)
+        first, second, third = self.payslips
+        self.assertEqual(sent, {'zip-1': first})
+        self.assertEqual(failed, second | third)
+        self.assertEqual(first.edi_zip_key, 'zip-1')
+        self.assertFalse(second.edi_zip_key)
+        self.assertIn("DIAN no responde", second.edi_status_message)
+        self.assertIn("sin ZipKey", third.edi_status_message)
+
+    def test_status_updates_each_document_of_the_envelope(self):
+        self.payslips.write({'edi_zip_key': 'zip-1'})
+        for rec in self.payslips:
+            rec.edi_uuid = 'cune-%s' % rec.id
+        first, second, third = self.payslips
+        service = MagicMock()
+        service.GetStatusZip.return_value = [
+            SimpleNamespace(XmlDocumentKey=first.edi_uuid, XmlFileName=None, IsValid=True,
+                            StatusCode='00', StatusDescription='Procesado Correctamente', ErrorMessage=None),
+            SimpleNamespace(XmlDocumentKey=second.edi_uuid, XmlFileName=None, IsValid=False,
+                            StatusCode='99', StatusDescription='Rechazado', ErrorMessage=['NIE024']),
+        ]
+        with patch.object(type(self.company), '_get_l10n_co_dian_service', return_value=(service, {})):
+            self.payslips.action_get_payroll_zip_status()
+        service.GetStatusZip.assert_called_once()
+        self.assertTrue(first.edi_is_valid)
+        self.assertFalse(second.edi_is_valid)
+        self.assertEqual(second.edi_errors_messages, 'NIE024')
+        self.assertFalse(third.edi_status_code)
+
+    def test_signing_failure_names_the_company_certificate(self):
+        Payslip = type(self.payslips)
+        self.company.certificate_filename = 'firma-nomina.p12'
+        with patch.object(Payslip, '_get_consolidated_payroll_data_batch', return_value={}), \
+                patch.object(Payslip, '_prepare_xml_data', return_value={'cune': 'cune-1'}), \
+                patch.object(Payslip, '_render_payroll_xml', return_value=b'<NominaIndividual/>'), \
+                patch.object(Payslip, '_check_payroll_xml_schema'), \
+                patch.object(type(self.company), '_l10n_co_payroll_sign_xml_batch',
+                             side_effect=ValueError("llave privada ilegible")), \
+                mute_logger('odoo.addons.l10n_co_nomina.models.edi'), \
+                self.assertRaises(UserError) as caught:
+            self.payslips._prepare_signed_payroll_documents()
+        message = str(caught.exception)
+        self.assertIn('firma-nomina.p12', message)
+        self.assertIn(self.company.name, message)
+        self.assertIn('llave privada ilegible', message)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Prueba de carga reproducible del envío de nómina contra el stub de APIDIAN.
+
+Levanta ``apidian_stub`` en proceso (o usa ``--url``), envía N payloads
+sintéticos en paralelo con el mismo cliente HTTP que usa el conector
+(``models/payroll_api_client.py``), consulta el estado de cada ZipKey y
+reporta documentos por segundo de extremo a extremo y latencias p50/p95.
+
+Uso::
+
+    python tools/apidian_load_test.py --documents 500 --workers 16 --latency 0.02
+"""
+
+import argparse
+import copy
+import importlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+
+from apidian_stub import ApidianStub, StubConfig  # noqa: E402
+
+
+def _load_api_client():
+    """
+    Importa ``payroll_api_client`` sin ejecutar ``models/__init__.py`` (que
+    requiere Odoo): se registra ``models/`` como un paquete vacío.
+    """
+    package = types.ModuleType('_l10n_co_nomina_models')
+    package.__path__ = [os.path.join(os.path.dirname(TOOLS_DIR), 'models')]
+    sys.modules.setdefault(package.__name__, package)
+    return importlib.import_module('%s.payroll_api_client' % package.__name__)
+
+
+SAMPLE_PAYLOAD = {
+    "resolution_number": "18760000001",
+    "prefix": "NI",
+    "consecutive": 1,
+    "type_document_id": 9,
+    "payroll_period_id": 4,
+    "worker_code": "1000000001",
+    "period": {
+        "admision_date": "2024-01-01",
+        "settlement_start_date": "2025-01-01",
+        "settlement_end_date": "2025-01-30",
+        "worked_time": "30",
+        "issue_date": "2025-01-31",
+    },
+    "worker": {
+        "type_worker_id": 1,
+        "sub_type_worker_id": 0,
+        "payroll_type_document_identification_id": 3,
+        "municipality_id": 820,
+        "type_contract_id": 1,
+        "high_risk_pension": False,
+        "integral_salary": False,
+        "salary": "1423500.0",
+        "identification_number": "1000000001",
+        "surname": "PRUEBA",
+        "first_name": "EMPLEADO",
+        "address": "CALLE 1 # 2-3",
+    },
+    "payment": {"payment_method_id": 10},
+    "payment_dates": [{"payment_date": "2025-01-31"}],
+    "accrued": {"worked_days": 30, "salary": "1423500.0", "accrued_total": "1423500.0"},
+    "deductions": {
+        "eps_type_law_deductions_id": 1, "eps_deduction": "56940.0",
+        "pension_type_law_deductions_id": 5, "pension_deduction": "56940.0",
+        "deductions_total": "113880.0",
+    },
+    "sendmail": False,
+    "sendmailtome": False,
+}
+
+
+def synthetic_payloads(count, start=1):
+    payloads = []
+    for offset in range(count):
+        payload = copy.deepcopy(SAMPLE_PAYLOAD)
+        payload['consecutive'] = start + offset
+        payload['worker_code'] = payload['worker']['identification_number'] = str(1000000001 + offset)
+        payloads.append(payload)
+    return payloads
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def run_load_test(url, token, documents, workers, test_set_id=None, poll_attempts=20, poll_interval=0.1,
+                  guard_rate=0.0):
+    """
+    Ejecuta la carga y devuelve un dict con métricas. Con ``guard_rate`` las
+    llamadas pasan por el interruptor de circuito y el limitador adaptativo
+    (estado en un directorio temporal) como lo hace el conector.
+    """
+    client = _load_api_client()
+    guard = None
+    if guard_rate:
+        guard_module = importlib.import_module('%s.payroll_api_guard' % client.__package__)
+        guard = guard_module.ApiGuard(
+            url, tempfile.mkdtemp(prefix='apidian_guard_'), rate=guard_rate, burst=max(1, int(guard_rate)))
+    endpoint = 'payroll/%s' % test_set_id if test_set_id else 'payroll'
+    payloads = synthetic_payloads(documents)
+    send_latencies = []
+    failures = {}
+
+    def _send(payload):
+        started = time.perf_counter()
+        try:
+            response = client.api_request(url, token, endpoint, json_data=payload, timeout=30, guard=guard)
+        except client.PayrollApiError as e:
+            return None, e.kind, time.perf_counter() - started
+        return response, None, time.perf_counter() - started
+
+    def _status(zip_key):
+        try:
+            return zip_key, client.normalize_status_response(client.api_request(
+                url, token, 'status/zip/%s' % zip_key, json_data={}, timeout=30, guard=guard))
+        except client.PayrollApiError:
+            return zip_key, None
+
+    started = time.perf_counter()
+    pending = []
+    accepted = rejected = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for response, error, elapsed in executor.map(_send, payloads):
+            send_latencies.append(elapsed)
+            if error:
+                failures[error] = failures.get(error, 0) + 1
+                continue
+            zip_key = client.extract_zip_key(response)
+            if zip_key:
+                pending.append(zip_key)
+            elif response.get('cune'):
+                accepted += 1
+        sent_at = time.perf_counter()
+
+        for __ in range(poll_attempts):
+            if not pending:
+                break
+            still_pending = []
+            for zip_key, status in executor.map(_status, pending):
+                if status is None or status['status'] == client.STATUS_PENDING:
+                    still_pending.append(zip_key)
+                elif status['status'] == client.STATUS_ACCEPTED:
+                    accepted += 1
+                else:
+                    rejected += 1
+            pending = still_pending
+            if pending and poll_interval:
+                time.sleep(poll_interval)
+    finished = time.perf_counter()
+
+    return {
+        'documents': documents,
+        'workers': workers,
+        'accepted': accepted,
+        'rejected': rejected,
+        'unresolved': len(pending),
+        'failures': failures,
+        'send_seconds': sent_at - started,
+        'total_seconds': finished - started,
+        'send_docs_per_second': documents / (sent_at - started) if sent_at > started else 0.0,
+        'docs_per_second': (accepted + rejected) / (finished - started) if finished > started else 0.0,
+        'latency_p50': statistics.median(send_latencies) if send_latencies else 0.0,
+        'latency_p95': _percentile(send_latencies, 95),
+    }
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga contra el stub de APIDIAN.")
+    parser.add_argument('--url', help="URL de un stub/APIDIAN ya levantado; si se omite se levanta uno local.")
+    parser.add_argument('--token', default='stub-token')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--test-set-id', default='stub-test-set')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rejection-rate', type=float, default=0.0)
+    parser.add_argument('--pending-polls', type=int, default=0)
+    parser.add_argument('--throttle-rps', type=float, default=0.0)
+    parser.add_argument('--guard-rate', type=float, default=0.0,
+                        help="Tasa inicial del limitador del conector (req/s); 0 lo desactiva.")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def _print_report(metrics):
+    print("Documentos:        %(documents)s (%(workers)s hilos)" % metrics)
+    print("Aceptados:         %(accepted)s  Rechazados: %(rejected)s  Sin veredicto: %(unresolved)s" % metrics)
+    print("Fallos de envío:   %s" % (metrics['failures'] or '-'))
+    print("Envío:             %.2f s (%.1f docs/s)" % (metrics['send_seconds'], metrics['send_docs_per_second']))
+    print("Extremo a extremo: %.2f s (%.1f docs/s)" % (metrics['total_seconds'], metrics['docs_per_second']))
+    print("Latencia envío:    p50 %.1f ms  p95 %.1f ms" % (
+        metrics['latency_p50'] * 1000, metrics['latency_p95'] * 1000))
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    if args.url:
+        metrics = run_load_test(args.url, args.token, args.documents, args.workers, args.test_set_id,
+                                guard_rate=args.guard_rate)
+    else:
+        config = StubConfig(
+            latency=args.latency, error_rate=args.error_rate, rejection_rate=args.rejection_rate,
+            pending_polls=args.pending_polls, throttle_rps=args.throttle_rps, seed=args.seed)
+        with ApidianStub(config) as stub:
+            metrics = run_load_test(stub.url, args.token, args.documents, args.workers, args.test_set_id,
+                                    guard_rate=args.guard_rate)
+    _print_report(metrics)
+    return 0 if not metrics['unresolved'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
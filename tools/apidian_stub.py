@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+#
+#   inencon S.A.S. / Adaptado - Copyright (C) (2024)
+#
+#   This file is part of l10n_co_nomina.
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+#   email: info@inencon.com
+#
+
+
+"""
+Servidor de reemplazo local de APIDIAN para pruebas de regresión y carga.
+
+Implementa, con la misma forma de respuesta que APIDIAN, los endpoints que
+usa ``l10n_co_nomina.payroll.api.connector``:
+
+- ``PUT  /api/ubl2.1/config/<recurso>``
+- ``POST /api/ubl2.1/payroll[/<test_set_id>]``
+- ``POST /api/ubl2.1/payroll-adjust-note[/<test_set_id>]``
+- ``POST /api/ubl2.1/status/zip/<zip_key>``
+- ``POST /api/ubl2.1/status/document/<cune>``
+- ``GET  /stats`` (contadores del stub, fuera de la API)
+
+La latencia, la tasa de errores 5xx y 422, el cuerpo del 422, las
+respuestas síncronas (CUNE) o asíncronas (ZipKey), los rechazos DIAN y el
+estrangulamiento con 429 + ``Retry-After`` son configurables. Solo usa la
+librería estándar; no depende de Odoo.
+
+Uso::
+
+    python tools/apidian_stub.py --port 8089 --latency 0.05 --throttle-rps 20
+
+y en la compañía: URL de la API ``http://127.0.0.1:8089``, cualquier token.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_logger = logging.getLogger(__name__)
+
+API_PREFIX = '/api/ubl2.1/'
+
+# Campos mínimos que APIDIAN exige en el cuerpo de una nómina
+REQUIRED_PAYROLL_FIELDS = (
+    'type_document_id', 'prefix', 'consecutive', 'payroll_period_id',
+    'period', 'worker', 'payment', 'accrued', 'deductions',
+)
+REQUIRED_ADJUST_FIELDS = ('type_document_id', 'type_note', 'prefix', 'predecessor', 'period')
+
+DEFAULT_VALIDATION_PAYLOAD = {
+    'message': 'The given data was invalid.',
+    'errors': {'worker.identification_number': ['The worker.identification_number field is required.']},
+}
+
+
+@dataclass
+class StubConfig:
+    """Comportamiento del stub; todos los valores pueden cambiarse en caliente."""
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    validation_error_rate: float = 0.0
+    validation_payload: dict = field(default_factory=lambda: dict(DEFAULT_VALIDATION_PAYLOAD))
+    sync: bool = False
+    rejection_rate: float = 0.0
+    pending_polls: int = 0
+    throttle_rps: float = 0.0
+    throttle_burst: int = 0
+    token: str = None
+    seed: int = None
+
+
+class _TokenBucket:
+    """Cubeta de fichas del lado del servidor para responder 429."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst or math.ceil(rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """``0`` si hay ficha; si no, los segundos hasta la próxima."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class StubState:
+    """Documentos recibidos y contadores, protegidos por un lock."""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.bucket = _TokenBucket(config.throttle_rps, config.throttle_burst) if config.throttle_rps else None
+        self.documents = {}
+        self.by_cune = {}
+        self.config_calls = []
+        self.counters = {
+            'requests': 0, 'documents': 0, 'status': 0, 'accepted': 0, 'rejected': 0,
+            'http_422': 0, 'http_429': 0, 'http_5xx': 0, 'http_401': 0,
+        }
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def throttle_wait(self):
+        if self.bucket is None:
+            return 0
+        with self.lock:
+            return self.bucket.take()
+
+    def register(self, payload, test_set_id):
+        """Guarda el documento y decide de una vez su veredicto DIAN."""
+        cune = hashlib.sha384(
+            json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        zip_key = str(uuid.uuid4())
+        rejected = self.chance(self.config.rejection_rate)
+        number = '%s%s' % (payload.get('prefix') or '', payload.get('consecutive') or '')
+        document = {
+            'zip_key': zip_key,
+            'cune': cune,
+            'number': number,
+            'test_set_id': test_set_id,
+            'rejected': rejected,
+            'polls': 0,
+        }
+        with self.lock:
+            self.documents[zip_key] = document
+            self.by_cune[cune] = document
+            self.counters['documents'] += 1
+            self.counters['rejected' if rejected else 'accepted'] += 1
+        return document
+
+    def poll(self, zip_key):
+        with self.lock:
+            document = self.documents.get(zip_key)
+            if document is not None:
+                document['polls'] += 1
+            return document
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'documents': len(self.documents),
+                'config_calls': list(self.config_calls),
+                'config': asdict(self.config),
+            }
+
+
+# -------------------------------------------------------------------------
+# Respuestas con la forma de APIDIAN / DIAN
+# -------------------------------------------------------------------------
+
+def _dian_response(document, pending=False):
+    if pending:
+        return {
+            'IsValid': 'false',
+            'StatusCode': '98',
+            'StatusDescription': 'Documento en proceso de validación.',
+            'ErrorMessage': {'string': []},
+            'XmlDocumentKey': document['cune'],
+            'XmlFileName': document['number'],
+        }
+    if document['rejected']:
+        return {
+            'IsValid': 'false',
+            'StatusCode': '99',
+            'StatusDescription': 'Validación contiene errores en campos mandatorios.',
+            'ErrorMessage': {'string': ['Regla: NIE024, Rechazo: Stub APIDIAN: documento rechazado.']},
+            'XmlDocumentKey': document['cune'],
+            'XmlFileName': document['number'],
+        }
+    return {
+        'IsValid': 'true',
+        'StatusCode': '00',
+        'StatusDescription': 'Procesado Correctamente.',
+        'ErrorMessage': {'string': []},
+        'XmlDocumentKey': document['cune'],
+        'XmlFileName': document['number'],
+    }
+
+
+def _send_response(document, sync):
+    if sync:
+        return {
+            'message': 'Nómina electrónica procesada (stub).',
+            'cune': document['cune'],
+            'ResponseDian': {'Envelope': {'Body': {'SendNominaSyncResponse': {
+                'SendNominaSyncResult': _dian_response(document)}}}},
+        }
+    return {
+        'message': 'Nómina electrónica enviada al set de pruebas (stub).',
+        'ResponseDian': {'Envelope': {'Body': {'SendTestSetAsyncResponse': {
+            'SendTestSetAsyncResult': {'ErrorMessageList': {}, 'ZipKey': document['zip_key']}}}}},
+    }
+
+
+def _status_zip_response(document, pending):
+    return {
+        'message': 'Consulta generada con éxito',
+        'ResponseDian': {'Envelope': {'Body': {'GetStatusZipResponse': {
+            'GetStatusZipResult': {'DianResponse': _dian_response(document, pending)}}}}},
+    }
+
+
+def _status_document_response(document):
+    return {
+        'message': 'Consulta generada con éxito',
+        'ResponseDian': {'Envelope': {'Body': {'GetStatusResponse': {
+            'GetStatusResult': _dian_response(document)}}}},
+    }
+
+
+def _missing_fields(payload, required):
+    return {
+        name: ['The %s field is required.' % name]
+        for name in required if payload.get(name) in (None, '', [], {})
+    }
+
+
+# -------------------------------------------------------------------------
+# Servidor HTTP
+# -------------------------------------------------------------------------
+
+_SEND_RE = re.compile(r'^(payroll|payroll-adjust-note)(?:/([^/]+))?$')
+_STATUS_ZIP_RE = re.compile(r'^status/zip/([^/]+)$')
+_STATUS_DOCUMENT_RE = re.compile(r'^status/document/([^/]+)$')
+
+
+class ApidianStubHandler(BaseHTTPRequestHandler):
+    server_version = 'ApidianStub/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def state(self):
+        return self.server.stub_state
+
+    def log_message(self, fmt, *args):
+        _logger.debug("%s - %s", self.address_string(), fmt % args)
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return None
+
+    def _preamble(self):
+        """Autenticación, estrangulamiento, latencia y fallos simulados."""
+        state = self.state
+        config = state.config
+        state.count('requests')
+        if config.token and self.headers.get('Authorization') != 'Bearer %s' % config.token:
+            state.count('http_401')
+            self._reply(401, {'message': 'Unauthenticated.'})
+            return False
+        wait = state.throttle_wait()
+        if wait:
+            state.count('http_429')
+            self._reply(429, {'message': 'Too Many Attempts.'},
+                        headers={'Retry-After': str(max(1, math.ceil(wait)))})
+            return False
+        if config.latency or config.latency_jitter:
+            with state.lock:
+                jitter = state.random.uniform(0, config.latency_jitter) if config.latency_jitter else 0
+            time.sleep(config.latency + jitter)
+        if state.chance(config.error_rate):
+            state.count('http_5xx')
+            self._reply(500, {'message': 'Server Error'})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._reply(200, self.state.snapshot())
+            return
+        self._reply(404, {'message': 'Not Found'})
+
+    def do_PUT(self):
+        if not self.path.startswith(API_PREFIX + 'config/'):
+            self._reply(404, {'message': 'Not Found'})
+            return
+        payload = self._read_json()
+        if not self._preamble():
+            return
+        if payload is None:
+            self._reply(400, {'message': 'Invalid JSON.'})
+            return
+        resource = self.path[len(API_PREFIX + 'config/'):]
+        with self.state.lock:
+            self.state.config_calls.append(resource)
+        self._reply(200, {'success': True, 'message': 'Configuración %s actualizada (stub).' % resource})
+
+    def do_POST(self):
+        if not self.path.startswith(API_PREFIX):
+            self._reply(404, {'message': 'Not Found'})
+            return
+        route = self.path[len(API_PREFIX):].strip('/')
+        payload = self._read_json()
+        if not self._preamble():
+            return
+        if payload is None:
+            self._reply(400, {'message': 'Invalid JSON.'})
+            return
+
+        match = _SEND_RE.match(route)
+        if match:
+            self._handle_send(match.group(1), match.group(2), payload)
+            return
+        match = _STATUS_ZIP_RE.match(route)
+        if match:
+            self._handle_status_zip(match.group(1))
+            return
+        match = _STATUS_DOCUMENT_RE.match(route)
+        if match:
+            document = self.state.by_cune.get(match.group(1))
+            self.state.count('status')
+            if document is None:
+                self._reply(404, {'message': 'Documento no encontrado.'})
+            else:
+                self._reply(200, _status_document_response(document))
+            return
+        self._reply(404, {'message': 'Not Found'})
+
+    def _handle_send(self, kind, test_set_id, payload):
+        state = self.state
+        required = REQUIRED_ADJUST_FIELDS if kind == 'payroll-adjust-note' else REQUIRED_PAYROLL_FIELDS
+        errors = _missing_fields(payload, required)
+        if errors:
+            state.count('http_422')
+            self._reply(422, {'message': 'The given data was invalid.', 'errors': errors})
+            return
+        if state.chance(state.config.validation_error_rate):
+            state.count('http_422')
+            self._reply(422, state.config.validation_payload)
+            return
+        document = state.register(payload, test_set_id)
+        # El set de pruebas siempre es asíncrono, como en la DIAN
+        sync = state.config.sync and not test_set_id
+        self._reply(200, _send_response(document, sync))
+
+    def _handle_status_zip(self, zip_key):
+        state = self.state
+        state.count('status')
+        document = state.poll(zip_key)
+        if document is None:
+            self._reply(200, {'message': 'Consulta generada con éxito', 'ResponseDian': {
+                'Envelope': {'Body': {'GetStatusZipResponse': {'GetStatusZipResult': {'DianResponse': {
+                    'IsValid': 'false', 'StatusCode': '66',
+                    'StatusDescription': 'NSU %s no encontrado.' % zip_key,
+                    'ErrorMessage': {'string': []}}}}}}}})
+            return
+        pending = document['polls'] <= state.config.pending_polls
+        self._reply(200, _status_zip_response(document, pending))
+
+
+class ApidianStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, ApidianStubHandler)
+        self.stub_state = StubState(config or StubConfig())
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+
+class ApidianStub:
+    """
+    Stub en un hilo de fondo, utilizable como context manager::
+
+        with ApidianStub(StubConfig(latency=0.01)) as stub:
+            company.l10n_co_payroll_api_url = stub.url
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.server = ApidianStubServer((host, port), config)
+        self._thread = None
+
+    @property
+    def url(self):
+        return self.server.url
+
+    @property
+    def state(self):
+        return self.server.stub_state
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name='apidian-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stub local de APIDIAN (nómina electrónica).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help="Latencia fija por petición (s).")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Latencia aleatoria adicional (s).")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Proporción de respuestas 500.")
+    parser.add_argument('--validation-error-rate', type=float, default=0.0, help="Proporción de respuestas 422.")
+    parser.add_argument('--validation-payload', help="Archivo JSON con el cuerpo de los 422 simulados.")
+    parser.add_argument('--sync', action='store_true', help="Respuestas síncronas con CUNE fuera del set de pruebas.")
+    parser.add_argument('--rejection-rate', type=float, default=0.0, help="Proporción de documentos rechazados.")
+    parser.add_argument('--pending-polls', type=int, default=0, help="Consultas 'en proceso' antes del veredicto.")
+    parser.add_argument('--throttle-rps', type=float, default=0.0, help="Peticiones por segundo antes de 429.")
+    parser.add_argument('--throttle-burst', type=int, default=0)
+    parser.add_argument('--token', help="Si se indica, exige este Bearer token.")
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    config = StubConfig(
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, validation_error_rate=args.validation_error_rate,
+        sync=args.sync, rejection_rate=args.rejection_rate, pending_polls=args.pending_polls,
+        throttle_rps=args.throttle_rps, throttle_burst=args.throttle_burst,
+        token=args.token, seed=args.seed,
+    )
+    if args.validation_payload:
+        with open(args.validation_payload, encoding='utf-8') as payload_file:
+            config.validation_payload = json.load(payload_file)
+    server = ApidianStubServer((args.host, args.port), config)
+    _logger.info("Stub APIDIAN escuchando en %s", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()